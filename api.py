@@ -0,0 +1,130 @@
+"""
+API de Resolución de Incidencias de Pedidos
+===========================================
+Servicio HTTP sin estado que expone el pipeline (vistas + análisis de IA)
+sin depender de Streamlit. Cada worker mantiene su propio pool de sesiones.
+El pipeline se ejecuta con la cuenta de servicio, así que todas las rutas salvo
+/health exigen una de las claves de API_KEYS en la cabecera X-API-Key.
+
+Ejecución (por defecto solo en local; detrás de un proxy para exponerla):
+    API_KEYS=clave1,clave2 uvicorn api:app --host 127.0.0.1 --port 8000 --workers 4
+"""
+import asyncio
+import hmac
+import os
+from contextlib import asynccontextmanager
+from typing import Callable, List, Optional
+from fastapi import Depends, FastAPI, HTTPException, Security
+from fastapi.responses import PlainTextResponse
+from fastapi.security import APIKeyHeader
+from pydantic import BaseModel, Field, field_validator
+from core.auth import create_service_session
+from core.ai_analysis import get_available_cortex_models
+from core.pipeline import SessionPool, run_incident_pipeline, serialize_pipeline_output
+from core.metrics import render_metrics
+
+
+API_POOL_SIZE = int(os.environ.get("API_POOL_SIZE", "4"))
+API_SESSION_TIMEOUT = float(os.environ.get("API_SESSION_TIMEOUT", "30"))
+API_HOST = os.environ.get("API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("API_PORT", "8000"))
+# Claves aceptadas (separadas por comas); sin claves la API rechaza todas las peticiones
+API_KEYS = [k.strip() for k in os.environ.get("API_KEYS", "").split(",") if k.strip()]
+
+# Códigos de pedido, UNECO y almacén: sin espacios ni comillas
+IDENTIFIER_PATTERN = r"^[A-Za-z0-9_./-]{1,64}$"
+
+
+class IncidenciaRequest(BaseModel):
+    """Datos de la incidencia (mismas claves que incidencia_data del formulario)."""
+    id: Optional[str] = Field(None, max_length=64)
+    uneco: str = Field(pattern=IDENTIFIER_PATTERN)
+    pedido_host: str = Field(pattern=IDENTIFIER_PATTERN)
+    almacen: str = Field(pattern=IDENTIFIER_PATTERN)
+    referencia: Optional[str] = Field(None, pattern=IDENTIFIER_PATTERN)
+    feo: Optional[str] = Field(None, max_length=32)
+    fis: Optional[str] = Field(None, max_length=32)
+    fecha_disponible: Optional[str] = Field(None, max_length=32)
+    es_prepack: Optional[str] = Field(None, max_length=8)
+    tiene_marca_prepack: Optional[str] = Field(None, max_length=8)
+    descripcion: Optional[str] = Field(None, max_length=2000)
+    model: str = "mistral-large"
+
+    @field_validator("model")
+    @classmethod
+    def _model_disponible(cls, value: str) -> str:
+        # Cada modelo abre su propio cubo en el planificador: solo los conocidos
+        if value not in get_available_cortex_models():
+            raise ValueError(f"Modelo no disponible. Opciones: {', '.join(get_available_cortex_models())}")
+        return value
+
+
+API_KEY_HEADER = APIKeyHeader(name="X-API-Key", auto_error=False)
+
+
+def api_key_dependency(api_keys: List[str]) -> Callable:
+    """Dependencia que exige una de las claves (comparación en tiempo constante)."""
+
+    async def require_api_key(api_key: Optional[str] = Security(API_KEY_HEADER)):
+        if not api_key or not any(hmac.compare_digest(api_key, key) for key in api_keys):
+            raise HTTPException(status_code=401, detail="Clave de API no válida",
+                                headers={"WWW-Authenticate": "X-API-Key"})
+
+    return require_api_key
+
+
+def create_app(session_factory: Callable = create_service_session,
+               pool_size: int = API_POOL_SIZE, api_keys: Optional[List[str]] = None) -> FastAPI:
+    """
+    Crea la aplicación con una factoría de sesiones inyectada.
+
+    Args:
+        session_factory: Función sin argumentos que crea una sesión (real o falsa)
+        pool_size: Sesiones máximas por worker
+        api_keys: Claves aceptadas (por defecto API_KEYS)
+    """
+    api_keys = API_KEYS if api_keys is None else api_keys
+    if not api_keys:
+        print("⚠️ API_KEYS vacío: la API rechazará todas las peticiones autenticadas")
+    authenticated = [Depends(api_key_dependency(api_keys))]
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        app.state.pool = SessionPool(session_factory, size=pool_size)
+        yield
+        app.state.pool.close()
+
+    app = FastAPI(title="Resolución de Incidencias de Pedidos", lifespan=lifespan)
+
+    def _run(incidencia_data: dict, model: str) -> dict:
+        with app.state.pool.session(timeout=API_SESSION_TIMEOUT) as session:
+            output = run_incident_pipeline(incidencia_data, session, model=model)
+        return serialize_pipeline_output(output)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "sessions": app.state.pool.active}
+
+    @app.get("/metrics", response_class=PlainTextResponse, dependencies=authenticated)
+    async def metrics():
+        # Con varios workers cada uno expone sus propias métricas (una por scrape)
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+    @app.post("/incidencias/analisis", dependencies=authenticated)
+    async def analizar_incidencia(request: IncidenciaRequest):
+        incidencia_data = request.model_dump(exclude={"model"}, exclude_none=True)
+        try:
+            # El pipeline es bloqueante (Snowpark): se ejecuta en el pool de hilos
+            return await asyncio.to_thread(_run, incidencia_data, request.model)
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Error ejecutando el pipeline: {str(e)}")
+
+    return app
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("api:app", host=API_HOST, port=API_PORT)
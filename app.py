@@ -10,12 +10,25 @@ from core import (
     reset_session_state,
     display_incidences_form,
     display_incidencia_summary,
+    display_incidencia_notices,
     build_initial_prompt,
     process_user_input,
     display_conversation,
     handle_user_inputs,
     handle_error_notifications,
-    display_warnings
+    display_warnings,
+    display_cost_report,
+    load_verified_query_index,
+    restore_session_state,
+    persist_session_state,
+    start_metrics_server,
+    record_script_run,
+    display_watch_mode,
+    display_model_comparison,
+    display_edit_incident,
+    display_pending_jobs,
+    display_analytics_page,
+    ANALYTICS_CONFIG
 )
 
 
@@ -28,6 +41,13 @@ def main():
     )
     st.title("📦 Sistema de Resolución de Incidencias de Pedidos")
     
+    # Compilar el modelo semántico local una sola vez por proceso
+    load_verified_query_index()
+    
+    # Endpoint /metrics (una vez por proceso) y contador de reruns
+    start_metrics_server()
+    record_script_run(st.session_state)
+    
     # Inicializar estado ANTES de show_header_and_sidebar
     if "incidencia_data" not in st.session_state:
         st.session_state.incidencia_data = None
@@ -36,14 +56,22 @@ def main():
     
     show_header_and_sidebar()
     
+    # Retomar la sesión guardada (si hay backend de estado y pertenece al usuario)
+    if restore_session_state():
+        st.toast("Sesión recuperada", icon="🔁")
+    
+    # Página de analítica sobre el histórico de incidencias (sustituye al flujo de la incidencia)
+    if ANALYTICS_CONFIG["enabled"] and st.sidebar.toggle("📊 Analítica de incidencias", key="analytics_page"):
+        display_analytics_page()
     # FLUJO: Si no hay incidencia capturada, mostrar formulario
-    if st.session_state.incidencia_data is None:
+    elif st.session_state.incidencia_data is None:
         st.markdown("### Complete el formulario para reportar una incidencia")
         st.info("💡 Una vez enviada la incidencia, Agente Foundry analizará el caso y ejecutará los procedimientos necesarios según el árbol de decisión configurado.")
         display_incidences_form()
     else:
         # Si ya hay incidencia capturada, mostrar el chat con Cortex Analyst
         st.success(f"✅ Incidencia registrada: {st.session_state.incidencia_data.get('id', 'N/A')[:8]}...")
+        display_incidencia_notices()
         
         with st.expander("📋 Ver datos de la incidencia", expanded=False):
             display_incidencia_summary(st.session_state.incidencia_data)
@@ -57,9 +85,17 @@ def main():
             process_user_input(initial_prompt)
         
         display_conversation()
+        display_pending_jobs()
+        display_cost_report(st.session_state.incidencia_data["id"])
+        display_watch_mode()
+        display_edit_incident()
+        display_model_comparison()
         handle_user_inputs()
         handle_error_notifications()
         display_warnings()
+    
+    # Guardar el estado fuera del proceso (escritura agrupada en segundo plano)
+    persist_session_state()
 
 
 if __name__ == "__main__":
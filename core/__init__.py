@@ -7,6 +7,7 @@ from .analyst import get_analyst_response, process_user_input, get_analyst_respo
 from .incidencia import (
     display_incidences_form, 
     display_incidencia_summary, 
+    display_incidencia_notices,
     build_initial_prompt,
     save_incidencia_to_snowflake
 )
@@ -17,8 +18,31 @@ from .ui import (
     display_charts_tab,
     handle_user_inputs,
     handle_error_notifications,
-    display_warnings
+    display_warnings,
+    display_cost_report
 )
+from .charts import prepare_chart_series
+from .execution import run_statement, incident_context, get_query_log
+from .cost import get_incident_cost_report, build_cost_report
+from .state_store import restore_session_state, persist_session_state, resolve_frame
+from .pipeline import run_incident_pipeline, SessionPool
+from .scheduler import scheduled, priority_context, get_scheduler_stats, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+from .snapshot import refresh_snapshot, lookup_snapshot
+from .semantic_model import load_verified_query_index, match_verified_query
+from .metrics import start_metrics_server, record_script_run, render_metrics
+from .watch import display_watch_mode, check_incident, diff_results
+from .model_compare import display_model_comparison, compare_models, build_leaderboard
+from .conversation import get_followup_analysis, build_followup_prompt
+from .attachments import process_attachments, attachment_status
+from .similarity import find_similar_incidents, search_similar, create_index
+from .rules import diagnose, compile_rules, DIAGNOSIS_RULES
+from .guardrails import QueryRejected, GUARDRAILS_CONFIG
+from .typeahead import suggest, validate_fields, ensure_typeahead
+from .dependencies import display_edit_incident, rerun_incident, build_dependency_graph
+from .jobs import display_pending_jobs, submit_job, get_job, get_job_submitters, JOBS_CONFIG
+from .analytics import display_analytics_page, refresh_cube, summarize, ANALYTICS_CONFIG
+from .rollups import answer_from_rollup, compile_rollups, refresh_rollups, ROLLUPS_CONFIG
+from .replay import ReplaySession, load_trace, record_statement, REPLAY_CONFIG
 from .utils import reset_session_state
 from .queries import (
     build_query,
@@ -29,8 +53,12 @@ from .queries import (
 )
 from .ai_analysis import (
     get_ai_analysis,
+    call_cortex,
+    parse_analysis,
+    render_analysis,
     get_available_cortex_models,
     build_analysis_prompt,
+    build_data_context,
     analyze_with_cortex
 )
 
@@ -45,6 +73,7 @@ __all__ = [
     'display_incidencia_summary',
     'build_initial_prompt',
     'save_incidencia_to_snowflake',
+    'display_incidencia_notices',
     'display_conversation',
     'display_message',
     'display_sql_query',
@@ -52,6 +81,71 @@ __all__ = [
     'handle_user_inputs',
     'handle_error_notifications',
     'display_warnings',
+    'display_cost_report',
+    'prepare_chart_series',
+    'load_verified_query_index',
+    'match_verified_query',
+    'run_statement',
+    'incident_context',
+    'get_query_log',
+    'get_incident_cost_report',
+    'build_cost_report',
+    'restore_session_state',
+    'persist_session_state',
+    'resolve_frame',
+    'run_incident_pipeline',
+    'SessionPool',
+    'scheduled',
+    'priority_context',
+    'get_scheduler_stats',
+    'start_metrics_server',
+    'record_script_run',
+    'render_metrics',
+    'display_watch_mode',
+    'check_incident',
+    'diff_results',
+    'display_model_comparison',
+    'compare_models',
+    'build_leaderboard',
+    'get_followup_analysis',
+    'build_followup_prompt',
+    'process_attachments',
+    'attachment_status',
+    'find_similar_incidents',
+    'search_similar',
+    'create_index',
+    'diagnose',
+    'compile_rules',
+    'DIAGNOSIS_RULES',
+    'QueryRejected',
+    'GUARDRAILS_CONFIG',
+    'suggest',
+    'validate_fields',
+    'ensure_typeahead',
+    'display_edit_incident',
+    'rerun_incident',
+    'build_dependency_graph',
+    'display_pending_jobs',
+    'submit_job',
+    'get_job',
+    'get_job_submitters',
+    'JOBS_CONFIG',
+    'display_analytics_page',
+    'refresh_cube',
+    'summarize',
+    'ANALYTICS_CONFIG',
+    'answer_from_rollup',
+    'compile_rollups',
+    'refresh_rollups',
+    'ROLLUPS_CONFIG',
+    'ReplaySession',
+    'load_trace',
+    'record_statement',
+    'REPLAY_CONFIG',
+    'PRIORITY_BATCH',
+    'PRIORITY_INTERACTIVE',
+    'refresh_snapshot',
+    'lookup_snapshot',
     'reset_session_state',
     'build_query',
     'execute_vista_query',
@@ -59,8 +153,12 @@ __all__ = [
     'get_diagnostico_paso2',
     'get_all_analyst_results',
     'get_ai_analysis',
+    'call_cortex',
+    'parse_analysis',
+    'render_analysis',
     'get_available_cortex_models',
     'build_analysis_prompt',
+    'build_data_context',
     'analyze_with_cortex'
 ]
 
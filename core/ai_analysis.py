@@ -3,9 +3,36 @@ Módulo de IA para análisis e interpretación de resultados
 Usa Snowflake Cortex para generar respuestas en lenguaje natural
 """
 
-from typing import Dict, List
+import json
+import os
+from typing import Dict, List, Optional
 import pandas as pd
 import streamlit as st
+from .scheduler import scheduled, SchedulerSaturated
+from .execution import run_statement
+from .metrics import CORTEX_PROMPT_CHARS, CORTEX_TOKENS, ERRORS
+from .rules import diagnose
+
+
+AI_CONFIG = {
+    # Límite de la generación: la latencia de COMPLETE crece con los tokens de salida
+    "max_tokens": int(os.environ.get("CORTEX_MAX_TOKENS", "300")),
+    "temperature": float(os.environ.get("CORTEX_TEMPERATURE", "0")),
+    # Salida JSON con ANALYSIS_SCHEMA (response_format) en el análisis de incidencias
+    "structured_output": os.environ.get("CORTEX_STRUCTURED_OUTPUT", "true").lower() in ("1", "true", "yes"),
+}
+
+# Campos del análisis estructurado
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "estado": {"type": "string"},
+        "problema": {"type": "string"},
+        "recomendaciones": {"type": "array", "items": {"type": "string"}},
+        "alertas": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["estado", "problema", "recomendaciones", "alertas"],
+}
 
 
 def get_available_cortex_models() -> List[str]:
@@ -22,6 +49,22 @@ def get_available_cortex_models() -> List[str]:
     ]
 
 
+# Instrucciones para la IA (análisis completo de la incidencia)
+ANALYSIS_INSTRUCTIONS = """
+
+**TU TAREA:**
+Analiza la incidencia con los datos de diagnóstico (tipo de pedido, estado del ASN
+y diferencias de revisión) y responde SOLO con un objeto JSON con estos campos:
+- "estado": 1 línea con cómo está el pedido (empieza por ✅, ⚠️ o ❌)
+- "problema": 1 frase con el problema principal (o si no hay datos, la razón probable)
+- "recomendaciones": hasta 3 acciones concretas y cortas
+- "alertas": hasta 3 puntos críticos a revisar (lista vacía si no hay)
+
+Español claro y profesional, sin títulos ni texto fuera del JSON.
+
+JSON:"""
+
+
 def build_analysis_prompt(incidencia_data: Dict, results: Dict) -> str:
     """
     Construye el prompt para que la IA analice los resultados.
@@ -33,6 +76,20 @@ def build_analysis_prompt(incidencia_data: Dict, results: Dict) -> str:
     Returns:
         Prompt formateado para el LLM
     """
+    return build_data_context(incidencia_data, results) + ANALYSIS_INSTRUCTIONS
+
+
+def build_data_context(incidencia_data: Dict, results: Dict) -> str:
+    """
+    Contexto del prompt: datos de la incidencia y resultados de las vistas.
+    
+    Args:
+        incidencia_data: Datos del formulario de incidencia
+        results: Resultados de las vistas ejecutadas
+        
+    Returns:
+        Texto con el contexto (sin instrucciones de tarea)
+    """
     
     # Construir contexto de la incidencia
     context = f"""Eres un asistente experto en logística y gestión de pedidos. 
@@ -76,69 +133,133 @@ Analiza la siguiente incidencia de pedido y los datos obtenidos de las vistas de
         else:
             context += f"\n\n**DIAGNÓSTICO PASO 2:** No se encontraron datos"
     
-    # Instrucciones para la IA
-    context += """
-
-**TU TAREA:**
-1. Analiza la información de la incidencia y los datos de diagnóstico
-2. Identifica el TIPO DE PEDIDO y explica qué significa
-3. Analiza el ESTADO del ASN y las DIFERENCIAS DE REVISIÓN si las hay
-4. Identifica el PROBLEMA PRINCIPAL de esta incidencia
-5. Proporciona RECOMENDACIONES concretas para resolver la incidencia
-6. Menciona si hay ALERTAS o puntos críticos a revisar
-
-**FORMATO DE RESPUESTA:**
-- Usa lenguaje claro y profesional en español
-- Usa emojis para mejorar la legibilidad (📊 📦 ⚠️ ✅ ❌)
-- Estructura tu respuesta con títulos claros
-- Si hay diferencias de revisión, resáltalas claramente
-- Si no hay datos, indica posibles razones
-- Da una respuesta de 1 linea, comentando solo como está el pedido
-
-Genera tu análisis ahora:"""
+    # Casos similares ya resueltos (solo los más parecidos)
+    if results.get("historial"):
+        historial = results["historial"]
+        if historial["data"] is not None and not historial["data"].empty:
+            df_hist = historial["data"][["score", "tipo_pedido", "almacen", "descripcion"]].head(3)
+            context += f"\n\n**INCIDENCIAS SIMILARES RESUELTAS:**\n"
+            context += df_hist.to_string(index=False)
     
     return context
 
 
-def analyze_with_cortex(prompt: str, model: str = "mistral-large") -> tuple[str, str]:
+def _sql_literal(value) -> str:
+    """Literal de Snowflake (objetos, arrays, cadenas) para las opciones de COMPLETE."""
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{_sql_literal(str(k))}: {_sql_literal(v)}" for k, v in value.items()) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(_sql_literal(v) for v in value) + "]"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+def build_complete_query(prompt: str, model: str, options: Optional[Dict] = None) -> str:
+    """
+    COMPLETE en su forma con opciones (mensajes + objeto de opciones).
+
+    Con opciones la respuesta es un JSON con choices/structured_output y usage.
+    """
+    messages = [{"role": "user", "content": prompt}]
+    return f"""
+    SELECT SNOWFLAKE.CORTEX.COMPLETE(
+        {_sql_literal(model)},
+        {_sql_literal(messages)},
+        {_sql_literal(options or {})}
+    ) AS response
+    """
+
+
+def completion_options(response_schema: Optional[Dict] = None) -> Dict:
+    """Opciones de COMPLETE: max_tokens, temperature y, si se indica, esquema JSON."""
+    options = {"max_tokens": AI_CONFIG["max_tokens"], "temperature": AI_CONFIG["temperature"]}
+    if response_schema:
+        options["response_format"] = {"type": "json", "schema": response_schema}
+    return options
+
+
+def parse_complete_response(raw) -> Dict:
+    """
+    Interpreta la respuesta de COMPLETE con opciones.
+
+    Returns:
+        {"text", "structured" (dict o None), "prompt_tokens", "output_tokens"}
     """
-    Ejecuta análisis usando Snowflake Cortex COMPLETE.
+    try:
+        parsed = json.loads(raw) if isinstance(raw, str) else dict(raw)
+    except (TypeError, ValueError):
+        parsed = None
+    if not isinstance(parsed, dict):
+        # Forma sin opciones: texto plano (también si el modelo responde un JSON que no es objeto)
+        return {"text": raw, "structured": None, "prompt_tokens": None, "output_tokens": None}
+    usage = parsed.get("usage") or {}
+    structured = None
+    if parsed.get("structured_output"):
+        structured = parsed["structured_output"][0].get("raw_message")
+        text = json.dumps(structured, ensure_ascii=False)
+    elif parsed.get("choices"):
+        choice = parsed["choices"][0]
+        text = choice.get("messages") or choice.get("message") or ""
+    else:
+        text = raw if isinstance(raw, str) else json.dumps(parsed, ensure_ascii=False)
+    return {
+        "text": text,
+        "structured": structured,
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "output_tokens": usage.get("completion_tokens"),
+    }
+
+
+def call_cortex(prompt: str, model: str = "mistral-large", session=None,
+                response_schema: Optional[Dict] = None) -> tuple[Optional[Dict], Optional[str]]:
+    """
+    Llama a Snowflake Cortex COMPLETE con max_tokens, temperature y esquema opcional.
     
     Args:
         prompt: Prompt con contexto y datos
         model: Modelo de Cortex a usar
+        session: Sesión de Snowpark (por defecto la de st.session_state)
+        response_schema: Esquema JSON de la salida (response_format)
         
     Returns:
-        (respuesta_ia, error_msg)
+        (respuesta de parse_complete_response, error_msg)
     """
-    if "snowpark_session" not in st.session_state:
-        return None, "No hay sesión activa de Snowflake"
+    if session is None:
+        if "snowpark_session" not in st.session_state:
+            return None, "No hay sesión activa de Snowflake"
+        session = st.session_state.snowpark_session
     
     try:
-        session = st.session_state.snowpark_session
-        
-        # Escapar comillas simples en el prompt
-        prompt_escaped = prompt.replace("'", "''")
-        
-        # Construir query para Snowflake Cortex
-        query = f"""
-        SELECT SNOWFLAKE.CORTEX.COMPLETE(
-            '{model}',
-            '{prompt_escaped}'
-        ) AS response
-        """
+        query = build_complete_query(prompt, model, completion_options(response_schema))
         
         print(f"\n🤖 Llamando a Cortex modelo: {model}")
         print(f"Longitud del prompt: {len(prompt)} caracteres")
+        CORTEX_PROMPT_CHARS.observe(len(prompt), model=model)
         
-        result = session.sql(query).collect()
+        with scheduled("llm", model=model):
+            result = run_statement(session, query, stage="llm", model=model, collect=True)
         
-        if result and len(result) > 0:
-            response_text = result[0]["RESPONSE"]
-            return response_text, None
-        else:
+        if not result or len(result) == 0:
             return None, "No se obtuvo respuesta del modelo Cortex"
-            
+        
+        response = parse_complete_response(result[0]["RESPONSE"])
+        # Sin uso de tokens en la respuesta: estimación de ~4 caracteres por token
+        response["tokens_estimated"] = response["output_tokens"] is None
+        if response["tokens_estimated"]:
+            response["prompt_tokens"] = response["prompt_tokens"] or len(prompt) // 4
+            response["output_tokens"] = len(response["text"] or "") // 4
+        CORTEX_TOKENS.inc(response["prompt_tokens"], model=model, kind="prompt")
+        CORTEX_TOKENS.inc(response["output_tokens"], model=model, kind="output")
+        print(f"Tokens de salida: {response['output_tokens']}")
+        return response, None
+    
+    except SchedulerSaturated as e:
+        print(f"⏳ Cortex descartado por saturación: {str(e)}")
+        ERRORS.inc(stage="llm", type="SchedulerSaturated")
+        return None, str(e)
     except Exception as e:
         error_msg = str(e)
         print(f"❌ Error en Cortex: {error_msg}")
@@ -150,7 +271,65 @@ def analyze_with_cortex(prompt: str, model: str = "mistral-large") -> tuple[str,
         return None, f"Error al analizar con Cortex: {error_msg}"
 
 
-def get_ai_analysis(incidencia_data: Dict, results: Dict, model: str = "mistral-large") -> Dict:
+def analyze_with_cortex(prompt: str, model: str = "mistral-large", session=None) -> tuple[str, str]:
+    """
+    Ejecuta análisis en texto libre usando Snowflake Cortex COMPLETE.
+    
+    Returns:
+        (respuesta_ia, error_msg)
+    """
+    response, error = call_cortex(prompt, model, session=session)
+    return (response["text"] if response else None), error
+
+
+def parse_analysis(response: Dict) -> Dict:
+    """
+    Campos del análisis estructurado (estado, problema, recomendaciones, alertas).
+
+    Acepta la salida de response_format o un JSON en el texto; si el modelo no
+    devuelve JSON, el texto completo pasa a ser el estado.
+    """
+    fields = response.get("structured")
+    if not isinstance(fields, dict):
+        text = (response.get("text") or "").strip()
+        start, end = text.find("{"), text.rfind("}")
+        try:
+            fields = json.loads(text[start:end + 1]) if start != -1 and end > start else None
+        except ValueError:
+            fields = None
+        if not isinstance(fields, dict):
+            fields = {"estado": text}
+
+    def as_list(value) -> List[str]:
+        if isinstance(value, str):
+            return [value] if value.strip() else []
+        return [str(v) for v in (value or []) if str(v).strip()]
+
+    return {
+        "estado": str(fields.get("estado") or "").strip(),
+        "problema": str(fields.get("problema") or "").strip(),
+        "recomendaciones": as_list(fields.get("recomendaciones")),
+        "alertas": as_list(fields.get("alertas")),
+    }
+
+
+def render_analysis(fields: Dict) -> str:
+    """Markdown del análisis estructurado para el chat."""
+    lines = []
+    if fields["estado"]:
+        lines.append(f"**Estado:** {fields['estado']}")
+    if fields["problema"]:
+        lines.append(f"**Problema:** {fields['problema']}")
+    if fields["recomendaciones"]:
+        lines.append("\n**Recomendaciones:**")
+        lines.extend(f"- {r}" for r in fields["recomendaciones"])
+    if fields["alertas"]:
+        lines.append("\n**⚠️ Alertas:**")
+        lines.extend(f"- {a}" for a in fields["alertas"])
+    return "\n".join(lines)
+
+
+def get_ai_analysis(incidencia_data: Dict, results: Dict, model: str = "mistral-large", session=None) -> Dict:
     """
     Obtiene análisis completo de la incidencia usando IA.
     
@@ -158,22 +337,46 @@ def get_ai_analysis(incidencia_data: Dict, results: Dict, model: str = "mistral-
         incidencia_data: Datos del formulario
         results: Resultados de las vistas
         model: Modelo de Cortex a usar
+        session: Sesión de Snowpark (por defecto la de st.session_state)
         
     Returns:
         Diccionario con análisis y metadatos
     """
     
+    # Reglas deterministas: los casos conocidos no pasan por Cortex
+    paso1, paso2 = results.get("diagnostico_paso1"), results.get("diagnostico_paso2")
+    if paso1 and paso2 and not paso1["error"] and not paso2["error"]:
+        diagnosis = diagnose(
+            extract_key_metrics(paso1["data"], "paso1"),
+            extract_key_metrics(paso2["data"], "paso2")
+        )
+        if diagnosis:
+            return {
+                "analysis": diagnosis["analysis"],
+                "error": None,
+                "model": "reglas",
+                "rule": diagnosis["rule"],
+                "prompt_length": 0
+            }
+    
     # Construir prompt
     prompt = build_analysis_prompt(incidencia_data, results)
     
-    # Analizar con Cortex
-    analysis, error = analyze_with_cortex(prompt, model)
+    # Analizar con Cortex (salida acotada y, si está activo, con esquema JSON)
+    schema = ANALYSIS_SCHEMA if AI_CONFIG["structured_output"] else None
+    response, error = call_cortex(prompt, model, session=session, response_schema=schema)
+    if error:
+        return {"analysis": None, "error": error, "model": model, "prompt_length": len(prompt)}
     
+    fields = parse_analysis(response)
     return {
-        "analysis": analysis,
-        "error": error,
+        "analysis": render_analysis(fields),
+        "structured": fields,
+        "error": None,
         "model": model,
-        "prompt_length": len(prompt)
+        "prompt_length": len(prompt),
+        "prompt_tokens": response["prompt_tokens"],
+        "output_tokens": response["output_tokens"]
     }
 
 
@@ -199,12 +402,15 @@ def extract_key_metrics(df: pd.DataFrame, vista_type: str) -> Dict:
     if vista_type == "paso1":
         if "TIPO_PEDIDO" in df.columns:
             metrics["tipo_pedido"] = df["TIPO_PEDIDO"].iloc[0] if len(df) > 0 else None
+            metrics["tipos_pedido"] = sorted(str(t) for t in df["TIPO_PEDIDO"].dropna().unique())
     
     elif vista_type == "paso2":
         if "DIFERENCIAS_REVISION" in df.columns:
-            total_dif = df["DIFERENCIAS_REVISION"].sum()
-            metrics["diferencias_total"] = float(total_dif) if pd.notna(total_dif) else 0
-            metrics["hay_diferencias"] = metrics["diferencias_total"] != 0
+            diferencias = pd.to_numeric(df["DIFERENCIAS_REVISION"], errors="coerce").fillna(0)
+            # Suma de valores absolutos: +5 en una línea y -5 en otra son 10 unidades
+            # de descuadre, no 0
+            metrics["diferencias_total"] = float(diferencias.abs().sum())
+            metrics["hay_diferencias"] = bool((diferencias != 0).any())
         
         if "CO_ESTADO_PREALBARAN" in df.columns:
             estados = df["CO_ESTADO_PREALBARAN"].value_counts().to_dict()
@@ -2,12 +2,20 @@
 Módulo de interacción con Cortex Analyst API y Vistas de Snowflake
 """
 
+import time
 import requests
 from typing import Dict, List, Optional, Tuple
 import streamlit as st
 from .ui import display_message
 from .queries import get_all_analyst_results
 from .ai_analysis import get_ai_analysis
+from .semantic_model import match_verified_query, build_verified_response
+from .rollups import ROLLUPS_CONFIG, answer_from_rollup, build_rollup_response
+from .execution import incident_context
+from .warmup import record_first_incident_latency
+from .metrics import CACHE_REQUESTS, record_chat_turn
+from .conversation import is_followup, latest_results, get_followup_analysis, prepare_followup_prompt
+from .jobs import JOBS_CONFIG, enqueue_chat_turn
 
 
 def get_analyst_response_cortex(messages: List[Dict]) -> Tuple[Dict, Optional[str]]:
@@ -16,6 +24,26 @@ def get_analyst_response_cortex(messages: List[Dict]) -> Tuple[Dict, Optional[st
     if "snowpark_session" not in st.session_state:
         return {}, "No hay una sesión activa de Snowflake."
     
+    # Ruta rápida: si la pregunta coincide con una verified query del modelo
+    # semántico local, se devuelve su SQL sin llamar a la API de Cortex Analyst
+    last_question = next(
+        (item["text"] for msg in reversed(messages) if msg["role"] == "user"
+         for item in msg["content"] if item["type"] == "text"),
+        None
+    )
+    if last_question:
+        match = match_verified_query(last_question)
+        CACHE_REQUESTS.inc(cache="verified_query", result="hit" if match else "miss")
+        if match:
+            return build_verified_response(match), None
+        # Preguntas por periodo: desde el rollup más pequeño que las cubre
+        if ROLLUPS_CONFIG["enabled"]:
+            answer = answer_from_rollup(last_question, st.session_state.snowpark_session)
+            CACHE_REQUESTS.inc(cache="rollup", result="hit" if answer else "miss")
+            if answer:
+                print(f"🧮 Pregunta respondida desde el rollup '{answer['rollup']}'")
+                return build_rollup_response(answer), None
+    
     session = st.session_state.snowpark_session
     model_path = st.session_state.selected_semantic_model_path
     
@@ -81,33 +109,68 @@ def get_analyst_response(messages: List[Dict]) -> Dict:
 def process_user_input(prompt: str):
     """Procesa la entrada del usuario y obtiene respuesta del Analyst (vistas + IA)."""
     st.session_state.warnings = []
+    record_chat_turn(st.session_state)
+    incidencia_data = st.session_state.get("incidencia_data")
+    # Seguimiento: se reutilizan los datos de vistas ya obtenidos
+    followup = bool(incidencia_data) and is_followup(st.session_state.messages, prompt)
     new_user_message = {"role": "user", "content": [{"type": "text", "text": prompt}]}
     st.session_state.messages.append(new_user_message)
     
     with st.chat_message("user"):
         display_message(new_user_message["content"], len(st.session_state.messages) - 1)
 
-    with st.chat_message("analyst"):
-        # Paso 1: Ejecutar vistas de Snowflake
-        with st.spinner("📊 Consultando vistas de Snowflake..."):
-            response = get_analyst_response(st.session_state.messages)
-        
-        # Paso 2: Analizar con IA si hay datos
-        ai_analysis = None
+    incident_id = (incidencia_data or {}).get("id")
+    with st.chat_message("analyst"), incident_context(incident_id):
         model = st.session_state.get("cortex_model", "mistral-large")
+
+        # Con trabajos en segundo plano el script no espera a Snowflake ni a Cortex:
+        # se deja un mensaje provisional que display_pending_jobs completa
+        if JOBS_CONFIG["enabled"] and incidencia_data and "snowpark_session" in st.session_state:
+            if followup:
+                response = latest_results(st.session_state.messages)
+                prompt_text = prepare_followup_prompt(incidencia_data, response, prompt,
+                                                      st.session_state.snowpark_session)
+                analyst_message = enqueue_chat_turn("followup", {
+                    "incident_id": incident_id, "model": model, "prompt": prompt_text,
+                })
+                # Los datos de vistas siguen siendo los de la respuesta anterior
+                analyst_message["raw_data"] = response
+            else:
+                analyst_message = enqueue_chat_turn("analysis", {
+                    "incident_id": incident_id, "model": model, "incidencia_data": incidencia_data,
+                })
+            st.session_state.messages.append(analyst_message)
+            st.rerun()
         
-        if "incidencia_data" in st.session_state and st.session_state.incidencia_data:
-            with st.spinner(f"🤖 Analizando con IA ({model})..."):
-                ai_analysis = get_ai_analysis(
-                    st.session_state.incidencia_data, 
-                    response,
-                    model=model
-                )
+        if followup:
+            response = latest_results(st.session_state.messages)
+            with st.spinner(f"🤖 Respondiendo ({model})..."):
+                ai_analysis = get_followup_analysis(incidencia_data, response, prompt, model=model)
+            content = format_followup_response(ai_analysis)
+        else:
+            # Paso 1: Ejecutar vistas de Snowflake
+            with st.spinner("📊 Consultando vistas de Snowflake..."):
+                start = time.perf_counter()
+                response = get_analyst_response(st.session_state.messages)
+                if "snowpark_session" in st.session_state:
+                    record_first_incident_latency(st.session_state.snowpark_session, time.perf_counter() - start)
+            
+            # Paso 2: Analizar con IA si hay datos
+            ai_analysis = None
+            
+            if incidencia_data:
+                with st.spinner(f"🤖 Analizando con IA ({model})..."):
+                    ai_analysis = get_ai_analysis(
+                        incidencia_data, 
+                        response,
+                        model=model
+                    )
+            content = format_analyst_response(response, ai_analysis)
         
         # Construir mensaje de respuesta con análisis de IA + datos
         analyst_message = {
             "role": "analyst",
-            "content": format_analyst_response(response, ai_analysis),
+            "content": content,
             "request_id": "N/A",
             "raw_data": response,  # Datos crudos de las vistas
             "ai_analysis": ai_analysis  # Análisis de IA
@@ -117,6 +180,18 @@ def process_user_input(prompt: str):
         st.rerun()
 
 
+def format_followup_response(ai_analysis: Dict) -> List[Dict]:
+    """Formatea la respuesta a una pregunta de seguimiento (sin repetir las tablas)."""
+    if ai_analysis.get("error"):
+        text = f"⚠️ **Nota**: No se pudo generar la respuesta: {ai_analysis['error']}"
+    else:
+        text = ai_analysis.get("analysis") or "Sin respuesta del modelo"
+    return [
+        {"type": "text", "text": text},
+        {"type": "text", "text": "_📎 Respuesta con los datos de vistas ya consultados. Escribe «actualiza» para volver a consultarlas._"}
+    ]
+
+
 def format_analyst_response(results: Dict, ai_analysis: Optional[Dict] = None) -> List[Dict]:
     """
     Formatea los resultados de las vistas en formato de mensaje,
@@ -160,6 +235,11 @@ def format_analyst_response(results: Dict, ai_analysis: Optional[Dict] = None) -
                 "type": "data_table",
                 "data": diag_p1["data"]
             })
+            if diag_p1["data"].attrs.get("truncated"):
+                content.append({
+                    "type": "text",
+                    "text": f"_✂️ Resultado recortado a {len(diag_p1['data'])} filas por los límites de consulta_"
+                })
         else:
             content.append({
                 "type": "text",
@@ -183,12 +263,35 @@ def format_analyst_response(results: Dict, ai_analysis: Optional[Dict] = None) -
                 "type": "data_table",
                 "data": diag_p2["data"]
             })
+            if diag_p2["data"].attrs.get("truncated"):
+                content.append({
+                    "type": "text",
+                    "text": f"_✂️ Resultado recortado a {len(diag_p2['data'])} filas por los límites de consulta_"
+                })
         else:
             content.append({
                 "type": "text",
                 "text": f"⚠️ {diag_p2['vista']}: No se encontraron resultados"
             })
     
+    # Historial: incidencias similares ya resueltas
+    if results.get("historial"):
+        historial = results["historial"]
+        if historial["error"]:
+            content.append({
+                "type": "text",
+                "text": f"⚠️ {historial['vista']}: {historial['error']}"
+            })
+        elif historial["data"] is not None and not historial["data"].empty:
+            content.append({
+                "type": "text",
+                "text": f"### {historial['vista']}"
+            })
+            content.append({
+                "type": "data_table",
+                "data": historial["data"]
+            })
+    
     if not content:
         content.append({
             "type": "text",
@@ -0,0 +1,407 @@
+"""
+Módulo de analítica de incidencias
+Agrega en el warehouse las incidencias guardadas (INCIDENCIAS_PEDIDOS) cruzadas
+con las vistas de diagnóstico en un cubo diario pequeño (día, almacén, tipo de
+pedido, estado del ASN) con contadores e histogramas sumables:
+- Refresco incremental por día (solo se vuelven a agregar los días nuevos)
+- Cubo en memoria y en disco (Parquet); los resúmenes de la página son
+  groupbys vectorizados sobre el cubo, cacheados por versión y filtros
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+import streamlit as st
+from .charts import prepare_chart_series
+from .execution import run_statement
+from .queries import VISTA_CONFIG
+from .rules import SIN_DATOS, MIXTO
+from .scheduler import scheduled, priority_context, PRIORITY_BATCH
+
+
+ANALYTICS_CONFIG = {
+    "enabled": os.environ.get("ANALYTICS_ENABLED", "false").lower() in ("1", "true", "yes"),
+    "table": os.environ.get("ANALYTICS_TABLE", "INCIDENCIAS_PEDIDOS"),
+    "dir": os.environ.get("ANALYTICS_DIR", ".analytics"),
+    # Refresco incremental (días nuevos) y completo (recoge cambios de estado en días pasados)
+    "refresh_seconds": int(os.environ.get("ANALYTICS_REFRESH_SECONDS", "300")),
+    "full_refresh_seconds": int(os.environ.get("ANALYTICS_FULL_REFRESH_SECONDS", "86400")),
+    # 0 = todo el histórico
+    "history_days": int(os.environ.get("ANALYTICS_HISTORY_DAYS", "0")),
+    # Límites superiores de los buckets de |diferencias| (unidades) y de tiempo (minutos)
+    "diferencias_buckets": [0, 1, 10, 100],
+    "tiempo_buckets": [5, 15, 60, 240, 1440],
+    "top_almacenes": 15,
+    # write_pandas crea las columnas con el nombre en minúsculas (identificadores entre comillas)
+    "columns": {"id": '"id"', "uneco": '"uneco"', "almacen": '"almacen"', "pedido_host": '"pedido_host"',
+                "inicio": '"hora_inicio"', "fin": '"hora_finalizacion"'},
+}
+
+DIMENSIONS = ["DIA", "ALMACEN", "TIPO_PEDIDO", "ESTADO_ASN"]
+
+
+def _bucket_labels(edges: List[float], unit: str) -> List[str]:
+    labels = [f"≤ {edge:g}{unit}" for edge in edges]
+    return labels + [f"> {edges[-1]:g}{unit}"]
+
+
+def _bucket_counts(prefix: str, expr: str, edges: List[float]) -> List[str]:
+    """COUNT_IF por bucket; cada bucket es una columna del cubo (sumable entre días)."""
+    clauses, lower = [], None
+    for i, edge in enumerate(edges):
+        cond = f"{expr} <= {edge}" if lower is None else f"{expr} > {lower} AND {expr} <= {edge}"
+        clauses.append(f"COUNT_IF({cond}) AS {prefix}_{i}")
+        lower = edge
+    clauses.append(f"COUNT_IF({expr} > {lower}) AS {prefix}_{len(edges)}")
+    return clauses
+
+
+def build_cube_query(since: Optional[date] = None) -> str:
+    """
+    Consulta del cubo diario: una fila por (día, almacén, tipo de pedido, estado ASN).
+
+    El cruce con las vistas y la agregación se hacen en el warehouse; solo
+    viajan contadores, no una fila por incidencia.
+    """
+    cols = ANALYTICS_CONFIG["columns"]
+    paso1 = VISTA_CONFIG["diagnostico_paso1"]["name"]
+    paso2 = VISTA_CONFIG["diagnostico_paso2"]["name"]
+    fin = f"TRY_TO_TIMESTAMP(TO_VARCHAR({cols['fin']}))"
+    inicio = f"TRY_TO_TIMESTAMP(TO_VARCHAR({cols['inicio']}))"
+    conditions = [f"{fin} IS NOT NULL"]
+    if since:
+        conditions.append(f"{fin} >= '{since.isoformat()}'")
+    elif ANALYTICS_CONFIG["history_days"]:
+        conditions.append(f"{fin} >= DATEADD(day, -{ANALYTICS_CONFIG['history_days']}, CURRENT_DATE())")
+
+    dif_edges = ANALYTICS_CONFIG["diferencias_buckets"]
+    time_edges = ANALYTICS_CONFIG["tiempo_buckets"]
+    return f"""
+WITH inc AS (
+    SELECT {cols['id']} AS ID, {cols['uneco']} AS UNECO, {cols['almacen']} AS ALMACEN,
+           {cols['pedido_host']} AS PEDIDO_HOST, {inicio} AS INICIO, {fin} AS FIN
+    FROM {ANALYTICS_CONFIG['table']}
+    WHERE {' AND '.join(conditions)}
+),
+p1 AS (
+    SELECT i.ID, IFF(COUNT(DISTINCT v.TIPO_PEDIDO) > 1, '{MIXTO}', ANY_VALUE(v.TIPO_PEDIDO)) AS TIPO_PEDIDO
+    FROM inc i JOIN {paso1} v
+      ON v.CO_UNECO = i.UNECO AND v.CO_CENTRO_LOGISTICO = i.ALMACEN AND v.CO_PEDIDO_HOST = i.PEDIDO_HOST
+    GROUP BY i.ID
+),
+p2 AS (
+    SELECT i.ID, IFF(COUNT(DISTINCT v.CO_ESTADO_PREALBARAN) > 1, '{MIXTO}', ANY_VALUE(v.CO_ESTADO_PREALBARAN)) AS ESTADO_ASN,
+           SUM(ABS(v.DIFERENCIAS_REVISION)) AS DIFERENCIAS
+    FROM inc i JOIN {paso2} v ON v.CO_PEDIDO = i.PEDIDO_HOST
+    GROUP BY i.ID
+),
+fact AS (
+    SELECT TO_DATE(i.FIN) AS DIA, COALESCE(i.ALMACEN, '{SIN_DATOS}') AS ALMACEN,
+           COALESCE(p1.TIPO_PEDIDO, '{SIN_DATOS}') AS TIPO_PEDIDO,
+           COALESCE(p2.ESTADO_ASN, '{SIN_DATOS}') AS ESTADO_ASN,
+           p2.DIFERENCIAS, DATEDIFF('second', i.INICIO, i.FIN) / 60 AS MINUTOS
+    FROM inc i LEFT JOIN p1 ON p1.ID = i.ID LEFT JOIN p2 ON p2.ID = i.ID
+)
+SELECT DIA, ALMACEN, TIPO_PEDIDO, ESTADO_ASN,
+       COUNT(*) AS INCIDENCIAS,
+       COUNT_IF(DIFERENCIAS > 0) AS CON_DIFERENCIAS,
+       COUNT(MINUTOS) AS CON_TIEMPO,
+       COALESCE(SUM(MINUTOS), 0) AS MINUTOS_TOTAL,
+       {', '.join(_bucket_counts('DIF', 'DIFERENCIAS', dif_edges))},
+       {', '.join(_bucket_counts('TIEMPO', 'MINUTOS', time_edges))}
+FROM fact
+GROUP BY DIA, ALMACEN, TIPO_PEDIDO, ESTADO_ASN
+"""
+
+
+def _normalize_cube(df: pd.DataFrame) -> pd.DataFrame:
+    """Tipos compactos: categorías para las dimensiones y enteros para los contadores."""
+    df = df.rename(columns={c: c.upper() for c in df.columns})
+    df["DIA"] = pd.to_datetime(df["DIA"]).dt.normalize()
+    for col in DIMENSIONS[1:]:
+        df[col] = df[col].astype(str).astype("category")
+    for col in df.columns:
+        if col not in DIMENSIONS:
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0)
+            if col != "MINUTOS_TOTAL":
+                df[col] = df[col].astype(np.int64)
+    return df.reset_index(drop=True)
+
+
+# --- Cubo (memoria + disco) ---
+
+_STATE: Dict = {"cube": None, "watermark": None, "version": 0, "refreshed_at": 0.0,
+                "full_refreshed_at": 0.0, "refreshing": False, "error": None}
+_LOCK = threading.Lock()
+
+
+def _cube_paths() -> tuple[str, str]:
+    base = ANALYTICS_CONFIG["dir"]
+    return os.path.join(base, "cubo.parquet"), os.path.join(base, "cubo.json")
+
+
+def _install(cube: pd.DataFrame, meta: Dict):
+    with _LOCK:
+        _STATE.update(cube=cube, watermark=meta.get("watermark"), refreshed_at=meta.get("refreshed_at", 0.0),
+                      full_refreshed_at=meta.get("full_refreshed_at", 0.0), version=_STATE["version"] + 1)
+
+
+def load_cube() -> bool:
+    """Carga el cubo guardado en disco. Devuelve True si existía."""
+    data_path, meta_path = _cube_paths()
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return False
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    _install(_normalize_cube(pd.read_parquet(data_path)), meta)
+    return True
+
+
+def refresh_cube(session, full: bool = False) -> int:
+    """
+    Refresca el cubo: completo, o incremental desde el último día agregado.
+
+    El último día se vuelve a agregar entero (puede haber llegado a medias), así
+    que la fusión es sustituir los días >= watermark por las filas nuevas.
+
+    Returns:
+        Número de filas del cubo traídas del warehouse
+    """
+    with _LOCK:
+        current, watermark = _STATE["cube"], _STATE["watermark"]
+        full_refreshed_at = _STATE["full_refreshed_at"]
+    since = None if full or current is None or not watermark else date.fromisoformat(watermark)
+
+    start = time.perf_counter()
+    with priority_context(PRIORITY_BATCH), scheduled("vista"):
+        rows = run_statement(session, build_cube_query(since), stage="analytics")
+    if "DIA" not in rows.columns and "dia" not in rows.columns:
+        rows = pd.DataFrame(columns=DIMENSIONS)
+    rows = _normalize_cube(rows)
+    if since is not None:
+        kept = current[current["DIA"] < pd.Timestamp(since)]
+        cube = _normalize_cube(pd.concat([kept, rows], ignore_index=True))
+    else:
+        cube = rows
+        full_refreshed_at = time.time()
+
+    latest = cube["DIA"].max() if not cube.empty else None
+    meta = {
+        "watermark": latest.date().isoformat() if latest is not None and pd.notna(latest) else watermark,
+        "refreshed_at": time.time(),
+        "full_refreshed_at": full_refreshed_at,
+    }
+    os.makedirs(ANALYTICS_CONFIG["dir"], exist_ok=True)
+    data_path, meta_path = _cube_paths()
+    cube.to_parquet(data_path, index=False)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    _install(cube, meta)
+    print(f"📊 Cubo de analítica {'completo' if since is None else 'desde ' + since.isoformat()}: "
+          f"+{len(rows)} filas ({len(cube)} en total, {time.perf_counter() - start:.2f}s)")
+    return len(rows)
+
+
+def _refresh_in_background(session, full: bool):
+    try:
+        refresh_cube(session, full=full)
+        with _LOCK:
+            _STATE["error"] = None
+    except Exception as e:
+        with _LOCK:
+            _STATE["error"] = str(e)
+        print(f"⚠️ No se pudo refrescar la analítica: {str(e)}")
+    finally:
+        with _LOCK:
+            _STATE["refreshing"] = False
+
+
+def ensure_cube(session) -> Optional[pd.DataFrame]:
+    """
+    Cubo listo para la página.
+
+    La primera vez (sin cubo en disco) se carga en el hilo del script; después
+    los refrescos van en segundo plano y la página sigue con el cubo anterior.
+    Mientras otra sesión hace la primera carga devuelve None.
+    """
+    with _LOCK:
+        cube = _STATE["cube"]
+    if cube is None and not load_cube():
+        with _LOCK:
+            if _STATE["refreshing"]:
+                return None
+            _STATE.update(refreshing=True, refreshed_at=time.time())
+        try:
+            refresh_cube(session, full=True)
+            with _LOCK:
+                _STATE["error"] = None
+        except Exception as e:
+            with _LOCK:
+                _STATE["error"] = str(e)
+            raise
+        finally:
+            with _LOCK:
+                _STATE["refreshing"] = False
+    with _LOCK:
+        now = time.time()
+        full = now - _STATE["full_refreshed_at"] >= ANALYTICS_CONFIG["full_refresh_seconds"]
+        stale = full or now - _STATE["refreshed_at"] >= ANALYTICS_CONFIG["refresh_seconds"]
+        if stale and not _STATE["refreshing"]:
+            # Si el refresco falla, se reintenta en el siguiente intervalo
+            _STATE.update(refreshing=True, refreshed_at=now)
+            threading.Thread(target=_refresh_in_background, args=(session, full),
+                             name="analytics", daemon=True).start()
+        return _STATE["cube"]
+
+
+# --- Resúmenes (groupbys vectorizados sobre el cubo) ---
+
+def _histogram(cube: pd.DataFrame, prefix: str, edges: List[float], unit: str) -> pd.Series:
+    columns = [f"{prefix}_{i}" for i in range(len(edges) + 1)]
+    return pd.Series(cube[columns].sum().to_numpy(), index=_bucket_labels(edges, unit), name="INCIDENCIAS")
+
+
+def approximate_median(histogram: pd.Series, edges: List[float]) -> Optional[float]:
+    """Mediana aproximada por interpolación lineal dentro del bucket que la contiene."""
+    total = histogram.sum()
+    if total == 0:
+        return None
+    counts = histogram.to_numpy()
+    cumulative = np.cumsum(counts)
+    i = int(np.searchsorted(cumulative, total / 2))
+    if i >= len(edges):
+        return float(edges[-1])
+    lower = edges[i - 1] if i > 0 else 0.0
+    before = cumulative[i - 1] if i > 0 else 0
+    return float(lower + (edges[i] - lower) * (total / 2 - before) / max(counts[i], 1))
+
+
+def _by(cube: pd.DataFrame, column: str) -> pd.DataFrame:
+    grouped = cube.groupby(column, observed=True)[["INCIDENCIAS", "CON_DIFERENCIAS"]].sum()
+    grouped["% CON DIFERENCIAS"] = (100 * grouped["CON_DIFERENCIAS"] / grouped["INCIDENCIAS"]).round(1)
+    return grouped.sort_values("INCIDENCIAS", ascending=False)
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _cached_summary(version: int, start: date, end: date, almacenes: tuple, _cube: pd.DataFrame) -> Dict:
+    """Resumen para unos filtros. La clave de caché es (versión del cubo, filtros)."""
+    return summarize(_cube, start, end, list(almacenes))
+
+
+def summarize(cube: pd.DataFrame, start: Optional[date] = None, end: Optional[date] = None,
+              almacenes: Optional[List[str]] = None) -> Dict:
+    """
+    Agregados de la página a partir del cubo.
+
+    Returns:
+        Diccionario con KPIs, desgloses por tipo/estado/almacén, serie diaria e
+        histogramas de diferencias y tiempos
+    """
+    mask = np.ones(len(cube), dtype=bool)
+    if start:
+        mask &= (cube["DIA"] >= pd.Timestamp(start)).to_numpy()
+    if end:
+        mask &= (cube["DIA"] <= pd.Timestamp(end)).to_numpy()
+    if almacenes:
+        mask &= cube["ALMACEN"].isin(almacenes).to_numpy()
+    cube = cube[mask]
+
+    total = int(cube["INCIDENCIAS"].sum())
+    con_tiempo = int(cube["CON_TIEMPO"].sum())
+    tiempos = _histogram(cube, "TIEMPO", ANALYTICS_CONFIG["tiempo_buckets"], " min")
+    return {
+        "kpis": {
+            "incidencias": total,
+            "con_diferencias": int(cube["CON_DIFERENCIAS"].sum()),
+            "minutos_medios": float(cube["MINUTOS_TOTAL"].sum() / con_tiempo) if con_tiempo else None,
+            "minutos_mediana": approximate_median(tiempos, ANALYTICS_CONFIG["tiempo_buckets"]),
+        },
+        "por_tipo": _by(cube, "TIPO_PEDIDO"),
+        "por_estado": _by(cube, "ESTADO_ASN"),
+        "por_almacen": _by(cube, "ALMACEN").head(ANALYTICS_CONFIG["top_almacenes"]),
+        "por_dia": cube.groupby("DIA")["INCIDENCIAS"].sum(),
+        "diferencias": _histogram(cube, "DIF", ANALYTICS_CONFIG["diferencias_buckets"], " ud"),
+        "tiempos": tiempos,
+    }
+
+
+def _bar_chart(series: pd.Series):
+    """Gráfico de barras con el presupuesto de puntos de charts (días agrupados si hace falta)."""
+    x = series.index.name or "X"
+    df = series.rename("INCIDENCIAS").rename_axis(x).reset_index()
+    st.bar_chart(prepare_chart_series(df, x, "INCIDENCIAS", "Barras"))
+
+
+def display_analytics_page():
+    """Página de analítica de incidencias (sobre el cubo diario)."""
+    st.markdown("### 📊 Analítica de incidencias")
+    session = st.session_state.get("snowpark_session")
+    if not ANALYTICS_CONFIG["enabled"] or session is None:
+        st.info("Analítica no disponible")
+        return
+
+    try:
+        with st.spinner("📊 Agregando el histórico de incidencias..."):
+            cube = ensure_cube(session)
+    except Exception as e:
+        st.error(f"No se pudo cargar la analítica: {str(e)}")
+        return
+    if cube is None:
+        st.info("⏳ Otra sesión está agregando el histórico de incidencias; vuelve en unos segundos")
+        return
+    if cube.empty:
+        st.info(f"No hay incidencias guardadas en {ANALYTICS_CONFIG['table']}")
+        return
+
+    first, last = cube["DIA"].min().date(), cube["DIA"].max().date()
+    col_dates, col_almacen = st.columns([1, 2])
+    rango = col_dates.date_input("Periodo", value=(max(first, last - timedelta(days=90)), last),
+                                 min_value=first, max_value=last, key="analytics_range")
+    almacenes = col_almacen.multiselect("Almacenes", sorted(cube["ALMACEN"].cat.categories),
+                                        key="analytics_almacenes")
+    start, end = (rango if isinstance(rango, (list, tuple)) and len(rango) == 2 else (first, last))
+
+    with _LOCK:
+        version, error = _STATE["version"], _STATE["error"]
+    summary = _cached_summary(version, start, end, tuple(sorted(almacenes)), cube)
+
+    kpis = summary["kpis"]
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Incidencias", f"{kpis['incidencias']:,}")
+    col2.metric("Con diferencias", f"{kpis['con_diferencias']:,}")
+    col3.metric("Tiempo medio", f"{kpis['minutos_medios']:.1f} min" if kpis["minutos_medios"] is not None else "N/A")
+    col4.metric("Tiempo mediano (aprox.)",
+                f"{kpis['minutos_mediana']:.1f} min" if kpis["minutos_mediana"] is not None else "N/A")
+
+    st.markdown("#### Incidencias por día")
+    _bar_chart(summary["por_dia"])
+
+    col_tipo, col_estado = st.columns(2)
+    with col_tipo:
+        st.markdown("#### Por tipo de pedido")
+        st.dataframe(summary["por_tipo"], use_container_width=True)
+    with col_estado:
+        st.markdown("#### Por estado del ASN")
+        st.dataframe(summary["por_estado"], use_container_width=True)
+
+    st.markdown(f"#### Almacenes con más incidencias (top {ANALYTICS_CONFIG['top_almacenes']})")
+    st.dataframe(summary["por_almacen"], use_container_width=True)
+
+    col_dif, col_tiempo = st.columns(2)
+    with col_dif:
+        st.markdown("#### Diferencias de revisión (|unidades|)")
+        _bar_chart(summary["diferencias"])
+    with col_tiempo:
+        st.markdown("#### Tiempo de registro")
+        _bar_chart(summary["tiempos"])
+
+    with _LOCK:
+        refreshing = _STATE["refreshing"]
+    st.caption(f"Datos hasta {last.isoformat()} · {len(cube):,} filas en el cubo"
+               + (" · actualizando en segundo plano..." if refreshing else "")
+               + (f" · ⚠️ último refresco fallido: {error}" if error else ""))
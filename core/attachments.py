@@ -0,0 +1,212 @@
+"""
+Módulo de adjuntos de incidencias
+Copia los ficheros subidos a un spool local por bloques (calculando su sha256
+sin duplicarlos en memoria) y los sube en segundo plano con PUT a un stage
+de Snowflake, con límites de tamaño y deduplicación por contenido
+"""
+
+import hashlib
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from .auth import create_service_session
+from .execution import run_statement, incident_context
+
+
+ATTACHMENTS_CONFIG = {
+    # Stage de destino (p.ej. @CORTEX_ANALYST_DEMO.CHATBOT_V2.INCIDENCIAS_ADJUNTOS); vacío = solo spool local
+    "stage": os.environ.get("ATTACHMENTS_STAGE", ""),
+    "spool_dir": os.environ.get("ATTACHMENTS_SPOOL_DIR", ".attachments"),
+    "max_file_bytes": int(float(os.environ.get("ATTACHMENTS_MAX_FILE_MB", "25")) * 1024 * 1024),
+    "max_total_bytes": int(float(os.environ.get("ATTACHMENTS_MAX_TOTAL_MB", "100")) * 1024 * 1024),
+    "chunk_bytes": 1024 * 1024,
+    "upload_workers": int(os.environ.get("ATTACHMENTS_UPLOAD_WORKERS", "2")),
+    # PUT con una sesión propia (usuario de servicio, SNOWFLAKE_USER/SNOWFLAKE_PASSWORD) en vez
+    # de la del usuario; sin ella el PUT se serializa con el lock de la sesión del usuario
+    "dedicated_session": os.environ.get("ATTACHMENTS_DEDICATED_SESSION", "false").lower() in ("1", "true", "yes"),
+}
+
+# Estado de las subidas del proceso, por ruta en el stage: pending | uploaded | error
+_UPLOADS: Dict[str, Dict] = {}
+_LOCK = threading.Lock()
+_EXECUTOR = {"pool": None}
+_UPLOAD_SESSION = {"session": None, "failed": False}
+
+
+def _content_name(sha256: str, name: str) -> str:
+    """Nombre por contenido: sha256 + extensión original (p.ej. 'ab12….pdf')."""
+    extension = re.sub(r"[^\w.]", "", os.path.splitext(name)[1].lower())
+    return f"{sha256}{extension}"
+
+
+def stage_path_for(sha256: str, name: str) -> Optional[str]:
+    """Ruta en el stage de un adjunto (direccionada por contenido)."""
+    if not ATTACHMENTS_CONFIG["stage"]:
+        return None
+    return f"{ATTACHMENTS_CONFIG['stage'].rstrip('/')}/{_content_name(sha256, name)}"
+
+
+def spool_upload(uploaded_file) -> Dict:
+    """
+    Copia un fichero subido al spool local por bloques y calcula su sha256.
+
+    Args:
+        uploaded_file: Objeto de st.file_uploader (o cualquier fichero con .name y .read)
+
+    Returns:
+        {"name", "size", "sha256", "spool_path"}
+    """
+    os.makedirs(ATTACHMENTS_CONFIG["spool_dir"], exist_ok=True)
+    tmp_path = os.path.join(ATTACHMENTS_CONFIG["spool_dir"], f".tmp-{uuid.uuid4().hex}")
+    digest = hashlib.sha256()
+    size = 0
+    uploaded_file.seek(0)
+    try:
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = uploaded_file.read(ATTACHMENTS_CONFIG["chunk_bytes"])
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > ATTACHMENTS_CONFIG["max_file_bytes"]:
+                    raise ValueError(
+                        f"supera el máximo de {ATTACHMENTS_CONFIG['max_file_bytes'] // (1024 * 1024)} MB"
+                    )
+                digest.update(chunk)
+                out.write(chunk)
+
+        sha256 = digest.hexdigest()
+        final_path = os.path.join(ATTACHMENTS_CONFIG["spool_dir"], _content_name(sha256, uploaded_file.name))
+        if os.path.exists(final_path):
+            # Mismo contenido ya en el spool
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, final_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return {"name": uploaded_file.name, "size": size, "sha256": sha256, "spool_path": final_path}
+
+
+def _remove_spooled(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _upload_session(session):
+    """Sesión para el PUT: la dedicada del proceso si está configurada, o la del usuario."""
+    if not ATTACHMENTS_CONFIG["dedicated_session"]:
+        return session
+    with _LOCK:
+        if _UPLOAD_SESSION["session"] is None and not _UPLOAD_SESSION["failed"]:
+            try:
+                _UPLOAD_SESSION["session"] = create_service_session()
+            except Exception as e:
+                _UPLOAD_SESSION["failed"] = True
+                print(f"⚠️ Sin sesión dedicada para adjuntos ({str(e)}): se usa la del usuario")
+        return _UPLOAD_SESSION["session"] or session
+
+
+def _put_to_stage(session, attachment: Dict, incident_id: Optional[str]):
+    """Sube un fichero del spool al stage (en un hilo del pool)."""
+    key = attachment["stage_path"]
+    try:
+        target_dir = ATTACHMENTS_CONFIG["stage"].rstrip("/")
+        local = os.path.abspath(attachment["spool_path"]).replace("\\", "/")
+        upload_session = _upload_session(session)
+        with incident_context(incident_id):
+            # En la sesión del usuario el PUT no se intercala con sus sentencias
+            # (QUERY_TAG y warehouse son estado de sesión)
+            run_statement(
+                upload_session,
+                f"PUT 'file://{local}' '{target_dir}' AUTO_COMPRESS=FALSE OVERWRITE=FALSE",
+                stage="attachments", collect=True, exclusive=upload_session is session
+            )
+        with _LOCK:
+            _UPLOADS[key]["status"] = "uploaded"
+        # En el stage ya está: el spool solo era un búfer
+        _remove_spooled(attachment["spool_path"])
+        print(f"📎 Adjunto subido: {key}")
+    except Exception as e:
+        with _LOCK:
+            _UPLOADS[key].update(status="error", error=str(e))
+        print(f"⚠️ Error subiendo adjunto {attachment['name']}: {str(e)}")
+
+
+def _executor() -> ThreadPoolExecutor:
+    with _LOCK:
+        if _EXECUTOR["pool"] is None:
+            _EXECUTOR["pool"] = ThreadPoolExecutor(
+                max_workers=ATTACHMENTS_CONFIG["upload_workers"], thread_name_prefix="attachments"
+            )
+        return _EXECUTOR["pool"]
+
+
+def process_attachments(uploaded_files: List, session=None, incident_id: Optional[str] = None) -> tuple[List[Dict], List[str]]:
+    """
+    Valida, deduplica y encola la subida de los adjuntos de una incidencia.
+
+    El spool se hace en el envío del formulario (lectura por bloques); el PUT
+    al stage corre en segundo plano y no bloquea el envío.
+
+    Args:
+        uploaded_files: Ficheros de st.file_uploader
+        session: Sesión de Snowpark para el PUT (sin sesión o sin stage se quedan en el spool)
+        incident_id: Incidencia a la que se asocian las sentencias PUT
+
+    Returns:
+        (adjuntos aceptados, mensajes de los rechazados)
+    """
+    accepted, rejected = [], []
+    seen, total = set(), 0
+    for uploaded_file in uploaded_files or []:
+        size = getattr(uploaded_file, "size", None)
+        if size is not None and size > ATTACHMENTS_CONFIG["max_file_bytes"]:
+            rejected.append(f"{uploaded_file.name}: supera el máximo de "
+                            f"{ATTACHMENTS_CONFIG['max_file_bytes'] // (1024 * 1024)} MB")
+            continue
+        if size is not None and total + size > ATTACHMENTS_CONFIG["max_total_bytes"]:
+            rejected.append(f"{uploaded_file.name}: se supera el total de "
+                            f"{ATTACHMENTS_CONFIG['max_total_bytes'] // (1024 * 1024)} MB por incidencia")
+            continue
+        try:
+            attachment = spool_upload(uploaded_file)
+        except Exception as e:
+            rejected.append(f"{uploaded_file.name}: {str(e)}")
+            continue
+        if (attachment["sha256"], attachment["name"]) in seen:
+            continue
+        seen.add((attachment["sha256"], attachment["name"]))
+        total += attachment["size"]
+        attachment["stage_path"] = stage_path_for(attachment["sha256"], attachment["name"])
+        accepted.append(attachment)
+
+        key = attachment["stage_path"]
+        if key is None or session is None:
+            continue
+        with _LOCK:
+            previous = _UPLOADS.get(key)
+            if previous and previous["status"] in ("pending", "uploaded"):
+                # Mismo contenido ya subido o en curso
+                if previous["status"] == "uploaded":
+                    _remove_spooled(attachment["spool_path"])
+                continue
+            _UPLOADS[key] = {"status": "pending", "error": None}
+        _executor().submit(_put_to_stage, session, attachment, incident_id)
+    return accepted, rejected
+
+
+def attachment_status(stage_path: Optional[str]) -> str:
+    """Estado de la subida de un adjunto: pending | uploaded | error | local | unknown."""
+    if stage_path is None:
+        return "local"
+    with _LOCK:
+        upload = _UPLOADS.get(stage_path)
+    # Sin registro en este proceso (p.ej. sesión restaurada en otra réplica)
+    return upload["status"] if upload else "unknown"
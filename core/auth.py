@@ -3,9 +3,15 @@ Módulo de autenticación y sesión de Snowflake
 """
 
 import os
+import threading
 import streamlit as st
 from snowflake.snowpark import Session
 from .utils import reset_session_state, get_config
+from .snapshot import register_snapshot_session, unregister_snapshot_session
+from .execution import run_statement
+from .warmup import start_warmup, touch_activity, stop_keepalive
+from .metrics import ACTIVE_SESSIONS
+from .guardrails import session_parameters
 
 
 def get_snowflake_session(user: str, password: str):
@@ -16,7 +22,8 @@ def get_snowflake_session(user: str, password: str):
             "account": config["snowflake_account"],
             "warehouse": config["snowflake_warehouse"],
             "user": user,
-            "password": password
+            "password": password,
+            "session_parameters": session_parameters()
         }
         return Session.builder.configs(connection_parameters).create()
     except Exception as e:
@@ -24,6 +31,50 @@ def get_snowflake_session(user: str, password: str):
         return None
 
 
+def create_service_session():
+    """
+    Crea una sesión con el usuario de servicio para procesos sin UI (API, jobs).
+    
+    Usa SNOWFLAKE_USER y SNOWFLAKE_PASSWORD además de la configuración de get_config().
+    
+    Raises: ValueError si faltan las credenciales.
+    """
+    config = get_config()
+    user = os.environ.get("SNOWFLAKE_USER")
+    password = os.environ.get("SNOWFLAKE_PASSWORD")
+    if not user or not password:
+        raise ValueError("Variables de entorno faltantes: SNOWFLAKE_USER, SNOWFLAKE_PASSWORD")
+    connection_parameters = {
+        "account": config["snowflake_account"],
+        "warehouse": config["snowflake_warehouse"],
+        "user": user,
+        "password": password,
+        "session_parameters": session_parameters()
+    }
+    return Session.builder.configs(connection_parameters).create()
+
+
+_SERVICE_SESSION = {"session": None, "failed": False}
+_SERVICE_LOCK = threading.Lock()
+
+
+def get_service_session():
+    """
+    Sesión de servicio compartida por los procesos de fondo del proceso (snapshot, autocompletado).
+
+    Se crea una sola vez; sin credenciales de servicio devuelve None y quien la
+    pide decide con qué sesión seguir.
+    """
+    with _SERVICE_LOCK:
+        if _SERVICE_SESSION["session"] is None and not _SERVICE_SESSION["failed"]:
+            try:
+                _SERVICE_SESSION["session"] = create_service_session()
+            except Exception as e:
+                _SERVICE_SESSION["failed"] = True
+                print(f"⚠️ Sin sesión de servicio ({str(e)})")
+        return _SERVICE_SESSION["session"]
+
+
 def get_available_semantic_views():
     """Obtiene la lista de Semantic Views disponibles en la cuenta."""
     if "snowpark_session" not in st.session_state:
@@ -32,7 +83,7 @@ def get_available_semantic_views():
     session_local = st.session_state.snowpark_session
     
     try:
-        df = session_local.sql("SHOW SEMANTIC VIEWS IN ACCOUNT").to_pandas()
+        df = run_statement(session_local, "SHOW SEMANTIC VIEWS IN ACCOUNT", stage="metadata")
         if df.empty:
             return []
         
@@ -61,6 +112,10 @@ def show_header_and_sidebar():
                         session_obj = get_snowflake_session(user_val, pass_val)
                         if session_obj:
                             st.session_state.snowpark_session = session_obj
+                            ACTIVE_SESSIONS.inc(origin="streamlit")
+                            register_snapshot_session(session_obj)
+                            # Warm-up del warehouse y vistas en segundo plano + keep-alive
+                            start_warmup(session_obj)
                             st.session_state.user_email = user_val
                             st.session_state.user_name = user_val.split('@')[0] if '@' in user_val else user_val
                             st.rerun()
@@ -70,12 +125,16 @@ def show_header_and_sidebar():
         
         # --- CÓDIGO SI YA ESTÁ LOGUEADO ---
         session = st.session_state.snowpark_session
+        touch_activity(session)
         st.success("✅ Conectado")
         st.write(f"👤 **Usuario:** {session.get_current_user()}")
         st.write(f"🏗️ **Warehouse:** {session.get_current_warehouse()}")
         
         if st.button("Cerrar Sesión", type="primary", use_container_width=True):
+            unregister_snapshot_session(session)
+            stop_keepalive(session)
             session.close()
+            ACTIVE_SESSIONS.dec(origin="streamlit")
             del st.session_state.snowpark_session
             reset_session_state()
             st.rerun()
@@ -0,0 +1,218 @@
+"""
+Módulo de preparación de datos para gráficos
+Reduce series grandes antes de enviarlas al navegador (downsampling y agregación)
+"""
+
+import hashlib
+import os
+import threading
+from typing import Optional
+import numpy as np
+import pandas as pd
+import streamlit as st
+from .metrics import CACHE_REQUESTS
+
+
+# Presupuesto de puntos por gráfico y método de reducción para líneas
+CHART_CONFIG = {
+    "max_points": int(os.environ.get("CHART_MAX_POINTS", "2000")),
+    "line_method": os.environ.get("CHART_LINE_METHOD", "lttb"),  # 'lttb' o 'minmax'
+    "bar_aggregation": os.environ.get("CHART_BAR_AGGREGATION", "sum"),
+}
+
+# Frecuencias candidatas para agrupar barras temporales (de más fina a más gruesa)
+# con su duración aproximada, usada para estimar el número de buckets
+TIME_BUCKETS = [
+    ("s", pd.Timedelta(seconds=1)),
+    ("min", pd.Timedelta(minutes=1)),
+    ("h", pd.Timedelta(hours=1)),
+    ("D", pd.Timedelta(days=1)),
+    ("W", pd.Timedelta(weeks=1)),
+    ("MS", pd.Timedelta(days=31)),
+    ("QS", pd.Timedelta(days=92)),
+    ("YS", pd.Timedelta(days=366)),
+]
+
+
+def dataframe_fingerprint(df: pd.DataFrame) -> str:
+    """Huella estable del contenido de un DataFrame (columnas + valores)."""
+    hasher = hashlib.sha1()
+    hasher.update(",".join(map(str, df.columns)).encode("utf-8"))
+    hasher.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return hasher.hexdigest()
+
+
+def _to_numeric_axis(values: pd.Series) -> np.ndarray:
+    """Convierte el eje X (fechas o números) a float64 para cálculos vectoriales."""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype("int64").to_numpy(dtype=np.float64)
+    return pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float64)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Selecciona índices con Largest-Triangle-Three-Buckets.
+
+    Args:
+        x: Eje X ordenado (float64)
+        y: Valores (float64)
+        n_out: Número de puntos deseado (incluye primero y último)
+
+    Returns:
+        Array de índices seleccionados, ordenados
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # Límites de los buckets interiores (el primero y el último punto se conservan)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    # Centroides del bucket siguiente, precalculados con sumas acumuladas
+    cum_x = np.concatenate(([0.0], np.cumsum(x)))
+    cum_y = np.concatenate(([0.0], np.cumsum(y)))
+    next_start = edges[1:]
+    next_end = np.append(edges[2:], n)
+    counts = np.maximum(next_end - next_start, 1)
+    avg_x = (cum_x[next_end] - cum_x[next_start]) / counts
+    avg_y = (cum_y[next_end] - cum_y[next_start]) / counts
+
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        bx = x[start:end]
+        by = y[start:end]
+        # Área del triángulo (a, candidato, centroide siguiente), sin el factor 1/2
+        area = np.abs(
+            (x[a] - avg_x[i]) * (by - y[a]) - (x[a] - bx) * (avg_y[i] - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
+
+
+def minmax_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Selecciona el mínimo y el máximo de cada bucket (totalmente vectorizado).
+
+    Args:
+        y: Valores (float64), en el orden del eje X
+        n_out: Número de puntos deseado
+
+    Returns:
+        Array de índices seleccionados, ordenados
+    """
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+
+    n_buckets = max(n_out // 2, 1)
+    bucket = (np.arange(n) * n_buckets) // n
+    # Ordenar por (bucket, y): el primero de cada bucket es el mínimo y el último el máximo
+    order = np.lexsort((y, bucket))
+    sorted_buckets = bucket[order]
+    first = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+    last = np.r_[first[1:] - 1, n - 1]
+    return np.unique(np.concatenate((order[first], order[last])))
+
+
+def downsample_line(series: pd.Series, max_points: int, method: str = "lttb") -> pd.Series:
+    """Reduce una serie indexada por el eje X a como máximo `max_points` puntos."""
+    if len(series) <= max_points:
+        return series
+
+    series = series.dropna()
+    x_values = series.index.to_series()
+    x = _to_numeric_axis(x_values)
+    if np.isnan(x).any():
+        # Eje categórico: no hay orden numérico, se usa la posición
+        x = np.arange(len(series), dtype=np.float64)
+    else:
+        order = np.argsort(x, kind="stable")
+        series = series.iloc[order]
+        x = x[order]
+    y = series.to_numpy(dtype=np.float64)
+
+    if method == "minmax":
+        idx = minmax_indices(y, max_points)
+    else:
+        idx = lttb_indices(x, y, max_points)
+    return series.iloc[idx]
+
+
+def aggregate_bars(series: pd.Series, max_points: int, how: str = "sum") -> pd.Series:
+    """
+    Agrega una serie para gráfico de barras.
+
+    - Eje temporal: agrupa en la frecuencia más fina que respeta el presupuesto
+    - Eje numérico: agrupa en `max_points` intervalos
+    - Eje categórico: agrega por categoría y conserva las de mayor valor
+    """
+    index = series.index
+    if pd.api.types.is_datetime64_any_dtype(index):
+        span = index.max() - index.min()
+        freq = next(
+            (f for f, duration in TIME_BUCKETS if span / duration + 1 <= max_points),
+            TIME_BUCKETS[-1][0]
+        )
+        return series.sort_index().resample(freq).agg(how)
+
+    grouped = series.groupby(level=0, sort=True).agg(how)
+    if len(grouped) <= max_points:
+        return grouped
+
+    if pd.api.types.is_numeric_dtype(grouped.index):
+        bins = pd.cut(grouped.index, bins=max_points)
+        binned = grouped.groupby(bins, observed=True).agg(how)
+        binned.index = [interval.mid for interval in binned.index]
+        return binned
+
+    return grouped.nlargest(max_points)
+
+
+# Marca por hilo: el cuerpo de la función cacheada solo corre en un fallo de caché
+_cache_probe = threading.local()
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def _cached_chart_series(fingerprint: str, x: str, y: str, chart_type: str,
+                         max_points: int, _df: pd.DataFrame) -> pd.Series:
+    """Serie lista para pintar. La clave de caché es (fingerprint, x, y, tipo, presupuesto)."""
+    _cache_probe.miss = True
+    series = _df.set_index(x)[y]
+    if series.index.dtype == object:
+        # Las columnas DATE de Snowflake llegan como objetos datetime.date
+        as_dates = pd.to_datetime(series.index, errors="coerce")
+        if not as_dates.isna().any():
+            series.index = as_dates
+    if chart_type == "Lineas":
+        return downsample_line(series, max_points, CHART_CONFIG["line_method"])
+    return aggregate_bars(series, max_points, CHART_CONFIG["bar_aggregation"])
+
+
+def prepare_chart_series(df: pd.DataFrame, x: str, y: str, chart_type: str,
+                         max_points: Optional[int] = None) -> pd.Series:
+    """
+    Prepara la serie de un gráfico respetando el presupuesto de puntos.
+
+    Args:
+        df: DataFrame con resultados
+        x: Columna del eje X
+        y: Columna del eje Y
+        chart_type: 'Lineas' o 'Barras'
+        max_points: Presupuesto de puntos (por defecto CHART_CONFIG['max_points'])
+
+    Returns:
+        Serie indexada por el eje X
+    """
+    max_points = max_points or CHART_CONFIG["max_points"]
+    if len(df) <= max_points or not pd.api.types.is_numeric_dtype(df[y]):
+        return df.set_index(x)[y]
+    _cache_probe.miss = False
+    series = _cached_chart_series(dataframe_fingerprint(df), x, y, chart_type, max_points, df)
+    CACHE_REQUESTS.inc(cache="chart", result="miss" if _cache_probe.miss else "hit")
+    return series
@@ -0,0 +1,224 @@
+"""
+Módulo de contexto de conversación
+Permite preguntas de seguimiento sobre una incidencia sin que el prompt crezca
+con cada turno:
+- La pregunta del operador se envía al modelo
+- Los turnos antiguos se pliegan en un resumen acotado
+- Se reutilizan los resultados de vistas ya obtenidos (no se vuelven a consultar)
+- Presupuesto máximo de tokens por turno
+"""
+
+import os
+import re
+from typing import Dict, List, Optional
+import streamlit as st
+from .ai_analysis import build_data_context, analyze_with_cortex
+from .execution import run_statement
+from .guardrails import quote_literal
+from .state_store import resolve_frame
+
+
+CONVERSATION_CONFIG = {
+    "max_prompt_tokens": int(os.environ.get("CONTEXT_MAX_PROMPT_TOKENS", "3000")),
+    "summary_max_tokens": int(os.environ.get("CONTEXT_SUMMARY_MAX_TOKENS", "400")),
+    # Turnos (pregunta + respuesta) que se envían literales
+    "recent_turns": int(os.environ.get("CONTEXT_RECENT_TURNS", "2")),
+    # extractive (sin coste) | cortex (SNOWFLAKE.CORTEX.SUMMARIZE al superar el límite)
+    "summary_mode": os.environ.get("CONTEXT_SUMMARY_MODE", "extractive"),
+}
+
+# Preguntas que piden volver a consultar las vistas en lugar de reutilizar los datos
+REFRESH_PATTERN = re.compile(r"\b(actualiza\w*|refresca\w*|recarga\w*|vuelve a consultar|datos nuevos)\b", re.IGNORECASE)
+
+FOLLOWUP_INSTRUCTIONS = """
+
+**TU TAREA:**
+Responde a la PREGUNTA DEL OPERADOR usando los datos de diagnóstico anteriores y el
+contexto de la conversación. Si los datos no permiten responder, dilo claramente.
+
+**FORMATO DE RESPUESTA:**
+- Español claro y profesional, con emojis si ayudan (📊 📦 ⚠️ ✅ ❌)
+- Responde solo a lo que se pregunta, en pocas líneas
+
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación barata de tokens (~4 caracteres por token)."""
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Recorta un texto al presupuesto de tokens indicado."""
+    max_chars = max(max_tokens, 0) * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max(max_chars - 20, 0)].rstrip() + " …[recortado]"
+
+
+def _message_text(message: Dict) -> str:
+    """Texto de un mensaje: la pregunta del usuario o la respuesta de IA del analista."""
+    if message["role"] == "user":
+        return " ".join(item["text"] for item in message["content"] if item["type"] == "text")
+    ai_analysis = message.get("ai_analysis") or {}
+    return ai_analysis.get("analysis") or ""
+
+
+def _turns(messages: List[Dict]) -> List[tuple]:
+    """Pares (pregunta, respuesta) de la conversación, en orden."""
+    turns, question = [], None
+    for message in messages:
+        if message["role"] == "user":
+            question = _message_text(message)
+        elif question is not None:
+            turns.append((question, _message_text(message)))
+            question = None
+    return turns
+
+
+def _first_sentence(text: str, max_chars: int) -> str:
+    text = " ".join(text.split())
+    match = re.search(r"[.!?](\s|$)", text)
+    sentence = text[:match.end()] if match else text
+    return sentence[:max_chars].rstrip()
+
+
+def _compress_summary(summary: str, session=None) -> str:
+    """Mantiene el resumen dentro de su presupuesto."""
+    max_tokens = CONVERSATION_CONFIG["summary_max_tokens"]
+    if estimate_tokens(summary) <= max_tokens:
+        return summary
+    if CONVERSATION_CONFIG["summary_mode"] == "cortex" and session is not None:
+        try:
+            # El resumen incluye texto del operador: comillas y barras invertidas escapadas
+            rows = run_statement(
+                session, f"SELECT SNOWFLAKE.CORTEX.SUMMARIZE({quote_literal(summary)}) AS SUMMARY",
+                stage="llm", model="summarize", collect=True
+            )
+            if rows and rows[0]["SUMMARY"]:
+                return truncate_to_tokens(rows[0]["SUMMARY"], max_tokens)
+        except Exception as e:
+            print(f"⚠️ No se pudo resumir con Cortex: {str(e)}")
+    # Extractivo: se descartan las líneas más antiguas
+    lines = summary.splitlines()
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return truncate_to_tokens("\n".join(lines), max_tokens)
+
+
+def get_conversation_context(incident_id: Optional[str]) -> Dict:
+    """Estado del contexto de la incidencia actual (resumen y turnos ya plegados)."""
+    context = st.session_state.get("conversation_context")
+    if context is None or context["incident_id"] != incident_id:
+        context = {"incident_id": incident_id, "summary": "", "folded_turns": 0}
+        st.session_state.conversation_context = context
+    return context
+
+
+def update_summary(context: Dict, messages: List[Dict], session=None):
+    """
+    Pliega en el resumen los turnos que salen de la ventana de turnos recientes.
+
+    Cada turno se pliega una sola vez, así que el coste por turno es constante.
+    """
+    turns = _turns(messages)
+    fold_until = max(len(turns) - CONVERSATION_CONFIG["recent_turns"], 0)
+    if fold_until <= context["folded_turns"]:
+        return
+    lines = [context["summary"]] if context["summary"] else []
+    for question, answer in turns[context["folded_turns"]:fold_until]:
+        lines.append(f"- P: {_first_sentence(question, 160)} → R: {_first_sentence(answer, 240) or 'sin respuesta'}")
+    context["summary"] = _compress_summary("\n".join(lines), session)
+    context["folded_turns"] = fold_until
+
+
+def latest_results(messages: List[Dict]) -> Optional[Dict]:
+    """Resultados de vistas de la última respuesta (los datos en caché de la conversación)."""
+    for message in reversed(messages):
+        if message.get("raw_data"):
+            return message["raw_data"]
+    return None
+
+
+def is_followup(messages: List[Dict], question: str) -> bool:
+    """True si la pregunta puede responderse con los datos ya obtenidos."""
+    return latest_results(messages) is not None and not REFRESH_PATTERN.search(question)
+
+
+def build_followup_prompt(incidencia_data: Dict, results: Dict, question: str,
+                          context: Dict, messages: List[Dict]) -> str:
+    """
+    Prompt de seguimiento dentro del presupuesto de tokens.
+
+    Orden de prioridad: pregunta, datos de diagnóstico, resumen y, con lo que
+    quede, los turnos recientes (del más nuevo al más antiguo).
+    """
+    budget = CONVERSATION_CONFIG["max_prompt_tokens"]
+    question_block = f"**PREGUNTA DEL OPERADOR:** {truncate_to_tokens(question, budget // 4)}\n\nRespuesta:"
+    budget -= estimate_tokens(FOLLOWUP_INSTRUCTIONS) + estimate_tokens(question_block)
+
+    frames = {k: dict(v, data=resolve_frame(v.get("data"))) for k, v in results.items() if isinstance(v, dict)}
+    data_block = truncate_to_tokens(build_data_context(incidencia_data, frames), budget * 2 // 3)
+    budget -= estimate_tokens(data_block)
+
+    summary_block = ""
+    if context["summary"]:
+        summary_block = "\n\n**RESUMEN DE LA CONVERSACIÓN:**\n" + context["summary"]
+        budget -= estimate_tokens(summary_block)
+
+    recent = []
+    for question_prev, answer in reversed(_turns(messages)[context["folded_turns"]:]):
+        turn = f"- Operador: {question_prev}\n- Asistente: {answer}"
+        if estimate_tokens(turn) > budget:
+            break
+        recent.insert(0, turn)
+        budget -= estimate_tokens(turn)
+    recent_block = "\n\n**ÚLTIMOS TURNOS:**\n" + "\n".join(recent) if recent else ""
+
+    return data_block + summary_block + recent_block + FOLLOWUP_INSTRUCTIONS + question_block
+
+
+def prepare_followup_prompt(incidencia_data: Dict, results: Dict, question: str, session=None) -> str:
+    """
+    Prompt de una pregunta de seguimiento con el contexto de la conversación.
+
+    Lee y actualiza st.session_state (mensajes y resumen): se llama desde el
+    hilo del script aunque la llamada a Cortex se haga en segundo plano.
+    """
+    messages = st.session_state.get("messages", [])
+    # El último mensaje es la propia pregunta: no forma parte del historial
+    history = messages[:-1] if messages and messages[-1]["role"] == "user" else messages
+    context = get_conversation_context(incidencia_data.get("id"))
+    update_summary(context, history, session)
+    return build_followup_prompt(incidencia_data, results, question, context, history)
+
+
+def get_followup_analysis(incidencia_data: Dict, results: Dict, question: str,
+                          model: str = "mistral-large", session=None) -> Dict:
+    """
+    Responde a una pregunta de seguimiento con los datos en caché.
+
+    Args:
+        incidencia_data: Datos del formulario
+        results: Resultados de vistas reutilizados
+        question: Pregunta del operador
+        model: Modelo de Cortex a usar
+        session: Sesión de Snowpark (por defecto la de st.session_state)
+
+    Returns:
+        Diccionario con análisis y metadatos (mismo formato que get_ai_analysis)
+    """
+    prompt = prepare_followup_prompt(incidencia_data, results, question, session)
+    return followup_from_prompt(prompt, model, session)
+
+
+def followup_from_prompt(prompt: str, model: str = "mistral-large", session=None) -> Dict:
+    """Llama a Cortex con un prompt de seguimiento ya construido (sin st.session_state si hay sesión)."""
+    analysis, error = analyze_with_cortex(prompt, model, session=session)
+    return {
+        "analysis": analysis,
+        "error": error,
+        "model": model,
+        "prompt_length": len(prompt),
+        "followup": True,
+    }
@@ -0,0 +1,174 @@
+"""
+Módulo de atribución de coste y latencia por incidencia
+Cruza los QUERY_ID registrados por execution.run_statement con QUERY_HISTORY
+(y opcionalmente GET_QUERY_OPERATOR_STATS) para obtener tiempos por etapa,
+bytes escaneados y créditos estimados por incidencia
+"""
+
+import json
+import os
+from typing import Dict, List, Optional
+import pandas as pd
+from .execution import get_query_log
+
+
+COST_CONFIG = {
+    # "information_schema" (inmediato, últimos 7 días) o "account_usage" (hasta 45 min de retraso)
+    "history_source": os.environ.get("COST_HISTORY_SOURCE", "information_schema").lower(),
+    # La sesión se crea sin base de datos: la función QUERY_HISTORY se califica con esta
+    "history_database": os.environ.get("COST_HISTORY_DATABASE", "CORTEX_ANALYST_DEMO"),
+    # Créditos por millón de tokens (entrada + salida) de Cortex COMPLETE por modelo; la
+    # tabla de consumo de Snowflake cambia: CORTEX_CREDITS_PER_M_TOKENS='{"modelo": 1.0}'
+    "cortex_credits_per_m_tokens": {
+        "mistral-large": 5.10, "mixtral-8x7b": 0.50, "snowflake-arctic": 0.84,
+        "llama3-70b": 1.21, "llama3-8b": 0.19, "mistral-7b": 0.12, "gemma-7b": 0.12,
+        **json.loads(os.environ.get("CORTEX_CREDITS_PER_M_TOKENS", "{}")),
+    },
+}
+
+# Créditos por hora según tamaño de warehouse
+WAREHOUSE_CREDITS_PER_HOUR = {
+    "X-SMALL": 1, "SMALL": 2, "MEDIUM": 4, "LARGE": 8, "X-LARGE": 16,
+    "2X-LARGE": 32, "3X-LARGE": 64, "4X-LARGE": 128, "5X-LARGE": 256, "6X-LARGE": 512,
+}
+
+
+HISTORY_COLUMNS = [
+    "QUERY_ID", "QUERY_TAG", "WAREHOUSE_NAME", "WAREHOUSE_SIZE",
+    "COMPILATION_TIME", "QUEUED_PROVISIONING_TIME", "QUEUED_OVERLOAD_TIME",
+    "EXECUTION_TIME", "TOTAL_ELAPSED_TIME", "BYTES_SCANNED", "CREDITS_USED_CLOUD_SERVICES",
+]
+
+
+def estimate_cortex_credits(model: str, prompt_tokens: int, output_tokens: int) -> Optional[float]:
+    """Créditos estimados de una llamada a COMPLETE (None si el modelo no tiene tarifa)."""
+    rate = COST_CONFIG["cortex_credits_per_m_tokens"].get(model)
+    if rate is None:
+        return None
+    return (prompt_tokens + output_tokens) / 1_000_000 * rate
+
+
+def build_history_query(query_ids: List[str]) -> str:
+    """SELECT de QUERY_HISTORY (calificado, según COST_HISTORY_SOURCE) para los QUERY_ID."""
+    ids = ", ".join(f"'{qid}'" for qid in query_ids)
+    if COST_CONFIG["history_source"] == "account_usage":
+        source = "SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY"
+    else:
+        source = f"TABLE({COST_CONFIG['history_database']}.INFORMATION_SCHEMA.QUERY_HISTORY(RESULT_LIMIT => 10000))"
+    return f"""
+    SELECT {', '.join(HISTORY_COLUMNS)}
+    FROM {source}
+    WHERE QUERY_ID IN ({ids})
+    """
+
+
+def fetch_query_history(session, query_ids: List[str]) -> pd.DataFrame:
+    """
+    Obtiene de QUERY_HISTORY las métricas de las sentencias indicadas.
+
+    Args:
+        session: Sesión de Snowpark
+        query_ids: QUERY_ID registrados
+
+    Returns:
+        DataFrame con HISTORY_COLUMNS (tiempos en milisegundos)
+    """
+    if not query_ids:
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+    return session.sql(build_history_query(query_ids)).to_pandas()
+
+
+def fetch_operator_stats(session, query_ids: List[str]) -> pd.DataFrame:
+    """
+    Resume GET_QUERY_OPERATOR_STATS por sentencia: nº de operadores y el más costoso.
+
+    Returns:
+        DataFrame con QUERY_ID, NUM_OPERATORS y TOP_OPERATOR
+    """
+    rows = []
+    for qid in query_ids:
+        stats = session.sql(f"SELECT * FROM TABLE(GET_QUERY_OPERATOR_STATS('{qid}'))").to_pandas()
+        stats.columns = [c.upper() for c in stats.columns]
+        top = None
+        if not stats.empty and "EXECUTION_TIME_BREAKDOWN" in stats.columns:
+            overall = stats["EXECUTION_TIME_BREAKDOWN"].map(_overall_percentage)
+            top = stats.loc[overall.idxmax(), "OPERATOR_TYPE"]
+        rows.append({"QUERY_ID": qid, "NUM_OPERATORS": len(stats), "TOP_OPERATOR": top})
+    return pd.DataFrame(rows, columns=["QUERY_ID", "NUM_OPERATORS", "TOP_OPERATOR"])
+
+
+def _overall_percentage(breakdown) -> float:
+    """Extrae overall_percentage del VARIANT EXECUTION_TIME_BREAKDOWN (dict o JSON)."""
+    if isinstance(breakdown, str):
+        try:
+            breakdown = json.loads(breakdown)
+        except ValueError:
+            return 0.0
+    if isinstance(breakdown, dict):
+        return float(breakdown.get("overall_percentage", 0.0) or 0.0)
+    return 0.0
+
+
+def build_cost_report(query_log: List[Dict], history: pd.DataFrame,
+                      operator_stats: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """
+    Construye el informe por incidencia y etapa.
+
+    Args:
+        query_log: Entradas de execution.get_query_log()
+        history: Filas de QUERY_HISTORY (ver fetch_query_history)
+        operator_stats: Resumen opcional de fetch_operator_stats
+
+    Returns:
+        DataFrame con una fila por (incidencia, etapa, vista, modelo): nº de sentencias,
+        compilación/cola/ejecución/total (ms), latencia observada, bytes y créditos estimados
+    """
+    log = pd.DataFrame(query_log)
+    if log.empty:
+        return pd.DataFrame()
+
+    history = history.copy()
+    history.columns = [c.upper() for c in history.columns]
+    log = log.rename(columns={"query_id": "QUERY_ID"})
+    merged = log.merge(history, on="QUERY_ID", how="left")
+    if operator_stats is not None and not operator_stats.empty:
+        merged = merged.merge(operator_stats, on="QUERY_ID", how="left")
+
+    for col in HISTORY_COLUMNS[4:]:
+        if col not in merged.columns:
+            merged[col] = 0
+        merged[col] = pd.to_numeric(merged[col], errors="coerce").fillna(0)
+
+    merged["QUEUED_TIME"] = merged["QUEUED_PROVISIONING_TIME"] + merged["QUEUED_OVERLOAD_TIME"]
+    credits_per_hour = (
+        merged.get("WAREHOUSE_SIZE", pd.Series(index=merged.index, dtype=object))
+        .fillna("").astype(str).str.upper().map(WAREHOUSE_CREDITS_PER_HOUR).fillna(0)
+    )
+    # Estimación: tiempo de ejecución prorrateado al tamaño del warehouse + cloud services
+    merged["CREDITS_ESTIMATED"] = (
+        merged["EXECUTION_TIME"] / 3_600_000 * credits_per_hour + merged["CREDITS_USED_CLOUD_SERVICES"]
+    )
+
+    group_cols = ["incident_id", "stage", "vista", "model"]
+    for col in group_cols:
+        merged[col] = merged[col].fillna("-")
+    report = merged.groupby(group_cols, dropna=False).agg(
+        sentencias=("QUERY_ID", "size"),
+        compilacion_ms=("COMPILATION_TIME", "sum"),
+        cola_ms=("QUEUED_TIME", "sum"),
+        ejecucion_ms=("EXECUTION_TIME", "sum"),
+        total_ms=("TOTAL_ELAPSED_TIME", "sum"),
+        latencia_observada_ms=("elapsed_ms", "sum"),
+        bytes_escaneados=("BYTES_SCANNED", "sum"),
+        creditos_estimados=("CREDITS_ESTIMATED", "sum"),
+    ).reset_index()
+    return report.sort_values(["incident_id", "total_ms"], ascending=[True, False]).reset_index(drop=True)
+
+
+def get_incident_cost_report(session, incident_id: str, include_operator_stats: bool = False) -> pd.DataFrame:
+    """Informe de coste/latencia de una incidencia a partir del registro del proceso."""
+    log = get_query_log(incident_id)
+    query_ids = [e["query_id"] for e in log if e["query_id"]]
+    history = fetch_query_history(session, query_ids)
+    operator_stats = fetch_operator_stats(session, query_ids) if include_operator_stats else None
+    return build_cost_report(log, history, operator_stats)
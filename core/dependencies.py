@@ -0,0 +1,228 @@
+"""
+Módulo de re-ejecución diferencial de incidencias
+Permite corregir campos de la incidencia sin empezar de cero: el grafo de
+dependencias sale de los "params" de VISTA_CONFIG, solo se vuelven a consultar
+las vistas cuyos parámetros cambian y el análisis de IA solo se recalcula si
+cambia la huella de sus entradas
+"""
+
+import hashlib
+import json
+from datetime import date, datetime
+from typing import Dict, List, Optional
+import pandas as pd
+import streamlit as st
+from .queries import VISTA_CONFIG, execute_vista_query, get_historial_result
+from .ai_analysis import get_ai_analysis
+from .execution import incident_context
+from .state_store import resolve_frame
+from .typeahead import validate_fields
+
+
+# Campos que se pueden corregir desde el chat
+EDITABLE_FIELDS = ["uneco", "pedido_host", "almacen", "referencia", "feo", "fis",
+                   "es_prepack", "tiene_marca_prepack", "descripcion"]
+
+# Campos del formulario que usa la búsqueda de incidencias similares (además del Paso 1)
+HISTORIAL_FIELDS = ["uneco", "almacen", "descripcion"]
+
+
+def build_dependency_graph() -> Dict[str, List[str]]:
+    """
+    Grafo campo -> nodos que dependen de él.
+
+    Las vistas dependen de los campos mapeados en sus "params"; el historial
+    depende de HISTORIAL_FIELDS y del resultado del Paso 1 (tipo de pedido).
+    """
+    graph: Dict[str, List[str]] = {}
+    for vista_key, vista in VISTA_CONFIG.items():
+        for data_key in vista["params"].values():
+            graph.setdefault(data_key, []).append(vista_key)
+    for field in HISTORIAL_FIELDS:
+        graph.setdefault(field, []).append("historial")
+    graph.setdefault("diagnostico_paso1", []).append("historial")
+    return graph
+
+
+def _normalize(value) -> str:
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()[:10]
+    return " ".join(str(value if value is not None else "").split()).upper()
+
+
+def normalized_fields(incidencia_data: Dict) -> Dict[str, str]:
+    """Campos editables normalizados (base de las huellas de entrada)."""
+    return {f: _normalize(incidencia_data.get(f)) for f in EDITABLE_FIELDS}
+
+
+def changed_fields(before: Dict, after: Dict) -> List[str]:
+    """Campos editables que cambian (ignorando espacios y mayúsculas)."""
+    return [f for f in EDITABLE_FIELDS if _normalize(before.get(f)) != _normalize(after.get(f))]
+
+
+def affected_nodes(changed: List[str], graph: Optional[Dict] = None) -> List[str]:
+    """Nodos a recalcular (cierre transitivo en el grafo), en orden de ejecución."""
+    graph = graph or build_dependency_graph()
+    pending, affected = list(changed), set()
+    while pending:
+        for node in graph.get(pending.pop(), []):
+            if node not in affected:
+                affected.add(node)
+                pending.append(node)
+    return [node for node in list(VISTA_CONFIG) + ["historial"] if node in affected]
+
+
+def _frame_hash(df) -> Optional[str]:
+    if df is None:
+        return None
+    digest = hashlib.sha256(",".join(map(str, df.columns)).encode("utf-8"))
+    if not df.empty:
+        digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def ai_fingerprint(incidencia_data: Dict, results: Dict) -> str:
+    """
+    Huella de las entradas del análisis de IA: contenido de cada resultado y
+    campos descriptivos normalizados. Los campos que son parámetros de vistas
+    entran a través de los resultados: corregir un UNECO o un almacén que
+    devuelve las mismas filas no obliga a repetir el análisis.
+    """
+    view_params = {key for vista in VISTA_CONFIG.values() for key in vista["params"].values()}
+    payload = {
+        "fields": {f: _normalize(incidencia_data.get(f)) for f in EDITABLE_FIELDS if f not in view_params},
+        "results": {
+            key: [_frame_hash(resolve_frame(r.get("data"))), r.get("error")]
+            for key, r in sorted(results.items()) if isinstance(r, dict)
+        },
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _latest_analyst_message() -> Optional[Dict]:
+    for message in reversed(st.session_state.get("messages", [])):
+        if message.get("raw_data"):
+            return message
+    return None
+
+
+def rerun_incident(previous_data: Dict, new_data: Dict, previous_results: Dict,
+                   previous_ai: Optional[Dict], model: str, session=None) -> Optional[Dict]:
+    """
+    Re-ejecuta solo lo afectado por los campos editados.
+
+    Args:
+        previous_data: Datos de la incidencia antes de editar
+        new_data: Datos corregidos
+        previous_results: Resultados de vistas de la última respuesta
+        previous_ai: Análisis de IA de la última respuesta
+        model: Modelo de Cortex seleccionado
+        session: Sesión de Snowpark (por defecto la de st.session_state)
+
+    Returns:
+        Mensaje del analista con los resultados actualizados, o None si no hay cambios
+    """
+    changed = changed_fields(previous_data, new_data)
+    if not changed:
+        return None
+    nodes = affected_nodes(changed)
+
+    results = dict(previous_results)
+    with incident_context(new_data.get("id")):
+        for vista_key in nodes:
+            if vista_key in VISTA_CONFIG:
+                df, err = execute_vista_query(vista_key, new_data, session=session)
+                results[vista_key] = {"data": df, "error": err, "vista": VISTA_CONFIG[vista_key]["description"]}
+        if "historial" in nodes:
+            df_p1 = resolve_frame((results.get("diagnostico_paso1") or {}).get("data"))
+            historial = get_historial_result(new_data, df_p1, session=session)
+            if historial:
+                results["historial"] = historial
+            else:
+                results.pop("historial", None)
+
+        frames = {k: dict(v, data=resolve_frame(v.get("data"))) for k, v in results.items() if isinstance(v, dict)}
+        reuse_ai = (
+            previous_ai is not None and not previous_ai.get("error")
+            and previous_ai.get("model") in (model, "reglas")
+            and ai_fingerprint(previous_data, previous_results) == ai_fingerprint(new_data, frames)
+        )
+        ai_analysis = previous_ai if reuse_ai else get_ai_analysis(new_data, frames, model=model, session=session)
+
+    # Import local para evitar dependencias circulares
+    from .analyst import format_analyst_response
+    rerun_views = [VISTA_CONFIG[n]["description"] if n in VISTA_CONFIG else "🗂️ Incidencias similares" for n in nodes]
+    summary = (
+        f"## ✏️ Incidencia corregida\n\nCampos modificados: **{', '.join(changed)}**\n\n"
+        f"- Vistas re-ejecutadas: {', '.join(rerun_views) if rerun_views else 'ninguna'}\n"
+        f"- Vistas reutilizadas: {len([k for k in results if k not in nodes])}\n"
+        f"- Análisis de IA: {'reutilizado (mismas entradas)' if reuse_ai else 'recalculado'}"
+    )
+    return {
+        "role": "analyst",
+        "content": [{"type": "text", "text": summary}] + format_analyst_response(frames, ai_analysis),
+        "request_id": "edit",
+        "raw_data": results,
+        "ai_analysis": ai_analysis,
+    }
+
+
+def _as_date(value):
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value[:10]).date()
+        except ValueError:
+            return None
+    return value
+
+
+def display_edit_incident():
+    """Formulario para corregir campos de la incidencia y re-ejecutar solo lo afectado."""
+    data = st.session_state.get("incidencia_data")
+    message = _latest_analyst_message()
+    if not data or message is None:
+        return
+
+    with st.expander("✏️ Corregir datos de la incidencia", expanded=False):
+        with st.form("edit_incidence_form"):
+            col1, col2 = st.columns(2)
+            with col1:
+                uneco = st.text_input("UNECO", value=data.get("uneco") or "")
+                pedido_host = st.text_input("Pedido Host", value=data.get("pedido_host") or "")
+                almacen = st.text_input("Almacén o centro afectado", value=data.get("almacen") or "")
+                referencia = st.text_input("Referencia afectada", value=data.get("referencia") or "")
+            with col2:
+                feo = st.date_input("FEO (Fecha)", value=_as_date(data.get("feo")))
+                fis = st.date_input("FIS (Fecha)", value=_as_date(data.get("fis")))
+                es_prepack = st.radio("¿Es un prepack?", ["Sí", "No"], horizontal=True,
+                                      index=0 if data.get("es_prepack") == "Sí" else 1)
+                tiene_marca_prepack = st.radio("¿Tiene puesta la marca de prepack?", ["Sí", "No"], horizontal=True,
+                                               index=0 if data.get("tiene_marca_prepack") == "Sí" else 1)
+            descripcion = st.text_area("Descripción", value=data.get("descripcion") or "", height=100)
+            submitted = st.form_submit_button("🔁 Aplicar y re-ejecutar lo afectado", use_container_width=True)
+
+        if not submitted:
+            return
+        new_data = {**data, "uneco": uneco, "pedido_host": pedido_host, "almacen": almacen,
+                    "referencia": referencia, "feo": feo, "fis": fis, "es_prepack": es_prepack,
+                    "tiene_marca_prepack": tiene_marca_prepack, "descripcion": descripcion}
+        errores = validate_fields({f: new_data[f] for f in ("uneco", "almacen", "pedido_host", "referencia")})
+        if errores:
+            for error in errores:
+                st.error(f"⚠️ {error}")
+            return
+
+        with st.spinner("🔁 Re-ejecutando las vistas afectadas..."):
+            reply = rerun_incident(
+                data, new_data, message["raw_data"], message.get("ai_analysis"),
+                st.session_state.get("cortex_model", "mistral-large"),
+                session=st.session_state.get("snowpark_session"),
+            )
+        if reply is None:
+            st.info("No hay cambios que aplicar")
+            return
+        st.session_state.incidencia_data = new_data
+        # La huella del modo watch corresponde a los datos anteriores
+        st.session_state.pop("watch_state", None)
+        st.session_state.messages.append(reply)
+        st.rerun()
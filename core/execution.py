@@ -0,0 +1,155 @@
+"""
+Módulo de ejecución de sentencias SQL
+Punto único por el que pasan las sentencias de la app: etiqueta cada una con
+QUERY_TAG (incidencia, etapa, vista, modelo) y registra su QUERY_ID y latencia
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from .router import routed, session_lock, set_query_tag
+from .metrics import STATEMENT_SECONDS, VISTA_QUERY_SECONDS, CORTEX_SECONDS, ERRORS
+from .replay import record_statement
+
+
+EXECUTION_CONFIG = {
+    "query_tagging": os.environ.get("QUERY_TAGGING_ENABLED", "true").lower() in ("1", "true", "yes"),
+    "log_size": int(os.environ.get("QUERY_LOG_SIZE", "5000")),
+    # true: las sentencias de una sesión con distinta etiqueta no se solapan (QUERY_TAG
+    # fiable en QUERY_HISTORY); false: la etiqueta es orientativa y no serializa nada
+    "strict_query_tag": os.environ.get("QUERY_TAG_STRICT", "true").lower() in ("1", "true", "yes"),
+}
+
+_current_incident: ContextVar[Optional[str]] = ContextVar("current_incident", default=None)
+_QUERY_LOG = deque(maxlen=EXECUTION_CONFIG["log_size"])
+_LOG_LOCK = threading.Lock()
+
+
+@contextmanager
+def incident_context(incident_id: Optional[str]):
+    """Asocia las sentencias ejecutadas dentro del bloque a una incidencia."""
+    token = _current_incident.set(incident_id)
+    try:
+        yield
+    finally:
+        _current_incident.reset(token)
+
+
+def build_query_tag(stage: str, vista: Optional[str] = None, model: Optional[str] = None) -> str:
+    """QUERY_TAG en JSON compacto: app, incidencia, etapa, vista y modelo."""
+    tag = {"app": "incidencias", "incident": _current_incident.get(), "stage": stage}
+    if vista:
+        tag["vista"] = vista
+    if model:
+        tag["model"] = model
+    return json.dumps(tag, separators=(",", ":"))
+
+
+def run_statement(session, query: str, stage: str, vista: Optional[str] = None,
+                  model: Optional[str] = None, collect: bool = False, exclusive: bool = False):
+    """
+    Ejecuta una sentencia etiquetada y registra su QUERY_ID.
+
+    Args:
+        session: Sesión de Snowpark
+        query: Sentencia SQL
+        stage: Etapa del pipeline ('vista', 'llm', 'exploratorio', 'metadata', ...)
+        vista: Clave de la vista en VISTA_CONFIG, si aplica
+        model: Modelo de Cortex, si aplica
+        collect: True para devolver filas (collect), False para DataFrame (to_pandas)
+        exclusive: True para que ninguna otra sentencia de la sesión se ejecute a la vez
+            (p.ej. PUT en segundo plano con la sesión del usuario)
+
+    Returns:
+        DataFrame de pandas o lista de filas
+    """
+    tag = build_query_tag(stage, vista, model)
+    tagging = EXECUTION_CONFIG["query_tagging"]
+    strict = tagging and EXECUTION_CONFIG["strict_query_tag"]
+    # Estricto: warehouse y QUERY_TAG se mantienen hasta que termina la sentencia
+    with routed(session, stage, tag=tag if strict else None, exclusive=exclusive):
+        if tagging and not strict:
+            # Sin garantía: otro hilo de la sesión puede cambiar la etiqueta antes de ejecutar
+            with session_lock(session):
+                set_query_tag(session, tag)
+        return _execute_recorded(session, query, tag, stage, vista, model, collect)
+
+
+def _execute_recorded(session, query: str, tag: str, stage: str, vista: Optional[str],
+                      model: Optional[str], collect: bool):
+    """Ejecuta la sentencia y deja constancia de QUERY_ID, latencia y error."""
+    history = session.query_history() if hasattr(session, "query_history") else nullcontext()
+    recorder = None
+    result = None
+    start = time.perf_counter()
+    error = None
+    try:
+        with history as recorder:
+            dataframe = session.sql(query)
+            result = dataframe.collect() if collect else dataframe.to_pandas()
+            return result
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        _observe_statement(stage, vista, model, elapsed, error)
+        # Traza anonimizada para reproducir la carga offline (TRACE_RECORD_FILE)
+        record_statement(query, stage, vista, model, collect, _current_incident.get(), elapsed, error, result)
+        queries = getattr(recorder, "queries", None)
+        record_query({
+            "incident_id": _current_incident.get(),
+            "stage": stage,
+            "vista": vista,
+            "model": model,
+            "query_id": _match_query_id(queries, query),
+            "query_tag": tag,
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "started_at": time.time() - elapsed,
+            "error": error,
+        })
+
+
+def _match_query_id(queries, query: str) -> Optional[str]:
+    """
+    QUERY_ID de la sentencia entre las registradas durante la llamada.
+
+    query_history() recoge también las sentencias de otros hilos que comparten
+    la sesión, así que se busca por texto y no se toma la última.
+    """
+    for record in reversed(queries or []):
+        if record.sql_text == query:
+            return record.query_id
+    return None
+
+
+def _observe_statement(stage: str, vista: Optional[str], model: Optional[str],
+                       elapsed: float, error: Optional[str]):
+    """Latencias y errores de la sentencia en las métricas del proceso."""
+    STATEMENT_SECONDS.observe(elapsed, stage=stage)
+    if stage == "vista" and vista:
+        VISTA_QUERY_SECONDS.observe(elapsed, vista=vista)
+    elif stage == "llm" and model:
+        CORTEX_SECONDS.observe(elapsed, model=model)
+    if error:
+        ERRORS.inc(stage=stage, type=error)
+
+
+def record_query(entry: Dict):
+    """Añade una entrada al registro de sentencias del proceso."""
+    with _LOG_LOCK:
+        _QUERY_LOG.append(entry)
+
+
+def get_query_log(incident_id: Optional[str] = None) -> List[Dict]:
+    """Sentencias registradas (todas o las de una incidencia)."""
+    with _LOG_LOCK:
+        entries = list(_QUERY_LOG)
+    if incident_id is None:
+        return entries
+    return [e for e in entries if e["incident_id"] == incident_id]
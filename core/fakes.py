@@ -0,0 +1,145 @@
+"""
+Módulo de backend simulado de Snowflake
+Sesión falsa con latencias configurables para pruebas de carga y
+ejecución del pipeline sin conexión
+"""
+
+import json
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+import pandas as pd
+
+
+# Filas de ejemplo que devuelven las vistas simuladas
+FAKE_VIEW_ROWS = {
+    "V_DIAGNOSTICO_PASO1_TIPO_PEDIDO": [
+        {"CO_PEDIDO": "4500000001", "CO_UNECO": "001", "CO_CENTRO_LOGISTICO": "ALM01",
+         "CO_PEDIDO_HOST": "123456", "TIPO_PEDIDO": "ALMACENABLE"},
+    ],
+    "V_DIAGNOSTICO_PASO2_ESTADO_ASN": [
+        {"CO_PEDIDO": "4500000001", "CO_POSICION_PEDIDO": 10, "CO_ALBARAN": "ASN01",
+         "CO_ESTADO_PREALBARAN": "RECIBIDO", "QT_PEDIDO": 100,
+         "CANTIDAD_REVISADA_ASN": 95, "DIFERENCIAS_REVISION": 5},
+    ],
+}
+
+# Latencias por defecto (segundos) por tipo de sentencia
+FAKE_LATENCY = {"vista": 0.05, "cortex": 0.8, "other": 0.01}
+
+
+def classify_statement(query: str) -> str:
+    """Clasifica una sentencia en 'cortex', 'vista' u 'other'."""
+    upper = query.upper()
+    if "CORTEX.COMPLETE" in upper:
+        return "cortex"
+    if any(view in upper for view in FAKE_VIEW_ROWS):
+        return "vista"
+    return "other"
+
+
+FAKE_ANALYSIS = {
+    "estado": "✅ Pedido recibido con 5 unidades de diferencia en revisión.",
+    "problema": "La cantidad revisada del ASN es menor que la pedida.",
+    "recomendaciones": ["Revisar la posición 10 del ASN01"],
+    "alertas": [],
+}
+
+
+def _fake_completion(query: str) -> str:
+    """Respuesta de COMPLETE con la misma forma que la real (con o sin opciones)."""
+    if "'response_format'" in query:
+        return json.dumps({"structured_output": [{"raw_message": FAKE_ANALYSIS, "type": "json"}],
+                           "usage": {"prompt_tokens": len(query) // 4, "completion_tokens": 40}})
+    if "'role'" in query:
+        return json.dumps({"choices": [{"messages": FAKE_ANALYSIS["estado"]}],
+                           "usage": {"prompt_tokens": len(query) // 4, "completion_tokens": 20}})
+    return FAKE_ANALYSIS["estado"]
+
+
+FakeQueryRecord = namedtuple("FakeQueryRecord", ["query_id", "sql_text"])
+
+
+class FakeQueryHistory:
+    """Equivalente a snowpark.QueryHistory: acumula las sentencias ejecutadas."""
+
+    def __init__(self):
+        self.queries: List[FakeQueryRecord] = []
+
+
+class FakeResult:
+    """Resultado diferido de session.sql(): la latencia se paga al materializar."""
+
+    def __init__(self, session: "FakeSession", query: str):
+        self._session = session
+        self._query = query
+
+    def to_pandas(self) -> pd.DataFrame:
+        return pd.DataFrame(self._session._execute(self._query))
+
+    def collect(self) -> List[Dict]:
+        return self._session._execute(self._query)
+
+
+class FakeSession:
+    """
+    Sesión falsa compatible con el subconjunto de Snowpark que usa `core/`.
+
+    Args:
+        latency: Segundos por tipo de sentencia ('vista', 'cortex', 'other')
+        handler: Función opcional query -> filas que sustituye a la respuesta por defecto
+    """
+
+    def __init__(self, latency: Optional[Dict[str, float]] = None,
+                 handler: Optional[Callable[[str], List[Dict]]] = None):
+        self.latency = {**FAKE_LATENCY, **(latency or {})}
+        self.handler = handler
+        self.queries: List[str] = []
+        self.query_tag = None
+        self.closed = False
+        self._recorders: List[FakeQueryHistory] = []
+
+    def sql(self, query: str) -> FakeResult:
+        return FakeResult(self, query)
+
+    @contextmanager
+    def query_history(self):
+        recorder = FakeQueryHistory()
+        self._recorders.append(recorder)
+        try:
+            yield recorder
+        finally:
+            self._recorders.remove(recorder)
+
+    def _execute(self, query: str) -> List[Dict]:
+        self.queries.append(query)
+        record = FakeQueryRecord(str(uuid.uuid4()), query)
+        for recorder in self._recorders:
+            recorder.queries.append(record)
+        kind = classify_statement(query)
+        time.sleep(self.latency.get(kind, 0))
+        if self.handler is not None:
+            return self.handler(query)
+        if kind == "cortex":
+            return [{"RESPONSE": _fake_completion(query)}]
+        if kind == "vista":
+            view = next(v for v in FAKE_VIEW_ROWS if v in query.upper())
+            return [dict(row) for row in FAKE_VIEW_ROWS[view]]
+        return [{"RESULT": 1}]
+
+    def get_current_user(self) -> str:
+        return "FAKE_USER"
+
+    def get_current_role(self) -> str:
+        return "FAKE_ROLE"
+
+    def get_current_warehouse(self) -> str:
+        return "FAKE_WH"
+
+    def get_current_account(self) -> str:
+        return "FAKE_ACCOUNT"
+
+    def close(self):
+        self.closed = True
@@ -0,0 +1,124 @@
+"""
+Módulo de límites de coste de las consultas a vistas
+Evita que una consulta sin filtro o demasiado grande tumbe la memoria del
+proceso o el warehouse:
+- LIMIT automático y recorte por filas y bytes del resultado
+- Estimación opcional con EXPLAIN (particiones y bytes) y rechazo por umbral
+- Timeout de sentencia como parámetro de sesión
+"""
+
+import json
+import os
+from typing import Dict, Optional
+import pandas as pd
+from .execution import run_statement
+
+
+GUARDRAILS_CONFIG = {
+    "max_rows": int(os.environ.get("GUARDRAIL_MAX_ROWS", "5000")),
+    "max_bytes": int(float(os.environ.get("GUARDRAIL_MAX_RESULT_MB", "50")) * 1024 * 1024),
+    # EXPLAIN antes de cada consulta (compila en cloud services, sin warehouse)
+    "explain": os.environ.get("GUARDRAIL_EXPLAIN", "false").lower() in ("1", "true", "yes"),
+    "max_partitions": int(os.environ.get("GUARDRAIL_MAX_PARTITIONS", "10000")),
+    "max_scan_bytes": int(float(os.environ.get("GUARDRAIL_MAX_SCAN_GB", "20")) * 1024 ** 3),
+    # 0 = sin timeout de sesión (se aplica a todas las sentencias, también Cortex)
+    "statement_timeout_seconds": int(os.environ.get("GUARDRAIL_STATEMENT_TIMEOUT_SECONDS", "300")),
+}
+
+
+class QueryRejected(Exception):
+    """Consulta rechazada por los límites antes de llegar al warehouse."""
+
+
+def quote_literal(value) -> str:
+    """Literal SQL: cadenas entre comillas simples con las comillas escapadas."""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+def session_parameters() -> Dict:
+    """Parámetros de sesión para Session.builder (timeout de sentencia)."""
+    params = {}
+    if GUARDRAILS_CONFIG["statement_timeout_seconds"] > 0:
+        params["STATEMENT_TIMEOUT_IN_SECONDS"] = GUARDRAILS_CONFIG["statement_timeout_seconds"]
+    return params
+
+
+def apply_row_limit(query: str, max_rows: Optional[int] = None) -> str:
+    """
+    Añade LIMIT a la consulta.
+
+    Se piden max_rows + 1 filas para saber si el resultado se ha recortado.
+    """
+    max_rows = max_rows or GUARDRAILS_CONFIG["max_rows"]
+    return f"{query} LIMIT {max_rows + 1}"
+
+
+def cap_result(df: pd.DataFrame, max_rows: Optional[int] = None, max_bytes: Optional[int] = None) -> pd.DataFrame:
+    """
+    Recorta un resultado por filas y por memoria.
+
+    Returns:
+        DataFrame recortado; df.attrs["truncated"] indica si se ha recortado
+    """
+    if df is None:
+        return df
+    max_rows = max_rows or GUARDRAILS_CONFIG["max_rows"]
+    max_bytes = max_bytes or GUARDRAILS_CONFIG["max_bytes"]
+    truncated = len(df) > max_rows
+    if truncated:
+        df = df.head(max_rows)
+    size = int(df.memory_usage(deep=True).sum()) if len(df) else 0
+    if size > max_bytes:
+        df = df.head(max(int(len(df) * max_bytes / size), 1))
+        truncated = True
+    if truncated:
+        df = df.copy()
+        print(f"⚠️ Resultado recortado a {len(df)} filas (límites: {max_rows} filas, "
+              f"{max_bytes // (1024 * 1024)} MB)")
+    df.attrs["truncated"] = truncated
+    return df
+
+
+def explain_estimate(session, query: str, vista: Optional[str] = None) -> Dict:
+    """
+    Particiones y bytes que escanearía la consulta según EXPLAIN USING JSON.
+
+    Returns:
+        {"partitions_total", "partitions_assigned", "bytes_assigned"}
+    """
+    rows = run_statement(session, f"EXPLAIN USING JSON {query}", stage="metadata", vista=vista, collect=True)
+    row = rows[0].as_dict() if hasattr(rows[0], "as_dict") else dict(rows[0])
+    content = row.get("content") or row.get("CONTENT") or "{}"
+    stats = json.loads(content).get("GlobalStats", {})
+    return {
+        "partitions_total": int(stats.get("partitionsTotal", 0)),
+        "partitions_assigned": int(stats.get("partitionsAssigned", 0)),
+        "bytes_assigned": int(stats.get("bytesAssigned", 0)),
+    }
+
+
+def check_scan_estimate(session, query: str, vista: Optional[str] = None) -> Optional[Dict]:
+    """
+    Rechaza la consulta si EXPLAIN estima un escaneo por encima de los umbrales.
+
+    Raises:
+        QueryRejected: si se superan GUARDRAIL_MAX_PARTITIONS o GUARDRAIL_MAX_SCAN_GB
+    """
+    if not GUARDRAILS_CONFIG["explain"]:
+        return None
+    estimate = explain_estimate(session, query, vista)
+    if estimate["partitions_assigned"] > GUARDRAILS_CONFIG["max_partitions"]:
+        raise QueryRejected(
+            f"La consulta escanearía {estimate['partitions_assigned']} particiones "
+            f"(máximo {GUARDRAILS_CONFIG['max_partitions']}); añade más filtros"
+        )
+    if estimate["bytes_assigned"] > GUARDRAILS_CONFIG["max_scan_bytes"]:
+        raise QueryRejected(
+            f"La consulta escanearía {estimate['bytes_assigned'] / 1024 ** 3:.1f} GB "
+            f"(máximo {GUARDRAILS_CONFIG['max_scan_bytes'] / 1024 ** 3:.0f} GB); añade más filtros"
+        )
+    return estimate
@@ -2,16 +2,40 @@
 Módulo de gestión de incidencias
 """
 
+import os
 import uuid
 from datetime import datetime
-from typing import Dict
+from typing import Dict, Optional
 import pandas as pd
 import streamlit as st
+from .attachments import process_attachments, attachment_status
+from .analytics import ANALYTICS_CONFIG
+from .similarity import SIMILARITY_CONFIG, index_incident
+from .queries import get_diagnostico_paso1, tipo_pedido_from
+from .typeahead import ensure_typeahead, validate_fields, display_typeahead_helper
+
+
+INCIDENCIA_CONFIG = {
+    # true/false fuerza el guardado en INCIDENCIAS_PEDIDOS; vacío = solo si lo usan
+    # la búsqueda de similares o la analítica (guardar consulta antes el Paso 1)
+    "save": os.environ.get("INCIDENCIAS_SAVE_ENABLED", "").lower(),
+}
+
+
+def save_enabled() -> bool:
+    """Si la incidencia se guarda en Snowflake al registrarla."""
+    if INCIDENCIA_CONFIG["save"]:
+        return INCIDENCIA_CONFIG["save"] in ("1", "true", "yes")
+    return SIMILARITY_CONFIG["enabled"] or ANALYTICS_CONFIG["enabled"]
 
 
 def display_incidences_form():
     """Muestra el formulario de captura de incidencias."""
     
+    # Valores válidos de las claves (carga en segundo plano) y buscador por prefijo
+    ensure_typeahead(st.session_state.get("snowpark_session"))
+    display_typeahead_helper()
+    
     with st.form("incidence_form", clear_on_submit=True):
         # ID y timestamps automáticos
         incidence_id = str(uuid.uuid4())
@@ -74,9 +98,26 @@ def display_incidences_form():
             # Validar campos obligatorios
             if not all([uneco, pedido_host, almacen, referencia, descripcion]):
                 st.error("⚠️ Por favor, complete todos los campos obligatorios (marcados con *)")
+            elif errores_claves := validate_fields({
+                "uneco": uneco, "almacen": almacen, "pedido_host": pedido_host, "referencia": referencia
+            }):
+                # Clave inexistente: se evita lanzar las vistas y el LLM para nada
+                for error in errores_claves:
+                    st.error(f"⚠️ {error}")
             else:
                 hora_finalizacion = datetime.now()
                 
+                # Adjuntos: spool por bloques y subida al stage en segundo plano
+                adjuntos, rechazados = process_attachments(
+                    uploaded_files,
+                    session=st.session_state.get("snowpark_session"),
+                    incident_id=incidence_id
+                )
+                # Avisos del registro: se muestran tras el st.rerun() junto a la incidencia
+                st.session_state.incidencia_notices = [
+                    f"📎 Adjunto descartado: {msg}" for msg in rechazados
+                ]
+                
                 # Preparar datos de la incidencia
                 incidencia_data = {
                     "id": incidence_id,
@@ -94,39 +135,51 @@ def display_incidences_form():
                     "es_prepack": es_prepack,
                     "tiene_marca_prepack": tiene_marca_prepack,
                     "descripcion": descripcion,
-                    "num_adjuntos": len(uploaded_files) if uploaded_files else 0,
-                    "adjuntos": [f.name for f in uploaded_files] if uploaded_files else []
+                    "num_adjuntos": len(adjuntos),
+                    "adjuntos": [a["name"] for a in adjuntos],
+                    "adjuntos_stage": [a["stage_path"] or a["spool_path"] for a in adjuntos],
+                    "adjuntos_sha256": [a["sha256"] for a in adjuntos]
                 }
                 
                 # Guardar en el estado
                 st.session_state.incidencia_data = incidencia_data
                 
-                # Opcional: Guardar en Snowflake
-                # save_incidencia_to_snowflake(incidencia_data)
+                # Guardar en Snowflake (alimenta el historial de similares y la analítica)
+                if save_enabled():
+                    save_incidencia_to_snowflake(incidencia_data)
                 
                 st.success("✅ Incidencia registrada correctamente")
                 st.info("🤖 Iniciando análisis con Cortex Analyst...")
                 st.rerun()
 
 
-def save_incidencia_to_snowflake(data: Dict) -> bool:
-    """Guarda la incidencia en Snowflake (opcional)."""
+def save_incidencia_to_snowflake(data: Dict, tipo_pedido: Optional[str] = None) -> bool:
+    """
+    Guarda la incidencia en INCIDENCIAS_PEDIDOS con su TIPO_PEDIDO.
+    
+    Si no se indica el tipo de pedido se toma del Paso 1 del diagnóstico
+    (la búsqueda de similares lo usa como componente del vector).
+    """
     if "snowpark_session" not in st.session_state:
         return False
     
     try:
         session = st.session_state.snowpark_session
+        if tipo_pedido is None:
+            df_p1, _ = get_diagnostico_paso1(data, session=session)
+            tipo_pedido = tipo_pedido_from(df_p1)
         
         # Preparar DataFrame
-        df_data = data.copy()
+        df_data = {**data, "tipo_pedido": tipo_pedido}
         # Convertir fechas a string
         for col in ['hora_inicio', 'hora_finalizacion', 'feo', 'fis', 'fecha_disponible']:
             if col in df_data:
                 df_data[col] = str(df_data[col])
         
-        # Convertir lista de adjuntos a string
-        if 'adjuntos' in df_data:
-            df_data['adjuntos'] = ','.join(df_data['adjuntos'])
+        # Convertir listas de adjuntos a string
+        for col in ['adjuntos', 'adjuntos_stage', 'adjuntos_sha256']:
+            if col in df_data:
+                df_data[col] = ','.join(df_data[col])
         
         df = pd.DataFrame([df_data])
         
@@ -138,12 +191,24 @@ def save_incidencia_to_snowflake(data: Dict) -> bool:
             auto_create_table=True,
             overwrite=False
         )
+        # Disponible de inmediato para la búsqueda de similares
+        index_incident(data, tipo_pedido=tipo_pedido, session=session)
         return True
     except Exception as e:
-        st.warning(f"No se pudo guardar en Snowflake: {str(e)}")
+        # Un st.warning aquí se perdería con el st.rerun() del formulario
+        print(f"⚠️ No se pudo guardar la incidencia {data.get('id')}: {e}")
+        st.session_state.setdefault("incidencia_notices", []).append(
+            f"No se pudo guardar en Snowflake: {str(e)}"
+        )
         return False
 
 
+def display_incidencia_notices():
+    """Muestra los avisos del registro de la incidencia (adjuntos descartados, guardado fallido)."""
+    for notice in st.session_state.get("incidencia_notices") or []:
+        st.warning(notice, icon="⚠️")
+
+
 def display_incidencia_summary(data: Dict):
     """Muestra un resumen de la incidencia capturada."""
     col1, col2, col3 = st.columns(3)
@@ -173,6 +238,11 @@ def display_incidencia_summary(data: Dict):
     
     if data.get('num_adjuntos', 0) > 0:
         st.markdown(f"**Adjuntos:** {data.get('num_adjuntos')} archivo(s)")
+        iconos = {"uploaded": "✅", "pending": "⏳", "error": "❌", "local": "💾", "unknown": "📎"}
+        rutas = data.get('adjuntos_stage') or [None] * len(data.get('adjuntos', []))
+        for nombre, ruta in zip(data.get('adjuntos', []), rutas):
+            estado = attachment_status(ruta if ruta and ruta.startswith("@") else None)
+            st.caption(f"{iconos.get(estado, '📎')} {nombre} — `{ruta}`")
 
 
 def build_initial_prompt(incidencia_data: Dict) -> str:
@@ -0,0 +1,479 @@
+"""
+Módulo de trabajos en segundo plano
+Los turnos del chat (vistas + IA, o preguntas de seguimiento) se encolan como
+trabajos en un pool de hilos con una tabla persistente en SQLite:
+- El hilo del script queda libre y la UI consulta el estado con un fragmento
+- Los resultados se guardan con la serialización de state_store (JSON + Arrow)
+- Deduplicación por huella de la entrada (usuario y rol, incidencia, modelo, prompt);
+  cada solicitante queda registrado con su incidencia para el informe de coste
+- Tras una reconexión o en otra réplica el resultado se recupera de la tabla;
+  los trabajos de un proceso caído se reanudan
+- Los trabajos terminados y sus DataFrames se borran pasada la retención
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional
+import streamlit as st
+from .queries import get_all_analyst_results
+from .ai_analysis import get_ai_analysis
+from .conversation import followup_from_prompt
+from .dependencies import normalized_fields
+from .execution import incident_context, record_query
+from .state_store import encode_state, decode_state, arrow_to_dataframe
+from .warmup import record_first_incident_latency
+
+
+JOBS_CONFIG = {
+    "enabled": os.environ.get("JOBS_ENABLED", "false").lower() in ("1", "true", "yes"),
+    "db_path": os.environ.get("JOBS_DB", ".jobs.db"),
+    "workers": int(os.environ.get("JOBS_WORKERS", "4")),
+    # Un resultado terminado se reutiliza para la misma entrada durante este tiempo
+    "result_ttl_seconds": int(os.environ.get("JOBS_RESULT_TTL_SECONDS", "600")),
+    # Sin latido durante este tiempo, un trabajo en curso se considera huérfano
+    "stale_seconds": int(os.environ.get("JOBS_STALE_SECONDS", "120")),
+    "poll_seconds": float(os.environ.get("JOBS_POLL_SECONDS", "2")),
+    # Limpieza de la tabla: retención de los trabajos terminados y máximo de filas
+    "retention_seconds": int(os.environ.get("JOBS_RETENTION_SECONDS", "86400")),
+    "max_jobs": int(os.environ.get("JOBS_MAX_JOBS", "10000")),
+    "purge_interval_seconds": int(os.environ.get("JOBS_PURGE_SECONDS", "3600")),
+}
+
+PENDING_STATUSES = ("queued", "running")
+
+
+class SQLiteJobStore:
+    """Tabla de trabajos y DataFrames de sus resultados (por contenido) en SQLite."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT, fingerprint TEXT, "
+                "incident_id TEXT, status TEXT, payload BLOB, result BLOB, error TEXT, attempts INTEGER, "
+                "created_at REAL, started_at REAL, finished_at REAL, heartbeat_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_fingerprint ON jobs (fingerprint, created_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS job_frames (ref TEXT PRIMARY KEY, payload BLOB, used_at REAL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_submitters (job_id TEXT, incident_id TEXT, namespace TEXT, "
+                "reused INTEGER, submitted_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS job_submitters_job ON job_submitters (job_id)")
+            try:
+                # Tablas creadas antes de la limpieza por antigüedad
+                conn.execute("ALTER TABLE job_frames ADD COLUMN used_at REAL")
+            except sqlite3.OperationalError:
+                pass
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def insert(self, job: Dict):
+        with self._conn() as conn:
+            conn.execute(
+                f"INSERT INTO jobs ({', '.join(job)}) VALUES ({', '.join('?' for _ in job)})",
+                list(job.values())
+            )
+
+    def update(self, job_id: str, **fields):
+        with self._conn() as conn:
+            conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                list(fields.values()) + [job_id]
+            )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def find_reusable(self, fingerprint: str, since: float) -> Optional[Dict]:
+        """Trabajo en curso, o terminado después de `since`, con la misma huella."""
+        row = self._conn().execute(
+            "SELECT * FROM jobs WHERE fingerprint = ? AND (status IN ('queued', 'running') "
+            "OR (status = 'done' AND finished_at >= ?)) ORDER BY created_at DESC LIMIT 1",
+            (fingerprint, since)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def heartbeat(self, job_ids: List[str]):
+        if not job_ids:
+            return
+        with self._conn() as conn:
+            conn.executemany("UPDATE jobs SET heartbeat_at = ? WHERE id = ?",
+                             [(time.time(), job_id) for job_id in job_ids])
+
+    def put_frames(self, frames: Dict[str, bytes]):
+        """Guarda los DataFrames (por contenido); los ya existentes solo se renuevan."""
+        if not frames:
+            return
+        now = time.time()
+        with self._conn() as conn:
+            conn.executemany("INSERT OR IGNORE INTO job_frames (ref, payload, used_at) VALUES (?, ?, ?)",
+                             [(ref, payload, now) for ref, payload in frames.items()])
+            conn.executemany("UPDATE job_frames SET used_at = ? WHERE ref = ?", [(now, ref) for ref in frames])
+
+    def get_frame(self, ref: str) -> Optional[bytes]:
+        row = self._conn().execute("SELECT payload FROM job_frames WHERE ref = ?", (ref,)).fetchone()
+        return row[0] if row else None
+
+    def add_submitter(self, job_id: str, incident_id: Optional[str], namespace: str, reused: bool):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO job_submitters (job_id, incident_id, namespace, reused, submitted_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job_id, incident_id, namespace, int(reused), time.time())
+            )
+
+    def get_submitters(self, job_id: str) -> List[Dict]:
+        rows = self._conn().execute(
+            "SELECT * FROM job_submitters WHERE job_id = ? ORDER BY submitted_at", (job_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def purge(self, retention_seconds: int, max_jobs: int) -> tuple[int, int]:
+        """
+        Borra los trabajos terminados (o abandonados) hace más de retention_seconds
+        y los más antiguos por encima de max_jobs, con sus DataFrames.
+
+        Un DataFrame se renueva cada vez que un trabajo lo guarda, así que los
+        usados antes del trabajo más antiguo que queda ya no los referencia nadie.
+
+        Returns:
+            (trabajos borrados, DataFrames borrados)
+        """
+        cutoff = time.time() - retention_seconds
+        with self._conn() as conn:
+            removed = conn.execute(
+                "DELETE FROM jobs WHERE (status NOT IN ('queued', 'running') AND finished_at < ?) "
+                "OR (status IN ('queued', 'running') AND COALESCE(heartbeat_at, created_at) < ?)",
+                (cutoff, cutoff)
+            ).rowcount
+            removed += conn.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE status NOT IN ('queued', 'running') "
+                "ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (max_jobs,)
+            ).rowcount
+            conn.execute("DELETE FROM job_submitters WHERE job_id NOT IN (SELECT id FROM jobs)")
+            oldest = conn.execute("SELECT MIN(created_at) FROM jobs").fetchone()[0]
+            # Nunca por encima de la retención: un trabajo recién empaquetado aún no tiene fila
+            frames = conn.execute(
+                "DELETE FROM job_frames WHERE COALESCE(used_at, 0) < ?",
+                (cutoff if oldest is None else min(oldest, cutoff),)
+            ).rowcount
+        return removed, frames
+
+
+_STORE = {"instance": None}
+_EXECUTOR = {"pool": None, "heartbeat": None, "purged_at": 0.0}
+# Trabajos encolados o en curso en este proceso (reciben latido)
+_LOCAL_JOBS = set()
+_LOCK = threading.Lock()
+
+
+def get_job_store() -> SQLiteJobStore:
+    with _LOCK:
+        if _STORE["instance"] is None:
+            _STORE["instance"] = SQLiteJobStore(JOBS_CONFIG["db_path"])
+        return _STORE["instance"]
+
+
+# --- Serialización (misma codificación que state_store) ---
+
+def _pack(value, store: SQLiteJobStore) -> bytes:
+    frames = {}
+    doc = encode_state(value, frames, {})
+    store.put_frames(frames)
+    return zlib.compress(json.dumps(doc, separators=(",", ":")).encode("utf-8"))
+
+
+def _unpack(payload: Optional[bytes], store: SQLiteJobStore):
+    if not payload:
+        return None
+
+    def restore(value):
+        if isinstance(value, dict):
+            if "__frame__" in value:
+                frame = store.get_frame(value["__frame__"])
+                return arrow_to_dataframe(frame) if frame else None
+            if "__datetime__" in value or "__date__" in value:
+                return decode_state(value)
+            return {k: restore(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [restore(v) for v in value]
+        return value
+
+    return restore(json.loads(zlib.decompress(payload)))
+
+
+def session_namespace(session) -> str:
+    """Usuario y rol de la sesión: los resultados no se comparten entre permisos distintos."""
+    parts = []
+    for getter in ("get_current_user", "get_current_role"):
+        try:
+            parts.append(str(getattr(session, getter)() or ""))
+        except Exception:
+            parts.append("")
+    return "/".join(parts)
+
+
+def job_fingerprint(kind: str, payload: Dict, namespace: str = "") -> str:
+    """Huella de la entrada de un trabajo (sin el id de la incidencia) dentro de un usuario/rol."""
+    key = {"kind": kind, "model": payload.get("model"), "namespace": namespace}
+    if kind == "analysis":
+        key["fields"] = normalized_fields(payload["incidencia_data"])
+    else:
+        key["prompt"] = payload["prompt"]
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+# --- Ejecución ---
+
+def _run_analysis(payload: Dict, session) -> Dict:
+    incidencia_data = payload["incidencia_data"]
+    start = time.perf_counter()
+    results = get_all_analyst_results(incidencia_data, session=session)
+    record_first_incident_latency(session, time.perf_counter() - start)
+    ai_analysis = get_ai_analysis(incidencia_data, results, model=payload["model"], session=session)
+    return {"results": results, "ai_analysis": ai_analysis}
+
+
+def _run_followup(payload: Dict, session) -> Dict:
+    return {"ai_analysis": followup_from_prompt(payload["prompt"], payload["model"], session=session)}
+
+
+JOB_HANDLERS: Dict[str, Callable[[Dict, object], Dict]] = {
+    "analysis": _run_analysis,
+    "followup": _run_followup,
+}
+
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(max(JOBS_CONFIG["stale_seconds"] / 4, 1))
+        with _LOCK:
+            running = list(_LOCAL_JOBS)
+        try:
+            get_job_store().heartbeat(running)
+        except Exception as e:
+            print(f"⚠️ No se pudo actualizar el latido de los trabajos: {str(e)}")
+        if time.time() - _EXECUTOR["purged_at"] > JOBS_CONFIG["purge_interval_seconds"]:
+            purge_jobs()
+
+
+def purge_jobs():
+    """Borra los trabajos caducados y los DataFrames que ya no usa ninguno."""
+    _EXECUTOR["purged_at"] = time.time()
+    try:
+        removed, frames = get_job_store().purge(JOBS_CONFIG["retention_seconds"], JOBS_CONFIG["max_jobs"])
+    except Exception as e:
+        print(f"⚠️ No se pudieron limpiar los trabajos: {str(e)}")
+        return
+    if removed or frames:
+        print(f"🧹 Trabajos: {removed} trabajos y {frames} DataFrames borrados")
+
+
+def _executor() -> ThreadPoolExecutor:
+    with _LOCK:
+        if _EXECUTOR["pool"] is None:
+            _EXECUTOR["pool"] = ThreadPoolExecutor(max_workers=JOBS_CONFIG["workers"], thread_name_prefix="jobs")
+            _EXECUTOR["heartbeat"] = threading.Thread(target=_heartbeat_loop, name="jobs-heartbeat", daemon=True)
+            _EXECUTOR["heartbeat"].start()
+        return _EXECUTOR["pool"]
+
+
+def _execute(job_id: str, kind: str, payload: Dict, session):
+    """Ejecuta un trabajo en un hilo del pool y guarda su resultado."""
+    store = get_job_store()
+    now = time.time()
+    store.update(job_id, status="running", started_at=now, heartbeat_at=now)
+    try:
+        with incident_context(payload.get("incident_id")):
+            result = JOB_HANDLERS[kind](payload, session)
+        store.update(job_id, status="done", result=_pack(result, store), finished_at=time.time())
+        print(f"🧵 Trabajo {kind} {job_id[:8]} terminado en {time.time() - now:.2f}s")
+    except Exception as e:
+        store.update(job_id, status="error", error=str(e), finished_at=time.time())
+        print(f"❌ Trabajo {kind} {job_id[:8]} fallido: {str(e)}")
+    finally:
+        with _LOCK:
+            _LOCAL_JOBS.discard(job_id)
+
+
+def submit_job(kind: str, payload: Dict, session) -> str:
+    """
+    Encola un trabajo (o reutiliza uno con la misma huella).
+
+    Args:
+        kind: Tipo de trabajo en JOB_HANDLERS ('analysis' o 'followup')
+        payload: Entrada del trabajo (serializable con state_store)
+        session: Sesión de Snowpark que usará el hilo del pool
+
+    Returns:
+        Id del trabajo
+    """
+    store = get_job_store()
+    namespace = session_namespace(session)
+    fingerprint = job_fingerprint(kind, payload, namespace)
+    existing = store.find_reusable(fingerprint, time.time() - JOBS_CONFIG["result_ttl_seconds"])
+    if existing and not _is_stale(existing):
+        print(f"🧵 Trabajo {kind} reutilizado ({existing['status']}): {existing['id'][:8]}")
+        store.add_submitter(existing["id"], payload.get("incident_id"), namespace, reused=True)
+        _record_reuse(existing, payload)
+        return existing["id"]
+
+    job_id = uuid.uuid4().hex
+    store.insert({
+        "id": job_id, "kind": kind, "fingerprint": fingerprint, "incident_id": payload.get("incident_id"),
+        "status": "queued", "payload": _pack(payload, store), "attempts": 1, "created_at": time.time(),
+    })
+    store.add_submitter(job_id, payload.get("incident_id"), namespace, reused=False)
+    with _LOCK:
+        _LOCAL_JOBS.add(job_id)
+    _executor().submit(_execute, job_id, kind, payload, session)
+    return job_id
+
+
+def _record_reuse(job: Dict, payload: Dict):
+    """
+    Deja en el registro de sentencias de la incidencia que reutiliza el trabajo
+    una entrada propia sin QUERY_ID: el coste del warehouse queda en la incidencia
+    que lo ejecutó y el informe de la otra muestra de qué trabajo sale su resultado.
+    """
+    record_query({
+        "incident_id": payload.get("incident_id"),
+        "stage": "job_reuse",
+        "vista": job["kind"],
+        "model": payload.get("model"),
+        "query_id": None,
+        "query_tag": json.dumps({"app": "incidencias", "incident": payload.get("incident_id"),
+                                 "stage": "job_reuse", "job": job["id"],
+                                 "source_incident": job["incident_id"]}, separators=(",", ":")),
+        "elapsed_ms": 0.0,
+        "started_at": time.time(),
+        "error": None,
+    })
+
+
+def get_job_submitters(job_id: str) -> List[Dict]:
+    """Solicitantes de un trabajo (incidencia, usuario/rol y si lo reutilizaron)."""
+    return get_job_store().get_submitters(job_id)
+
+
+def _is_stale(job: Dict) -> bool:
+    """Trabajo pendiente sin latido reciente (su proceso ya no existe)."""
+    if job["status"] not in PENDING_STATUSES:
+        return False
+    with _LOCK:
+        if job["id"] in _LOCAL_JOBS:
+            return False
+    return time.time() - (job["heartbeat_at"] or job["created_at"] or 0) > JOBS_CONFIG["stale_seconds"]
+
+
+def resume_job(job: Dict, session):
+    """Vuelve a lanzar en este proceso un trabajo huérfano."""
+    store = get_job_store()
+    store.update(job["id"], status="queued", attempts=(job["attempts"] or 0) + 1, heartbeat_at=time.time())
+    with _LOCK:
+        _LOCAL_JOBS.add(job["id"])
+    print(f"🧵 Reanudando trabajo {job['kind']} {job['id'][:8]} (intento {(job['attempts'] or 0) + 1})")
+    _executor().submit(_execute, job["id"], job["kind"], _unpack(job["payload"], store), session)
+
+
+def get_job(job_id: str) -> Optional[Dict]:
+    """Estado de un trabajo con su resultado ya deserializado."""
+    store = get_job_store()
+    job = store.get(job_id)
+    if job is None:
+        return None
+    if job["status"] == "done":
+        job["result"] = _unpack(job["result"], store)
+    return job
+
+
+# --- Integración con Streamlit ---
+
+def enqueue_chat_turn(kind: str, payload: Dict) -> Dict:
+    """
+    Encola un turno del chat y devuelve el mensaje provisional del analista.
+
+    El mensaje guarda job_id, así que sobrevive a reconexiones si el estado de
+    sesión se persiste (state_store) y se completa al terminar el trabajo.
+    """
+    job_id = submit_job(kind, payload, st.session_state.snowpark_session)
+    text = ("⏳ Consultando vistas y analizando con IA en segundo plano..." if kind == "analysis"
+            else "⏳ Preparando la respuesta en segundo plano...")
+    return {
+        "role": "analyst",
+        "content": [{"type": "text", "text": text + " Puedes seguir usando la aplicación; el resultado aparecerá aquí."}],
+        "request_id": "job",
+        "job_id": job_id,
+        "job_kind": kind,
+        "job_status": "queued",
+    }
+
+
+def _attach_result(message: Dict, job: Dict):
+    """Sustituye el mensaje provisional por el resultado del trabajo."""
+    # Import local para evitar dependencias circulares
+    from .analyst import format_analyst_response, format_followup_response
+    message["job_status"] = job["status"]
+    if job["status"] == "error":
+        message["content"] = [{"type": "text", "text": f"❌ El análisis en segundo plano falló: {job['error']}"}]
+        return
+    result = job["result"]
+    message["ai_analysis"] = result["ai_analysis"]
+    if message["job_kind"] == "analysis":
+        message["raw_data"] = result["results"]
+        message["content"] = format_analyst_response(result["results"], result["ai_analysis"])
+    else:
+        message["content"] = format_followup_response(result["ai_analysis"])
+
+
+def pending_job_messages() -> List[Dict]:
+    return [m for m in st.session_state.get("messages", []) if m.get("job_status") in PENDING_STATUSES]
+
+
+@st.fragment(run_every=timedelta(seconds=JOBS_CONFIG["poll_seconds"]))
+def _jobs_fragment():
+    pending = pending_job_messages()
+    if not pending:
+        return
+    finished = False
+    for message in pending:
+        job = get_job(message["job_id"])
+        if job is None:
+            _attach_result(message, {"status": "error", "error": "trabajo no encontrado"})
+            finished = True
+        elif job["status"] in ("done", "error"):
+            _attach_result(message, job)
+            finished = True
+        else:
+            if _is_stale(job) and "snowpark_session" in st.session_state:
+                resume_job(job, st.session_state.snowpark_session)
+            message["job_status"] = job["status"]
+    if finished:
+        # Redibuja la conversación con el resultado
+        st.rerun()
+    st.caption(f"⏳ {len(pending)} trabajo(s) en curso en segundo plano...")
+
+
+def display_pending_jobs():
+    """Consulta periódica de los trabajos pendientes de la conversación (solo si hay)."""
+    if pending_job_messages():
+        _jobs_fragment()
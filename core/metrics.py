@@ -0,0 +1,227 @@
+"""
+Módulo de métricas operativas (formato de exposición de Prometheus)
+Contadores, gauges e histogramas con etiquetas, de bajo coste en el camino
+crítico, servidos en un endpoint HTTP lateral (/metrics)
+"""
+
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+
+METRICS_CONFIG = {
+    "enabled": os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true", "yes"),
+    "port": int(os.environ.get("METRICS_PORT", "9108")),
+    # El endpoint no tiene autenticación: por defecto solo escucha en local
+    # (0.0.0.0 para que lo lea un Prometheus de otra máquina, detrás de la red interna)
+    "host": os.environ.get("METRICS_HOST", "127.0.0.1"),
+}
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+SIZE_BUCKETS = [500, 1000, 2000, 4000, 8000, 16000, 32000]
+COUNT_BUCKETS = [1, 2, 3, 5, 8, 13, 21]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = ['%s="%s"' % (n, _escape(str(v))) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Optional[List[float]] = None):
+        super().__init__(name, help_text, labels)
+        self.buckets = sorted(buckets or LATENCY_BUCKETS)
+        # Por etiqueta: [contadores por bucket (no acumulados) + overflow, suma, total]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._values[key] = state
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in self._values.items()]
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+_REGISTRY: List[_Metric] = []
+
+
+def _register(metric):
+    _REGISTRY.append(metric)
+    return metric
+
+
+# --- Métricas del pipeline ---
+VISTA_QUERY_SECONDS = _register(Histogram(
+    "incidencias_vista_query_seconds", "Latencia de las consultas a vistas de VISTA_CONFIG", ("vista",)))
+CORTEX_SECONDS = _register(Histogram(
+    "incidencias_cortex_seconds", "Latencia de SNOWFLAKE.CORTEX.COMPLETE", ("model",)))
+CORTEX_PROMPT_CHARS = _register(Histogram(
+    "incidencias_cortex_prompt_chars", "Longitud del prompt enviado a Cortex (caracteres)", ("model",), SIZE_BUCKETS))
+CORTEX_TTFT_SECONDS = _register(Histogram(
+    "incidencias_cortex_ttft_seconds", "Tiempo hasta el primer token (streaming REST)", ("model",)))
+CORTEX_TOKENS = _register(Counter(
+    "incidencias_cortex_tokens_total", "Tokens de Cortex por modelo y tipo (prompt/output)", ("model", "kind")))
+STATEMENT_SECONDS = _register(Histogram(
+    "incidencias_statement_seconds", "Latencia de todas las sentencias por etapa", ("stage",)))
+CACHE_REQUESTS = _register(Counter(
+    "incidencias_cache_requests_total", "Consultas a cachés locales por resultado (hit/miss)", ("cache", "result")))
+ACTIVE_SESSIONS = _register(Gauge(
+    "incidencias_snowpark_sessions_active", "Sesiones de Snowpark abiertas en el proceso", ("origin",)))
+SCRIPT_RUNS = _register(Counter(
+    "incidencias_script_runs_total", "Ejecuciones del script de Streamlit (reruns)"))
+CHAT_TURNS = _register(Counter(
+    "incidencias_chat_turns_total", "Turnos de chat procesados"))
+RERUNS_PER_TURN = _register(Histogram(
+    "incidencias_reruns_per_turn", "Reruns del script entre dos turnos de chat", (), COUNT_BUCKETS))
+ERRORS = _register(Counter(
+    "incidencias_errors_total", "Errores por etapa y tipo", ("stage", "type")))
+SCHEDULER_WAIT_SECONDS = _register(Histogram(
+    "incidencias_scheduler_wait_seconds", "Espera en la cola del planificador", ("kind",)))
+RULE_EVALUATIONS = _register(Counter(
+    "incidencias_rule_evaluations_total", "Evaluaciones de reglas de diagnóstico (hit/miss/ambiguous/escalated)", ("result",)))
+RULE_HITS = _register(Counter(
+    "incidencias_rule_hits_total", "Diagnósticos resueltos por regla, sin LLM", ("rule",)))
+
+
+def record_script_run(state):
+    """Cuenta una ejecución del script (llamar al inicio de cada rerun)."""
+    SCRIPT_RUNS.inc()
+    state["_reruns_since_turn"] = state.get("_reruns_since_turn", 0) + 1
+
+
+def record_chat_turn(state):
+    """Cuenta un turno de chat y observa los reruns acumulados desde el anterior."""
+    CHAT_TURNS.inc()
+    RERUNS_PER_TURN.observe(state.get("_reruns_since_turn", 0))
+    state["_reruns_since_turn"] = 0
+
+
+def render_metrics() -> str:
+    """Todas las métricas en formato de exposición de texto."""
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_SERVER = {"instance": None}
+_SERVER_LOCK = threading.Lock()
+
+
+def start_metrics_server(port: Optional[int] = None, host: Optional[str] = None) -> bool:
+    """Arranca (una vez por proceso) el endpoint /metrics en un hilo aparte (METRICS_HOST:METRICS_PORT)."""
+    if not METRICS_CONFIG["enabled"]:
+        return False
+    with _SERVER_LOCK:
+        if _SERVER["instance"] is not None:
+            return True
+        try:
+            host = host or METRICS_CONFIG["host"]
+            port = METRICS_CONFIG["port"] if port is None else port
+            server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            # Puerto ocupado (p.ej. otro worker ya lo sirve)
+            print(f"⚠️ No se pudo abrir el endpoint de métricas: {str(e)}")
+            return False
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        _SERVER["instance"] = server
+        print(f"📈 Métricas en http://{host}:{server.server_address[1]}/metrics")
+        return True
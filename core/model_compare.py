@@ -0,0 +1,327 @@
+"""
+Módulo de comparación de modelos de Cortex
+Envía el mismo prompt de build_analysis_prompt a varios modelos en paralelo y
+mide tiempo hasta el primer token, latencia total, tokens y coste estimado;
+incluye el corpus de incidencias guardadas y la tabla de clasificación del
+benchmark offline (scripts/benchmark_models.py)
+"""
+
+import contextvars
+import difflib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+import pandas as pd
+import requests
+import streamlit as st
+from .ai_analysis import (
+    build_analysis_prompt, get_available_cortex_models, build_complete_query,
+    completion_options, parse_complete_response, AI_CONFIG
+)
+from .cost import estimate_cortex_credits
+from .execution import run_statement
+from .metrics import CORTEX_SECONDS, CORTEX_TTFT_SECONDS, CORTEX_TOKENS, ERRORS
+from .scheduler import scheduled, SchedulerSaturated
+from .state_store import resolve_frame
+
+
+COMPARE_CONFIG = {
+    "models": [m for m in os.environ.get(
+        "COMPARE_MODELS", "mistral-large,llama3-70b,mixtral-8x7b").split(",") if m],
+    "max_workers": int(os.environ.get("COMPARE_MAX_WORKERS", "4")),
+    # Streaming por la API REST para medir el primer token; si falla se usa SQL
+    "streaming": os.environ.get("COMPARE_STREAMING", "true").lower() in ("1", "true", "yes"),
+    "timeout_seconds": int(os.environ.get("COMPARE_TIMEOUT_SECONDS", "120")),
+    "corpus_path": os.environ.get("BENCHMARK_CORPUS", "benchmark/incidencias.jsonl"),
+}
+
+
+def _rest_endpoint(session) -> Tuple[str, Dict]:
+    """URL y cabeceras de la API REST de Cortex con el token de la sesión."""
+    host = session.get_current_account().replace('"', '').lower()
+    token = session._conn._conn.rest.token
+    headers = {
+        "Authorization": f'Snowflake Token="{token}"',
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream",
+    }
+    return f"https://{host}.snowflakecomputing.com/api/v2/cortex/inference:complete", headers
+
+
+def _stream_complete(session, prompt: str, model: str, progress: Optional[Dict] = None) -> Dict:
+    """
+    COMPLETE en streaming (SSE): mide el primer token y lee el uso de tokens.
+
+    Args:
+        progress: Diccionario que se va llenando con el texto recibido ("parts"),
+            el uso ("usage") y el primer token ("ttft"), para saber qué se ha
+            facturado si el stream se corta a medias
+    """
+    url, headers = _rest_endpoint(session)
+    body = {"model": model, "messages": [{"role": "user", "content": prompt}], "stream": True,
+            "max_tokens": AI_CONFIG["max_tokens"], "temperature": AI_CONFIG["temperature"]}
+    start = time.perf_counter()
+    progress = progress if progress is not None else {}
+    progress.update(parts=[], usage={}, ttft=None)
+    parts = progress["parts"]
+    ttft, usage = None, {}
+    with requests.post(url, headers=headers, json=body, stream=True,
+                       timeout=COMPARE_CONFIG["timeout_seconds"]) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            payload = line[len("data:"):].strip()
+            if payload == "[DONE]":
+                break
+            event = json.loads(payload)
+            for choice in event.get("choices", []):
+                delta = choice.get("delta", {})
+                text = delta.get("content") or delta.get("text") or ""
+                if text and ttft is None:
+                    ttft = progress["ttft"] = time.perf_counter() - start
+                parts.append(text)
+            usage = progress["usage"] = event.get("usage") or usage
+    return {
+        "response": "".join(parts),
+        "ttft_s": ttft,
+        "latency_s": time.perf_counter() - start,
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "output_tokens": usage.get("completion_tokens"),
+        "via": "stream",
+    }
+
+
+def _sql_complete(session, prompt: str, model: str) -> Dict:
+    """COMPLETE por SQL con opciones: devuelve el uso de tokens, sin primer token."""
+    query = build_complete_query(prompt, model, completion_options())
+    start = time.perf_counter()
+    rows = run_statement(session, query, stage="llm", model=model, collect=True)
+    latency = time.perf_counter() - start
+    parsed = parse_complete_response(rows[0]["RESPONSE"] if rows else "")
+    return {
+        "response": parsed["text"],
+        "ttft_s": None,
+        "latency_s": latency,
+        "prompt_tokens": parsed["prompt_tokens"],
+        "output_tokens": parsed["output_tokens"],
+        "via": "sql",
+    }
+
+
+def complete_with_stats(session, prompt: str, model: str) -> Dict:
+    """
+    Llama a un modelo y devuelve respuesta y métricas.
+
+    Returns:
+        {"model", "response", "error", "ttft_s", "latency_s", "prompt_tokens",
+         "output_tokens", "tokens_estimated", "credits", "via"}
+    """
+    result = {"model": model, "response": None, "error": None, "ttft_s": None, "latency_s": None,
+              "prompt_tokens": None, "output_tokens": None, "tokens_estimated": False,
+              "credits": None, "via": None}
+    try:
+        with scheduled("llm", model=model):
+            stats = None
+            if COMPARE_CONFIG["streaming"]:
+                progress = {}
+                try:
+                    stats = _stream_complete(session, prompt, model, progress)
+                    CORTEX_SECONDS.observe(stats["latency_s"], model=model)
+                    if stats["ttft_s"] is not None:
+                        CORTEX_TTFT_SECONDS.observe(stats["ttft_s"], model=model)
+                except Exception as e:
+                    if "".join(progress.get("parts", [])):
+                        # Ya se han facturado tokens: repetir el prompt por SQL los cobraría otra vez
+                        stats = {
+                            "response": "".join(progress["parts"]),
+                            "ttft_s": progress["ttft"],
+                            "prompt_tokens": progress["usage"].get("prompt_tokens"),
+                            "output_tokens": progress["usage"].get("completion_tokens"),
+                            "via": "stream",
+                        }
+                        result["error"] = f"Streaming interrumpido en {model}: {str(e)}"
+                    else:
+                        print(f"⚠️ Streaming no disponible para {model}, se usa SQL: {str(e)}")
+            if stats is None:
+                stats = _sql_complete(session, prompt, model)
+        result.update(stats)
+    except SchedulerSaturated as e:
+        ERRORS.inc(stage="llm", type="SchedulerSaturated")
+        result["error"] = str(e)
+        return result
+    except Exception as e:
+        result["error"] = f"Error en {model}: {str(e)}"
+        return result
+
+    # Sin uso de tokens en la respuesta: estimación de ~4 caracteres por token
+    if result["prompt_tokens"] is None or result["output_tokens"] is None:
+        result["prompt_tokens"] = result["prompt_tokens"] or len(prompt) // 4
+        result["output_tokens"] = result["output_tokens"] or len(result["response"] or "") // 4
+        result["tokens_estimated"] = True
+    CORTEX_TOKENS.inc(result["prompt_tokens"], model=model, kind="prompt")
+    CORTEX_TOKENS.inc(result["output_tokens"], model=model, kind="output")
+    result["credits"] = estimate_cortex_credits(model, result["prompt_tokens"], result["output_tokens"])
+    return result
+
+
+def compare_models(prompt: str, models: List[str], session) -> List[Dict]:
+    """
+    Envía el mismo prompt a varios modelos en paralelo.
+
+    Args:
+        prompt: Prompt (normalmente de build_analysis_prompt)
+        models: Modelos de Cortex a comparar
+        session: Sesión de Snowpark
+
+    Returns:
+        Lista de resultados de complete_with_stats, en el orden de `models`
+    """
+    if not models:
+        return []
+    workers = min(len(models), COMPARE_CONFIG["max_workers"])
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="compare") as pool:
+        # Cada hilo hereda el contexto (incidencia para QUERY_TAG, prioridad)
+        futures = [
+            pool.submit(contextvars.copy_context().run, complete_with_stats, session, prompt, model)
+            for model in models
+        ]
+        return [future.result() for future in futures]
+
+
+def comparison_table(results: List[Dict]) -> pd.DataFrame:
+    """Tabla de métricas de una comparación (una fila por modelo)."""
+    columns = ["model", "ttft_s", "latency_s", "prompt_tokens", "output_tokens", "credits", "via", "error"]
+    return pd.DataFrame([{col: r.get(col) for col in columns} for r in results], columns=columns)
+
+
+# --- Corpus y benchmark offline ---
+
+def append_to_corpus(path: str, incidencia_data: Dict, results: Dict, expected: Optional[Dict] = None):
+    """
+    Guarda una incidencia y sus resultados de vistas en el corpus (JSONL).
+
+    `expected` admite {"keywords": [...], "reference": "respuesta de referencia"}.
+    """
+    case = {
+        "incidencia": {k: v for k, v in incidencia_data.items() if isinstance(v, (str, int, float, bool))},
+        "results": {
+            vista_key: {
+                "data": json.loads(resolve_frame(r["data"]).to_json(orient="records", date_format="iso"))
+                if r.get("data") is not None else None,
+                "error": r.get("error"),
+                "vista": r.get("vista"),
+            }
+            for vista_key, r in results.items() if isinstance(r, dict)
+        },
+        "expected": expected or {},
+    }
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(case, ensure_ascii=False) + "\n")
+
+
+def load_corpus(path: str) -> Iterator[Dict]:
+    """Lee el corpus: {"incidencia", "results" (con DataFrames), "expected"} por caso."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            case = json.loads(line)
+            for result in case["results"].values():
+                result["data"] = pd.DataFrame(result["data"]) if result.get("data") is not None else None
+            case.setdefault("expected", {})
+            yield case
+
+
+def score_response(response: Optional[str], expected: Dict) -> Optional[float]:
+    """
+    Calidad de una respuesta frente a lo esperado (0-1).
+
+    Media de la cobertura de palabras clave y la similitud con la respuesta de
+    referencia, según cuáles haya en el caso. None si el caso no define ninguna.
+    """
+    scores = []
+    text = (response or "").lower()
+    keywords = expected.get("keywords") or []
+    if keywords:
+        scores.append(sum(1 for kw in keywords if kw.lower() in text) / len(keywords))
+    if expected.get("reference"):
+        scores.append(difflib.SequenceMatcher(None, expected["reference"].lower(), text).ratio())
+    return sum(scores) / len(scores) if scores else None
+
+
+def build_leaderboard(rows: List[Dict]) -> pd.DataFrame:
+    """
+    Clasificación por modelo a partir de los resultados del benchmark.
+
+    Returns:
+        DataFrame ordenado por calidad (desc) y latencia p50 (asc)
+    """
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return df
+    ok = df[df["error"].isna()]
+    board = df.groupby("model").agg(casos=("model", "size"), errores=("error", lambda s: s.notna().sum()))
+    stats = ok.groupby("model").agg(
+        calidad=("quality", "mean"),
+        ttft_p50=("ttft_s", "median"),
+        latencia_p50=("latency_s", "median"),
+        latencia_p95=("latency_s", lambda s: s.quantile(0.95)),
+        tokens_salida=("output_tokens", "mean"),
+        creditos_por_caso=("credits", "mean"),
+    )
+    board = board.join(stats).reset_index()
+    return board.sort_values(["calidad", "latencia_p50"], ascending=[False, True], na_position="last")
+
+
+# --- UI ---
+
+def display_model_comparison():
+    """Panel para comparar modelos sobre la última respuesta de la incidencia."""
+    incidencia_data = st.session_state.get("incidencia_data")
+    results = next((m["raw_data"] for m in reversed(st.session_state.get("messages", []))
+                    if m.get("raw_data")), None)
+    if not incidencia_data or not results or "snowpark_session" not in st.session_state:
+        return
+
+    with st.expander("⚖️ Comparar modelos", expanded=False):
+        available = get_available_cortex_models()
+        models = st.multiselect(
+            "Modelos:",
+            available,
+            default=[m for m in COMPARE_CONFIG["models"] if m in available],
+            key="compare_models",
+        )
+        col_run, col_save = st.columns(2)
+        if col_run.button("▶️ Comparar", use_container_width=True, disabled=not models):
+            frames = {k: dict(v, data=resolve_frame(v.get("data"))) for k, v in results.items()
+                      if isinstance(v, dict)}
+            prompt = build_analysis_prompt(incidencia_data, frames)
+            with st.spinner(f"🤖 Consultando {len(models)} modelos en paralelo..."):
+                st.session_state.model_comparison = compare_models(
+                    prompt, models, st.session_state.snowpark_session
+                )
+        if col_save.button("💾 Guardar en corpus", use_container_width=True):
+            append_to_corpus(COMPARE_CONFIG["corpus_path"], incidencia_data, results)
+            st.toast(f"Incidencia añadida a {COMPARE_CONFIG['corpus_path']}", icon="💾")
+
+        comparison = st.session_state.get("model_comparison")
+        if not comparison:
+            return
+        for column, result in zip(st.columns(len(comparison)), comparison):
+            with column:
+                st.markdown(f"**{result['model']}**")
+                if result["error"]:
+                    st.error(result["error"])
+                    continue
+                ttft = f"{result['ttft_s']:.2f}s" if result["ttft_s"] is not None else "n/d"
+                st.caption(
+                    f"⏱️ 1er token {ttft} · total {result['latency_s']:.2f}s · "
+                    f"{result['prompt_tokens']}+{result['output_tokens']} tokens"
+                    f"{' (estimados)' if result['tokens_estimated'] else ''}"
+                )
+                st.markdown(result["response"])
+        st.dataframe(comparison_table(comparison), use_container_width=True, hide_index=True)
@@ -0,0 +1,119 @@
+"""
+Módulo del pipeline de resolución sin dependencia de Streamlit
+Ejecuta vistas + análisis de IA con una sesión inyectada explícitamente,
+para usarlo desde servicios HTTP, jobs o herramientas offline
+"""
+
+import json
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+import pandas as pd
+from .queries import get_all_analyst_results
+from .ai_analysis import get_ai_analysis
+from .execution import incident_context
+from .metrics import ACTIVE_SESSIONS
+
+
+class SessionPool:
+    """
+    Pool de sesiones de Snowpark creadas bajo demanda.
+
+    Cada sesión la usa un único hilo a la vez; el pool crece hasta `size`
+    y a partir de ahí las peticiones esperan una sesión libre.
+    """
+
+    def __init__(self, factory: Callable, size: int = 4):
+        self._factory = factory
+        self._size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def session(self, timeout: Optional[float] = None):
+        session = self._acquire(timeout)
+        try:
+            yield session
+        except Exception:
+            # Una sesión que ha fallado puede estar rota: se descarta
+            self._discard(session)
+            raise
+        else:
+            self._idle.put(session)
+
+    def _acquire(self, timeout: Optional[float]):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self._size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                session = self._factory()
+                ACTIVE_SESSIONS.inc(origin="pool")
+                return session
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get(timeout=timeout)
+
+    def _discard(self, session):
+        with self._lock:
+            self._created -= 1
+        ACTIVE_SESSIONS.dec(origin="pool")
+        try:
+            session.close()
+        except Exception:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(session)
+
+    @property
+    def active(self) -> int:
+        return self._created
+
+
+def run_incident_pipeline(incidencia_data: Dict, session, model: str = "mistral-large") -> Dict:
+    """
+    Ejecuta el pipeline completo de una incidencia: vistas + análisis de IA.
+
+    Args:
+        incidencia_data: Datos de la incidencia
+        session: Sesión de Snowpark (obligatoria; no se usa st.session_state)
+        model: Modelo de Cortex a usar
+
+    Returns:
+        {"results": resultados de las vistas, "ai_analysis": análisis de IA}
+    """
+    with incident_context(incidencia_data.get("id")):
+        results = get_all_analyst_results(incidencia_data, session=session)
+        ai_analysis = get_ai_analysis(incidencia_data, results, model=model, session=session)
+    return {"results": results, "ai_analysis": ai_analysis}
+
+
+def serialize_pipeline_output(output: Dict) -> Dict:
+    """Convierte la salida del pipeline a un diccionario serializable en JSON."""
+    results = {}
+    for vista_key, result in output["results"].items():
+        df = result.get("data")
+        results[vista_key] = {
+            "vista": result.get("vista"),
+            "error": result.get("error"),
+            "data": json.loads(df.to_json(orient="records", date_format="iso"))
+            if isinstance(df, pd.DataFrame) else None,
+        }
+    return {"results": results, "ai_analysis": output["ai_analysis"]}
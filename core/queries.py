@@ -3,12 +3,19 @@ Módulo de queries SQL para resolución de incidencias
 Define queries paramétrizadas que se ejecutan contra vistas de Snowflake
 """
 
-from typing import Dict, List
+from typing import Dict, List, Optional
 import pandas as pd
 import streamlit as st
+from .snapshot import lookup_snapshot, snapshot_enabled_for
+from .scheduler import scheduled, SchedulerSaturated
+from .execution import run_statement
+from .metrics import CACHE_REQUESTS, ERRORS
+from .similarity import find_similar_incidents
+from .guardrails import QueryRejected, quote_literal, apply_row_limit, cap_result, check_scan_estimate
 
 
-# Mapear las vistas de Snowflake que has creado y sus parámetros
+# Mapear las vistas de Snowflake que has creado y sus parámetros.
+# "required": columnas sin las que no se consulta la vista (por defecto, todas)
 VISTA_CONFIG = {
     "diagnostico_paso1": {
         "name": "CORTEX_ANALYST_DEMO.CHATBOT_V2.V_DIAGNOSTICO_PASO1_TIPO_PEDIDO",
@@ -17,18 +24,34 @@ VISTA_CONFIG = {
             "CO_CENTRO_LOGISTICO": "almacen",
             "CO_PEDIDO_HOST": "pedido_host"
         },
+        "required": ["CO_PEDIDO_HOST"],
         "description": "📊 Diagnóstico Paso 1: Tipo de Pedido"
     },
     "diagnostico_paso2": {
         "name": "CORTEX_ANALYST_DEMO.CHATBOT_V2.V_DIAGNOSTICO_PASO2_ESTADO_ASN",
         "params": {
-            "CO_PEDIDO": "pedido"
+            "CO_PEDIDO": "pedido_host"
         },
+        "required": ["CO_PEDIDO"],
         "description": "📊 Diagnóstico Paso 2: Estado ASN y Revisiones"
     }
 }
 
 
+def _has_value(value) -> bool:
+    return value is not None and not (isinstance(value, str) and not value.strip())
+
+
+def missing_required_params(vista_key: str, incidencia_data: Dict) -> List[str]:
+    """Campos del formulario obligatorios para la vista que faltan o están vacíos."""
+    vista = VISTA_CONFIG[vista_key]
+    required = vista.get("required", list(vista["params"].keys()))
+    return [
+        vista["params"][col_name] for col_name in required
+        if not _has_value(incidencia_data.get(vista["params"][col_name]))
+    ]
+
+
 def build_query(vista_key: str, incidencia_data: Dict) -> tuple[str, Dict]:
     """
     Construye una query paramétrica para una vista específica.
@@ -39,6 +62,9 @@ def build_query(vista_key: str, incidencia_data: Dict) -> tuple[str, Dict]:
         
     Returns:
         (query_sql, parametros)
+    
+    Raises:
+        QueryRejected: si faltan parámetros obligatorios (nunca se consulta la vista sin filtro)
     """
     if vista_key not in VISTA_CONFIG:
         raise ValueError(f"Vista '{vista_key}' no configurada")
@@ -47,47 +73,56 @@ def build_query(vista_key: str, incidencia_data: Dict) -> tuple[str, Dict]:
     vista_name = vista["name"]
     param_mapping = vista["params"]
     
+    missing = missing_required_params(vista_key, incidencia_data)
+    if missing:
+        raise QueryRejected(f"Faltan datos obligatorios para '{vista_key}': {', '.join(missing)}")
+    
     # Construir WHERE clause con los parámetros disponibles
     where_conditions = []
     params = {}
     
     for col_name, data_key in param_mapping.items():
-        # Buscar el valor en incidencia_data
-        if data_key in incidencia_data:
-            value = incidencia_data[data_key]
-            # Escapar valores string
-            if isinstance(value, str):
-                where_conditions.append(f"{col_name} = '{value}'")
-            else:
-                where_conditions.append(f"{col_name} = {value}")
+        value = incidencia_data.get(data_key)
+        if _has_value(value):
+            where_conditions.append(f"{col_name} = {quote_literal(value)}")
             params[col_name] = value
     
-    # Construir query
-    if where_conditions:
-        query = f"SELECT * FROM {vista_name} WHERE {' AND '.join(where_conditions)}"
-    else:
-        query = f"SELECT * FROM {vista_name}"
+    query = f"SELECT * FROM {vista_name} WHERE {' AND '.join(where_conditions)}"
     
     return query, params
 
 
-def execute_vista_query(vista_key: str, incidencia_data: Dict) -> tuple[pd.DataFrame, str]:
+def execute_vista_query(vista_key: str, incidencia_data: Dict, session=None) -> tuple[pd.DataFrame, str]:
     """
     Ejecuta una query contra una vista de Snowflake.
     
     Args:
         vista_key: Clave de la vista a consultar
         incidencia_data: Datos de la incidencia
+        session: Sesión de Snowpark (por defecto la de st.session_state)
         
     Returns:
         (DataFrame con resultados, mensaje de error si lo hay)
     """
-    if "snowpark_session" not in st.session_state:
-        return None, "No hay sesión activa de Snowflake"
+    missing = missing_required_params(vista_key, incidencia_data)
+    if missing:
+        return None, f"Faltan datos obligatorios para '{vista_key}': {', '.join(missing)}"
     
-    try:
+    # Snapshot local (si está activo y fresco) antes de ir al warehouse
+    df = lookup_snapshot(vista_key, incidencia_data)
+    if snapshot_enabled_for(vista_key):
+        CACHE_REQUESTS.inc(cache="snapshot", result="hit" if df is not None else "miss")
+    if df is not None:
+        print(f"🗂️ {vista_key} servido desde snapshot local ({len(df)} filas)")
+        return df, None
+    
+    if session is None:
+        if "snowpark_session" not in st.session_state:
+            return None, "No hay sesión activa de Snowflake"
         session = st.session_state.snowpark_session
-        
+    
+    try:
+
         # Construir y ejecutar query
         query, params = build_query(vista_key, incidencia_data)
         
@@ -95,34 +130,46 @@ def execute_vista_query(vista_key: str, incidencia_data: Dict) -> tuple[pd.DataF
         print(f"Ejecutando query para {vista_key}:")
         print(query)
         
-        df = session.sql(query).to_pandas()
+        check_scan_estimate(session, query, vista=vista_key)
+        with scheduled("vista"):
+            df = run_statement(session, apply_row_limit(query), stage="vista", vista=vista_key)
         
-        return df, None
+        return cap_result(df), None
+    except QueryRejected as e:
+        ERRORS.inc(stage="vista", type="QueryRejected")
+        return None, str(e)
+    except SchedulerSaturated as e:
+        ERRORS.inc(stage="vista", type="SchedulerSaturated")
+        return None, str(e)
     except Exception as e:
         return None, f"Error ejecutando vista '{vista_key}': {str(e)}"
 
 
-def get_diagnostico_paso1(incidencia_data: Dict) -> tuple[pd.DataFrame, str]:
+def get_diagnostico_paso1(incidencia_data: Dict, session=None) -> tuple[pd.DataFrame, str]:
     """Obtiene el diagnóstico paso 1: tipo de pedido."""
-    return execute_vista_query("diagnostico_paso1", incidencia_data)
+    return execute_vista_query("diagnostico_paso1", incidencia_data, session=session)
 
 
-def get_diagnostico_paso2(incidencia_data: Dict) -> tuple[pd.DataFrame, str]:
+def get_diagnostico_paso2(incidencia_data: Dict, session=None) -> tuple[pd.DataFrame, str]:
     """Obtiene el diagnóstico paso 2: estado ASN."""
-    return execute_vista_query("diagnostico_paso2", incidencia_data)
+    return execute_vista_query("diagnostico_paso2", incidencia_data, session=session)
 
 
-def get_all_analyst_results(incidencia_data: Dict) -> Dict:
+def get_all_analyst_results(incidencia_data: Dict, session=None) -> Dict:
     """
     Ejecuta todas las vistas para obtener un análisis completo.
     
+    Args:
+        incidencia_data: Datos de la incidencia
+        session: Sesión de Snowpark (por defecto la de st.session_state)
+    
     Returns:
         Diccionario con resultados de todas las vistas
     """
     results = {}
     
     # Diagnóstico Paso 1: Tipo de Pedido
-    df_p1, err_p1 = get_diagnostico_paso1(incidencia_data)
+    df_p1, err_p1 = get_diagnostico_paso1(incidencia_data, session=session)
     results["diagnostico_paso1"] = {
         "data": df_p1,
         "error": err_p1,
@@ -130,11 +177,43 @@ def get_all_analyst_results(incidencia_data: Dict) -> Dict:
     }
     
     # Diagnóstico Paso 2: Estado ASN
-    df_p2, err_p2 = get_diagnostico_paso2(incidencia_data)
+    df_p2, err_p2 = get_diagnostico_paso2(incidencia_data, session=session)
     results["diagnostico_paso2"] = {
         "data": df_p2,
         "error": err_p2,
         "vista": VISTA_CONFIG["diagnostico_paso2"]["description"]
     }
     
+    # Historial: incidencias guardadas parecidas (índice local, sin consultar vistas)
+    historial = get_historial_result(incidencia_data, df_p1, session=session)
+    if historial:
+        results["historial"] = historial
+    
     return results
+
+
+def tipo_pedido_from(df_p1: pd.DataFrame) -> Optional[str]:
+    """Tipo de pedido del resultado del Paso 1 (None si no hay datos)."""
+    if df_p1 is not None and "TIPO_PEDIDO" in df_p1.columns and not df_p1.empty:
+        return df_p1["TIPO_PEDIDO"].iloc[0]
+    return None
+
+
+def get_historial_result(incidencia_data: Dict, df_p1: pd.DataFrame, session=None) -> Dict:
+    """
+    Resultado de incidencias similares (usa el tipo de pedido del Paso 1).
+    
+    Returns:
+        Entrada de resultados {"data", "error", "vista"} o None si está desactivado
+    """
+    if session is None:
+        session = st.session_state.get("snowpark_session")
+    tipo_pedido = tipo_pedido_from(df_p1)
+    df_hist, err_hist = find_similar_incidents(incidencia_data, tipo_pedido, session=session)
+    if df_hist is None and not err_hist:
+        return None
+    return {
+        "data": df_hist,
+        "error": err_hist,
+        "vista": "🗂️ Incidencias similares"
+    }
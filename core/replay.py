@@ -0,0 +1,364 @@
+"""
+Módulo de grabación y reproducción de tráfico
+Graba cada sentencia que pasa por execution.run_statement en una traza JSONL
+compacta y anonimizada (plantilla SQL sin literales, hashes de parámetros,
+forma del resultado y latencia observada) y la reproduce con ReplaySession,
+una sesión falsa que devuelve resultados con la misma forma y los mismos
+tiempos, para comparar ramas offline con la mezcla real de carga
+"""
+
+import atexit
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from .fakes import FakeSession, FakeQueryRecord
+
+
+REPLAY_CONFIG = {
+    # Ruta de la traza (.jsonl o .jsonl.gz); vacío = sin grabación
+    "record_path": os.environ.get("TRACE_RECORD_FILE", ""),
+    # Fracción de incidencias grabadas (las sentencias de una incidencia van todas o ninguna)
+    "sample_rate": float(os.environ.get("TRACE_SAMPLE_RATE", "1.0")),
+    # Columnas de dominio (no identificadores) cuyos valores se conservan: deciden la ruta del pipeline
+    "keep_columns": [c.strip().upper() for c in os.environ.get(
+        "TRACE_KEEP_COLUMNS", "TIPO_PEDIDO,CO_ESTADO_PREALBARAN").split(",") if c.strip()],
+    "max_kept_values": 16,
+    # Medidas cuyo rango (mín/máx) se conserva; el resto de columnas numéricas son
+    # identificadores (CO_PEDIDO, CO_MATERIAL...) y solo se guarda su longitud
+    "measure_columns": [c.strip().upper() for c in os.environ.get(
+        "TRACE_MEASURE_COLUMNS", "QT_PEDIDO,CANTIDAD_REVISADA_ASN,DIFERENCIAS_REVISION").split(",") if c.strip()],
+    # Las fechas se redondean al día o al mes (day | month)
+    "datetime_grain": os.environ.get("TRACE_DATETIME_GRAIN", "month"),
+}
+
+TRACE_VERSION = 1
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"(?<![\w.])\d+(?:\.\d+)?(?![\w.])")
+
+
+# --- Anonimización ---
+
+def anonymize_sql(query: str, salt: bytes) -> tuple[str, List[list]]:
+    """
+    Plantilla de una sentencia sin literales y sus parámetros anonimizados.
+
+    Cada literal se sustituye por '?' y se guarda como [hmac, longitud]: dos
+    sentencias con el mismo valor comparten hash dentro de la traza, pero el
+    salt no se guarda, así que los valores no se pueden recuperar.
+    """
+    params = []
+
+    def replace(match):
+        value = match.group(0)
+        digest = hmac.new(salt, value.encode("utf-8"), hashlib.sha1).hexdigest()[:10]
+        params.append([digest, len(value)])
+        return "?"
+
+    template = STRING_LITERAL.sub(replace, query)
+    template = NUMBER_LITERAL.sub(replace, template)
+    return " ".join(template.split()), params
+
+
+def statement_template(query: str) -> str:
+    """Plantilla de una sentencia (clave para emparejar al reproducir)."""
+    return anonymize_sql(query, b"")[0]
+
+
+def anonymize_json(value):
+    """Misma estructura y números; los textos se sustituyen por su longitud."""
+    if isinstance(value, dict):
+        return {k: anonymize_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [anonymize_json(v) for v in value]
+    if isinstance(value, str):
+        return {"__str__": len(value)}
+    return value
+
+
+def restore_json(value):
+    """Inverso de anonymize_json con textos de relleno de la misma longitud."""
+    if isinstance(value, dict):
+        if set(value) == {"__str__"}:
+            return "x" * value["__str__"]
+        return {k: restore_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [restore_json(v) for v in value]
+    return value
+
+
+def _as_frame(result) -> Optional[pd.DataFrame]:
+    if result is None:
+        return None
+    if isinstance(result, pd.DataFrame):
+        return result
+    return pd.DataFrame([r.as_dict() if hasattr(r, "as_dict") else dict(r) for r in result])
+
+
+def _truncate_datetime(value: pd.Timestamp) -> str:
+    """Fecha redondeada al grano de TRACE_DATETIME_GRAIN (sin hora)."""
+    value = value.normalize()
+    if REPLAY_CONFIG["datetime_grain"] == "month":
+        value = value.replace(day=1)
+    return value.date().isoformat()
+
+
+def _column_shape(name: str, series: pd.Series) -> Dict:
+    """
+    Forma anonimizada de una columna.
+
+    Solo se guardan valores de TRACE_KEEP_COLUMNS y rangos de TRACE_MEASURE_COLUMNS;
+    las demás columnas numéricas (o con pinta de número) se tratan como
+    identificadores y las fechas se redondean a TRACE_DATETIME_GRAIN.
+    """
+    values = series.dropna()
+    if values.empty:
+        return {"n": name, "k": "null"}
+    if name.upper() in REPLAY_CONFIG["keep_columns"]:
+        return {"n": name, "k": "cat", "v": [str(v) for v in values.unique()[:REPLAY_CONFIG["max_kept_values"]]]}
+    if pd.api.types.is_bool_dtype(values):
+        return {"n": name, "k": "bool"}
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return {"n": name, "k": "dt", "min": _truncate_datetime(values.min()),
+                "max": _truncate_datetime(values.max())}
+    numeric = pd.to_numeric(values, errors="coerce") if values.dtype == object else values
+    if pd.api.types.is_numeric_dtype(numeric) and numeric.notna().all():
+        if name.upper() in REPLAY_CONFIG["measure_columns"]:
+            return {"n": name, "k": "num", "min": float(numeric.min()), "max": float(numeric.max()),
+                    "int": bool((numeric == np.floor(numeric)).all())}
+        return {"n": name, "k": "id", "len": int(values.astype(str).str.len().max()),
+                "num": bool(values.dtype != object)}
+    first = values.iloc[0]
+    if isinstance(first, str) and first[:1] in ("{", "["):
+        try:
+            return {"n": name, "k": "json", "t": anonymize_json(json.loads(first))}
+        except ValueError:
+            pass
+    return {"n": name, "k": "str", "len": int(values.astype(str).str.len().mean())}
+
+
+def result_shape(result) -> Optional[Dict]:
+    """Forma de un resultado: filas y, por columna, tipo y rango o dominio."""
+    df = _as_frame(result)
+    if df is None:
+        return None
+    return {"rows": len(df), "cols": [_column_shape(str(c), df[c]) for c in df.columns]}
+
+
+def synthesize_rows(shape: Optional[Dict]) -> List[Dict]:
+    """Filas sintéticas con la forma grabada (deterministas)."""
+    if not shape:
+        return []
+    n = shape["rows"]
+    columns = {}
+    for col in shape["cols"]:
+        kind = col["k"]
+        if kind == "cat":
+            values = [col["v"][i % len(col["v"])] for i in range(n)]
+        elif kind == "num":
+            values = np.linspace(col["min"], col["max"], n) if n > 1 else np.array([col["min"]] * n)
+            values = [int(round(v)) if col["int"] else float(v) for v in values]
+        elif kind == "id":
+            # Identificadores sintéticos distintos con la longitud grabada
+            values = [str(i + 1).zfill(col["len"]) for i in range(n)]
+            if col["num"]:
+                values = [int(v) for v in values]
+        elif kind == "bool":
+            values = [i % 2 == 0 for i in range(n)]
+        elif kind == "dt":
+            values = list(pd.date_range(col["min"], col["max"], periods=n)) if n > 1 else [pd.Timestamp(col["min"])] * n
+        elif kind == "json":
+            text = json.dumps(restore_json(col["t"]))
+            values = [text] * n
+        elif kind == "str":
+            values = ["x" * col["len"]] * n
+        else:
+            values = [None] * n
+        columns[col["n"]] = values
+    return [{name: values[i] for name, values in columns.items()} for i in range(n)]
+
+
+# --- Grabación ---
+
+class TraceRecorder:
+    """Escribe la traza JSONL (gzip si la ruta acaba en .gz) desde cualquier hilo."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.salt = os.urandom(16)
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, "at", encoding="utf-8") if path.endswith(".gz") else open(path, "a", encoding="utf-8")
+        self._write({"trace": TRACE_VERSION, "started_at": self.started})
+
+    def _write(self, entry: Dict):
+        line = json.dumps(entry, separators=(",", ":"), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def _sampled(self, incident: Optional[str]) -> bool:
+        rate = REPLAY_CONFIG["sample_rate"]
+        if rate >= 1.0:
+            return True
+        if incident is None:
+            return random.random() < rate
+        return int(incident[:8], 16) / 0xFFFFFFFF < rate
+
+    def record(self, query: str, stage: str, vista: Optional[str], model: Optional[str], collect: bool,
+               incident_id: Optional[str], elapsed: float, error: Optional[str], result):
+        incident = (hmac.new(self.salt, incident_id.encode("utf-8"), hashlib.sha1).hexdigest()[:12]
+                    if incident_id else None)
+        if not self._sampled(incident):
+            return
+        template, params = anonymize_sql(query, self.salt)
+        self._write({
+            "t": round(max(time.time() - elapsed - self.started, 0.0), 4),
+            "inc": incident,
+            "stage": stage,
+            "vista": vista,
+            "model": model,
+            "collect": collect,
+            "sql": template,
+            "params": params,
+            "ms": round(elapsed * 1000, 1),
+            "error": error,
+            "shape": result_shape(result) if error is None else None,
+        })
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+_RECORDER = {"instance": None, "loaded": False}
+_RECORDER_LOCK = threading.Lock()
+
+
+def get_trace_recorder() -> Optional[TraceRecorder]:
+    """Grabador del proceso (None si TRACE_RECORD_FILE no está configurado)."""
+    if _RECORDER["loaded"]:
+        return _RECORDER["instance"]
+    with _RECORDER_LOCK:
+        if not _RECORDER["loaded"]:
+            if REPLAY_CONFIG["record_path"]:
+                _RECORDER["instance"] = TraceRecorder(REPLAY_CONFIG["record_path"])
+                # Cierra el gzip al salir; si el proceso muere, load_trace lee hasta el último flush
+                atexit.register(_RECORDER["instance"].close)
+                print(f"🎙️ Grabando traza de sentencias en {REPLAY_CONFIG['record_path']}")
+            _RECORDER["loaded"] = True
+    return _RECORDER["instance"]
+
+
+def record_statement(query: str, stage: str, vista: Optional[str], model: Optional[str], collect: bool,
+                     incident_id: Optional[str], elapsed: float, error: Optional[str], result):
+    """Graba una sentencia si la grabación está activa; nunca interrumpe la ejecución."""
+    recorder = get_trace_recorder()
+    if recorder is None:
+        return
+    try:
+        recorder.record(query, stage, vista, model, collect, incident_id, elapsed, error, result)
+    except Exception as e:
+        print(f"⚠️ No se pudo grabar la sentencia en la traza: {str(e)}")
+
+
+# --- Reproducción ---
+
+def load_trace(path: str) -> List[Dict]:
+    """Entradas de una traza (sin las cabeceras)."""
+    opener = gzip.open if path.endswith(".gz") else open
+    entries = []
+    with opener(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    entries.append(json.loads(line))
+        except (EOFError, json.JSONDecodeError):
+            # Traza cortada (proceso terminado sin cerrar el fichero): se usa lo leído
+            print(f"⚠️ Traza {path} incompleta: se reproducen {len(entries)} líneas")
+    return [e for e in entries if "trace" not in e]
+
+
+class ReplaySession(FakeSession):
+    """
+    Sesión falsa que reproduce una traza.
+
+    Cada sentencia se empareja por plantilla con la siguiente entrada grabada
+    (primero las de `entries`, después las de `fallback`), espera la latencia
+    grabada (× latency_scale) y devuelve filas con la forma grabada. Las
+    sentencias sin pareja se resuelven como FakeSession y se cuentan en `misses`.
+    """
+
+    def __init__(self, entries: List[Dict], fallback: Optional[List[Dict]] = None, latency_scale: float = 1.0):
+        super().__init__()
+        self.latency_scale = latency_scale
+        self.misses: List[str] = []
+        self._lock = threading.Lock()
+        self._queues = self._index(entries)
+        self._fallback = self._index(fallback or [])
+
+    @staticmethod
+    def _index(entries: List[Dict]) -> Dict[str, deque]:
+        queues: Dict[str, deque] = {}
+        for entry in entries:
+            queues.setdefault(entry["sql"], deque()).append(entry)
+        return queues
+
+    def _next(self, template: str) -> Optional[Dict]:
+        with self._lock:
+            own = self._queues.get(template)
+            if own:
+                return own.popleft()
+            shared = self._fallback.get(template)
+            if shared:
+                # La traza global se recorre en círculo
+                entry = shared.popleft()
+                shared.append(entry)
+                return entry
+        return None
+
+    def _execute(self, query: str) -> List[Dict]:
+        self.queries.append(query)
+        template = statement_template(query)
+        entry = self._next(template)
+        if entry is None:
+            self.misses.append(template)
+            return super()._execute(query)
+        record = FakeQueryRecord(f"replay-{len(self.queries)}", query)
+        for recorder in self._recorders:
+            recorder.queries.append(record)
+        time.sleep(entry["ms"] / 1000 * self.latency_scale)
+        if entry.get("error"):
+            raise RuntimeError(f"Error reproducido de la traza: {entry['error']}")
+        return synthesize_rows(entry.get("shape"))
+
+
+def group_by_incident(entries: List[Dict]) -> tuple[List[Dict], List[Dict]]:
+    """
+    Incidencias de la traza en orden de llegada y sentencias sueltas.
+
+    Returns:
+        ([{"inc", "t", "model", "entries"}], sentencias sin incidencia)
+    """
+    incidents: Dict[str, Dict] = {}
+    loose = []
+    for entry in sorted(entries, key=lambda e: e["t"]):
+        if entry.get("inc") is None:
+            loose.append(entry)
+            continue
+        incident = incidents.setdefault(entry["inc"], {"inc": entry["inc"], "t": entry["t"], "model": None, "entries": []})
+        incident["entries"].append(entry)
+        if entry.get("model") and incident["model"] is None:
+            incident["model"] = entry["model"]
+    return list(incidents.values()), loose
@@ -0,0 +1,465 @@
+"""
+Módulo de rollups del modelo semántico
+Compila a partir del YAML del modelo semántico agregados por semana y por mes
+(× combinaciones de dimensiones) de la tabla de hechos diaria, en local
+(Parquet, refresco incremental del último periodo) o como dynamic tables de
+Snowflake (refresco incremental gestionado por Snowflake). Las preguntas por
+periodo (mensual, trimestral, anual, semanal) se responden desde el rollup más
+pequeño que las cubre en lugar de re-agregar el histórico diario
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from itertools import combinations
+from typing import Dict, List, Optional
+import pandas as pd
+from .execution import run_statement
+from .guardrails import quote_literal
+from .scheduler import scheduled, priority_context, PRIORITY_BATCH
+from .semantic_model import compile_table_ctes, extract_period, load_semantic_model, normalize_text
+
+
+ROLLUPS_CONFIG = {
+    "enabled": os.environ.get("ROLLUPS_ENABLED", "false").lower() in ("1", "true", "yes"),
+    # local (Parquet en ROLLUPS_DIR) | dynamic_table (objetos en Snowflake)
+    "mode": os.environ.get("ROLLUPS_MODE", "local"),
+    "grains": ["week", "month"],
+    "dir": os.environ.get("ROLLUPS_DIR", ".rollups"),
+    "refresh_seconds": int(os.environ.get("ROLLUPS_REFRESH_SECONDS", "3600")),
+    # Esquema de las dynamic tables (por defecto el de la tabla de hechos)
+    "schema": os.environ.get("ROLLUPS_SCHEMA", ""),
+    "target_lag": os.environ.get("ROLLUPS_TARGET_LAG", "1 hour"),
+    # Por defecto el warehouse actual de la sesión
+    "warehouse": os.environ.get("ROLLUPS_WAREHOUSE", ""),
+}
+
+# Palabras de la pregunta -> grano pedido
+GRAIN_WORDS = {
+    "week": {"week", "weeks", "weekly", "semana", "semanas", "semanal", "semanales"},
+    "month": {"month", "months", "monthly", "mes", "meses", "mensual", "mensuales"},
+    "quarter": {"quarter", "quarters", "quarterly", "trimestre", "trimestres", "trimestral", "trimestrales"},
+    "year": {"year", "years", "yearly", "annual", "ano", "anos", "anual", "anuales"},
+}
+
+# Grano pedido -> grano del rollup que lo contiene (los meses se agrupan en trimestres y años)
+GRAIN_SOURCE = {"week": "week", "month": "month", "quarter": "month", "year": "month"}
+
+# Preguntas que necesitan el detalle diario o valores extremos: no se sirven desde rollups
+DAILY_WORDS = {
+    "day", "days", "daily", "dia", "dias", "diario", "diaria", "cumulative", "acumulado", "acumulada",
+    "lowest", "highest", "min", "max", "minimum", "maximum", "minimo", "maximo",
+}
+
+PANDAS_PERIODS = {"week": "W", "month": "M", "quarter": "Q", "year": "Y"}
+
+
+def _measure_phrases(measure: Dict) -> List[str]:
+    name = measure["name"]
+    short = name[len("daily_"):] if name.startswith("daily_") else name
+    phrases = {short.replace("_", " "), name.replace("_", " ")}
+    phrases.update(normalize_text(s) for s in measure.get("synonyms", []))
+    return [p for p in phrases if p]
+
+
+def compile_rollups(model: Dict) -> Optional[Dict]:
+    """
+    Especificación de los rollups a partir del modelo semántico.
+
+    La tabla de hechos es la que tiene dimensiones de tiempo; las dimensiones
+    de los rollups son las de las tablas unidas por relationships (sin las
+    claves del join). Se genera un rollup por grano y combinación de dimensiones.
+
+    Returns:
+        {"fact", "time", "ctes", "base_schema", "measures", "dimensions", "rollups"} o None
+    """
+    tables = {}
+    for table in model.get("tables", []):
+        tables.setdefault(table["name"], table)
+    fact = next((t for t in tables.values() if t.get("time_dimensions")), None)
+    if fact is None:
+        return None
+
+    measures = []
+    for measure in fact.get("measures", []):
+        agg = str(measure.get("default_aggregation", "sum")).lower()
+        measures.append({
+            "name": measure["name"],
+            # Las medias se guardan como suma + recuento para poder re-agregarlas
+            "agg": "avg" if agg == "avg" else "sum",
+            "phrases": _measure_phrases(measure),
+        })
+
+    dimensions = {}
+    for rel in model.get("relationships", []):
+        if rel["left_table"] != fact["name"] or rel["right_table"] not in tables:
+            continue
+        right = tables[rel["right_table"]]
+        keys = {c["right_column"] for c in rel["relationship_columns"]}
+        for dim in right.get("dimensions", []):
+            if dim["name"] in keys or dim["name"] in dimensions:
+                continue
+            dimensions[dim["name"]] = {
+                "table": right["name"],
+                "on": [(c["left_column"], c["right_column"]) for c in rel["relationship_columns"]],
+                "values": [str(v) for v in dim.get("sample_values", [])],
+                "phrases": {dim["name"].replace("_", " "), dim["name"].split("_")[-1]},
+            }
+
+    rollups = []
+    for grain in ROLLUPS_CONFIG["grains"]:
+        for size in range(len(dimensions) + 1):
+            for combo in combinations(sorted(dimensions), size):
+                rollups.append({
+                    "name": f"{fact['name']}_{grain}_{'_'.join(combo) or 'total'}".upper(),
+                    "grain": grain,
+                    "dimensions": list(combo),
+                })
+
+    base = fact["base_table"]
+    return {
+        "fact": fact["name"],
+        "time": fact["time_dimensions"][0]["name"],
+        "ctes": compile_table_ctes(model),
+        "base_schema": f"{base['database']}.{base['schema']}",
+        "measures": measures,
+        "dimensions": dimensions,
+        "rollups": rollups,
+    }
+
+
+def _measure_columns(measure: Dict, qualified: str) -> List[str]:
+    name = measure["name"].upper()
+    if measure["agg"] == "avg":
+        return [f"SUM({qualified}) AS {name}_SUM", f"COUNT({qualified}) AS {name}_COUNT"]
+    return [f"SUM({qualified}) AS {name}"]
+
+
+def build_rollup_select(spec: Dict, rollup: Dict, since: Optional[str] = None) -> str:
+    """SELECT que materializa un rollup sobre las CTEs de las tablas lógicas."""
+    fact, time_col = spec["fact"], spec["time"]
+    joins, tables = [], [fact]
+    for dim in rollup["dimensions"]:
+        table = spec["dimensions"][dim]["table"]
+        if table in tables:
+            continue
+        tables.append(table)
+        condition = " AND ".join(f"{fact}.{left} = {table}.{right}" for left, right in spec["dimensions"][dim]["on"])
+        joins.append(f"LEFT OUTER JOIN {table} ON {condition}")
+
+    columns = [f"DATE_TRUNC('{rollup['grain'].upper()}', {fact}.{time_col}) AS PERIOD_START"]
+    columns += [f"{spec['dimensions'][dim]['table']}.{dim} AS {dim.upper()}" for dim in rollup["dimensions"]]
+    for measure in spec["measures"]:
+        columns += _measure_columns(measure, f"{fact}.{measure['name']}")
+    columns.append("COUNT(*) AS ROW_COUNT")
+
+    query = (f"WITH {', '.join(spec['ctes'][t] for t in tables)}\n"
+             f"SELECT {', '.join(columns)}\nFROM {fact} {' '.join(joins)}")
+    if since:
+        query += f"\nWHERE {fact}.{time_col} >= {quote_literal(since)}"
+    return query + "\nGROUP BY ALL"
+
+
+def build_dynamic_table_ddl(spec: Dict, rollup: Dict, warehouse: str) -> str:
+    """DDL de la dynamic table de un rollup (refresco incremental en Snowflake)."""
+    return (f"CREATE DYNAMIC TABLE IF NOT EXISTS {_rollup_table(spec, rollup)} "
+            f"TARGET_LAG = '{ROLLUPS_CONFIG['target_lag']}' WAREHOUSE = {warehouse} "
+            f"REFRESH_MODE = INCREMENTAL AS\n{build_rollup_select(spec, rollup)}")
+
+
+def _rollup_table(spec: Dict, rollup: Dict) -> str:
+    return f"{ROLLUPS_CONFIG['schema'] or spec['base_schema']}.{rollup['name']}"
+
+
+# --- Materialización ---
+
+_STATE: Dict = {"spec": None, "frames": {}, "watermarks": {}, "ready": set(),
+                "refreshed_at": 0.0, "refreshing": False, "error": None}
+_LOCK = threading.Lock()
+
+
+def get_rollup_spec() -> Optional[Dict]:
+    """Especificación de los rollups del modelo configurado (una vez por proceso)."""
+    with _LOCK:
+        if _STATE["spec"] is None:
+            _STATE["spec"] = compile_rollups(load_semantic_model()) or {}
+        return _STATE["spec"] or None
+
+
+def _rollup_paths(name: str) -> tuple[str, str]:
+    return (os.path.join(ROLLUPS_CONFIG["dir"], f"{name}.parquet"),
+            os.path.join(ROLLUPS_CONFIG["dir"], f"{name}.json"))
+
+
+def _normalize_rollup(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.rename(columns={c: c.upper() for c in df.columns})
+    df["PERIOD_START"] = pd.to_datetime(df["PERIOD_START"])
+    for col in df.columns:
+        if df[col].dtype == object and col != "PERIOD_START":
+            converted = pd.to_numeric(df[col], errors="coerce")
+            # Las columnas NUMBER llegan como Decimal; las dimensiones quedan como texto
+            if converted.notna().sum() == df[col].notna().sum():
+                df[col] = converted
+    return df.reset_index(drop=True)
+
+
+def load_local_rollups() -> int:
+    """Carga de disco los rollups locales guardados. Devuelve cuántos había."""
+    spec = get_rollup_spec()
+    loaded = 0
+    for rollup in (spec or {}).get("rollups", []):
+        data_path, meta_path = _rollup_paths(rollup["name"])
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            continue
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        df = pd.read_parquet(data_path)
+        with _LOCK:
+            _STATE["frames"][rollup["name"]] = df
+            _STATE["watermarks"][rollup["name"]] = meta.get("watermark")
+        loaded += 1
+    return loaded
+
+
+def refresh_local_rollup(session, spec: Dict, rollup: Dict) -> int:
+    """
+    Refresca un rollup local. Solo se re-agregan los periodos desde el último
+    periodo guardado (que puede estar incompleto) y se sustituyen en el Parquet.
+
+    Returns:
+        Filas traídas del warehouse
+    """
+    name = rollup["name"]
+    with _LOCK:
+        current, watermark = _STATE["frames"].get(name), _STATE["watermarks"].get(name)
+    since = watermark if current is not None else None
+
+    with priority_context(PRIORITY_BATCH), scheduled("vista"):
+        rows = run_statement(session, build_rollup_select(spec, rollup, since), stage="rollups")
+    rows = _normalize_rollup(rows)
+    if since is not None:
+        rows = pd.concat([current[current["PERIOD_START"] < pd.Timestamp(since)], rows], ignore_index=True)
+
+    latest = rows["PERIOD_START"].max() if not rows.empty else None
+    meta = {"watermark": latest.date().isoformat() if latest is not None and pd.notna(latest) else watermark}
+    os.makedirs(ROLLUPS_CONFIG["dir"], exist_ok=True)
+    data_path, meta_path = _rollup_paths(name)
+    rows.to_parquet(data_path, index=False)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    with _LOCK:
+        _STATE["frames"][name] = rows
+        _STATE["watermarks"][name] = meta["watermark"]
+    return len(rows)
+
+
+def create_dynamic_tables(session, spec: Dict):
+    """Crea (si no existen) las dynamic tables de todos los rollups."""
+    warehouse = ROLLUPS_CONFIG["warehouse"] or session.get_current_warehouse()
+    for rollup in spec["rollups"]:
+        with priority_context(PRIORITY_BATCH), scheduled("vista"):
+            run_statement(session, build_dynamic_table_ddl(spec, rollup, warehouse), stage="rollups", collect=True)
+        with _LOCK:
+            _STATE["ready"].add(rollup["name"])
+
+
+def refresh_rollups(session):
+    """Materializa los rollups según ROLLUPS_MODE (se llama en un hilo)."""
+    start = time.perf_counter()
+    try:
+        spec = get_rollup_spec()
+        if spec is None:
+            return
+        if ROLLUPS_CONFIG["mode"] == "dynamic_table":
+            create_dynamic_tables(session, spec)
+        else:
+            for rollup in spec["rollups"]:
+                refresh_local_rollup(session, spec, rollup)
+        with _LOCK:
+            _STATE["error"] = None
+        print(f"🧮 Rollups ({ROLLUPS_CONFIG['mode']}) actualizados: {len(spec['rollups'])} "
+              f"({time.perf_counter() - start:.2f}s)")
+    except Exception as e:
+        with _LOCK:
+            _STATE["error"] = str(e)
+        print(f"⚠️ No se pudieron actualizar los rollups: {str(e)}")
+    finally:
+        with _LOCK:
+            _STATE["refreshing"] = False
+
+
+def ensure_rollups(session):
+    """Lanza la materialización en segundo plano si toca (no bloquea)."""
+    if not ROLLUPS_CONFIG["enabled"] or session is None:
+        return
+    with _LOCK:
+        first = _STATE["refreshed_at"] == 0.0
+        stale = time.time() - _STATE["refreshed_at"] >= ROLLUPS_CONFIG["refresh_seconds"]
+        if not stale or _STATE["refreshing"]:
+            return
+        # Si falla, se reintenta en el siguiente intervalo
+        _STATE.update(refreshing=True, refreshed_at=time.time())
+    if first and ROLLUPS_CONFIG["mode"] == "local":
+        load_local_rollups()
+    threading.Thread(target=refresh_rollups, args=(session,), name="rollups", daemon=True).start()
+
+
+def _available(rollup: Dict) -> bool:
+    with _LOCK:
+        if ROLLUPS_CONFIG["mode"] == "dynamic_table":
+            return rollup["name"] in _STATE["ready"]
+        return rollup["name"] in _STATE["frames"]
+
+
+# --- Reescritura de preguntas ---
+
+def _find_phrases(text: str, phrases_by_key: Dict[str, List[str]]) -> List[str]:
+    """Claves cuyas frases aparecen en el texto (las frases más largas primero)."""
+    found = []
+    candidates = sorted(((p, k) for k, ps in phrases_by_key.items() for p in ps), key=lambda pk: -len(pk[0]))
+    for phrase, key in candidates:
+        pattern = rf"\b{re.escape(phrase)}\b"
+        if re.search(pattern, text):
+            if key not in found:
+                found.append(key)
+            text = re.sub(pattern, " ", text)
+    return found
+
+
+def parse_rollup_request(question: str, spec: Dict) -> Optional[Dict]:
+    """
+    Interpreta una pregunta por periodo sobre la tabla de hechos.
+
+    Returns:
+        {"grain", "measures", "group_by", "filters", "period"} o None si la
+        pregunta no es por periodo o necesita el detalle diario
+    """
+    tokens = normalize_text(question).split()
+    if not tokens or any(t in DAILY_WORDS for t in tokens):
+        return None
+    grain = next((g for g, words in GRAIN_WORDS.items() if any(t in words for t in tokens)), None)
+    if grain is None:
+        return None
+    text = " ".join(tokens)
+
+    measures = _find_phrases(text, {m["name"]: m["phrases"] for m in spec["measures"]})
+    if not measures:
+        return None
+    filters = {}
+    for dim, info in spec["dimensions"].items():
+        for value in info["values"]:
+            if re.search(rf"\b{re.escape(normalize_text(value))}\b", text):
+                filters.setdefault(dim, []).append(value)
+    group_by = [d for d in _find_phrases(text, {d: list(i["phrases"]) for d, i in spec["dimensions"].items()})
+                if d not in filters]
+    return {"grain": grain, "measures": measures, "group_by": group_by,
+            "filters": filters, "period": extract_period(question)}
+
+
+def choose_rollup(request: Dict, spec: Dict) -> Optional[Dict]:
+    """Rollup más pequeño que cubre la pregunta (grano compatible y dimensiones necesarias)."""
+    # Las semanas no encajan en meses ni años: con periodo se necesita el detalle diario
+    if request["grain"] == "week" and request["period"]:
+        return None
+    needed = set(request["group_by"]) | set(request["filters"])
+    candidates = [r for r in spec["rollups"]
+                  if r["grain"] == GRAIN_SOURCE[request["grain"]] and needed <= set(r["dimensions"]) and _available(r)]
+    if not candidates:
+        return None
+
+    def size(rollup):
+        with _LOCK:
+            frame = _STATE["frames"].get(rollup["name"])
+        return (len(frame) if frame is not None else 0, len(rollup["dimensions"]))
+
+    return min(candidates, key=lambda r: (len(r["dimensions"]), size(r)))
+
+
+def build_rollup_query(request: Dict, rollup: Dict, spec: Dict) -> str:
+    """SQL que responde la pregunta sobre la dynamic table del rollup."""
+    grain = request["grain"]
+    columns = [f"DATE_TRUNC('{grain.upper()}', PERIOD_START) AS {grain.upper()}"]
+    columns += [d.upper() for d in request["group_by"]]
+    for measure in spec["measures"]:
+        if measure["name"] not in request["measures"]:
+            continue
+        name = measure["name"].upper()
+        if measure["agg"] == "avg":
+            columns.append(f"SUM({name}_SUM) / NULLIF(SUM({name}_COUNT), 0) AS {name}")
+        else:
+            columns.append(f"SUM({name}) AS {name}")
+    conditions = []
+    if request["period"]:
+        conditions.append(f"PERIOD_START BETWEEN '{request['period'][0]}' AND '{request['period'][1]}'")
+    for dim, values in request["filters"].items():
+        conditions.append(f"{dim.upper()} IN ({', '.join(quote_literal(v) for v in values)})")
+    query = f"SELECT {', '.join(columns)}\nFROM {_rollup_table(spec, rollup)}"
+    if conditions:
+        query += f"\nWHERE {' AND '.join(conditions)}"
+    return query + "\nGROUP BY ALL\nORDER BY 1"
+
+
+def answer_locally(request: Dict, df: pd.DataFrame, spec: Dict) -> pd.DataFrame:
+    """Responde la pregunta con un groupby sobre el rollup local."""
+    mask = pd.Series(True, index=df.index)
+    if request["period"]:
+        mask &= df["PERIOD_START"].between(pd.Timestamp(request["period"][0]), pd.Timestamp(request["period"][1]))
+    for dim, values in request["filters"].items():
+        mask &= df[dim.upper()].isin(values)
+    df = df[mask]
+
+    grain = request["grain"].upper()
+    key = df["PERIOD_START"].dt.to_period(PANDAS_PERIODS[request["grain"]]).dt.start_time.rename(grain)
+    dims = [d.upper() for d in request["group_by"]]
+    selected = [m for m in spec["measures"] if m["name"] in request["measures"]]
+    value_columns = []
+    for measure in selected:
+        name = measure["name"].upper()
+        value_columns += [f"{name}_SUM", f"{name}_COUNT"] if measure["agg"] == "avg" else [name]
+    grouped = df[dims + value_columns].groupby([key] + dims, sort=True).sum().reset_index()
+    for measure in selected:
+        name = measure["name"].upper()
+        if measure["agg"] == "avg":
+            grouped[name] = grouped[f"{name}_SUM"] / grouped[f"{name}_COUNT"].where(grouped[f"{name}_COUNT"] != 0)
+            grouped = grouped.drop(columns=[f"{name}_SUM", f"{name}_COUNT"])
+    return grouped
+
+
+def answer_from_rollup(question: str, session=None) -> Optional[Dict]:
+    """
+    Responde una pregunta por periodo desde un rollup.
+
+    Returns:
+        {"rollup", "request", "sql"} (dynamic tables) o {"rollup", "request", "data"}
+        (local), o None si ningún rollup la cubre
+    """
+    if not ROLLUPS_CONFIG["enabled"]:
+        return None
+    ensure_rollups(session)
+    spec = get_rollup_spec()
+    if spec is None:
+        return None
+    request = parse_rollup_request(question, spec)
+    rollup = choose_rollup(request, spec) if request else None
+    if rollup is None:
+        return None
+    if ROLLUPS_CONFIG["mode"] == "dynamic_table":
+        return {"rollup": rollup["name"], "request": request, "sql": build_rollup_query(request, rollup, spec)}
+    with _LOCK:
+        frame = _STATE["frames"][rollup["name"]]
+    return {"rollup": rollup["name"], "request": request, "data": answer_locally(request, frame, spec)}
+
+
+def build_rollup_response(answer: Dict) -> Dict:
+    """Respuesta con el mismo formato que devuelve la API de Cortex Analyst."""
+    text = f"Respuesta calculada desde el rollup **{answer['rollup']}** (sin re-agregar el histórico diario)."
+    if "sql" in answer:
+        item = {"type": "sql", "statement": answer["sql"], "confidence": {}}
+    else:
+        item = {"type": "data_table", "data": answer["data"]}
+    return {
+        "message": {"role": "analyst", "content": [{"type": "text", "text": text}, item]},
+        "request_id": "local-rollup",
+    }
@@ -0,0 +1,213 @@
+"""
+Módulo de enrutado de sentencias a warehouses
+Envía cada clase de sentencia (consultas puntuales interactivas, SQL
+exploratorio/batch, llamadas a Cortex) a su warehouse configurado con
+USE WAREHOUSE, con límite de concurrencia por clase y fallback al
+warehouse por defecto si el destino no es accesible.
+
+El warehouse (y el QUERY_TAG) son estado de la sesión: las sentencias que
+comparten sesión solo corren a la vez si necesitan el mismo estado
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Hashable, Optional
+from .utils import get_config
+
+
+# Clase de warehouse para cada etapa de execution.run_statement
+STAGE_CLASSES = {
+    "vista": "interactive",
+    "metadata": "interactive",
+    "watch": "interactive",
+    "warmup": "interactive",
+    "typeahead_lookup": "interactive",
+    "exploratorio": "batch",
+    "snapshot": "batch",
+    "analytics": "batch",
+    "rollups": "batch",
+    "attachments": "batch",
+    "similarity": "batch",
+    "typeahead": "batch",
+    "llm": "llm",
+}
+
+ROUTER_CONFIG = {
+    # Sentencias simultáneas por clase en este proceso
+    "concurrency": {
+        "interactive": int(os.environ.get("ROUTER_INTERACTIVE_CONCURRENCY", "16")),
+        "batch": int(os.environ.get("ROUTER_BATCH_CONCURRENCY", "2")),
+        "llm": int(os.environ.get("ROUTER_LLM_CONCURRENCY", "8")),
+    },
+    # Un warehouse suspendido se reanuda solo con la primera sentencia (AUTO_RESUME);
+    # activar solo para warehouses sin AUTO_RESUME (requiere el privilegio OPERATE)
+    "resume_if_suspended": os.environ.get("ROUTER_RESUME_IF_SUSPENDED", "false").lower() in ("1", "true", "yes"),
+    # Segundos sin volver a intentar un warehouse cuyo USE ha fallado
+    "retry_seconds": int(os.environ.get("ROUTER_RETRY_SECONDS", "60")),
+}
+
+_SEMAPHORES: Dict[str, threading.BoundedSemaphore] = {}
+# Warehouse -> instante del último fallo al usarlo
+_UNAVAILABLE: Dict[str, float] = {}
+_LOCK = threading.Lock()
+_ROUTES = {"loaded": False, "default": None, "routes": {}}
+
+
+def _load_routes() -> Dict:
+    if not _ROUTES["loaded"]:
+        try:
+            config = get_config()
+            _ROUTES["default"] = config["snowflake_warehouse"]
+            _ROUTES["routes"] = config.get("warehouse_routes", {})
+        except ValueError:
+            _ROUTES["routes"] = {}
+        _ROUTES["loaded"] = True
+    return _ROUTES
+
+
+def session_lock(session) -> threading.RLock:
+    """Lock por sesión para cambiar su estado (USE WAREHOUSE, QUERY_TAG) sin intercalarse."""
+    lock = getattr(session, "_incidencias_route_lock", None)
+    if lock is None:
+        with _LOCK:
+            lock = getattr(session, "_incidencias_route_lock", None)
+            if lock is None:
+                lock = threading.RLock()
+                session._incidencias_route_lock = lock
+    return lock
+
+
+class SessionGate:
+    """
+    Puerta del estado de una sesión (warehouse, QUERY_TAG).
+
+    Las sentencias con la misma clave de estado se ejecutan en paralelo; una
+    sentencia que necesita otro estado espera a que terminen las que están en
+    curso, lo aplica y entonces entra. Mientras espera no entran más sentencias
+    con el estado antiguo, así que no se queda esperando indefinidamente.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.key: Optional[Hashable] = None
+        self.active = 0
+        self._draining = False
+
+    @contextmanager
+    def hold(self, key: Hashable, apply: Callable[[], None]):
+        with self._cond:
+            while self.active and (self.key != key or self._draining):
+                if self.key != key:
+                    self._draining = True
+                self._cond.wait()
+            if self.key != key:
+                # Nadie ejecuta con el estado anterior: se puede cambiar
+                self._draining = False
+                self.key = None
+                try:
+                    apply()
+                except Exception:
+                    self._cond.notify_all()
+                    raise
+                self.key = key
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                if not self.active:
+                    self._cond.notify_all()
+
+
+def session_gate(session) -> SessionGate:
+    """Puerta de estado de la sesión (una por objeto de sesión)."""
+    gate = getattr(session, "_incidencias_gate", None)
+    if gate is None:
+        with _LOCK:
+            gate = getattr(session, "_incidencias_gate", None)
+            if gate is None:
+                gate = SessionGate()
+                session._incidencias_gate = gate
+    return gate
+
+
+def _semaphore(warehouse_class: str) -> threading.BoundedSemaphore:
+    with _LOCK:
+        if warehouse_class not in _SEMAPHORES:
+            limit = ROUTER_CONFIG["concurrency"].get(warehouse_class, 4)
+            _SEMAPHORES[warehouse_class] = threading.BoundedSemaphore(limit)
+        return _SEMAPHORES[warehouse_class]
+
+
+def resolve_warehouse(stage: str) -> Optional[str]:
+    """
+    Warehouse que debe usar una etapa, o None si no hay enrutado configurado.
+
+    Un destino cuyo USE ha fallado hace menos de ROUTER_RETRY_SECONDS se sustituye
+    por el warehouse por defecto; pasado ese tiempo se vuelve a intentar.
+    """
+    routes = _load_routes()
+    target = routes["routes"].get(STAGE_CLASSES.get(stage, "interactive"))
+    if not target:
+        return None
+    failed_at = _UNAVAILABLE.get(target.upper())
+    if failed_at is not None and time.monotonic() - failed_at < ROUTER_CONFIG["retry_seconds"]:
+        return routes["default"]
+    return target
+
+
+def _use_warehouse(session, warehouse: str):
+    if getattr(session, "_incidencias_warehouse", None) == warehouse:
+        return
+    if ROUTER_CONFIG["resume_if_suspended"]:
+        session.sql(f"ALTER WAREHOUSE {warehouse} RESUME IF SUSPENDED").collect()
+    session.sql(f"USE WAREHOUSE {warehouse}").collect()
+    session._incidencias_warehouse = warehouse
+
+
+def set_query_tag(session, tag: str):
+    """Fija QUERY_TAG en la sesión solo si cambia (cada cambio es un ALTER SESSION)."""
+    if getattr(session, "_incidencias_query_tag", None) == tag:
+        return
+    session.query_tag = tag
+    session._incidencias_query_tag = tag
+
+
+@contextmanager
+def routed(session, stage: str, tag: Optional[str] = None, exclusive: bool = False):
+    """
+    Ejecuta el bloque con la sesión apuntando al warehouse de la etapa (y con su QUERY_TAG).
+
+    El warehouse y la etiqueta se mantienen desde el cambio hasta el final del
+    bloque: otra sentencia de la misma sesión que necesite otro estado espera
+    (ver SessionGate); las que necesitan el mismo se ejecutan en paralelo.
+
+    Args:
+        tag: QUERY_TAG de la sentencia (None = no se toca)
+        exclusive: True para que ninguna otra sentencia de la sesión se ejecute a la vez
+    """
+    routes = _load_routes()
+    warehouse_class = STAGE_CLASSES.get(stage, "interactive")
+    with (_semaphore(warehouse_class) if routes["routes"] else nullcontext()):
+        target = resolve_warehouse(stage) if routes["routes"] else None
+
+        def apply():
+            if target:
+                try:
+                    _use_warehouse(session, target)
+                    _UNAVAILABLE.pop(target.upper(), None)
+                except Exception as e:
+                    # Sin privilegios o warehouse inexistente: por defecto hasta el siguiente reintento
+                    _UNAVAILABLE[target.upper()] = time.monotonic()
+                    print(f"⚠️ No se pudo usar {target} ({str(e)}): se usa {routes['default']}")
+                    _use_warehouse(session, routes["default"])
+            if tag is not None:
+                set_query_tag(session, tag)
+
+        # Una clave única no coincide con ninguna otra: la sentencia va sola
+        key = object() if exclusive else (target, tag)
+        with session_gate(session).hold(key, apply):
+            yield
@@ -0,0 +1,243 @@
+"""
+Módulo de reglas de diagnóstico
+Resuelve sin LLM las combinaciones conocidas de tipo de pedido, estado del ASN y
+diferencias de revisión (ver CONFIG_VISTAS.md). Las reglas se declaran en
+DIAGNOSIS_RULES (o en un YAML) y se compilan a una tabla de decisión; solo los
+casos sin regla o ambiguos pasan a Cortex
+"""
+
+import os
+import threading
+from itertools import product
+from typing import Dict, List, Optional
+import yaml
+from .metrics import RULE_EVALUATIONS, RULE_HITS
+
+
+RULES_CONFIG = {
+    "enabled": os.environ.get("RULES_ENABLED", "true").lower() in ("1", "true", "yes"),
+    # YAML con una lista de reglas que sustituye a DIAGNOSIS_RULES
+    "path": os.environ.get("DIAGNOSIS_RULES_FILE", ""),
+}
+
+# Estados de CO_ESTADO_PREALBARAN en los que el ASN ya está revisado (ver
+# CONFIG_VISTAS.md); con otro estado (p. ej. PENDIENTE) las diferencias aún no
+# son definitivas y el caso pasa al LLM
+ESTADOS_ASN_REVISADOS = [e.strip().upper() for e in os.environ.get(
+    "RULES_ESTADOS_ASN_REVISADOS", "REVISADO,RECIBIDO").split(",") if e.strip()]
+
+# Dimensiones de la tabla de decisión, en orden
+DIMENSIONS = ("tipo_pedido", "asn", "diferencias")
+WILDCARD = "*"
+
+# Valores especiales de las dimensiones
+SIN_DATOS = "SIN_DATOS"
+CON_DATOS = "CON_DATOS"
+MIXTO = "MIXTO"
+# Hay filas pero no se conoce el valor (columna ausente en la vista o nula)
+DESCONOCIDO = "DESCONOCIDO"
+
+# Condiciones: valor o lista de valores por dimensión (sin clave = cualquiera).
+# "prioridad" desempata reglas que coinciden a la vez; con "llm": True la
+# combinación se deriva siempre a Cortex.
+DIAGNOSIS_RULES = [
+    {
+        "id": "pedido_no_encontrado",
+        "when": {"tipo_pedido": SIN_DATOS},
+        "prioridad": 10,
+        "estado": "❌ No se encontró el pedido con el UNECO, almacén y pedido host indicados.",
+        "recomendaciones": [
+            "Revisa UNECO, almacén y pedido host en el formulario",
+            "Confirma en host que el pedido existe y no está anulado",
+        ],
+    },
+    {
+        "id": "tipo_no_clasificado",
+        "when": {"tipo_pedido": ["OTRO TIPO", MIXTO]},
+        "prioridad": 5,
+        "llm": True,
+    },
+    {
+        "id": "asn_estados_mixtos",
+        "when": {"asn": MIXTO},
+        "prioridad": 5,
+        "llm": True,
+    },
+    {
+        "id": "sin_asn",
+        "when": {"asn": SIN_DATOS},
+        "estado": "⚠️ Pedido {tipo_pedido} sin ASN: todavía no hay pre-albarán para este pedido.",
+        "recomendaciones": [
+            "Comprueba con el proveedor el envío del ASN",
+            "Si la FEO ya ha pasado, escala el retraso al equipo de aprovisionamiento",
+        ],
+    },
+    {
+        "id": "asn_sin_diferencias",
+        "when": {"asn": ESTADOS_ASN_REVISADOS, "diferencias": "NO"},
+        "estado": "✅ Pedido {tipo_pedido} con ASN revisado y sin diferencias ({lineas_asn} línea(s)).",
+        "recomendaciones": [
+            "No hay descuadre entre lo pedido y lo revisado: verifica la ubicación física de la mercancía",
+        ],
+    },
+    {
+        "id": "asn_con_diferencias",
+        "when": {"asn": ESTADOS_ASN_REVISADOS, "diferencias": "SI"},
+        "estado": "⚠️ Pedido {tipo_pedido} con {diferencias_total:g} unidad(es) de diferencia entre lo pedido y lo revisado en el ASN.",
+        "recomendaciones": [
+            "Revisa las líneas con DIFERENCIAS_REVISION distinta de 0 en el Paso 2",
+            "Abre reclamación al proveedor si la mercancía revisada es menor que la pedida",
+        ],
+    },
+]
+
+_TABLE = {"table": None}
+_LOCK = threading.Lock()
+
+
+def _values(condition) -> List[str]:
+    if condition is None:
+        return [WILDCARD]
+    if isinstance(condition, (list, tuple)):
+        return [str(v).upper() for v in condition]
+    return [str(condition).upper()]
+
+
+def compile_rules(rules: List[Dict]) -> Dict[tuple, List[Dict]]:
+    """
+    Compila las reglas a una tabla de decisión {(tipo, asn, diferencias): [reglas]}.
+
+    Las listas de valores se expanden y las dimensiones sin condición quedan
+    como comodín, así que buscar es un número fijo de accesos al diccionario.
+    """
+    table: Dict[tuple, List[Dict]] = {}
+    for rule in rules:
+        unknown = set(rule.get("when", {})) - set(DIMENSIONS)
+        if unknown:
+            raise ValueError(f"Regla '{rule.get('id')}': dimensiones desconocidas {sorted(unknown)}")
+        conditions = [_values(rule.get("when", {}).get(dim)) for dim in DIMENSIONS]
+        for key in product(*conditions):
+            table.setdefault(key, []).append(rule)
+    return table
+
+
+def load_rules() -> List[Dict]:
+    """Reglas configuradas (YAML de DIAGNOSIS_RULES_FILE o DIAGNOSIS_RULES)."""
+    if RULES_CONFIG["path"]:
+        with open(RULES_CONFIG["path"], "r", encoding="utf-8") as f:
+            return yaml.safe_load(f) or []
+    return DIAGNOSIS_RULES
+
+
+def get_decision_table() -> Dict[tuple, List[Dict]]:
+    """Tabla de decisión compilada (una vez por proceso)."""
+    with _LOCK:
+        if _TABLE["table"] is None:
+            _TABLE["table"] = compile_rules(load_rules())
+        return _TABLE["table"]
+
+
+def build_features(metrics_paso1: Dict, metrics_paso2: Dict) -> Dict:
+    """
+    Valores de las dimensiones a partir de la salida de extract_key_metrics.
+
+    Args:
+        metrics_paso1: extract_key_metrics(df_paso1, "paso1")
+        metrics_paso2: extract_key_metrics(df_paso2, "paso2")
+    """
+    tipos = metrics_paso1.get("tipos_pedido") or []
+    # Solo un Paso 1 vacío significa que el pedido no existe; si la vista no
+    # trae TIPO_PEDIDO (o viene nulo) el tipo es desconocido, no SIN_DATOS
+    if not metrics_paso1.get("num_registros"):
+        tipo_pedido = SIN_DATOS
+    elif len(tipos) > 1:
+        tipo_pedido = MIXTO
+    elif not tipos:
+        tipo_pedido = DESCONOCIDO
+    else:
+        tipo_pedido = str(metrics_paso1.get("tipo_pedido") or DESCONOCIDO).upper()
+
+    estados = metrics_paso2.get("estados_asn") or {}
+    if not metrics_paso2:
+        asn = SIN_DATOS
+    elif len(estados) > 1:
+        asn = MIXTO
+    else:
+        asn = str(next(iter(estados), CON_DATOS)).upper()
+
+    if "hay_diferencias" in metrics_paso2:
+        diferencias = "SI" if metrics_paso2["hay_diferencias"] else "NO"
+    else:
+        diferencias = SIN_DATOS
+
+    return {
+        "tipo_pedido": tipo_pedido,
+        "asn": asn,
+        "diferencias": diferencias,
+        "diferencias_total": metrics_paso2.get("diferencias_total", 0),
+        "lineas_asn": metrics_paso2.get("num_registros", 0),
+    }
+
+
+def match_rule(features: Dict, table: Optional[Dict] = None) -> tuple[Optional[Dict], str]:
+    """
+    Busca la regla de una combinación de dimensiones.
+
+    Returns:
+        (regla, resultado) con resultado 'hit', 'miss', 'ambiguous' o 'escalated'
+    """
+    table = table if table is not None else get_decision_table()
+    key = tuple(features[dim] for dim in DIMENSIONS)
+    candidates = []
+    # Cada dimensión con su valor o con comodín: 2^3 accesos como máximo
+    for pattern in product(*[(value, WILDCARD) for value in key]):
+        for rule in table.get(pattern, []):
+            specificity = sum(v != WILDCARD for v in pattern)
+            candidates.append(((rule.get("prioridad", 0), specificity), rule))
+    if not candidates:
+        return None, "miss"
+
+    best = max(rank for rank, _ in candidates)
+    winners = {id(rule): rule for rank, rule in candidates if rank == best}
+    if len(winners) > 1:
+        return None, "ambiguous"
+    rule = next(iter(winners.values()))
+    if rule.get("llm"):
+        return rule, "escalated"
+    return rule, "hit"
+
+
+def render_diagnosis(rule: Dict, features: Dict) -> str:
+    """Texto del diagnóstico de una regla (estado + recomendaciones)."""
+    values = dict(features)
+    if values["tipo_pedido"] in (SIN_DATOS, MIXTO, DESCONOCIDO):
+        values["tipo_pedido"] = ""
+    estado = " ".join(rule["estado"].format(**values).split())
+    lines = [estado]
+    if rule.get("recomendaciones"):
+        lines.append("\n**Recomendaciones:**")
+        lines.extend(f"- {r}" for r in rule["recomendaciones"])
+    lines.append(f"\n_⚡ Diagnóstico por regla `{rule['id']}` (sin LLM)_")
+    return "\n".join(lines)
+
+
+def diagnose(metrics_paso1: Dict, metrics_paso2: Dict) -> Optional[Dict]:
+    """
+    Diagnóstico determinista de una incidencia, si alguna regla lo resuelve.
+
+    Args:
+        metrics_paso1: Métricas del Paso 1 (extract_key_metrics)
+        metrics_paso2: Métricas del Paso 2 (extract_key_metrics)
+
+    Returns:
+        {"rule", "analysis", "features"} o None si hay que consultar al LLM
+    """
+    if not RULES_CONFIG["enabled"]:
+        return None
+    features = build_features(metrics_paso1, metrics_paso2)
+    rule, result = match_rule(features)
+    RULE_EVALUATIONS.inc(result=result)
+    if result != "hit":
+        return None
+    RULE_HITS.inc(rule=rule["id"])
+    return {"rule": rule["id"], "analysis": render_diagnosis(rule, features), "features": features}
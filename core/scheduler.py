@@ -0,0 +1,235 @@
+"""
+Módulo de control de admisión para llamadas a Snowflake
+Planificador de proceso para llamadas a Cortex COMPLETE y a las vistas:
+límites de concurrencia, rate limit por modelo (token bucket), prioridad de
+turnos interactivos frente a batch, métricas de espera y descarte por saturación
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+from .metrics import SCHEDULER_WAIT_SECONDS
+
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+SCHEDULER_CONFIG = {
+    # Llamadas simultáneas por tipo de trabajo
+    "concurrency": {
+        "llm": int(os.environ.get("SCHED_LLM_CONCURRENCY", "4")),
+        "vista": int(os.environ.get("SCHED_VISTA_CONCURRENCY", "8")),
+    },
+    # Peticiones por minuto y ráfaga por modelo de Cortex ("default" para el resto)
+    "rate_limits": {
+        "default": {
+            "per_minute": float(os.environ.get("CORTEX_RATE_PER_MINUTE", "60")),
+            "burst": int(os.environ.get("CORTEX_RATE_BURST", "10")),
+        },
+    },
+    # Peticiones en cola por tipo antes de descartar
+    "max_queue": int(os.environ.get("SCHED_MAX_QUEUE", "50")),
+    # Espera máxima en cola (segundos) antes de descartar
+    "max_wait_seconds": float(os.environ.get("SCHED_MAX_WAIT_SECONDS", "30")),
+}
+
+_current_priority: ContextVar[int] = ContextVar("scheduler_priority", default=PRIORITY_INTERACTIVE)
+
+
+class SchedulerSaturated(Exception):
+    """El planificador no admite más trabajo (cola llena o espera excesiva)."""
+
+
+class TokenBucket:
+    """Rate limit clásico: `rate` tokens por segundo con capacidad `capacity`."""
+
+    def __init__(self, per_minute: float, burst: int):
+        self.rate = per_minute / 60.0
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Reserva un token y devuelve los segundos que hay que esperar para usarlo."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate if self.rate > 0 else float("inf")
+
+    def cancel(self):
+        """Devuelve un token reservado que no se va a usar."""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class AdmissionQueue:
+    """Cola con prioridad y límite de concurrencia para un tipo de trabajo."""
+
+    def __init__(self, kind: str, limit: int):
+        self.kind = kind
+        self.limit = max(limit, 1)
+        self.running = 0
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.stats = {"admitted": 0, "shed": 0, "wait_total": 0.0, "wait_max": 0.0}
+        self.recent_waits = deque(maxlen=500)
+
+    def acquire(self, priority: int, timeout: float) -> float:
+        """Espera un hueco respetando la prioridad. Devuelve el tiempo de espera."""
+        start = time.monotonic()
+        with self._cond:
+            if len(self._heap) >= SCHEDULER_CONFIG["max_queue"]:
+                self.stats["shed"] += 1
+                raise SchedulerSaturated(
+                    f"Sistema saturado: hay {len(self._heap)} peticiones de tipo '{self.kind}' en cola. "
+                    f"Inténtalo de nuevo en unos segundos."
+                )
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._heap, entry)
+            while not (self._heap[0] == entry and self.running < self.limit):
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._heap.remove(entry)
+                    heapq.heapify(self._heap)
+                    self.stats["shed"] += 1
+                    self._cond.notify_all()
+                    raise SchedulerSaturated(
+                        f"Sistema saturado: la petición de tipo '{self.kind}' esperó más de "
+                        f"{timeout:.0f}s en cola. Inténtalo de nuevo en unos segundos."
+                    )
+                self._cond.wait(remaining)
+            heapq.heappop(self._heap)
+            self.running += 1
+            # El siguiente en cola puede tener hueco también
+            self._cond.notify_all()
+
+        waited = time.monotonic() - start
+        self._record_wait(waited)
+        return waited
+
+    def release(self):
+        with self._cond:
+            self.running -= 1
+            self._cond.notify_all()
+
+    def record_shed(self):
+        """Cuenta una petición descartada fuera de acquire (p.ej. por rate limit)."""
+        with self._cond:
+            self.stats["shed"] += 1
+
+    def _record_wait(self, waited: float):
+        with self._cond:
+            self.stats["admitted"] += 1
+            self.stats["wait_total"] += waited
+            self.stats["wait_max"] = max(self.stats["wait_max"], waited)
+            self.recent_waits.append(waited)
+        SCHEDULER_WAIT_SECONDS.observe(waited, kind=self.kind)
+
+    @property
+    def queued(self) -> int:
+        return len(self._heap)
+
+
+_QUEUES: Dict[str, AdmissionQueue] = {}
+_BUCKETS: Dict[str, TokenBucket] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def _get_queue(kind: str) -> AdmissionQueue:
+    with _REGISTRY_LOCK:
+        if kind not in _QUEUES:
+            limit = SCHEDULER_CONFIG["concurrency"].get(kind, 4)
+            _QUEUES[kind] = AdmissionQueue(kind, limit)
+        return _QUEUES[kind]
+
+
+def _get_bucket(model: str) -> TokenBucket:
+    with _REGISTRY_LOCK:
+        if model not in _BUCKETS:
+            limits = SCHEDULER_CONFIG["rate_limits"]
+            config = limits.get(model, limits["default"])
+            _BUCKETS[model] = TokenBucket(config["per_minute"], config["burst"])
+        return _BUCKETS[model]
+
+
+@contextmanager
+def priority_context(priority: int):
+    """Fija la prioridad de las llamadas hechas dentro del bloque (p.ej. PRIORITY_BATCH)."""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+@contextmanager
+def scheduled(kind: str, model: Optional[str] = None, priority: Optional[int] = None):
+    """
+    Ejecuta el bloque cuando el planificador lo admite.
+
+    Args:
+        kind: Tipo de trabajo ('llm' o 'vista')
+        model: Modelo de Cortex, para aplicar su rate limit
+        priority: Prioridad (menor = antes); por defecto la del contexto actual
+
+    Raises:
+        SchedulerSaturated si la cola está llena o la espera supera el máximo
+    """
+    priority = _current_priority.get() if priority is None else priority
+    timeout = SCHEDULER_CONFIG["max_wait_seconds"]
+    queue = _get_queue(kind)
+    # El rate limit se espera antes de ocupar un hueco: un modelo limitado no
+    # debe bloquear la concurrencia del resto de modelos
+    delay = 0.0
+    bucket = _get_bucket(model) if model else None
+    if bucket is not None:
+        delay = bucket.reserve()
+        if delay > timeout:
+            bucket.cancel()
+            queue.record_shed()
+            raise SchedulerSaturated(
+                f"Límite de peticiones alcanzado para el modelo '{model}'. "
+                f"Inténtalo de nuevo en {delay:.0f}s o elige otro modelo."
+            )
+        if delay > 0:
+            time.sleep(delay)
+    try:
+        queue.acquire(priority, timeout - delay)
+    except SchedulerSaturated:
+        if bucket is not None:
+            bucket.cancel()
+        raise
+    try:
+        yield
+    finally:
+        queue.release()
+
+
+def get_scheduler_stats() -> Dict[str, Dict]:
+    """Métricas de cola por tipo de trabajo (esperas en segundos)."""
+    stats = {}
+    for kind, queue in list(_QUEUES.items()):
+        waits = sorted(queue.recent_waits)
+        admitted = queue.stats["admitted"]
+        stats[kind] = {
+            "running": queue.running,
+            "queued": queue.queued,
+            "admitted": admitted,
+            "shed": queue.stats["shed"],
+            "wait_avg": queue.stats["wait_total"] / admitted if admitted else 0.0,
+            "wait_max": queue.stats["wait_max"],
+            "wait_p95": waits[int(len(waits) * 0.95) - 1] if waits else 0.0,
+        }
+    return stats
@@ -0,0 +1,268 @@
+"""
+Módulo del modelo semántico local
+Compila el YAML del modelo semántico (tablas lógicas + verified_queries) para
+responder las preguntas verificadas sin pasar por la API de Cortex Analyst
+"""
+
+import difflib
+import os
+import re
+import unicodedata
+from calendar import monthrange
+from typing import Dict, List, Optional, Tuple
+import streamlit as st
+import yaml
+
+
+SEMANTIC_MODEL_CONFIG = {
+    "path": os.environ.get("SEMANTIC_MODEL_FILE", "revenue_timeseries.yaml"),
+    "min_score": float(os.environ.get("VERIFIED_QUERY_MIN_SCORE", "0.75")),
+}
+
+MONTHS = {
+    "jan": 1, "january": 1, "ene": 1, "enero": 1,
+    "feb": 2, "february": 2, "febrero": 2,
+    "mar": 3, "march": 3, "marzo": 3,
+    "apr": 4, "april": 4, "abr": 4, "abril": 4,
+    "may": 5, "mayo": 5,
+    "jun": 6, "june": 6, "junio": 6,
+    "jul": 7, "july": 7, "julio": 7,
+    "aug": 8, "august": 8, "ago": 8, "agosto": 8,
+    "sep": 9, "sept": 9, "september": 9, "septiembre": 9,
+    "oct": 10, "october": 10, "octubre": 10,
+    "nov": 11, "november": 11, "noviembre": 11,
+    "dec": 12, "december": 12, "dic": 12, "diciembre": 12,
+}
+
+STOPWORDS = {
+    "the", "a", "an", "of", "in", "on", "for", "and", "what", "was", "is", "did",
+    "that", "each", "me", "show", "el", "la", "los", "las", "de", "del", "en",
+    "y", "que", "cual", "por", "para", "un", "una", "muestra", "dame",
+}
+
+DATE_RANGE_PATTERN = re.compile(
+    r"BETWEEN\s+'(\d{4}-\d{2}-\d{2})'\s+AND\s+'(\d{4}-\d{2}-\d{2})'",
+    re.IGNORECASE
+)
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sin acentos ni puntuación."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", " ", text).strip()
+
+
+def extract_period(text: str) -> Optional[Tuple[str, str]]:
+    """
+    Extrae un periodo (año o mes de un año) de una pregunta.
+
+    Returns:
+        (fecha_inicio, fecha_fin) en formato ISO, o None si no hay periodo
+    """
+    tokens = normalize_text(text).split()
+    year = next((int(t) for t in tokens if re.fullmatch(r"(19|20)\d{2}", t)), None)
+    if year is None:
+        return None
+    month = next((MONTHS[t] for t in tokens if t in MONTHS), None)
+    if month is None:
+        return f"{year}-01-01", f"{year}-12-31"
+    last_day = monthrange(year, month)[1]
+    return f"{year}-{month:02d}-01", f"{year}-{month:02d}-{last_day:02d}"
+
+
+def _keywords(text: str) -> List[str]:
+    """Palabras significativas de una pregunta, sin periodos ni stopwords."""
+    return [
+        t for t in normalize_text(text).split()
+        if t not in STOPWORDS and t not in MONTHS and not t.isdigit()
+    ]
+
+
+def compile_table_ctes(model: Dict) -> Dict[str, str]:
+    """
+    Compila cada tabla lógica del modelo a una CTE sobre su tabla física.
+
+    Las columnas de la CTE usan los nombres semánticos (dimensiones, dimensiones
+    de tiempo y medidas), que son los que usan las verified_queries.
+    """
+    ctes = {}
+    # Tabla física -> (tabla lógica que la compiló primero, columnas semánticas)
+    compiled = {}
+    for table in model.get("tables", []):
+        if table["name"] in ctes:
+            # Si hay dos tablas lógicas con el mismo nombre prevalece la primera
+            continue
+        base = table["base_table"]
+        physical = f"{base['database']}.{base['schema']}.{base['table']}"
+        columns = [
+            column for section in ("time_dimensions", "dimensions", "measures")
+            for column in table.get(section, [])
+        ]
+        names = {column["name"] for column in columns}
+        first = compiled.get(physical)
+        if first and columns and names <= first[1]:
+            # Otra vista lógica de la misma tabla física (product_dimension sobre
+            # product_dim): se reutiliza la CTE existente en vez de duplicarla
+            select = ", ".join(sorted(names))
+            source = first[0]
+        else:
+            select = ", ".join(f"{c['expr']} AS {c['name']}" for c in columns) if columns else "*"
+            source = physical
+            compiled.setdefault(physical, (table["name"], names))
+        ctes[table["name"]] = f"{table['name']} AS (SELECT {select} FROM {source})"
+    return ctes
+
+
+def compile_verified_sql(sql: str, ctes: Dict[str, str]) -> str:
+    """Antepone las CTEs de las tablas lógicas referenciadas por la query verificada."""
+    sql = sql.strip().rstrip(";").strip()
+    names = {
+        name for name in ctes
+        if re.search(rf"\b{re.escape(name)}\b", sql, re.IGNORECASE)
+    }
+    # CTEs que leen de otra CTE (tablas lógicas sobre la misma tabla física)
+    names |= {
+        source for name in names
+        for source in re.findall(r"FROM (\w+)\)$", ctes[name]) if source in ctes
+    }
+    used = [cte for name, cte in ctes.items() if name in names]
+    if not used:
+        return sql
+    prefix = ",\n".join(used)
+    if re.match(r"WITH\b", sql, re.IGNORECASE):
+        return f"WITH {prefix},\n{sql[4:].lstrip()}"
+    return f"WITH {prefix}\n{sql}"
+
+
+def build_verified_query_index(model: Dict) -> Dict:
+    """
+    Construye el índice de preguntas verificadas.
+
+    Returns:
+        {"queries": [...], "tokens": {palabra: [posiciones]}}
+    """
+    ctes = compile_table_ctes(model)
+    queries = []
+    inverted = {}
+
+    for vq in model.get("verified_queries", []):
+        sql = compile_verified_sql(vq["sql"], ctes)
+        date_range = DATE_RANGE_PATTERN.search(sql)
+        # Se indexan la pregunta y el nombre como formulaciones alternativas
+        forms = [_keywords(vq["question"]), _keywords(vq["name"])]
+        entry = {
+            "name": vq["name"],
+            "question": vq["question"],
+            "verified_by": vq.get("verified_by", "N/A"),
+            "original_sql": vq["sql"].strip(),
+            "sql": sql,
+            # Periodo por defecto de la query (parametrizable con la pregunta)
+            "period": date_range.groups() if date_range else None,
+            "forms": [(set(form), " ".join(form)) for form in forms if form],
+        }
+        for token in set().union(*forms):
+            inverted.setdefault(token, []).append(len(queries))
+        queries.append(entry)
+
+    return {"queries": queries, "tokens": inverted}
+
+
+def load_semantic_model(path: Optional[str] = None) -> Dict:
+    """YAML del modelo semántico ({} si no existe)."""
+    path = path or SEMANTIC_MODEL_CONFIG["path"]
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+@st.cache_resource(show_spinner=False)
+def load_verified_query_index(path: Optional[str] = None) -> Dict:
+    """Carga (una vez por proceso) el modelo semántico y su índice de preguntas verificadas."""
+    path = path or SEMANTIC_MODEL_CONFIG["path"]
+    if not os.path.exists(path):
+        return {"queries": [], "tokens": {}}
+    model = load_semantic_model(path)
+    index = build_verified_query_index(model)
+    print(f"📚 Modelo semántico '{path}': {len(index['queries'])} verified queries indexadas")
+    return index
+
+
+def match_verified_query(question: str, index: Optional[Dict] = None,
+                         min_score: Optional[float] = None) -> Optional[Dict]:
+    """
+    Busca la verified query que mejor responde a la pregunta.
+
+    Args:
+        question: Pregunta del usuario
+        index: Índice de build_verified_query_index (por defecto el del YAML configurado)
+        min_score: Puntuación mínima (0-1) para aceptar la coincidencia
+
+    Returns:
+        Diccionario con la query verificada y el SQL listo para ejecutar, o None
+    """
+    index = index if index is not None else load_verified_query_index()
+    min_score = SEMANTIC_MODEL_CONFIG["min_score"] if min_score is None else min_score
+
+    keywords = _keywords(question)
+    if not keywords:
+        return None
+
+    # Candidatos: queries que comparten al menos una palabra clave
+    candidates = {pos for token in keywords for pos in index["tokens"].get(token, [])}
+    keyword_set = set(keywords)
+    normalized = " ".join(keywords)
+    best, best_score = None, 0.0
+    for pos in candidates:
+        entry = index["queries"][pos]
+        for form_keywords, form_text in entry["forms"]:
+            overlap = len(form_keywords & keyword_set) / len(form_keywords | keyword_set)
+            ratio = difflib.SequenceMatcher(None, form_text, normalized).ratio()
+            score = 0.5 * overlap + 0.5 * ratio
+            if score > best_score:
+                best, best_score = entry, score
+
+    if best is None or best_score < min_score:
+        return None
+
+    sql = best["sql"]
+    period = extract_period(question)
+    if best["period"] and period:
+        sql = DATE_RANGE_PATTERN.sub(f"BETWEEN '{period[0]}' AND '{period[1]}'", sql)
+
+    return {
+        "name": best["name"],
+        "question": best["question"],
+        "verified_by": best["verified_by"],
+        "sql": sql,
+        "score": round(best_score, 3),
+    }
+
+
+def build_verified_response(match: Dict) -> Dict:
+    """Construye una respuesta con el mismo formato que devuelve la API de Cortex Analyst."""
+    return {
+        "message": {
+            "role": "analyst",
+            "content": [
+                {
+                    "type": "text",
+                    "text": f"Esta pregunta coincide con la consulta verificada **{match['name']}**."
+                },
+                {
+                    "type": "sql",
+                    "statement": match["sql"],
+                    "confidence": {
+                        "verified_query_used": {
+                            "name": match["name"],
+                            "question": match["question"],
+                            "verified_by": match["verified_by"],
+                            "sql": match["sql"],
+                        }
+                    }
+                }
+            ]
+        },
+        "request_id": "local-verified-query",
+    }
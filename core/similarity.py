@@ -0,0 +1,345 @@
+"""
+Módulo de incidencias similares
+Índice vectorial local sobre las incidencias guardadas en INCIDENCIAS_PEDIDOS:
+embedding de la descripción (Cortex EMBED_TEXT_768 o hashing local) combinado
+con las claves estructuradas (UNECO, almacén, tipo de pedido). Búsqueda por
+fuerza bruta con NumPy o, si está instalado, HNSW (hnswlib); altas incrementales
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from .execution import run_statement
+from .semantic_model import normalize_text, STOPWORDS
+
+
+SIMILARITY_CONFIG = {
+    "enabled": os.environ.get("SIMILARITY_ENABLED", "false").lower() in ("1", "true", "yes"),
+    "table": os.environ.get("SIMILARITY_TABLE", "INCIDENCIAS_PEDIDOS"),
+    # cortex (EMBED_TEXT_768) | hashing (local, sin coste)
+    "embeddings": os.environ.get("SIMILARITY_EMBEDDINGS", "hashing"),
+    "embed_model": os.environ.get("SIMILARITY_EMBED_MODEL", "snowflake-arctic-embed-m"),
+    # numpy (fuerza bruta exacta) | hnsw (aproximado, requiere hnswlib)
+    "backend": os.environ.get("SIMILARITY_BACKEND", "numpy"),
+    "text_dim": 768,
+    "key_dim": 64,
+    # Peso de las claves estructuradas frente a la descripción
+    "key_weight": float(os.environ.get("SIMILARITY_KEY_WEIGHT", "0.35")),
+    "top_k": int(os.environ.get("SIMILARITY_TOP_K", "5")),
+    "refresh_seconds": int(os.environ.get("SIMILARITY_REFRESH_SECONDS", "600")),
+    "index_path": os.environ.get("SIMILARITY_INDEX_PATH", ""),
+    # write_pandas crea las columnas con el nombre en minúsculas (identificadores entre comillas)
+    "columns": {"watermark": '"hora_finalizacion"', "descripcion": '"descripcion"'},
+}
+
+STRUCTURED_KEYS = ["uneco", "almacen", "tipo_pedido"]
+RESULT_COLUMNS = ["id", "score", "uneco", "almacen", "tipo_pedido", "descripcion", "hora_finalizacion"]
+
+
+# --- Embeddings ---
+
+def _hashed_features(features: List[str], dim: int) -> np.ndarray:
+    """Vector normalizado por feature hashing con signo."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        vector[value % dim] += 1.0 if (value >> 63) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def hash_text_embedding(text: str, dim: Optional[int] = None) -> np.ndarray:
+    """Embedding local de un texto: palabras y bigramas con feature hashing."""
+    tokens = [t for t in normalize_text(text or "").split() if t not in STOPWORDS]
+    features = tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+    return _hashed_features(features, dim or SIMILARITY_CONFIG["text_dim"])
+
+
+def key_embedding(record: Dict) -> np.ndarray:
+    """Embedding de las claves estructuradas (coincidencia exacta por clave)."""
+    features = [f"{key}={str(record.get(key) or '').strip().upper()}" for key in STRUCTURED_KEYS
+                if record.get(key)]
+    return _hashed_features(features, SIMILARITY_CONFIG["key_dim"])
+
+
+def combine_embedding(text_vector: np.ndarray, record: Dict) -> np.ndarray:
+    """Vector final normalizado: descripción + claves ponderadas."""
+    weight = SIMILARITY_CONFIG["key_weight"]
+    combined = np.concatenate([
+        (1.0 - weight) * np.asarray(text_vector, dtype=np.float32),
+        weight * key_embedding(record),
+    ])
+    norm = np.linalg.norm(combined)
+    return combined / norm if norm else combined
+
+
+def _parse_vector(value) -> np.ndarray:
+    if isinstance(value, str):
+        value = json.loads(value)
+    return np.asarray(value, dtype=np.float32)
+
+
+def embed_description(text: str, session=None) -> np.ndarray:
+    """Embedding de una descripción con el modo configurado."""
+    if SIMILARITY_CONFIG["embeddings"] != "cortex":
+        return hash_text_embedding(text)
+    model = SIMILARITY_CONFIG["embed_model"]
+    escaped = (text or "").replace("'", "''")
+    rows = run_statement(
+        session, f"SELECT SNOWFLAKE.CORTEX.EMBED_TEXT_768('{model}', '{escaped}') AS EMB",
+        stage="similarity", model=model, collect=True
+    )
+    vector = _parse_vector(rows[0]["EMB"])
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# --- Índices ---
+
+class VectorIndex:
+    """Índice exacto en NumPy (producto escalar sobre vectores normalizados)."""
+
+    def __init__(self, dim: int, capacity: int = 1024):
+        self.dim = dim
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._size = 0
+        self.ids: List[str] = []
+        self.meta: List[Dict] = []
+        self._rows: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, ids: List[str], vectors: np.ndarray, metas: List[Dict]):
+        """Añade (o reemplaza por id) vectores. La matriz crece duplicando su capacidad."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        for item_id, vector, meta in zip(ids, vectors, metas):
+            row = self._rows.get(item_id)
+            if row is None:
+                if self._size == len(self._vectors):
+                    grown = np.zeros((max(len(self._vectors) * 2, 1), self.dim), dtype=np.float32)
+                    grown[:self._size] = self._vectors[:self._size]
+                    self._vectors = grown
+                row = self._size
+                self._size += 1
+                self.ids.append(item_id)
+                self.meta.append(meta)
+                self._rows[item_id] = row
+            else:
+                self.meta[row] = meta
+            self._vectors[row] = vector
+
+    def search(self, vector: np.ndarray, k: int) -> List[tuple]:
+        """Los k más similares: [(posición, similitud)]."""
+        if self._size == 0:
+            return []
+        scores = self._vectors[:self._size] @ np.asarray(vector, dtype=np.float32)
+        k = min(k, self._size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def vectors(self) -> np.ndarray:
+        return self._vectors[:self._size]
+
+
+class HnswIndex(VectorIndex):
+    """Índice aproximado HNSW (hnswlib) con los mismos metadatos que VectorIndex."""
+
+    def __init__(self, dim: int, capacity: int = 1024):
+        try:
+            import hnswlib
+        except ImportError:
+            raise ImportError("SIMILARITY_BACKEND=hnsw requiere el paquete 'hnswlib' (pip install hnswlib)")
+        super().__init__(dim, capacity)
+        self._hnsw = hnswlib.Index(space="ip", dim=dim)
+        self._hnsw.init_index(max_elements=capacity, ef_construction=200, M=16, allow_replace_deleted=True)
+        self._hnsw.set_ef(64)
+
+    def add(self, ids: List[str], vectors: np.ndarray, metas: List[Dict]):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        super().add(ids, vectors, metas)
+        if self._size > self._hnsw.get_max_elements():
+            self._hnsw.resize_index(max(self._size, self._hnsw.get_max_elements() * 2))
+        rows = [self._rows[item_id] for item_id in ids]
+        # Reemplazar una etiqueta existente la actualiza en el grafo
+        self._hnsw.add_items(vectors, rows)
+
+    def search(self, vector: np.ndarray, k: int) -> List[tuple]:
+        if self._size == 0:
+            return []
+        labels, distances = self._hnsw.knn_query(np.asarray(vector, dtype=np.float32), k=min(k, self._size))
+        # En espacio 'ip' la distancia es 1 - producto escalar
+        return [(int(label), float(1.0 - dist)) for label, dist in zip(labels[0], distances[0])]
+
+
+def create_index(dim: Optional[int] = None, backend: Optional[str] = None) -> VectorIndex:
+    """Índice vacío del backend configurado."""
+    dim = dim or SIMILARITY_CONFIG["text_dim"] + SIMILARITY_CONFIG["key_dim"]
+    backend = backend or SIMILARITY_CONFIG["backend"]
+    return HnswIndex(dim) if backend == "hnsw" else VectorIndex(dim)
+
+
+def save_index(index: VectorIndex, path: str, watermark: Optional[str] = None):
+    """Guarda el índice en disco (vectores .npy + metadatos .json)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    np.save(f"{path}.npy", index.vectors())
+    with open(f"{path}.json", "w", encoding="utf-8") as f:
+        json.dump({"ids": index.ids, "meta": index.meta, "watermark": watermark,
+                   "embeddings": SIMILARITY_CONFIG["embeddings"]}, f, ensure_ascii=False, default=str)
+
+
+def load_index(path: str, backend: Optional[str] = None) -> tuple[Optional[VectorIndex], Optional[str]]:
+    """Carga un índice guardado con save_index. Devuelve (índice, watermark)."""
+    if not (os.path.exists(f"{path}.npy") and os.path.exists(f"{path}.json")):
+        return None, None
+    with open(f"{path}.json", "r", encoding="utf-8") as f:
+        doc = json.load(f)
+    if doc.get("embeddings") != SIMILARITY_CONFIG["embeddings"]:
+        # Otro espacio de embeddings: hay que reconstruir
+        return None, None
+    vectors = np.load(f"{path}.npy")
+    index = create_index(vectors.shape[1], backend)
+    index.add(doc["ids"], vectors, doc["meta"])
+    return index, doc.get("watermark")
+
+
+# --- Índice del proceso ---
+
+_STATE = {"index": None, "watermark": None, "refreshed_at": 0.0}
+_LOCK = threading.Lock()
+
+
+def _normalize_records(df: pd.DataFrame) -> List[Dict]:
+    """Filas de INCIDENCIAS_PEDIDOS con columnas en minúsculas."""
+    df = df.rename(columns={c: c.lower() for c in df.columns})
+    return df.to_dict(orient="records")
+
+
+def _record_meta(record: Dict) -> Dict:
+    return {col: (str(record.get(col)) if record.get(col) is not None else None)
+            for col in RESULT_COLUMNS if col not in ("id", "score")}
+
+
+def _fetch_new_incidents(session, watermark: Optional[str]) -> pd.DataFrame:
+    """Incidencias guardadas después del watermark (con su embedding si es Cortex)."""
+    columns = SIMILARITY_CONFIG["columns"]
+    select = "*"
+    if SIMILARITY_CONFIG["embeddings"] == "cortex":
+        select = (f"*, SNOWFLAKE.CORTEX.EMBED_TEXT_768('{SIMILARITY_CONFIG['embed_model']}', "
+                  f"{columns['descripcion']}) AS EMB")
+    query = f"SELECT {select} FROM {SIMILARITY_CONFIG['table']}"
+    if watermark:
+        query += f" WHERE {columns['watermark']} > '{watermark}'"
+    return run_statement(session, query, stage="similarity")
+
+
+def _incident_vectors(records: List[Dict], session=None) -> tuple[List[str], List[np.ndarray], List[Dict]]:
+    """Ids, vectores y metadatos de unas incidencias (sin tocar el índice)."""
+    ids, vectors, metas = [], [], []
+    for record in records:
+        if record.get("emb") is not None:
+            text_vector = _parse_vector(record["emb"])
+            text_vector = text_vector / (np.linalg.norm(text_vector) or 1.0)
+        else:
+            text_vector = embed_description(record.get("descripcion"), session)
+        ids.append(str(record.get("id")))
+        vectors.append(combine_embedding(text_vector, record))
+        metas.append(_record_meta(record))
+    return ids, vectors, metas
+
+
+def add_incidents(index: VectorIndex, records: List[Dict], session=None):
+    """Añade incidencias al índice (alta incremental). El llamador debe tener _LOCK."""
+    ids, vectors, metas = _incident_vectors(records, session)
+    if ids:
+        index.add(ids, np.vstack(vectors), metas)
+
+
+def refresh_similarity_index(session) -> VectorIndex:
+    """Carga el índice (de disco o de la tabla) y añade las incidencias nuevas."""
+    with _LOCK:
+        if _STATE["index"] is None:
+            index, watermark = (None, None)
+            if SIMILARITY_CONFIG["index_path"]:
+                index, watermark = load_index(SIMILARITY_CONFIG["index_path"])
+            _STATE["index"] = index or create_index()
+            _STATE["watermark"] = watermark
+        index, watermark = _STATE["index"], _STATE["watermark"]
+        if time.time() - _STATE["refreshed_at"] < SIMILARITY_CONFIG["refresh_seconds"]:
+            return index
+
+        start = time.perf_counter()
+        # Si la consulta falla no se reintenta hasta el siguiente intervalo
+        _STATE["refreshed_at"] = time.time()
+        df = _fetch_new_incidents(session, watermark)
+        records = _normalize_records(df)
+        add_incidents(index, records, session)
+        marks = [str(r["hora_finalizacion"]) for r in records if r.get("hora_finalizacion") is not None]
+        _STATE["watermark"] = max(marks + ([watermark] if watermark else [])) if marks else watermark
+        if SIMILARITY_CONFIG["index_path"] and records:
+            save_index(index, SIMILARITY_CONFIG["index_path"], _STATE["watermark"])
+        print(f"🗂️ Índice de similitud: +{len(records)} incidencias ({len(index)} en total, "
+              f"{time.perf_counter() - start:.2f}s)")
+        return index
+
+
+def index_incident(incidencia_data: Dict, tipo_pedido: Optional[str] = None, session=None):
+    """Añade una incidencia recién guardada al índice del proceso (si ya está cargado)."""
+    with _LOCK:
+        index = _STATE["index"]
+    if index is None:
+        return
+    record = {**incidencia_data, "tipo_pedido": tipo_pedido or incidencia_data.get("tipo_pedido")}
+    try:
+        # El embedding (posible llamada a Cortex) se calcula fuera del lock
+        ids, vectors, metas = _incident_vectors([record], session)
+        with _LOCK:
+            index.add(ids, np.vstack(vectors), metas)
+    except Exception as e:
+        # Se recogerá en el siguiente refresco incremental
+        print(f"⚠️ No se pudo indexar la incidencia {incidencia_data.get('id')}: {str(e)}")
+
+
+def search_similar(index: VectorIndex, incidencia_data: Dict, tipo_pedido: Optional[str] = None,
+                   k: Optional[int] = None, session=None) -> pd.DataFrame:
+    """
+    Incidencias del índice más parecidas a una incidencia.
+
+    Returns:
+        DataFrame con RESULT_COLUMNS, ordenado por similitud (excluye la propia incidencia)
+    """
+    k = k or SIMILARITY_CONFIG["top_k"]
+    record = {**incidencia_data, "tipo_pedido": tipo_pedido}
+    vector = combine_embedding(embed_description(incidencia_data.get("descripcion"), session), record)
+    rows = []
+    # Las altas de otras sesiones hacen crecer los arrays del índice: se lee bajo el lock
+    with _LOCK:
+        for position, score in index.search(vector, k + 1):
+            if index.ids[position] == str(incidencia_data.get("id")):
+                continue
+            rows.append({"id": index.ids[position], "score": round(score, 3), **index.meta[position]})
+    return pd.DataFrame(rows[:k], columns=RESULT_COLUMNS)
+
+
+def find_similar_incidents(incidencia_data: Dict, tipo_pedido: Optional[str] = None,
+                           session=None) -> tuple[Optional[pd.DataFrame], Optional[str]]:
+    """
+    Casos similares de INCIDENCIAS_PEDIDOS para el historial de la incidencia.
+
+    Returns:
+        (DataFrame con los casos similares, mensaje de error si lo hay)
+    """
+    if not SIMILARITY_CONFIG["enabled"]:
+        return None, None
+    try:
+        index = refresh_similarity_index(session)
+        return search_similar(index, incidencia_data, tipo_pedido, session=session), None
+    except Exception as e:
+        return None, f"Error buscando incidencias similares: {str(e)}"
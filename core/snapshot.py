@@ -0,0 +1,300 @@
+"""
+Módulo de snapshot local de las vistas de diagnóstico
+Mantiene una copia local (Parquet) de las vistas, indexada por las columnas de
+búsqueda, para servir las consultas por pedido sin ir al warehouse. Una clave solo
+se sirve en local si se trajeron todas sus filas; si no, se va a la vista en vivo
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+import pandas as pd
+from .execution import run_statement
+from .guardrails import apply_row_limit, cap_result, quote_literal
+
+
+# Configuración del snapshot por vista
+# - watermark: columna monótona para refresco incremental (None = refresco completo)
+# - window_days: ventana de actividad reciente; se guardan enteras (todas sus filas)
+#   las claves de búsqueda con alguna fila en la ventana
+# Sin watermark la vista se trae entera en cada refresco, así que max_rows y
+# max_bytes acotan siempre lo que se trae y lo que se guarda en memoria.
+# El incremental no ve las filas borradas en origen: cada full_refresh_seconds
+# se rehace el snapshot completo
+SNAPSHOT_CONFIG = {
+    "enabled": os.environ.get("SNAPSHOT_ENABLED", "false").lower() in ("1", "true", "yes"),
+    "dir": os.environ.get("SNAPSHOT_DIR", ".snapshots"),
+    "max_age_seconds": int(os.environ.get("SNAPSHOT_MAX_AGE_SECONDS", "900")),
+    "refresh_interval_seconds": int(os.environ.get("SNAPSHOT_REFRESH_SECONDS", "300")),
+    "max_rows": int(os.environ.get("SNAPSHOT_MAX_ROWS", "200000")),
+    "max_bytes": int(float(os.environ.get("SNAPSHOT_MAX_MB", "200")) * 1024 * 1024),
+    "full_refresh_seconds": int(os.environ.get("SNAPSHOT_FULL_REFRESH_SECONDS", "86400")),
+    "vistas": {
+        "diagnostico_paso1": {
+            "watermark": None,
+            "window_days": None,
+        },
+        "diagnostico_paso2": {
+            "watermark": "FECHA_ULT_REVISION",
+            "window_days": 90,
+        },
+    },
+}
+
+# Estado en memoria de cada snapshot: DataFrame, índice de búsqueda y metadatos
+_SNAPSHOTS: Dict[str, Dict] = {}
+_LOCK = threading.Lock()
+_REFRESHER = {"thread": None, "session": None}
+
+
+def _normalize_key(value) -> str:
+    """Normaliza un valor de búsqueda (los del formulario llegan como texto)."""
+    return str(value).strip()
+
+
+def _snapshot_paths(vista_key: str) -> tuple[str, str]:
+    base = os.path.join(SNAPSHOT_CONFIG["dir"], vista_key)
+    return f"{base}.parquet", f"{base}.json"
+
+
+def _lookup_columns(vista_key: str) -> list:
+    """Columnas de búsqueda: las mismas que usa build_query en el WHERE."""
+    from .queries import VISTA_CONFIG
+    return list(VISTA_CONFIG[vista_key]["params"].keys())
+
+
+def _row_keys(df: pd.DataFrame, lookup_columns: list) -> pd.Series:
+    """Clave de búsqueda normalizada de cada fila (la misma tupla que usa el índice)."""
+    if df.empty or not all(col in df.columns for col in lookup_columns):
+        return pd.Series([()] * len(df), index=df.index, dtype=object)
+    keys = df[lookup_columns].astype(str).apply(lambda col: col.str.strip())
+    return pd.Series(list(zip(*(keys[col] for col in lookup_columns))), index=df.index, dtype=object)
+
+
+def _build_index(df: pd.DataFrame, lookup_columns: list) -> Dict:
+    """Índice hash {tupla de claves normalizadas: posiciones de fila}."""
+    if df.empty or not all(col in df.columns for col in lookup_columns):
+        return {}
+    keys = df[lookup_columns].astype(str).apply(lambda col: col.str.strip())
+    groups = keys.groupby(lookup_columns, sort=False).indices
+    # Con una sola columna pandas devuelve claves escalares
+    if len(lookup_columns) == 1:
+        return {(k,): v for k, v in groups.items()}
+    return dict(groups)
+
+
+def _install(vista_key: str, df: pd.DataFrame, meta: Dict):
+    """Publica un snapshot en memoria (reemplazo atómico bajo lock)."""
+    df = df.reset_index(drop=True)
+    entry = {
+        "data": df,
+        "index": _build_index(df, _lookup_columns(vista_key)),
+        "watermark": meta.get("watermark"),
+        "refreshed_at": meta.get("refreshed_at", 0.0),
+        "full_refreshed_at": meta.get("full_refreshed_at", 0.0),
+        # Claves de las que puede faltar alguna fila: se buscan en vivo
+        "incomplete": {tuple(k) for k in meta.get("incomplete", [])},
+    }
+    with _LOCK:
+        _SNAPSHOTS[vista_key] = entry
+
+
+def load_snapshot(vista_key: str) -> bool:
+    """Carga desde disco un snapshot guardado previamente. Devuelve True si existía."""
+    data_path, meta_path = _snapshot_paths(vista_key)
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return False
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    _install(vista_key, pd.read_parquet(data_path), meta)
+    return True
+
+
+def refresh_snapshot(session, vista_key: str, full: bool = False) -> int:
+    """
+    Refresca el snapshot de una vista (incremental si tiene columna watermark).
+
+    Se traen siempre claves de búsqueda enteras: el incremental pide todas las
+    filas de las claves con alguna fila nueva y las sustituye (así también
+    desaparecen sus líneas borradas). Si el resultado se recorta, las claves
+    que pueden haber quedado a medias se marcan como incompletas.
+
+    Args:
+        session: Sesión de Snowpark (o cualquier objeto con .sql(q).to_pandas())
+        vista_key: Clave de la vista en VISTA_CONFIG / SNAPSHOT_CONFIG
+        full: True para rehacer el snapshot aunque no toque (ver full_refresh_seconds)
+
+    Returns:
+        Número de filas traídas del warehouse
+    """
+    from .queries import VISTA_CONFIG
+
+    config = SNAPSHOT_CONFIG["vistas"][vista_key]
+    vista_name = VISTA_CONFIG[vista_key]["name"]
+    watermark_col = config["watermark"]
+    window_days = config["window_days"]
+    lookup_columns = _lookup_columns(vista_key)
+    columns = ", ".join(lookup_columns)
+
+    with _LOCK:
+        current = _SNAPSHOTS.get(vista_key)
+    full = full or current is None or \
+        time.time() - current["full_refreshed_at"] >= SNAPSHOT_CONFIG["full_refresh_seconds"]
+    watermark = current["watermark"] if current and watermark_col and not full else None
+    incremental = watermark is not None
+
+    if incremental:
+        # >= para no perder filas con la misma marca que la última traída
+        activity = f"{watermark_col} >= {quote_literal(watermark)}"
+    elif watermark_col and window_days:
+        activity = f"{watermark_col} >= DATEADD(day, -{int(window_days)}, CURRENT_DATE())"
+    else:
+        activity = None
+    query = f"SELECT * FROM {vista_name}"
+    if activity:
+        # Todas las filas de las claves con actividad, no solo las filas recientes
+        query += f" WHERE ({columns}) IN (SELECT {columns} FROM {vista_name} WHERE {activity})"
+    # Incremental por marca: con el recorte, el siguiente continúa desde la última
+    # traída. Completo por clave: con el recorte solo la última queda a medias
+    query += f" ORDER BY {watermark_col if incremental else columns}"
+    max_rows = SNAPSHOT_CONFIG["max_rows"]
+    query = apply_row_limit(query, max_rows)
+
+    print(f"🗂️ Refrescando snapshot {vista_key}{' (completo)' if not incremental else ''}: {query}")
+    new_rows = cap_result(run_statement(session, query, stage="snapshot", vista=vista_key),
+                          max_rows, SNAPSHOT_CONFIG["max_bytes"])
+    truncated = bool(new_rows.attrs.get("truncated"))
+    fetched = set(_row_keys(new_rows, lookup_columns))
+
+    if incremental:
+        kept = current["data"][~_row_keys(current["data"], lookup_columns).isin(fetched)]
+        merged = pd.concat([kept, new_rows], ignore_index=True)
+        # Recortado por marca: de cualquier clave traída pueden faltar filas posteriores
+        incomplete = (current["incomplete"] - fetched) | (fetched if truncated else set())
+    else:
+        merged = new_rows.reset_index(drop=True)
+        incomplete = {_row_keys(merged, lookup_columns).iloc[-1]} if truncated and len(merged) else set()
+
+    if watermark_col and watermark_col in merged.columns and not merged.empty:
+        marks = pd.to_datetime(merged[watermark_col], errors="coerce")
+        codes = pd.Series(pd.factorize(_row_keys(merged, lookup_columns))[0], index=merged.index)
+        # Marca de cada clave: la más reciente de sus filas (las claves se conservan o se descartan enteras)
+        key_marks = marks.groupby(codes).transform("max")
+        keep = pd.Series(True, index=merged.index)
+        if window_days:
+            cutoff = pd.Timestamp(datetime.now() - timedelta(days=int(window_days)))
+            keep &= key_marks.isna() | (key_marks >= cutoff)
+        if keep.sum() > max_rows:
+            # Se conservan las claves más recientes hasta max_rows filas, sin partir ninguna
+            ranked = pd.DataFrame({"mark": key_marks, "code": codes})[keep].sort_values(
+                ["mark", "code"], na_position="first")
+            dropped = set(ranked["code"].iloc[:-max_rows])
+            keep &= ~codes.isin(dropped)
+            truncated = True
+        merged, marks = merged[keep], marks[keep]
+        latest = marks.max()
+        new_watermark = str(latest) if pd.notna(latest) else watermark
+    else:
+        new_watermark = None
+
+    now = time.time()
+    meta = {
+        "watermark": new_watermark,
+        "refreshed_at": now,
+        "full_refreshed_at": current["full_refreshed_at"] if incremental else now,
+        "truncated": truncated,
+        "incomplete": sorted(list(k) for k in incomplete),
+    }
+    os.makedirs(SNAPSHOT_CONFIG["dir"], exist_ok=True)
+    data_path, meta_path = _snapshot_paths(vista_key)
+    merged.reset_index(drop=True).to_parquet(data_path, index=False)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    _install(vista_key, merged, meta)
+    return len(new_rows)
+
+
+def snapshot_enabled_for(vista_key: str) -> bool:
+    """True si la vista se sirve desde snapshot local."""
+    return SNAPSHOT_CONFIG["enabled"] and vista_key in SNAPSHOT_CONFIG["vistas"]
+
+
+def lookup_snapshot(vista_key: str, incidencia_data: Dict,
+                    max_age_seconds: Optional[int] = None) -> Optional[pd.DataFrame]:
+    """
+    Busca en el snapshot local las filas de una incidencia.
+
+    Returns:
+        DataFrame con las filas encontradas, o None si hay que ir a la vista en vivo
+        (snapshot desactivado, inexistente, caducado, sin clave, sin coincidencias
+        o con la clave incompleta)
+    """
+    if not snapshot_enabled_for(vista_key):
+        return None
+
+    from .queries import VISTA_CONFIG
+    max_age = SNAPSHOT_CONFIG["max_age_seconds"] if max_age_seconds is None else max_age_seconds
+
+    with _LOCK:
+        entry = _SNAPSHOTS.get(vista_key)
+    if entry is None or time.time() - entry["refreshed_at"] > max_age:
+        return None
+
+    param_mapping = VISTA_CONFIG[vista_key]["params"]
+    if not all(data_key in incidencia_data for data_key in param_mapping.values()):
+        return None
+
+    key = tuple(_normalize_key(incidencia_data[data_key]) for data_key in param_mapping.values())
+    positions = entry["index"].get(key)
+    if positions is None or key in entry["incomplete"]:
+        # Fuera de la ventana local o a medias: no se puede afirmar nada
+        return None
+    return entry["data"].iloc[positions].reset_index(drop=True)
+
+
+def _refresh_session():
+    """
+    Sesión del refresco periódico: la de servicio (el snapshot se comparte entre
+    todos los usuarios del proceso) o, sin credenciales de servicio, la última
+    sesión de usuario registrada.
+    """
+    # Import diferido: auth importa este módulo
+    from .auth import get_service_session
+    return get_service_session() or _REFRESHER["session"]
+
+
+def register_snapshot_session(session):
+    """Arranca el refresco periódico si está activo (la sesión solo se usa sin sesión de servicio)."""
+    if not SNAPSHOT_CONFIG["enabled"]:
+        return
+    _REFRESHER["session"] = session
+    if _REFRESHER["thread"] is not None and _REFRESHER["thread"].is_alive():
+        return
+
+    for vista_key in SNAPSHOT_CONFIG["vistas"]:
+        load_snapshot(vista_key)
+
+    def _loop():
+        while True:
+            session_actual = _refresh_session()
+            if session_actual is not None:
+                for vista_key in SNAPSHOT_CONFIG["vistas"]:
+                    try:
+                        refresh_snapshot(session_actual, vista_key)
+                    except Exception as e:
+                        print(f"⚠️ Error refrescando snapshot {vista_key}: {str(e)}")
+            time.sleep(SNAPSHOT_CONFIG["refresh_interval_seconds"])
+
+    thread = threading.Thread(target=_loop, name="snapshot-refresher", daemon=True)
+    _REFRESHER["thread"] = thread
+    thread.start()
+
+
+def unregister_snapshot_session(session):
+    """Deja de usar una sesión (p.ej. al cerrar sesión) para el refresco periódico."""
+    if _REFRESHER["session"] is session:
+        _REFRESHER["session"] = None
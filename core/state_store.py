@@ -0,0 +1,378 @@
+"""
+Módulo de almacenamiento externo del estado de sesión
+Guarda la incidencia y la conversación fuera del proceso (SQLite o Redis)
+para que cualquier réplica pueda retomar la sesión de un usuario:
+- Documento de sesión compacto (JSON + zlib) con referencias a DataFrames
+- DataFrames en Arrow IPC, direccionados por contenido (se escriben una vez)
+- Carga perezosa de DataFrames al mostrarlos y escritura agrupada en segundo plano
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Dict, Optional
+import pandas as pd
+import pyarrow as pa
+import streamlit as st
+
+
+STATE_CONFIG = {
+    # sqlite:///ruta/estado.db | redis://host:6379/0 | vacío = desactivado
+    "backend": os.environ.get("STATE_BACKEND", ""),
+    "flush_seconds": float(os.environ.get("STATE_FLUSH_SECONDS", "0.5")),
+    "ttl_seconds": int(os.environ.get("STATE_TTL_SECONDS", str(7 * 24 * 3600))),
+    # Cada cuánto se borran del SQLite las claves caducadas
+    "purge_interval_seconds": int(os.environ.get("STATE_PURGE_SECONDS", "3600")),
+    # DataFrames que el proceso recuerda como ya escritos (LRU)
+    "written_frames_max": int(os.environ.get("STATE_WRITTEN_FRAMES_MAX", "10000")),
+}
+
+# Claves de st.session_state que se persisten
+PERSISTED_KEYS = ["incidencia_data", "messages", "cortex_model"]
+
+
+class FrameExpired(Exception):
+    """El DataFrame referenciado por el estado ya no está en el backend (caducado o borrado)."""
+
+
+class SQLiteStateBackend:
+    """Backend en un fichero SQLite (compartido por réplicas en el mismo volumen)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value BLOB, updated_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS state_updated_at ON state (updated_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._conn().execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_many(self, items: Dict[str, bytes]):
+        now = time.time()
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO state (key, value, updated_at) VALUES (?, ?, ?)",
+                [(k, v, now) for k, v in items.items()]
+            )
+
+    def touch(self, keys):
+        """Renueva las claves (sus DataFrames siguen vivos mientras se guarde el documento)."""
+        now = time.time()
+        with self._conn() as conn:
+            conn.executemany("UPDATE state SET updated_at = ? WHERE key = ?", [(now, k) for k in keys])
+
+    def purge(self, ttl_seconds: int) -> int:
+        """Borra las claves no renovadas en ttl_seconds. Devuelve cuántas se han borrado."""
+        with self._conn() as conn:
+            cursor = conn.execute("DELETE FROM state WHERE updated_at < ?", (time.time() - ttl_seconds,))
+        return cursor.rowcount
+
+
+class RedisStateBackend:
+    """Backend Redis (o cualquier servidor compatible con el protocolo)."""
+
+    def __init__(self, url: str, ttl_seconds: int):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("STATE_BACKEND=redis:// requiere el paquete 'redis' (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl_seconds
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set_many(self, items: Dict[str, bytes]):
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in items.items():
+            pipe.set(key, value, ex=self.ttl)
+        pipe.execute()
+
+    def touch(self, keys):
+        """Renueva el TTL de las claves (los DataFrames caducan con su documento)."""
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def purge(self, ttl_seconds: int) -> int:
+        # Redis borra las claves caducadas por sí solo
+        return 0
+
+
+_BACKEND = {"instance": None, "loaded": False}
+_PENDING: Dict[str, bytes] = {}
+_TOUCH: set = set()
+_PENDING_LOCK = threading.Lock()
+# ref -> instante de escritura; acotado y renovado antes de que caduque en el backend
+_WRITTEN_FRAMES: "OrderedDict[str, float]" = OrderedDict()
+_WRITER = {"thread": None, "purged_at": 0.0}
+
+
+def get_state_backend():
+    """Backend configurado en STATE_BACKEND, o None si está desactivado."""
+    if not _BACKEND["loaded"]:
+        url = STATE_CONFIG["backend"]
+        if url.startswith("sqlite:///"):
+            _BACKEND["instance"] = SQLiteStateBackend(url[len("sqlite:///"):])
+        elif url.startswith(("redis://", "rediss://")):
+            _BACKEND["instance"] = RedisStateBackend(url, STATE_CONFIG["ttl_seconds"])
+        _BACKEND["loaded"] = True
+    return _BACKEND["instance"]
+
+
+# --- Serialización ---
+
+def dataframe_to_arrow(df: pd.DataFrame) -> bytes:
+    """Serializa un DataFrame en formato Arrow IPC (stream)."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def arrow_to_dataframe(payload: bytes) -> pd.DataFrame:
+    return pa.ipc.open_stream(payload).read_all().to_pandas()
+
+
+def _frame_ref(df: pd.DataFrame, frames: Dict[str, bytes], memo: Dict[int, tuple]) -> str:
+    """
+    Referencia por contenido de un DataFrame.
+
+    `memo` ({id(df): (df, ref)}) evita re-serializar en cada rerun los DataFrames
+    ya vistos; guarda el DataFrame para que su id no se reutilice.
+    """
+    cached = memo.get(id(df))
+    if cached is not None and cached[0] is df:
+        return cached[1]
+    payload = dataframe_to_arrow(df)
+    ref = "df:" + hashlib.sha1(payload).hexdigest()
+    frames[ref] = payload
+    memo[id(df)] = (df, ref)
+    return ref
+
+
+def encode_state(value, frames: Dict[str, bytes], memo: Dict[int, tuple]):
+    """Convierte el estado a JSON; los DataFrames se sustituyen por referencias."""
+    if isinstance(value, pd.DataFrame):
+        return {"__frame__": _frame_ref(value, frames, memo)}
+    if isinstance(value, LazyFrame):
+        return {"__frame__": value.ref}
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, dict):
+        return {k: encode_state(v, frames, memo) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_state(v, frames, memo) for v in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def decode_state(value):
+    """Inverso de encode_state. Los DataFrames quedan como LazyFrame hasta que se usan."""
+    if isinstance(value, dict):
+        if "__frame__" in value:
+            return LazyFrame(value["__frame__"])
+        if "__datetime__" in value:
+            return datetime.fromisoformat(value["__datetime__"])
+        if "__date__" in value:
+            return date.fromisoformat(value["__date__"])
+        return {k: decode_state(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [decode_state(v) for v in value]
+    return value
+
+
+def frame_refs(doc) -> set:
+    """Referencias a DataFrames de un documento ya codificado."""
+    if isinstance(doc, dict):
+        if "__frame__" in doc:
+            return {doc["__frame__"]}
+        return set().union(*(frame_refs(v) for v in doc.values())) if doc else set()
+    if isinstance(doc, list):
+        return set().union(*(frame_refs(v) for v in doc)) if doc else set()
+    return set()
+
+
+class LazyFrame:
+    """Referencia a un DataFrame guardado; se carga del backend al primer uso."""
+
+    def __init__(self, ref: str):
+        self.ref = ref
+        self._df = None
+
+    def load(self) -> pd.DataFrame:
+        """
+        Raises:
+            FrameExpired: si el DataFrame ya no está en el backend
+        """
+        if self._df is None:
+            backend = get_state_backend()
+            payload = backend.get(self.ref) if backend else None
+            if not payload:
+                raise FrameExpired(f"Los datos guardados ({self.ref}) ya no están disponibles")
+            self._df = arrow_to_dataframe(payload)
+        return self._df
+
+
+def resolve_frame(value):
+    """Devuelve un DataFrame tanto si `value` ya lo es como si es un LazyFrame."""
+    return value.load() if isinstance(value, LazyFrame) else value
+
+
+# --- Escritura agrupada ---
+
+def _writer_loop():
+    while True:
+        time.sleep(STATE_CONFIG["flush_seconds"])
+        flush_pending()
+        if time.time() - _WRITER["purged_at"] > STATE_CONFIG["purge_interval_seconds"]:
+            purge_expired()
+
+
+def flush_pending():
+    """Escribe de una vez las claves pendientes (la última versión de cada una)."""
+    with _PENDING_LOCK:
+        if not _PENDING and not _TOUCH:
+            return
+        items = dict(_PENDING)
+        touch = _TOUCH - set(items)
+        _PENDING.clear()
+        _TOUCH.clear()
+    backend = get_state_backend()
+    try:
+        if items:
+            backend.set_many(items)
+        if touch:
+            backend.touch(touch)
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar el estado: {str(e)}")
+        with _PENDING_LOCK:
+            for key, value in items.items():
+                _PENDING.setdefault(key, value)
+            _TOUCH.update(touch)
+
+
+def purge_expired():
+    """Borra del backend las claves caducadas (solo hace falta en SQLite)."""
+    _WRITER["purged_at"] = time.time()
+    try:
+        removed = get_state_backend().purge(STATE_CONFIG["ttl_seconds"])
+    except Exception as e:
+        print(f"⚠️ No se pudo limpiar el estado caducado: {str(e)}")
+        return
+    if removed:
+        print(f"🧹 Estado: {removed} claves caducadas borradas")
+
+
+def _frame_written(ref: str) -> bool:
+    """True si el proceso escribió el DataFrame hace menos de la mitad del TTL."""
+    written_at = _WRITTEN_FRAMES.get(ref)
+    if written_at is None or time.time() - written_at > STATE_CONFIG["ttl_seconds"] / 2:
+        return False
+    _WRITTEN_FRAMES.move_to_end(ref)
+    return True
+
+
+def _mark_written(ref: str):
+    _WRITTEN_FRAMES[ref] = time.time()
+    _WRITTEN_FRAMES.move_to_end(ref)
+    while len(_WRITTEN_FRAMES) > STATE_CONFIG["written_frames_max"]:
+        _WRITTEN_FRAMES.popitem(last=False)
+
+
+def _enqueue(items: Dict[str, bytes], touch=()):
+    with _PENDING_LOCK:
+        _PENDING.update(items)
+        _TOUCH.update(touch)
+    if _WRITER["thread"] is None:
+        _WRITER["thread"] = threading.Thread(target=_writer_loop, name="state-writer", daemon=True)
+        _WRITER["thread"].start()
+
+
+# --- Integración con Streamlit ---
+
+def get_state_id() -> str:
+    """Identificador de sesión estable entre réplicas (parámetro ?sid= de la URL)."""
+    sid = st.query_params.get("sid")
+    if not sid:
+        sid = uuid.uuid4().hex
+        st.query_params["sid"] = sid
+    return sid
+
+
+def persist_session_state():
+    """Encola el estado actual si ha cambiado desde la última escritura."""
+    if get_state_backend() is None or "user_email" not in st.session_state:
+        return
+    frames = {}
+    memo = st.session_state.setdefault("_state_frame_refs", {})
+    doc = {key: encode_state(st.session_state.get(key), frames, memo) for key in PERSISTED_KEYS}
+    doc["owner"] = st.session_state.user_email
+    payload = zlib.compress(json.dumps(doc, separators=(",", ":")).encode("utf-8"))
+
+    digest = hashlib.sha1(payload).hexdigest()
+    if st.session_state.get("_state_digest") == digest:
+        return
+    st.session_state._state_digest = digest
+
+    items = {f"state:{get_state_id()}": payload}
+    # Los DataFrames nuevos se escriben una sola vez (la clave es su contenido);
+    # los ya escritos se renuevan para que no caduquen antes que el documento
+    touch = set()
+    with _PENDING_LOCK:
+        for ref in frame_refs(doc):
+            if ref in frames and not _frame_written(ref):
+                items[ref] = frames[ref]
+                _mark_written(ref)
+            else:
+                touch.add(ref)
+    _enqueue(items, touch)
+
+
+def restore_session_state() -> bool:
+    """
+    Recupera el estado guardado de esta sesión (una vez, tras el login).
+
+    Solo se restaura si el documento pertenece al usuario conectado.
+    """
+    if st.session_state.get("_state_restored"):
+        return False
+    st.session_state._state_restored = True
+    backend = get_state_backend()
+    if backend is None or "user_email" not in st.session_state:
+        return False
+
+    payload = backend.get(f"state:{get_state_id()}")
+    if not payload:
+        return False
+    doc = decode_state(json.loads(zlib.decompress(payload)))
+    if doc.get("owner") != st.session_state.user_email:
+        return False
+    for key in PERSISTED_KEYS:
+        if doc.get(key) is not None:
+            st.session_state[key] = doc[key]
+    return True
@@ -0,0 +1,294 @@
+"""
+Módulo de autocompletado de claves del formulario
+Carga una vez (y refresca en segundo plano) los valores válidos de UNECO,
+almacén, pedido host y referencia en arrays ordenados de NumPy para sugerir
+por prefijo y validar el formulario antes de lanzar las vistas y el LLM.
+Los dominios son por rol (cada rol ve sus filas) o, con TYPEAHEAD_SESSION=service,
+uno por proceso cargado con la sesión de servicio
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+import numpy as np
+import streamlit as st
+from .auth import get_service_session
+from .execution import run_statement
+from .guardrails import quote_literal
+from .queries import VISTA_CONFIG
+from .scheduler import scheduled, priority_context, PRIORITY_BATCH
+
+
+TYPEAHEAD_CONFIG = {
+    "enabled": os.environ.get("TYPEAHEAD_ENABLED", "true").lower() in ("1", "true", "yes"),
+    "refresh_seconds": int(os.environ.get("TYPEAHEAD_REFRESH_SECONDS", "3600")),
+    # Máximo de claves y de memoria por campo; por encima el dominio queda parcial
+    "max_keys": int(os.environ.get("TYPEAHEAD_MAX_KEYS", "2000000")),
+    "max_bytes": int(float(os.environ.get("TYPEAHEAD_MAX_MB", "64")) * 1024 * 1024),
+    "max_suggestions": 8,
+    # user: dominios por rol, cargados con la sesión del primer usuario de ese rol;
+    # service: un dominio por proceso cargado con la sesión de servicio (solo si su
+    # rol ve las mismas filas que los usuarios; sin credenciales se vuelve a user)
+    "session": os.environ.get("TYPEAHEAD_SESSION", "user").lower(),
+}
+
+# Campo del formulario -> (vista, columna) de la que sale su dominio de valores
+TYPEAHEAD_FIELDS = {
+    "uneco": ("diagnostico_paso1", "CO_UNECO"),
+    "almacen": ("diagnostico_paso1", "CO_CENTRO_LOGISTICO"),
+    "pedido_host": ("diagnostico_paso1", "CO_PEDIDO_HOST"),
+    "referencia": ("diagnostico_paso2", "CO_REFERENCIA"),
+}
+
+FIELD_LABELS = {"uneco": "UNECO", "almacen": "Almacén", "pedido_host": "Pedido Host", "referencia": "Referencia"}
+
+
+def normalize_key(value) -> bytes:
+    """
+    Clave normalizada (sin espacios alrededor) en UTF-8.
+
+    Se conserva la capitalización: los filtros de las vistas distinguen
+    mayúsculas, así que «abc» no es válido si la vista solo tiene «ABC».
+    """
+    return str(value).strip().encode("utf-8")
+
+
+class KeyDomain:
+    """
+    Dominio de un campo: array ordenado de bytes de ancho fijo (dtype 'S').
+
+    Una búsqueda por prefijo son dos np.searchsorted (O(log n)) y el coste en
+    memoria es n * longitud máxima, sin objetos de Python por clave.
+    """
+
+    def __init__(self, keys: List, partial: bool = False):
+        encoded = sorted({normalize_key(k) for k in keys if k is not None and str(k).strip()})
+        self.keys = np.array(encoded, dtype=bytes) if encoded else np.array([], dtype="S1")
+        # Con el dominio recortado no se puede afirmar que un valor no existe
+        self.partial = partial
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.keys.nbytes)
+
+    def _range(self, prefix: bytes) -> tuple[int, int]:
+        lo = int(np.searchsorted(self.keys, prefix, side="left"))
+        hi = int(np.searchsorted(self.keys, prefix + b"\xff", side="left"))
+        return lo, hi
+
+    def suggest(self, prefix: str, limit: int) -> List[str]:
+        """Claves que empiezan por el prefijo, en orden."""
+        # Primero con la capitalización escrita y, si no hay nada, en mayúsculas
+        for key in (normalize_key(prefix), normalize_key(prefix).upper()):
+            lo, hi = self._range(key)
+            if hi > lo:
+                return [k.decode("utf-8") for k in self.keys[lo:min(hi, lo + limit)]]
+        return []
+
+    def contains(self, value: str) -> bool:
+        key = normalize_key(value)
+        i = int(np.searchsorted(self.keys, key, side="left"))
+        return i < len(self.keys) and self.keys[i] == key
+
+    def closest(self, value: str, limit: int) -> List[str]:
+        """Sugerencias para un valor erróneo: el prefijo más largo que sí existe."""
+        key = normalize_key(value)
+        for length in range(len(key), 0, -1):
+            # El mismo valor en mayúsculas es la sugerencia más probable
+            for candidate in (key[:length], key[:length].upper()):
+                lo, hi = self._range(candidate)
+                if hi > lo:
+                    return [k.decode("utf-8") for k in self.keys[lo:min(hi, lo + limit)]]
+        return []
+
+
+# Espacio de dominios (rol o "service") -> {"domains", "loaded_at", "refreshing", "error"}
+_STATE: Dict[str, Dict] = {}
+_LOCK = threading.Lock()
+SERVICE_NAMESPACE = "service"
+
+
+def domain_namespace(session) -> str:
+    """Espacio de dominios de una sesión: su rol (o el de servicio si se comparten)."""
+    if TYPEAHEAD_CONFIG["session"] == "service" and get_service_session() is not None:
+        return SERVICE_NAMESPACE
+    try:
+        return str(session.get_current_role() or "")
+    except Exception:
+        return ""
+
+
+def _namespace_state(namespace: str) -> Dict:
+    with _LOCK:
+        return _STATE.setdefault(namespace, {"domains": {}, "loaded_at": 0.0, "refreshing": False, "error": None})
+
+
+def load_domain(session, field: str) -> KeyDomain:
+    """
+    Valores distintos de un campo (con LIMIT y tope de memoria).
+
+    Antes de traer las claves se cuenta el dominio y se mide la clave más
+    larga, así el LIMIT ya respeta TYPEAHEAD_MAX_KEYS y TYPEAHEAD_MAX_MB y
+    nunca se descargan filas que luego se descartarían.
+    """
+    vista_key, column = TYPEAHEAD_FIELDS[field]
+    vista_name = VISTA_CONFIG[vista_key]["name"]
+    stats = run_statement(
+        session,
+        f"SELECT COUNT(DISTINCT {column}) AS N, MAX(OCTET_LENGTH({column})) AS BYTES "
+        f"FROM {vista_name} WHERE {column} IS NOT NULL",
+        stage="typeahead", vista=vista_key, collect=True,
+    )[0]
+    total, width = int(stats["N"] or 0), int(stats["BYTES"] or 0)
+    limit = min(TYPEAHEAD_CONFIG["max_keys"], TYPEAHEAD_CONFIG["max_bytes"] // max(width, 1))
+    limit = max(limit, 1)
+    if total == 0:
+        return KeyDomain([])
+    query = (f"SELECT DISTINCT {column} AS CLAVE FROM {vista_name} "
+             f"WHERE {column} IS NOT NULL ORDER BY CLAVE LIMIT {limit}")
+    rows = run_statement(session, query, stage="typeahead", vista=vista_key, collect=True)
+    domain = KeyDomain([row["CLAVE"] for row in rows], partial=total > limit)
+    if domain.nbytes > TYPEAHEAD_CONFIG["max_bytes"]:
+        # Por si el dominio ha cambiado entre las dos consultas
+        keep = max(TYPEAHEAD_CONFIG["max_bytes"] // max(domain.keys.itemsize, 1), 1)
+        domain.keys = domain.keys[:keep]
+        domain.partial = True
+    return domain
+
+
+def refresh_typeahead(session, namespace: Optional[str] = None):
+    """Recarga los dominios de todos los campos de un espacio (se llama en un hilo)."""
+    namespace = domain_namespace(session) if namespace is None else namespace
+    state = _namespace_state(namespace)
+    start = time.perf_counter()
+    domains = {}
+    try:
+        with priority_context(PRIORITY_BATCH):
+            for field in TYPEAHEAD_FIELDS:
+                with scheduled("vista"):
+                    domains[field] = load_domain(session, field)
+        with _LOCK:
+            state.update(domains=domains, error=None)
+        print(f"🔤 Autocompletado cargado ({namespace or 'sin rol'}): " + ", ".join(
+            f"{field} {len(d)}{' (parcial)' if d.partial else ''}" for field, d in domains.items()
+        ) + f" ({time.perf_counter() - start:.2f}s)")
+    except Exception as e:
+        with _LOCK:
+            state["error"] = str(e)
+        print(f"⚠️ No se pudo cargar el autocompletado: {str(e)}")
+    finally:
+        with _LOCK:
+            state["refreshing"] = False
+
+
+def ensure_typeahead(session):
+    """Lanza la carga en segundo plano si no hay dominios o están caducados (no bloquea)."""
+    if not TYPEAHEAD_CONFIG["enabled"] or session is None:
+        return
+    namespace = domain_namespace(session)
+    load_session = get_service_session() if namespace == SERVICE_NAMESPACE else session
+    state = _namespace_state(namespace)
+    with _LOCK:
+        stale = time.time() - state["loaded_at"] >= TYPEAHEAD_CONFIG["refresh_seconds"]
+        if not stale or state["refreshing"]:
+            return
+        # Si la carga falla, se reintenta en el siguiente intervalo
+        state.update(refreshing=True, loaded_at=time.time())
+    threading.Thread(target=refresh_typeahead, args=(load_session, namespace),
+                     name="typeahead", daemon=True).start()
+
+
+def _current_session():
+    return st.session_state.get("snowpark_session")
+
+
+def get_domain(field: str, session=None) -> Optional[KeyDomain]:
+    """Dominio cargado de un campo para el rol de la sesión (la del usuario si no se indica)."""
+    session = session if session is not None else _current_session()
+    if session is None:
+        return None
+    state = _namespace_state(domain_namespace(session))
+    with _LOCK:
+        return state["domains"].get(field)
+
+
+def key_exists(session, field: str, value: str) -> Optional[bool]:
+    """
+    Consulta puntual de una clave en su vista (LIMIT 1).
+
+    Returns:
+        True/False, o None si la consulta falla (no se puede afirmar nada)
+    """
+    vista_key, column = TYPEAHEAD_FIELDS[field]
+    query = (f"SELECT 1 AS EXISTE FROM {VISTA_CONFIG[vista_key]['name']} "
+             f"WHERE {column} = {quote_literal(str(value).strip())} LIMIT 1")
+    try:
+        rows = run_statement(session, query, stage="typeahead_lookup", vista=vista_key, collect=True)
+    except Exception as e:
+        print(f"⚠️ No se pudo comprobar {field}: {str(e)}")
+        return None
+    return bool(rows)
+
+
+def suggest(field: str, prefix: str, limit: Optional[int] = None, session=None) -> List[str]:
+    """Sugerencias por prefijo para un campo (vacío si aún no está cargado)."""
+    domain = get_domain(field, session)
+    if domain is None or not prefix.strip():
+        return []
+    return domain.suggest(prefix, limit or TYPEAHEAD_CONFIG["max_suggestions"])
+
+
+def validate_fields(values: Dict, session=None) -> List[str]:
+    """
+    Valida los campos del formulario contra los dominios cargados.
+
+    Solo informa de valores que seguro no existen: sin dominio cargado o con
+    dominio parcial el valor se da por bueno, y un valor que no está en el
+    dominio (que puede tener hasta TYPEAHEAD_REFRESH_SECONDS) se confirma con
+    una consulta puntual en la vista antes de rechazarlo.
+
+    Returns:
+        Mensajes de error (con sugerencias), vacío si todo es válido
+    """
+    session = session if session is not None else _current_session()
+    errors = []
+    for field, value in values.items():
+        domain = get_domain(field, session)
+        if domain is None or domain.partial or not value or domain.contains(value):
+            continue
+        # Clave nueva desde la última carga (o consulta fallida): se da por buena
+        if key_exists(session, field, value) is not False:
+            continue
+        message = f"{FIELD_LABELS.get(field, field)} «{value}» no existe"
+        candidates = domain.closest(value, TYPEAHEAD_CONFIG["max_suggestions"])
+        if candidates:
+            message += f". ¿Quizá: {', '.join(candidates)}?"
+        errors.append(message)
+    return errors
+
+
+def display_typeahead_helper():
+    """Buscador de códigos por prefijo (fuera del formulario, se actualiza al escribir)."""
+    if not TYPEAHEAD_CONFIG["enabled"]:
+        return
+    session = _current_session()
+    with st.expander("🔎 Buscar códigos", expanded=False):
+        state = _namespace_state(domain_namespace(session)) if session is not None else {}
+        if not state.get("domains"):
+            st.caption("Cargando valores válidos..." if state.get("refreshing") else
+                       f"Autocompletado no disponible{': ' + state['error'] if state.get('error') else ''}")
+            return
+        col_field, col_prefix = st.columns([1, 2])
+        field = col_field.selectbox("Campo", list(TYPEAHEAD_FIELDS), format_func=FIELD_LABELS.get,
+                                    key="typeahead_field")
+        prefix = col_prefix.text_input("Empieza por", key="typeahead_prefix")
+        if prefix:
+            matches = suggest(field, prefix, session=session)
+            if matches:
+                st.code("\n".join(matches), language=None)
+            else:
+                st.caption("Sin coincidencias")
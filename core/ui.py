@@ -6,6 +6,10 @@ from datetime import datetime
 from typing import Dict, List
 import pandas as pd
 import streamlit as st
+from .charts import prepare_chart_series
+from .cost import get_incident_cost_report
+from .execution import run_statement
+from .state_store import FrameExpired, resolve_frame
 
 
 def display_message(content: List[Dict], message_index: int, request_id: str = None):
@@ -14,11 +18,16 @@ def display_message(content: List[Dict], message_index: int, request_id: str = N
         if item["type"] == "text":
             st.markdown(item["text"])
         elif item["type"] == "data_table":
-            # Mostrar tabla de datos
-            st.dataframe(item["data"], use_container_width=True)
+            # Mostrar tabla de datos (si viene de una sesión restaurada se carga ahora)
+            try:
+                data = resolve_frame(item["data"])
+            except FrameExpired:
+                st.error("⚠️ Los datos de esta tabla han caducado. Repite la consulta para verlos.")
+                continue
+            st.dataframe(data, use_container_width=True)
             
             # Botón de descarga
-            csv = item["data"].to_csv(index=False).encode('utf-8')
+            csv = data.to_csv(index=False).encode('utf-8')
             st.download_button(
                 label="📥 Descargar tabla como CSV",
                 data=csv,
@@ -78,7 +87,7 @@ def get_query_exec_result(query: str):
     session_ejecucion = st.session_state.snowpark_session
     
     try:
-        return session_ejecucion.sql(query).to_pandas(), None
+        return run_statement(session_ejecucion, query, stage="exploratorio"), None
     except Exception as e:
         return None, str(e)
 
@@ -108,10 +117,40 @@ def display_charts_tab(df: pd.DataFrame, message_index: int):
         
         chart_type = st.selectbox("Tipo de gráfico", ["Lineas", "Barras"], key=f"t_{message_index}")
         
+        # Reducir puntos antes de enviarlos al navegador (LTTB/min-max o agregación temporal)
+        series = prepare_chart_series(df, x, y, chart_type)
+        if len(series) < len(df):
+            st.caption(f"Mostrando {len(series):,} de {len(df):,} puntos (serie reducida)")
+        
         if chart_type == "Lineas":
-            st.line_chart(df.set_index(x)[y])
+            st.line_chart(series)
         else:
-            st.bar_chart(df.set_index(x)[y])
+            st.bar_chart(series)
+
+
+def display_cost_report(incident_id: str):
+    """Muestra el informe de coste y latencia por etapa de una incidencia."""
+    with st.expander("💰 Coste y latencia de la incidencia", expanded=False):
+        include_ops = st.checkbox("Incluir estadísticas de operadores", key="cost_include_ops")
+        if not st.button("Calcular informe", key="cost_report_button"):
+            return
+        try:
+            report = get_incident_cost_report(
+                st.session_state.snowpark_session, incident_id, include_operator_stats=include_ops
+            )
+        except Exception as e:
+            st.error(f"No se pudo obtener QUERY_HISTORY: {str(e)}")
+            return
+        if report.empty:
+            st.write("No hay sentencias registradas para esta incidencia.")
+            return
+        st.dataframe(report, use_container_width=True)
+        st.download_button(
+            label="📥 Exportar informe como CSV",
+            data=report.to_csv(index=False).encode('utf-8'),
+            file_name=f"coste_incidencia_{incident_id[:8]}.csv",
+            mime='text/csv',
+        )
 
 
 def display_conversation():
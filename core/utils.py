@@ -10,6 +10,10 @@ except ImportError:
     import tomli as tomllib
 
 
+# Clases de sentencia que se pueden enrutar a un warehouse propio
+WAREHOUSE_CLASSES = ["interactive", "batch", "llm"]
+
+
 def get_config():
     """
     Obtiene la configuración desde variables de entorno.
@@ -18,6 +22,10 @@ def get_config():
     1. STREAMLIT_SECRETS_TOML: Contenido completo del archivo secrets.toml como variable
     2. Variables individuales: SNOWFLAKE_ACCOUNT y SNOWFLAKE_WAREHOUSE
     
+    Opcionalmente, un warehouse por clase de sentencia (ver core/router.py):
+    sección [snowflake.warehouses] del TOML o SNOWFLAKE_WAREHOUSE_INTERACTIVE,
+    SNOWFLAKE_WAREHOUSE_BATCH y SNOWFLAKE_WAREHOUSE_LLM.
+    
     Raises: ValueError si no se encuentra configuración válida.
     """
     
@@ -26,9 +34,14 @@ def get_config():
     if secrets_content:
         try:
             secrets_dict = tomllib.loads(secrets_content)
+            snowflake = secrets_dict.get("snowflake", {})
             return {
-                "snowflake_account": secrets_dict.get("snowflake", {}).get("account"),
-                "snowflake_warehouse": secrets_dict.get("snowflake", {}).get("warehouse"),
+                "snowflake_account": snowflake.get("account"),
+                "snowflake_warehouse": snowflake.get("warehouse"),
+                "warehouse_routes": {
+                    cls: wh for cls, wh in snowflake.get("warehouses", {}).items()
+                    if cls in WAREHOUSE_CLASSES and wh
+                },
             }
         except Exception as e:
             raise ValueError(
@@ -44,6 +57,10 @@ def get_config():
         return {
             "snowflake_account": account,
             "snowflake_warehouse": warehouse,
+            "warehouse_routes": {
+                cls: os.environ[f"SNOWFLAKE_WAREHOUSE_{cls.upper()}"] for cls in WAREHOUSE_CLASSES
+                if os.environ.get(f"SNOWFLAKE_WAREHOUSE_{cls.upper()}")
+            },
         }
     
     # Si no hay ninguna configuración
@@ -70,3 +87,7 @@ def reset_session_state():
     st.session_state.active_suggestion = None
     st.session_state.warnings = []
     st.session_state.incidencia_data = None
+    st.session_state.pop("_state_frame_refs", None)
+    st.session_state.pop("incidencia_notices", None)
+    st.session_state.pop("watch_state", None)
+    st.session_state.pop("conversation_context", None)
@@ -0,0 +1,128 @@
+"""
+Módulo de pre-calentamiento y keep-alive de sesiones
+Tras el login reanuda el warehouse y lanza una consulta barata contra las
+vistas de VISTA_CONFIG en segundo plano; mientras el operador está activo,
+un heartbeat mantiene viva la sesión (y su token) y se detiene al quedar inactivo
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Optional
+from .execution import run_statement
+from .utils import get_config
+
+
+WARMUP_CONFIG = {
+    "enabled": os.environ.get("WARMUP_ENABLED", "true").lower() in ("1", "true", "yes"),
+    "heartbeat_seconds": int(os.environ.get("KEEPALIVE_INTERVAL_SECONDS", "240")),
+    "idle_timeout_seconds": int(os.environ.get("KEEPALIVE_IDLE_TIMEOUT_SECONDS", "1800")),
+}
+
+
+def _state(session) -> Dict:
+    """Estado de warm-up/keep-alive asociado a la sesión."""
+    state = getattr(session, "_incidencias_keepalive", None)
+    if state is None:
+        state = {
+            "login_at": time.time(),
+            "last_activity": time.time(),
+            "heartbeat": None,
+            "warmup": None,
+            "warmup_seconds": None,
+            "first_incident_seconds": None,
+            "stop": threading.Event(),
+        }
+        session._incidencias_keepalive = state
+    return state
+
+
+def _warehouses_to_resume() -> list:
+    """Warehouse por defecto y los de las clases que atienden al operador."""
+    try:
+        config = get_config()
+    except ValueError:
+        return []
+    routes = config.get("warehouse_routes", {})
+    warehouses = [routes.get("interactive"), routes.get("llm"), config["snowflake_warehouse"]]
+    return list(dict.fromkeys(wh for wh in warehouses if wh))
+
+
+def warm_up(session):
+    """Reanuda los warehouses y ejecuta una consulta mínima contra cada vista configurada."""
+    from .queries import VISTA_CONFIG
+
+    state = _state(session)
+    start = time.perf_counter()
+    for warehouse in _warehouses_to_resume():
+        try:
+            run_statement(session, f"ALTER WAREHOUSE IF EXISTS {warehouse} RESUME IF SUSPENDED", stage="warmup")
+        except Exception as e:
+            # Sin privilegio OPERATE la primera consulta hará el auto-resume igualmente
+            print(f"⚠️ Warm-up: no se pudo reanudar {warehouse}: {str(e)}")
+    for vista_key, vista in VISTA_CONFIG.items():
+        try:
+            run_statement(session, f"SELECT * FROM {vista['name']} LIMIT 1", stage="warmup", vista=vista_key)
+        except Exception as e:
+            print(f"⚠️ Warm-up: error en {vista_key}: {str(e)}")
+    state["warmup_seconds"] = time.perf_counter() - start
+    print(f"🔥 Warm-up completado en {state['warmup_seconds']:.2f}s")
+
+
+def _heartbeat_loop(session, state: Dict):
+    while not state["stop"].wait(WARMUP_CONFIG["heartbeat_seconds"]):
+        idle = time.time() - state["last_activity"]
+        if idle > WARMUP_CONFIG["idle_timeout_seconds"]:
+            print(f"💤 Keep-alive detenido tras {idle:.0f}s de inactividad")
+            break
+        try:
+            # SELECT 1 no usa warehouse: mantiene la sesión y el token sin gastar créditos
+            session.sql("SELECT 1").collect()
+        except Exception as e:
+            print(f"⚠️ Keep-alive: {str(e)}")
+            break
+    state["heartbeat"] = None
+
+
+def start_warmup(session):
+    """Lanza el warm-up en segundo plano y arranca el heartbeat (llamar tras el login)."""
+    state = _state(session)
+    if WARMUP_CONFIG["enabled"] and state["warmup"] is None:
+        state["warmup"] = threading.Thread(target=warm_up, args=(session,), name="warmup", daemon=True)
+        state["warmup"].start()
+    touch_activity(session)
+
+
+def touch_activity(session):
+    """Registra actividad del operador; reactiva el heartbeat si se había detenido."""
+    state = _state(session)
+    state["last_activity"] = time.time()
+    if state["heartbeat"] is None and not state["stop"].is_set():
+        state["heartbeat"] = threading.Thread(
+            target=_heartbeat_loop, args=(session, state), name="keepalive", daemon=True
+        )
+        state["heartbeat"].start()
+
+
+def stop_keepalive(session):
+    """Detiene el heartbeat (al cerrar sesión)."""
+    _state(session)["stop"].set()
+
+
+def record_first_incident_latency(session, seconds: float) -> Optional[float]:
+    """
+    Guarda la latencia de las vistas de la primera incidencia tras el login.
+
+    Returns:
+        La latencia registrada, o None si ya se había registrado antes
+    """
+    state = _state(session)
+    if state["first_incident_seconds"] is not None:
+        return None
+    state["first_incident_seconds"] = seconds
+    warmup = "activado" if WARMUP_CONFIG["enabled"] else "desactivado"
+    print(
+        f"⏱️ Primera incidencia tras login: {seconds:.2f}s "
+        f"(warm-up {warmup}, {time.time() - state['login_at']:.0f}s desde el login)"
+    )
+    return seconds
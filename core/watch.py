@@ -0,0 +1,235 @@
+"""
+Módulo de vigilancia de una incidencia abierta (modo watch)
+Sondea el estado ASN con una consulta de huella barata (COUNT + MAX + HASH_AGG)
+y solo cuando la huella cambia trae los datos, calcula las diferencias y
+vuelve a pedir el análisis de IA
+"""
+
+import os
+import time
+from datetime import timedelta
+from typing import Dict, Optional
+import pandas as pd
+import streamlit as st
+from .queries import VISTA_CONFIG, build_query
+from .ai_analysis import get_ai_analysis
+from .execution import run_statement, incident_context
+from .scheduler import scheduled, priority_context, SchedulerSaturated, PRIORITY_BATCH
+from .snapshot import SNAPSHOT_CONFIG
+from .state_store import resolve_frame
+from .guardrails import apply_row_limit, cap_result
+
+
+WATCH_CONFIG = {
+    "vista": "diagnostico_paso2",
+    "watermark": "FECHA_ULT_REVISION",
+    "interval_seconds": int(os.environ.get("WATCH_INTERVAL_SECONDS", "60")),
+    # Diferencias de celdas que se muestran como máximo en el mensaje
+    "max_changes_shown": 20,
+}
+
+
+def build_fingerprint_query(vista_key: str, incidencia_data: Dict) -> str:
+    """
+    Consulta de huella sobre las mismas filas que build_query.
+
+    Devuelve una fila con FILAS, ULT_REVISION (si hay columna watermark) y HUELLA
+    (HASH_AGG de todas las columnas: cambia con cualquier alta, baja o modificación).
+    """
+    query, _ = build_query(vista_key, incidencia_data)
+    columns = ["COUNT(*) AS FILAS"]
+    if WATCH_CONFIG["watermark"]:
+        columns.append(f"MAX({WATCH_CONFIG['watermark']}) AS ULT_REVISION")
+    columns.append("HASH_AGG(*) AS HUELLA")
+    return f"SELECT {', '.join(columns)} FROM ({query})"
+
+
+def fetch_fingerprint(session, incidencia_data: Dict) -> tuple[Optional[str], Optional[str]]:
+    """
+    Ejecuta la consulta de huella de la vista vigilada.
+
+    Returns:
+        (huella, error_msg)
+    """
+    vista_key = WATCH_CONFIG["vista"]
+    try:
+        query = build_fingerprint_query(vista_key, incidencia_data)
+        with priority_context(PRIORITY_BATCH), scheduled("vista"):
+            rows = run_statement(session, query, stage="watch", vista=vista_key, collect=True)
+        row = rows[0].as_dict() if hasattr(rows[0], "as_dict") else dict(rows[0])
+        return "|".join(str(row.get(col)) for col in ("FILAS", "ULT_REVISION", "HUELLA")), None
+    except SchedulerSaturated as e:
+        return None, str(e)
+    except Exception as e:
+        return None, f"Error en la consulta de huella: {str(e)}"
+
+
+def diff_results(before: Optional[pd.DataFrame], after: pd.DataFrame, vista_key: str) -> Dict:
+    """
+    Diferencias entre dos resultados de una vista.
+
+    Las filas se emparejan por las columnas clave de SNAPSHOT_CONFIG; sin claves
+    comunes se comparan filas completas (solo altas y bajas).
+
+    Returns:
+        {"added": DataFrame, "removed": DataFrame, "changed": [{"key", "column", "before", "after"}]}
+    """
+    before = before if before is not None else after.iloc[0:0]
+    keys = [k for k in SNAPSHOT_CONFIG["vistas"].get(vista_key, {}).get("keys", [])
+            if k in before.columns and k in after.columns]
+    if not keys:
+        keys = [c for c in after.columns if c in before.columns]
+        if not keys:
+            return {"added": after, "removed": before, "changed": []}
+        merged = before.merge(after, on=keys, how="outer", indicator=True)
+        return {
+            "added": merged[merged["_merge"] == "right_only"][keys],
+            "removed": merged[merged["_merge"] == "left_only"][keys],
+            "changed": [],
+        }
+
+    old = before.drop_duplicates(subset=keys, keep="last").set_index(keys)
+    new = after.drop_duplicates(subset=keys, keep="last").set_index(keys)
+    added = new.loc[new.index.difference(old.index)].reset_index()
+    removed = old.loc[old.index.difference(new.index)].reset_index()
+
+    changed = []
+    common = new.index.intersection(old.index)
+    columns = [c for c in new.columns if c in old.columns]
+    if len(common) and columns:
+        old_c = old.loc[common, columns].astype(str)
+        new_c = new.loc[common, columns].astype(str)
+        mask = old_c.ne(new_c)
+        for key, column in zip(*mask.values.nonzero()):
+            key_values = common[key] if isinstance(common[key], tuple) else (common[key],)
+            changed.append({
+                "key": " / ".join(str(v) for v in key_values),
+                "column": columns[column],
+                "before": old_c.iat[key, column],
+                "after": new_c.iat[key, column],
+            })
+    return {"added": added, "removed": removed, "changed": changed}
+
+
+def format_diff(diff: Dict) -> str:
+    """Resumen en markdown de las diferencias."""
+    lines = [
+        f"**{len(diff['added'])}** filas nuevas · **{len(diff['removed'])}** eliminadas · "
+        f"**{len(diff['changed'])}** valores modificados"
+    ]
+    for change in diff["changed"][:WATCH_CONFIG["max_changes_shown"]]:
+        lines.append(f"- `{change['key']}` · **{change['column']}**: {change['before']} → {change['after']}")
+    if len(diff["changed"]) > WATCH_CONFIG["max_changes_shown"]:
+        lines.append(f"- … y {len(diff['changed']) - WATCH_CONFIG['max_changes_shown']} más")
+    return "\n".join(lines)
+
+
+def _latest_results() -> Dict:
+    """Resultados de vistas del último mensaje del analista (base de comparación)."""
+    for message in reversed(st.session_state.get("messages", [])):
+        if message.get("raw_data"):
+            return message["raw_data"]
+    return {}
+
+
+def check_incident(session, incidencia_data: Dict, model: str) -> Optional[Dict]:
+    """
+    Una comprobación del modo watch.
+
+    Solo consulta la huella; si cambia respecto a la anterior, trae los datos
+    de la vista, calcula las diferencias y vuelve a analizar con IA.
+
+    Returns:
+        Mensaje del analista con las diferencias, o None si no hubo cambios
+    """
+    vista_key = WATCH_CONFIG["vista"]
+    state = st.session_state.get("watch_state")
+    if state is None or state["incident_id"] != incidencia_data.get("id"):
+        state = {"incident_id": incidencia_data.get("id"), "fingerprint": None,
+                 "checks": 0, "changes": 0, "last_check": None, "error": None}
+        st.session_state.watch_state = state
+
+    with incident_context(incidencia_data.get("id")):
+        fingerprint, error = fetch_fingerprint(session, incidencia_data)
+        state["checks"] += 1
+        state["last_check"] = time.time()
+        state["error"] = error
+        if error or fingerprint == state["fingerprint"]:
+            return None
+
+        previous_fingerprint = state["fingerprint"]
+        state["fingerprint"] = fingerprint
+        if previous_fingerprint is None:
+            # Primera huella: la base de comparación es lo que ya muestra el chat
+            return None
+
+        try:
+            # Tras restaurar la sesión los resultados guardados son LazyFrame:
+            # el análisis y el formateo necesitan DataFrames
+            previous = {
+                k: dict(v, data=resolve_frame(v.get("data"))) if isinstance(v, dict) else v
+                for k, v in _latest_results().items()
+            }
+            before = (previous.get(vista_key) or {}).get("data")
+            query, _ = build_query(vista_key, incidencia_data)
+            with scheduled("vista"):
+                after = cap_result(run_statement(session, apply_row_limit(query), stage="watch", vista=vista_key))
+        except Exception as e:
+            state["error"] = f"Error consultando {vista_key}: {str(e)}"
+            # Se reintenta en la siguiente comprobación
+            state["fingerprint"] = previous_fingerprint
+            return None
+
+        diff = diff_results(before, after, vista_key)
+        results = dict(previous)
+        results[vista_key] = {"data": after, "error": None, "vista": VISTA_CONFIG[vista_key]["description"]}
+        ai_analysis = get_ai_analysis(incidencia_data, results, model=model, session=session)
+
+    state["changes"] += 1
+    # Import local para evitar dependencias circulares
+    from .analyst import format_analyst_response
+    content = [{"type": "text", "text": "## 👁️ Cambios detectados en el estado ASN\n\n" + format_diff(diff)}]
+    if not diff["added"].empty:
+        content.append({"type": "data_table", "data": diff["added"]})
+    return {
+        "role": "analyst",
+        "content": content + format_analyst_response(results, ai_analysis),
+        "request_id": "watch",
+        "raw_data": results,
+        "ai_analysis": ai_analysis,
+    }
+
+
+@st.fragment(run_every=timedelta(seconds=WATCH_CONFIG["interval_seconds"]))
+def _watch_fragment():
+    """Sondeo periódico: solo este fragmento se re-ejecuta mientras no haya cambios."""
+    if "snowpark_session" not in st.session_state or not st.session_state.get("incidencia_data"):
+        return
+    message = check_incident(
+        st.session_state.snowpark_session,
+        st.session_state.incidencia_data,
+        st.session_state.get("cortex_model", "mistral-large"),
+    )
+    state = st.session_state.get("watch_state") or {}
+    if state.get("error"):
+        st.caption(f"⚠️ {state['error']}")
+    elif state.get("last_check"):
+        st.caption(
+            f"👁️ Última comprobación: {time.strftime('%H:%M:%S', time.localtime(state['last_check']))} · "
+            f"{state['checks']} comprobaciones, {state['changes']} con cambios"
+        )
+    if message:
+        st.session_state.messages.append(message)
+        st.rerun()
+
+
+def display_watch_mode():
+    """Interruptor del modo watch para la incidencia abierta."""
+    enabled = st.toggle(
+        "👁️ Vigilar estado ASN",
+        key="watch_enabled",
+        help=f"Comprueba cada {WATCH_CONFIG['interval_seconds']}s si cambian los datos de la vista "
+             f"y solo entonces vuelve a consultar y analizar",
+    )
+    if enabled:
+        _watch_fragment()
@@ -0,0 +1,73 @@
+"""
+Benchmark offline de modelos de Cortex
+======================================
+Reproduce un corpus de incidencias guardadas (JSONL, ver core/model_compare.py)
+contra varios modelos y genera una clasificación de latencia y calidad.
+
+Uso:
+    python scripts/benchmark_models.py --corpus benchmark/incidencias.jsonl \
+        --models mistral-large,llama3-70b,mixtral-8x7b --output leaderboard.csv
+    python scripts/benchmark_models.py --corpus benchmark/incidencias.jsonl --fake
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.ai_analysis import build_analysis_prompt
+from core.execution import incident_context
+from core.model_compare import (
+    COMPARE_CONFIG, compare_models, load_corpus, score_response, build_leaderboard
+)
+from core.scheduler import priority_context, PRIORITY_BATCH
+
+
+def run(args):
+    if args.fake:
+        from core.fakes import FakeSession
+        session = FakeSession(latency={"cortex": args.fake_latency})
+    else:
+        from core.auth import create_service_session
+        session = create_service_session()
+
+    models = [m for m in args.models.split(",") if m]
+    rows = []
+    # El benchmark no debe quitar hueco a los operadores
+    with priority_context(PRIORITY_BATCH):
+        for i, case in enumerate(load_corpus(args.corpus)):
+            if args.limit and i >= args.limit:
+                break
+            prompt = build_analysis_prompt(case["incidencia"], case["results"])
+            with incident_context(f"benchmark-{case['incidencia'].get('id', i)}"):
+                results = compare_models(prompt, models, session)
+            for result in results:
+                result["case"] = i
+                result["quality"] = score_response(result["response"], case["expected"])
+                rows.append(result)
+            print(f"Caso {i + 1}: " + ", ".join(
+                f"{r['model']} {r['latency_s']:.2f}s" if r["latency_s"] is not None else f"{r['model']} error"
+                for r in results
+            ))
+
+    board = build_leaderboard(rows)
+    print()
+    print(board.to_string(index=False))
+    if args.output:
+        board.to_csv(args.output, index=False)
+        print(f"\nClasificación guardada en {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=COMPARE_CONFIG["corpus_path"])
+    parser.add_argument("--models", default=",".join(COMPARE_CONFIG["models"]))
+    parser.add_argument("--limit", type=int, default=0, help="Máximo de casos (0 = todos)")
+    parser.add_argument("--output", help="CSV de salida para la clasificación")
+    parser.add_argument("--fake", action="store_true", help="Usar FakeSession en lugar de Snowflake")
+    parser.add_argument("--fake-latency", type=float, default=0.2)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark del índice de incidencias similares
+=============================================
+Genera un corpus sintético de incidencias (y opcionalmente lo guarda en JSONL
+como fixture), lo indexa con cada backend y mide:
+- Altas por segundo
+- Latencia de búsqueda p50/p95
+- recall@k frente a la búsqueda exacta (NumPy)
+
+Uso:
+    python scripts/benchmark_similarity.py --size 50000 --queries 200
+    python scripts/benchmark_similarity.py --size 5000 --fixture benchmark/incidencias_sinteticas.jsonl
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from core.similarity import SIMILARITY_CONFIG, create_index, add_incidents, search_similar
+
+SINTOMAS = [
+    "ASN no recibido en almacén", "pedido bloqueado en preparación", "referencia sin stock",
+    "FEO anterior a FIS", "prepack sin marca", "cantidad servida menor a la pedida",
+    "pedido duplicado en host", "ASN cancelado por el proveedor", "retraso en la expedición",
+    "error de ubicación en el centro",
+]
+DETALLES = [
+    "desde hace dos días", "tras la carga nocturna", "solo en la talla M",
+    "el cliente reclama la entrega", "afecta a varias referencias", "con incidencia previa abierta",
+]
+TIPOS = ["REPOSICION", "IMPLANTACION", "TRASPASO", "DEVOLUCION"]
+
+
+def synthetic_corpus(size: int, seed: int = 7):
+    """Incidencias sintéticas con descripciones y claves repetidas."""
+    rng = random.Random(seed)
+    for i in range(size):
+        yield {
+            "id": f"sint-{i:07d}",
+            "uneco": str(rng.randint(1, 40)),
+            "almacen": f"ALM{rng.randint(1, 25):03d}",
+            "tipo_pedido": rng.choice(TIPOS),
+            "descripcion": f"{rng.choice(SINTOMAS)} {rng.choice(DETALLES)}",
+            "hora_finalizacion": f"2026-01-01 00:{i % 60:02d}:00",
+        }
+
+
+def build(backend: str, records, batch: int = 1000):
+    index = create_index(backend=backend)
+    start = time.perf_counter()
+    for i in range(0, len(records), batch):
+        add_incidents(index, records[i:i + batch])
+    return index, time.perf_counter() - start
+
+
+def run(args):
+    SIMILARITY_CONFIG["embeddings"] = "hashing"
+    records = list(synthetic_corpus(args.size))
+    if args.fixture:
+        os.makedirs(os.path.dirname(args.fixture) or ".", exist_ok=True)
+        with open(args.fixture, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        print(f"Corpus sintético guardado en {args.fixture}")
+
+    rng = random.Random(11)
+    queries = [dict(records[rng.randrange(len(records))], id=None) for _ in range(args.queries)]
+
+    exact = None
+    for backend in args.backends.split(","):
+        try:
+            index, elapsed = build(backend, records)
+        except ImportError as e:
+            print(f"{backend}: omitido ({str(e)})")
+            continue
+
+        latencies, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            df = search_similar(index, query, query["tipo_pedido"], k=args.k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append(set(df["id"]))
+        if exact is None:
+            exact = found
+        recall = np.mean([len(f & e) / max(len(e), 1) for f, e in zip(found, exact)])
+        print(f"{backend:>6}: {len(records) / elapsed:,.0f} altas/s | "
+              f"p50 {np.percentile(latencies, 50):.2f} ms | p95 {np.percentile(latencies, 95):.2f} ms | "
+              f"recall@{args.k} {recall:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=20000, help="Incidencias del corpus sintético")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=SIMILARITY_CONFIG["top_k"])
+    parser.add_argument("--backends", default="numpy,hnsw", help="El primero se usa como referencia exacta")
+    parser.add_argument("--fixture", help="JSONL donde guardar el corpus sintético")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Prueba de carga de la API contra un backend simulado
+=====================================================
+Levanta la API en proceso con FakeSession (latencias configurables) y lanza
+peticiones concurrentes para medir el throughput.
+
+Uso:
+    python scripts/loadtest_api.py --requests 200 --concurrency 32 --pool-size 16
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from api import create_app
+from core.fakes import FakeSession
+
+
+API_KEY = "loadtest"
+
+PAYLOAD = {
+    "uneco": "001",
+    "pedido_host": "123456",
+    "almacen": "ALM01",
+    "referencia": "REF789",
+    "descripcion": "Diferencias en cantidades recibidas",
+}
+
+
+async def run(args):
+    latency = {"vista": args.vista_latency, "cortex": args.cortex_latency}
+    app = create_app(session_factory=lambda: FakeSession(latency=latency), pool_size=args.pool_size,
+                     api_keys=[API_KEY])
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=120,
+                                     headers={"X-API-Key": API_KEY}) as client:
+
+            async def one_request():
+                nonlocal errors
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.post("/incidencias/analisis", json=PAYLOAD)
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        errors += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one_request() for _ in range(args.requests)))
+            elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"Peticiones:   {args.requests} (concurrencia {args.concurrency}, pool {args.pool_size})")
+    print(f"Errores:      {errors}")
+    print(f"Duración:     {elapsed:.2f}s")
+    print(f"Throughput:   {args.requests / elapsed:.1f} req/s")
+    print(f"Latencia p50: {statistics.median(latencies) * 1000:.0f} ms")
+    print(f"Latencia p95: {latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--pool-size", type=int, default=16)
+    parser.add_argument("--vista-latency", type=float, default=0.05)
+    parser.add_argument("--cortex-latency", type=float, default=0.8)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
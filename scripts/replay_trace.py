@@ -0,0 +1,177 @@
+"""
+Reproducción de una traza de producción
+=======================================
+Reproduce offline una traza grabada con TRACE_RECORD_FILE: cada incidencia de
+la traza vuelve a pasar por el pipeline de `core/` (vistas + reglas + IA)
+contra una ReplaySession con las latencias y formas de resultado grabadas, a
+su ritmo de llegada original; las sentencias sueltas (SQL exploratorio,
+metadatos...) se reproducen tal cual. Mide latencias por incidencia y por etapa
+para comparar ramas.
+
+Uso:
+    TRACE_RECORD_FILE=traza.jsonl.gz streamlit run app.py     # grabar
+    python scripts/replay_trace.py traza.jsonl.gz --output antes.json
+    git checkout mi-rama
+    python scripts/replay_trace.py traza.jsonl.gz --compare antes.json
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from core.execution import run_statement, get_query_log
+from core.pipeline import run_incident_pipeline
+from core.replay import ReplaySession, load_trace, group_by_incident
+
+
+def synthetic_incident(incident_id: str) -> dict:
+    """Datos de incidencia de relleno: la traza no guarda los valores reales."""
+    return {
+        "id": incident_id,
+        "uneco": "001",
+        "pedido_host": "123456",
+        "almacen": "ALM01",
+        "referencia": "REF789",
+        "descripcion": "Incidencia reproducida desde traza",
+    }
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "max": None}
+    return {
+        "count": len(values),
+        "p50": round(float(np.percentile(values, 50)), 1),
+        "p95": round(float(np.percentile(values, 95)), 1),
+        "max": round(float(max(values)), 1),
+    }
+
+
+def run(args):
+    entries = load_trace(args.trace)
+    incidents, loose = group_by_incident(entries)
+    print(f"🎬 Traza: {len(entries)} sentencias, {len(incidents)} incidencias, {len(loose)} sueltas")
+
+    sessions = []
+    incident_ms, errors = [], []
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def wait_until(offset):
+        if args.speed > 0:
+            delay = offset / args.speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+    def replay_incident(incident):
+        wait_until(incident["t"])
+        session = ReplaySession(incident["entries"], fallback=entries, latency_scale=args.latency_scale)
+        t0 = time.perf_counter()
+        try:
+            run_incident_pipeline(synthetic_incident(incident["inc"]), session,
+                                  model=args.model or incident["model"] or "mistral-large")
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+        with lock:
+            incident_ms.append((time.perf_counter() - t0) * 1000)
+            sessions.append(session)
+
+    def replay_loose(entry):
+        wait_until(entry["t"])
+        session = ReplaySession([entry], latency_scale=args.latency_scale)
+        try:
+            run_statement(session, entry["sql"], stage=entry["stage"], vista=entry.get("vista"),
+                          model=entry.get("model"), collect=entry.get("collect", False))
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+        with lock:
+            sessions.append(session)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(replay_incident, incident) for incident in incidents]
+        futures += [pool.submit(replay_loose, entry) for entry in loose]
+        for future in futures:
+            future.result()
+    wall = time.perf_counter() - start
+
+    stages = {}
+    for entry in get_query_log():
+        stages.setdefault(entry["stage"], []).append(entry["elapsed_ms"])
+    misses = sum(len(s.misses) for s in sessions)
+    summary = {
+        "trace": os.path.basename(args.trace),
+        "incidents": len(incidents),
+        "statements": sum(len(v) for v in stages.values()),
+        "misses": misses,
+        "errors": len(errors),
+        "wall_s": round(wall, 2),
+        "incident_ms": percentiles(incident_ms),
+        "stages": {stage: percentiles(values) for stage, values in sorted(stages.items())},
+    }
+    report(summary)
+    if misses:
+        print(f"⚠️ {misses} sentencias sin pareja en la traza (se resolvieron con FakeSession)")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        print(f"💾 Resumen guardado en {args.output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), summary)
+
+
+def report(summary):
+    inc = summary["incident_ms"]
+    print(f"\nIncidencias: {summary['incidents']}  Sentencias: {summary['statements']}  "
+          f"Errores: {summary['errors']}  Tiempo total: {summary['wall_s']}s")
+    print(f"Por incidencia: p50 {inc['p50']} ms  p95 {inc['p95']} ms  max {inc['max']} ms")
+    print(f"\n{'Etapa':<14}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}")
+    for stage, stats in summary["stages"].items():
+        print(f"{stage:<14}{stats['count']:>7}{stats['p50']:>10}{stats['p95']:>10}")
+
+
+def compare(before, after):
+    def delta(old, new):
+        if old in (None, 0) or new is None:
+            return "n/a"
+        return f"{100 * (new - old) / old:+.1f}%"
+
+    print(f"\nComparación con {before.get('trace')}:")
+    print(f"{'':<22}{'antes':>10}{'después':>10}{'delta':>10}")
+    rows = [("incidencia p50", before["incident_ms"]["p50"], after["incident_ms"]["p50"]),
+            ("incidencia p95", before["incident_ms"]["p95"], after["incident_ms"]["p95"]),
+            ("sentencias", before["statements"], after["statements"]),
+            ("tiempo total s", before["wall_s"], after["wall_s"])]
+    for stage in sorted(set(before["stages"]) | set(after["stages"])):
+        old = before["stages"].get(stage, {})
+        new = after["stages"].get(stage, {})
+        rows.append((f"{stage} n", old.get("count"), new.get("count")))
+        rows.append((f"{stage} p95", old.get("p95"), new.get("p95")))
+    for label, old, new in rows:
+        print(f"{label:<22}{str(old):>10}{str(new):>10}{delta(old, new):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", help="Traza grabada (.jsonl o .jsonl.gz)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Factor sobre el ritmo de llegada grabado (0 = sin esperas)")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Factor sobre las latencias grabadas")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--model", help="Modelo de Cortex (por defecto el de la traza)")
+    parser.add_argument("--output", help="JSON donde guardar el resumen")
+    parser.add_argument("--compare", help="Resumen JSON de otra ejecución para comparar")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
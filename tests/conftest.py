@@ -0,0 +1,21 @@
+"""
+Fixtures comunes de las pruebas
+Las pruebas usan las sesiones falsas de core.fakes: no necesitan conexión a Snowflake
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.fakes import FakeSession
+
+
+@pytest.fixture
+def fake_session():
+    """Fábrica de FakeSession sin latencias (salvo las que se indiquen)."""
+    def factory(handler=None, **latency):
+        return FakeSession(latency={"vista": 0, "cortex": 0, "other": 0, **latency}, handler=handler)
+    return factory
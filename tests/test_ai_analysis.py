@@ -0,0 +1,23 @@
+"""
+Pruebas de la interpretación de las respuestas de Cortex COMPLETE
+"""
+
+import json
+
+import pytest
+
+from core.ai_analysis import parse_complete_response
+
+
+@pytest.mark.parametrize("raw", ["42", '"texto"', "[1, 2]", "null", "Texto sin JSON"])
+def test_non_object_responses_fall_back_to_text(raw):
+    result = parse_complete_response(raw)
+    assert result == {"text": raw, "structured": None, "prompt_tokens": None, "output_tokens": None}
+
+
+def test_options_response_reads_text_and_usage():
+    raw = json.dumps({"choices": [{"messages": "Análisis"}],
+                      "usage": {"prompt_tokens": 10, "completion_tokens": 3}})
+    result = parse_complete_response(raw)
+    assert result["text"] == "Análisis"
+    assert (result["prompt_tokens"], result["output_tokens"]) == (10, 3)
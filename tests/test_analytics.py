@@ -0,0 +1,51 @@
+"""
+Pruebas del cubo de analítica: primera carga con una sola agregación
+"""
+
+import threading
+
+import pytest
+
+from core import analytics
+from core.analytics import build_cube_query, ensure_cube
+
+
+@pytest.fixture
+def empty_cube(tmp_path, monkeypatch):
+    monkeypatch.setitem(analytics.ANALYTICS_CONFIG, "dir", str(tmp_path))
+    monkeypatch.setattr(analytics, "_STATE", {
+        "cube": None, "watermark": None, "version": 0, "refreshed_at": 0.0,
+        "full_refreshed_at": 0.0, "refreshing": False, "error": None,
+    })
+
+
+def test_first_load_runs_a_single_aggregation(empty_cube, fake_session):
+    session = fake_session(handler=lambda query: [], other=0.3)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(ensure_cube(session))) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    cube_queries = [q for q in session.queries if "WITH inc AS" in q]
+    assert len(cube_queries) == 1
+    assert sum(r is None for r in results) == 2
+    assert not analytics._STATE["refreshing"]
+
+
+def test_failed_first_load_releases_the_guard(empty_cube, fake_session):
+    def handler(query):
+        raise RuntimeError("warehouse caído")
+
+    with pytest.raises(RuntimeError):
+        ensure_cube(fake_session(handler=handler))
+    assert not analytics._STATE["refreshing"]
+    assert "warehouse caído" in analytics._STATE["error"]
+
+
+def test_differences_are_summed_in_absolute_value():
+    query = build_cube_query()
+    # +5 en una línea y -5 en otra son 10 unidades de diferencia, no 0
+    assert "SUM(ABS(v.DIFERENCIAS_REVISION)) AS DIFERENCIAS" in query
+    assert "ABS(p2.DIFERENCIAS)" not in query
@@ -0,0 +1,44 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from api import create_app
+from core.fakes import FakeSession
+
+
+PAYLOAD = {"uneco": "001", "pedido_host": "123456", "almacen": "ALM01"}
+
+
+@pytest.fixture
+def client():
+    app = create_app(session_factory=lambda: FakeSession(latency={"vista": 0, "cortex": 0}),
+                     pool_size=2, api_keys=["secreta"])
+    with TestClient(app) as client:
+        yield client
+
+
+def test_requires_api_key(client):
+    assert client.post("/incidencias/analisis", json=PAYLOAD).status_code == 401
+    assert client.post("/incidencias/analisis", json=PAYLOAD, headers={"X-API-Key": "otra"}).status_code == 401
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/health").status_code == 200
+
+
+def test_runs_pipeline_with_valid_key(client):
+    response = client.post("/incidencias/analisis", json=PAYLOAD, headers={"X-API-Key": "secreta"})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("changes", [
+    {"pedido_host": "1' OR '1'='1"},
+    {"almacen": "ALM01; DROP TABLE X"},
+    {"model": "modelo-inventado"},
+])
+def test_rejects_invalid_fields(client, changes):
+    response = client.post("/incidencias/analisis", json={**PAYLOAD, **changes}, headers={"X-API-Key": "secreta"})
+    assert response.status_code == 422
+
+
+def test_without_configured_keys_everything_is_rejected():
+    app = create_app(session_factory=FakeSession, pool_size=1, api_keys=[])
+    with TestClient(app) as client:
+        assert client.post("/incidencias/analisis", json=PAYLOAD, headers={"X-API-Key": ""}).status_code == 401
@@ -0,0 +1,65 @@
+import io
+import threading
+import time
+
+import pytest
+
+from core import attachments
+from core.attachments import ATTACHMENTS_CONFIG, attachment_status, process_attachments
+from core.execution import run_statement
+
+
+class Upload(io.BytesIO):
+    def __init__(self, name, content):
+        super().__init__(content)
+        self.name = name
+        self.size = len(content)
+
+
+@pytest.fixture(autouse=True)
+def config(tmp_path, monkeypatch):
+    monkeypatch.setitem(ATTACHMENTS_CONFIG, "spool_dir", str(tmp_path))
+    monkeypatch.setitem(ATTACHMENTS_CONFIG, "stage", "@DB.SCHEMA.ADJUNTOS")
+    monkeypatch.setattr(attachments, "_UPLOADS", {})
+
+
+def wait_for(stage_path, timeout=2.0):
+    deadline = time.time() + timeout
+    while attachment_status(stage_path) == "pending" and time.time() < deadline:
+        time.sleep(0.01)
+    return attachment_status(stage_path)
+
+
+def test_put_runs_in_background_and_dedups(fake_session):
+    session = fake_session()
+    accepted, rejected = process_attachments(
+        [Upload("a.pdf", b"contenido"), Upload("b.pdf", b"contenido"), Upload("a.pdf", b"contenido")],
+        session=session, incident_id="inc1")
+
+    assert rejected == []
+    assert len(accepted) == 2
+    assert wait_for(accepted[0]["stage_path"]) == "uploaded"
+    assert len([q for q in session.queries if q.startswith("PUT")]) == 1
+
+
+def test_put_on_user_session_is_not_interleaved(fake_session):
+    started = threading.Event()
+
+    def handler(query):
+        if query.startswith("PUT"):
+            started.set()
+            time.sleep(0.2)
+        return [{"RESULT": 1}]
+
+    session = fake_session(handler=handler)
+    accepted, _ = process_attachments([Upload("a.pdf", b"x")], session=session)
+    started.wait(1)
+    put_tag = session.query_tag
+
+    # La sentencia del usuario espera a que termine el PUT para cambiar QUERY_TAG
+    start = time.perf_counter()
+    run_statement(session, "SELECT 1", stage="vista")
+
+    assert time.perf_counter() - start > 0.1
+    assert wait_for(accepted[0]["stage_path"]) == "uploaded"
+    assert '"stage":"attachments"' in put_tag
@@ -0,0 +1,17 @@
+"""
+Pruebas del resumen de la conversación
+"""
+
+from core import conversation
+from core.conversation import _compress_summary
+
+
+def test_cortex_summary_escapes_quotes_and_backslashes(fake_session, monkeypatch):
+    monkeypatch.setitem(conversation.CONVERSATION_CONFIG, "summary_mode", "cortex")
+    monkeypatch.setitem(conversation.CONVERSATION_CONFIG, "summary_max_tokens", 5)
+    session = fake_session(handler=lambda q: [{"SUMMARY": "resumen"}])
+    summary = "- P: ¿ruta C:\\pedidos\\ o 'P1'? → R: revisa el almacén \\"
+
+    assert _compress_summary(summary, session) == "resumen"
+    query = session.queries[-1]
+    assert "SUMMARIZE('- P: ¿ruta C:\\\\pedidos\\\\ o ''P1''? → R: revisa el almacén \\\\')" in query
@@ -0,0 +1,79 @@
+import pandas as pd
+import pytest
+
+from core import cost
+from core.cost import COST_CONFIG, build_cost_report, build_history_query, get_incident_cost_report
+from core.execution import get_query_log, incident_context, run_statement
+
+
+# Filas de QUERY_HISTORY tal y como las devuelve Snowflake (tiempos en ms)
+HISTORY_ROWS = [
+    {"QUERY_ID": "q1", "QUERY_TAG": "{}", "WAREHOUSE_NAME": "WH", "WAREHOUSE_SIZE": "Small",
+     "COMPILATION_TIME": 100, "QUEUED_PROVISIONING_TIME": 0, "QUEUED_OVERLOAD_TIME": 50,
+     "EXECUTION_TIME": 1800, "TOTAL_ELAPSED_TIME": 1950, "BYTES_SCANNED": 1000,
+     "CREDITS_USED_CLOUD_SERVICES": 0.001},
+    {"QUERY_ID": "q2", "QUERY_TAG": "{}", "WAREHOUSE_NAME": "WH", "WAREHOUSE_SIZE": "Small",
+     "COMPILATION_TIME": 20, "QUEUED_PROVISIONING_TIME": 10, "QUEUED_OVERLOAD_TIME": 0,
+     "EXECUTION_TIME": 1800, "TOTAL_ELAPSED_TIME": 1830, "BYTES_SCANNED": 500,
+     "CREDITS_USED_CLOUD_SERVICES": 0.0},
+]
+
+
+def log_entry(query_id, stage="vista", vista="diagnostico_paso1"):
+    return {"incident_id": "inc1", "stage": stage, "vista": vista, "model": None,
+            "query_id": query_id, "elapsed_ms": 2000.0}
+
+
+def test_report_aggregates_history_rows_by_stage():
+    log = [log_entry("q1"), log_entry("q2"), log_entry(None, stage="llm", vista=None)]
+
+    report = build_cost_report(log, pd.DataFrame(HISTORY_ROWS))
+
+    vista = report[report["stage"] == "vista"].iloc[0]
+    assert vista["sentencias"] == 2
+    assert vista["cola_ms"] == 60
+    assert vista["bytes_escaneados"] == 1500
+    # 3600 ms en un SMALL (2 créditos/hora) + cloud services
+    assert vista["creditos_estimados"] == pytest.approx(0.002 + 0.001)
+    assert report[report["stage"] == "llm"].iloc[0]["sentencias"] == 1
+
+
+@pytest.mark.parametrize("source, expected", [
+    ("information_schema", "TABLE(CORTEX_ANALYST_DEMO.INFORMATION_SCHEMA.QUERY_HISTORY("),
+    ("account_usage", "FROM SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY"),
+])
+def test_history_query_is_qualified(monkeypatch, source, expected):
+    monkeypatch.setitem(COST_CONFIG, "history_source", source)
+    query = build_history_query(["q1"])
+    assert expected in query
+    assert "QUERY_ID IN ('q1')" in query
+
+
+def test_query_id_ignores_statements_from_other_threads(fake_session):
+    session = None
+
+    def handler(query):
+        if "PASO1" in query:
+            # Otra sentencia en la misma sesión mientras se ejecuta la vista
+            session.sql("SELECT 'otro hilo'").collect()
+        return [{"RESULT": 1}]
+
+    session = fake_session(handler=handler)
+    query = "SELECT * FROM V_DIAGNOSTICO_PASO1_TIPO_PEDIDO WHERE CO_PEDIDO_HOST = '1'"
+    with session.query_history() as history, incident_context("inc-atribucion"):
+        run_statement(session, query, stage="vista")
+
+    entry = get_query_log("inc-atribucion")[0]
+    own, other = history.queries
+    assert own.sql_text == query and other.sql_text == "SELECT 'otro hilo'"
+    assert entry["query_id"] == own.query_id
+
+
+def test_incident_report_uses_fixture_history(fake_session, monkeypatch):
+    monkeypatch.setattr(cost, "get_query_log", lambda incident_id: [log_entry("q1")])
+    session = fake_session(handler=lambda query: HISTORY_ROWS)
+
+    report = get_incident_cost_report(session, "inc1")
+
+    assert "INFORMATION_SCHEMA.QUERY_HISTORY" in session.queries[-1]
+    assert report.iloc[0]["total_ms"] == 1950
@@ -0,0 +1,90 @@
+"""
+Pruebas de los límites de coste de las consultas a vistas
+"""
+
+import json
+
+import pandas as pd
+import pytest
+
+from core import guardrails
+from core.guardrails import (
+    QueryRejected, apply_row_limit, cap_result, check_scan_estimate, quote_literal,
+)
+from core.queries import build_query, execute_vista_query
+
+
+def explain_handler(partitions=10, scan_bytes=1024):
+    """Respuesta de EXPLAIN USING JSON con las estadísticas indicadas."""
+    def handler(query):
+        if query.startswith("EXPLAIN"):
+            stats = {"partitionsTotal": partitions * 2, "partitionsAssigned": partitions,
+                     "bytesAssigned": scan_bytes}
+            return [{"step": None, "content": json.dumps({"GlobalStats": stats})}]
+        return [{"TIPO_PEDIDO": "REPOSICION"}]
+    return handler
+
+
+def test_apply_row_limit_asks_one_extra_row():
+    assert apply_row_limit("SELECT * FROM V", 100) == "SELECT * FROM V LIMIT 101"
+
+
+def test_cap_result_by_rows():
+    df = cap_result(pd.DataFrame({"A": range(11)}), max_rows=10)
+    assert len(df) == 10
+    assert df.attrs["truncated"]
+    assert not cap_result(pd.DataFrame({"A": range(10)}), max_rows=10).attrs["truncated"]
+
+
+def test_cap_result_by_bytes():
+    df = pd.DataFrame({"A": ["x" * 1000] * 100})
+    capped = cap_result(df, max_rows=1000, max_bytes=20_000)
+    assert 1 <= len(capped) < 100
+    assert capped.attrs["truncated"]
+
+
+def test_quote_literal_escapes_quotes_and_backslashes():
+    assert quote_literal("O'Brien") == "'O''Brien'"
+    assert quote_literal("a\\'") == "'a\\\\'''"
+    assert quote_literal(5) == "5"
+    assert quote_literal(True) == "TRUE"
+
+
+def test_build_query_rejects_missing_required_filter():
+    with pytest.raises(QueryRejected):
+        build_query("diagnostico_paso1", {"uneco": "U1", "almacen": "A1", "pedido_host": ""})
+
+
+def test_build_query_quotes_values():
+    query, _ = build_query("diagnostico_paso2", {"pedido_host": "1' OR '1'='1"})
+    assert "CO_PEDIDO = '1'' OR ''1''=''1'" in query
+
+
+def test_check_scan_estimate_disabled_by_default(fake_session):
+    session = fake_session()
+    assert check_scan_estimate(session, "SELECT 1") is None
+    assert session.queries == []
+
+
+def test_check_scan_estimate_rejects_large_scans(fake_session, monkeypatch):
+    monkeypatch.setitem(guardrails.GUARDRAILS_CONFIG, "explain", True)
+    monkeypatch.setitem(guardrails.GUARDRAILS_CONFIG, "max_partitions", 100)
+    monkeypatch.setitem(guardrails.GUARDRAILS_CONFIG, "max_scan_bytes", 1024 ** 3)
+
+    estimate = check_scan_estimate(fake_session(handler=explain_handler()), "SELECT 1")
+    assert estimate["partitions_assigned"] == 10
+    with pytest.raises(QueryRejected):
+        check_scan_estimate(fake_session(handler=explain_handler(partitions=500)), "SELECT 1")
+    with pytest.raises(QueryRejected):
+        check_scan_estimate(fake_session(handler=explain_handler(scan_bytes=2 * 1024 ** 3)), "SELECT 1")
+
+
+def test_rejected_view_query_never_reaches_the_warehouse(fake_session, monkeypatch):
+    monkeypatch.setitem(guardrails.GUARDRAILS_CONFIG, "explain", True)
+    monkeypatch.setitem(guardrails.GUARDRAILS_CONFIG, "max_partitions", 100)
+    session = fake_session(handler=explain_handler(partitions=500))
+
+    df, error = execute_vista_query("diagnostico_paso2", {"pedido_host": "P1"}, session=session)
+
+    assert df is None and "particiones" in error
+    assert all(q.startswith("EXPLAIN") or not q.startswith("SELECT") for q in session.queries)
@@ -0,0 +1,44 @@
+"""
+Pruebas del guardado de incidencias: cuándo se guarda y avisos tras el st.rerun()
+"""
+
+import pytest
+import streamlit as st
+
+from core import incidencia
+from core.incidencia import save_enabled, save_incidencia_to_snowflake
+
+
+@pytest.fixture
+def clean_state():
+    for key in ("snowpark_session", "incidencia_notices"):
+        st.session_state.pop(key, None)
+    yield st.session_state
+    for key in ("snowpark_session", "incidencia_notices"):
+        st.session_state.pop(key, None)
+
+
+def test_save_only_when_similarity_or_analytics_use_it(monkeypatch):
+    monkeypatch.setitem(incidencia.INCIDENCIA_CONFIG, "save", "")
+    monkeypatch.setitem(incidencia.SIMILARITY_CONFIG, "enabled", False)
+    monkeypatch.setitem(incidencia.ANALYTICS_CONFIG, "enabled", False)
+    assert not save_enabled()
+    monkeypatch.setitem(incidencia.ANALYTICS_CONFIG, "enabled", True)
+    assert save_enabled()
+    monkeypatch.setitem(incidencia.INCIDENCIA_CONFIG, "save", "false")
+    assert not save_enabled()
+    monkeypatch.setitem(incidencia.ANALYTICS_CONFIG, "enabled", False)
+    monkeypatch.setitem(incidencia.INCIDENCIA_CONFIG, "save", "true")
+    assert save_enabled()
+
+
+def test_save_failure_is_kept_for_after_rerun(clean_state, fake_session):
+    # FakeSession no implementa write_pandas: el guardado falla
+    clean_state["snowpark_session"] = fake_session()
+    clean_state["incidencia_notices"] = ["📎 Adjunto descartado: a.exe"]
+
+    assert not save_incidencia_to_snowflake({"id": "INC-1", "adjuntos": []}, tipo_pedido="REPOSICION")
+
+    notices = clean_state["incidencia_notices"]
+    assert notices[0] == "📎 Adjunto descartado: a.exe"
+    assert len(notices) == 2 and notices[1].startswith("No se pudo guardar en Snowflake")
@@ -0,0 +1,98 @@
+"""
+Pruebas de los trabajos en segundo plano: huella por usuario/rol, atribución
+por solicitante y limpieza de la tabla
+"""
+
+import time
+
+import pandas as pd
+import pytest
+
+from core import jobs
+from core.execution import get_query_log
+from core.jobs import get_job, get_job_store, get_job_submitters, job_fingerprint, submit_job
+
+
+class RoleSession:
+    """Sesión falsa con otro usuario/rol."""
+
+    def get_current_user(self):
+        return "OTRO_USER"
+
+    def get_current_role(self):
+        return "OTRO_ROLE"
+
+
+@pytest.fixture
+def job_store(tmp_path, monkeypatch):
+    monkeypatch.setitem(jobs.JOBS_CONFIG, "db_path", str(tmp_path / "jobs.db"))
+    monkeypatch.setitem(jobs._STORE, "instance", None)
+    monkeypatch.setitem(jobs.JOB_HANDLERS, "echo",
+                        lambda payload, session: {"frame": pd.DataFrame({"A": [payload["prompt"]]})})
+    return get_job_store()
+
+
+def wait_done(job_id, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = get_job(job_id)
+        if job["status"] in ("done", "error"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError("el trabajo no ha terminado")
+
+
+def test_fingerprint_depends_on_namespace():
+    payload = {"model": "m", "prompt": "p"}
+    assert job_fingerprint("followup", payload, "U1/R1") != job_fingerprint("followup", payload, "U2/R1")
+    assert job_fingerprint("followup", payload, "U1/R1") == job_fingerprint("followup", payload, "U1/R1")
+
+
+def test_results_are_not_shared_across_roles(job_store, fake_session):
+    first = submit_job("echo", {"incident_id": "inc1", "prompt": "hola"}, fake_session())
+    other = submit_job("echo", {"incident_id": "inc2", "prompt": "hola"}, RoleSession())
+    assert first != other
+
+
+def test_reuse_is_attributed_per_submitter(job_store, fake_session):
+    session = fake_session()
+    job_id = submit_job("echo", {"incident_id": "inc1", "prompt": "hola"}, session)
+    wait_done(job_id)
+    assert submit_job("echo", {"incident_id": "inc2", "prompt": "hola"}, session) == job_id
+
+    submitters = get_job_submitters(job_id)
+    assert [(s["incident_id"], s["reused"]) for s in submitters] == [("inc1", 0), ("inc2", 1)]
+    assert submitters[0]["namespace"] == "FAKE_USER/FAKE_ROLE"
+    reuse = [e for e in get_query_log("inc2") if e["stage"] == "job_reuse"]
+    assert len(reuse) == 1 and reuse[0]["query_id"] is None and job_id in reuse[0]["query_tag"]
+
+
+def test_purge_removes_old_jobs_and_unused_frames(job_store, fake_session):
+    session = fake_session()
+    old_id = submit_job("echo", {"incident_id": "inc1", "prompt": "viejo"}, session)
+    wait_done(old_id)
+    # El trabajo y sus DataFrames pasan a ser de hace dos días
+    two_days_ago = time.time() - 2 * 86400
+    job_store.update(old_id, created_at=two_days_ago, finished_at=two_days_ago)
+    with job_store._conn() as conn:
+        conn.execute("UPDATE job_frames SET used_at = ?", (two_days_ago,))
+    new_id = submit_job("echo", {"incident_id": "inc2", "prompt": "nuevo"}, session)
+    wait_done(new_id)
+
+    removed, frames = job_store.purge(retention_seconds=86400, max_jobs=100)
+
+    assert removed == 1 and frames >= 1
+    assert get_job(old_id) is None and get_job_submitters(old_id) == []
+    assert get_job(new_id)["result"]["frame"]["A"].tolist() == ["nuevo"]
+
+
+def test_purge_keeps_at_most_max_jobs(job_store, fake_session):
+    session = fake_session()
+    ids = [submit_job("echo", {"incident_id": f"inc{i}", "prompt": f"p{i}"}, session) for i in range(3)]
+    for job_id in ids:
+        wait_done(job_id)
+
+    job_store.purge(retention_seconds=86400, max_jobs=2)
+
+    remaining = [job_id for job_id in ids if get_job(job_id) is not None]
+    assert len(remaining) == 2
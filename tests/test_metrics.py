@@ -0,0 +1,54 @@
+"""
+Pruebas del formato de exposición de las métricas y del endpoint /metrics
+"""
+
+import urllib.request
+
+from core import metrics
+from core.metrics import Counter, Histogram, start_metrics_server
+
+
+def test_counter_exposition_escapes_label_values():
+    counter = Counter("prueba_total", "Contador de prueba", ("stage", "type"))
+    counter.inc(stage='vis"ta', type="a\\b\nc")
+    counter.inc(2, stage='vis"ta', type="a\\b\nc")
+
+    assert counter.render() == [
+        "# HELP prueba_total Contador de prueba",
+        "# TYPE prueba_total counter",
+        'prueba_total{stage="vis\\"ta",type="a\\\\b\\nc"} 3.0',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("prueba_seconds", "Latencia de prueba", ("vista",), [0.1, 1])
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value, vista="paso1")
+
+    lines = histogram.render()
+
+    assert lines[1] == "# TYPE prueba_seconds histogram"
+    assert lines[2:] == [
+        'prueba_seconds_bucket{vista="paso1",le="0.1"} 1',
+        'prueba_seconds_bucket{vista="paso1",le="1"} 3',
+        'prueba_seconds_bucket{vista="paso1",le="+Inf"} 4',
+        'prueba_seconds_sum{vista="paso1"} 6.05',
+        'prueba_seconds_count{vista="paso1"} 4',
+    ]
+
+
+def test_metrics_server_listens_on_localhost_by_default(monkeypatch):
+    monkeypatch.setitem(metrics.METRICS_CONFIG, "enabled", True)
+    monkeypatch.setitem(metrics._SERVER, "instance", None)
+
+    assert start_metrics_server(port=0)
+    server = metrics._SERVER["instance"]
+    try:
+        host, port = server.server_address
+        assert host == "127.0.0.1"
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert "# TYPE incidencias_statement_seconds histogram" in response.read().decode("utf-8")
+    finally:
+        server.shutdown()
+        server.server_close()
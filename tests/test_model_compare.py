@@ -0,0 +1,37 @@
+from core import model_compare
+from core.model_compare import COMPARE_CONFIG, complete_with_stats
+
+
+def test_stream_cut_midway_is_not_resent_by_sql(fake_session, monkeypatch):
+    monkeypatch.setitem(COMPARE_CONFIG, "streaming", True)
+
+    def stream_cut(session, prompt, model, progress):
+        progress.update(parts=["El pedido ", "está "], usage={}, ttft=0.1)
+        raise ConnectionError("stream cortado")
+
+    monkeypatch.setattr(model_compare, "_stream_complete", stream_cut)
+    session = fake_session()
+
+    result = complete_with_stats(session, "x" * 400, "mistral-large")
+
+    assert session.queries == []
+    assert result["response"] == "El pedido está "
+    assert "interrumpido" in result["error"]
+    assert result["prompt_tokens"] == 100 and result["tokens_estimated"]
+    assert result["credits"] > 0
+
+
+def test_stream_failing_before_first_token_falls_back_to_sql(fake_session, monkeypatch):
+    monkeypatch.setitem(COMPARE_CONFIG, "streaming", True)
+
+    def stream_down(session, prompt, model, progress):
+        progress.update(parts=[], usage={}, ttft=None)
+        raise ConnectionError("sin conexión")
+
+    monkeypatch.setattr(model_compare, "_stream_complete", stream_down)
+    session = fake_session()
+
+    result = complete_with_stats(session, "prompt", "mistral-large")
+
+    assert result["via"] == "sql" and result["error"] is None
+    assert any("CORTEX.COMPLETE" in q for q in session.queries)
@@ -0,0 +1,77 @@
+"""
+Pruebas de la anonimización de las trazas de sentencias
+"""
+
+import json
+
+import pandas as pd
+
+from core import replay
+from core.replay import ReplaySession, TraceRecorder, load_trace, result_shape, synthesize_rows
+
+
+SECRETS = ["4500012345", "987654321", "ALM07", "2026-03-17", "14:25"]
+
+
+def paso2_result():
+    return pd.DataFrame({
+        "CO_PEDIDO": ["4500012345", "4500012345"],
+        "CO_MATERIAL": [987654321, 987654322],
+        "CO_CENTRO_LOGISTICO": ["ALM07", "ALM07"],
+        "CO_ESTADO_PREALBARAN": ["RECIBIDO", "RECIBIDO"],
+        "FECHA_ULT_REVISION": pd.to_datetime(["2026-03-17 14:25:00", "2026-03-18 09:00:00"]),
+        "QT_PEDIDO": [100, 40],
+        "DIFERENCIAS_REVISION": [5, 0],
+    })
+
+
+def columns(shape):
+    return {col["n"]: col for col in shape["cols"]}
+
+
+def test_identifiers_and_exact_dates_do_not_leak():
+    shape = result_shape(paso2_result())
+    text = json.dumps(shape)
+    for secret in SECRETS + ["987654322", "2026-03-18"]:
+        assert secret not in text
+    cols = columns(shape)
+    assert cols["CO_PEDIDO"]["k"] == "id" and cols["CO_MATERIAL"]["k"] == "id"
+    assert cols["FECHA_ULT_REVISION"]["min"] == "2026-03-01"
+    assert cols["CO_ESTADO_PREALBARAN"]["v"] == ["RECIBIDO"]
+
+
+def test_measure_ranges_are_kept():
+    cols = columns(result_shape(paso2_result()))
+    assert (cols["QT_PEDIDO"]["min"], cols["QT_PEDIDO"]["max"]) == (40.0, 100.0)
+    assert cols["DIFERENCIAS_REVISION"]["k"] == "num"
+
+
+def test_day_grain(monkeypatch):
+    monkeypatch.setitem(replay.REPLAY_CONFIG, "datetime_grain", "day")
+    cols = columns(result_shape(paso2_result()))
+    assert (cols["FECHA_ULT_REVISION"]["min"], cols["FECHA_ULT_REVISION"]["max"]) == ("2026-03-17", "2026-03-18")
+
+
+def test_synthesized_rows_keep_shape_and_types():
+    rows = synthesize_rows(result_shape(paso2_result()))
+    assert len(rows) == 2
+    assert isinstance(rows[0]["CO_MATERIAL"], int) and isinstance(rows[0]["CO_PEDIDO"], str)
+    assert len(rows[0]["CO_PEDIDO"]) == 10 and rows[0]["CO_PEDIDO"] != rows[1]["CO_PEDIDO"]
+    assert {r["QT_PEDIDO"] for r in rows} == {40, 100}
+
+
+def test_recorded_trace_has_no_identifiers(tmp_path):
+    path = str(tmp_path / "traza.jsonl")
+    recorder = TraceRecorder(path)
+    query = ("SELECT * FROM CORTEX_ANALYST_DEMO.CHATBOT_V2.V_DIAGNOSTICO_PASO2_ESTADO_ASN "
+             "WHERE CO_PEDIDO = '4500012345'")
+    recorder.record(query, "vista", "diagnostico_paso2", None, False, "a1b2c3d4e5", 0.05, None, paso2_result())
+    recorder.close()
+
+    raw = open(path, encoding="utf-8").read()
+    for secret in SECRETS:
+        assert secret not in raw
+
+    session = ReplaySession(load_trace(path), latency_scale=0)
+    df = session.sql(query.replace("4500012345", "4500099999")).to_pandas()
+    assert list(df.columns) == list(paso2_result().columns) and len(df) == 2
@@ -0,0 +1,137 @@
+"""
+Pruebas de los rollups del modelo semántico (modelo revenue_timeseries.yaml)
+"""
+
+import os
+import re
+import time
+
+import pytest
+
+from core import rollups
+from core.rollups import (
+    answer_from_rollup, compile_rollups, create_dynamic_tables, parse_rollup_request, refresh_local_rollup,
+)
+from core.semantic_model import load_semantic_model
+
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "revenue_timeseries.yaml")
+REGIONS = ["Europe", "Asia"]
+
+
+@pytest.fixture
+def spec(tmp_path, monkeypatch):
+    compiled = compile_rollups(load_semantic_model(MODEL_PATH))
+    monkeypatch.setattr(rollups, "_STATE", {"spec": compiled, "frames": {}, "watermarks": {}, "ready": set(),
+                                            "refreshed_at": time.time(), "refreshing": False, "error": None})
+    monkeypatch.setitem(rollups.ROLLUPS_CONFIG, "enabled", True)
+    monkeypatch.setitem(rollups.ROLLUPS_CONFIG, "mode", "local")
+    monkeypatch.setitem(rollups.ROLLUPS_CONFIG, "dir", str(tmp_path))
+    # Sin refrescos en segundo plano durante la prueba
+    monkeypatch.setitem(rollups.ROLLUPS_CONFIG, "refresh_seconds", 10 ** 6)
+    return compiled
+
+
+def rollup_handler(spec, months):
+    """Warehouse falso: una fila por mes (y región si el rollup la tiene), revenue = 10 por fila."""
+    def handler(query):
+        since = re.search(r">= '([\d-]+)'", query)
+        regions = REGIONS if "AS SALES_REGION" in query else [None]
+        rows = []
+        for month in months:
+            if since and month < since.group(1):
+                continue
+            for region in regions:
+                row = {"PERIOD_START": month, "ROW_COUNT": 30}
+                if region:
+                    row["SALES_REGION"] = region
+                for measure in spec["measures"]:
+                    name = measure["name"].upper()
+                    if measure["agg"] == "avg":
+                        row.update({f"{name}_SUM": 60.0, f"{name}_COUNT": 30})
+                    else:
+                        row[name] = 10.0
+                rows.append(row)
+        return rows
+    return handler
+
+
+def rollup(spec, name):
+    return next(r for r in spec["rollups"] if r["name"] == name)
+
+
+def test_compile_rollups_from_model(spec):
+    assert spec["fact"] == "daily_revenue" and spec["time"] == "date"
+    assert set(spec["dimensions"]) == {"product_line", "sales_region"}
+    # 2 granos x (total, producto, región, producto+región)
+    assert len(spec["rollups"]) == 8
+    avg = next(m for m in spec["measures"] if m["name"] == "daily_forecast_abs_error")
+    assert avg["agg"] == "avg"
+
+
+def test_parse_rollup_request(spec):
+    request = parse_rollup_request("quarterly revenue by sales region in 2024", spec)
+    assert request["grain"] == "quarter"
+    assert "daily_revenue" in request["measures"]
+    assert request["group_by"] == ["sales_region"]
+    assert request["period"] == ("2024-01-01", "2024-12-31")
+    assert parse_rollup_request("monthly revenue in Europe", spec)["filters"] == {"sales_region": ["Europe"]}
+
+
+def test_daily_or_extreme_questions_are_not_rewritten(spec):
+    assert parse_rollup_request("daily revenue in 2024", spec) is None
+    assert parse_rollup_request("lowest revenue each month", spec) is None
+    assert parse_rollup_request("revenue by region", spec) is None
+
+
+def test_quarterly_answer_from_monthly_rollup(spec, fake_session):
+    months = [f"2024-{m:02d}-01" for m in range(1, 7)]
+    session = fake_session(handler=rollup_handler(spec, months))
+    refresh_local_rollup(session, spec, rollup(spec, "DAILY_REVENUE_MONTH_SALES_REGION"))
+
+    answer = answer_from_rollup("quarterly revenue and forecast abs error by sales region in 2024", session)
+
+    assert answer["rollup"] == "DAILY_REVENUE_MONTH_SALES_REGION"
+    data = answer["data"]
+    assert len(data) == 4
+    assert (data["DAILY_REVENUE"] == 30.0).all()
+    # Las medias se re-agregan como suma / recuento, no como media de medias
+    assert (data["DAILY_FORECAST_ABS_ERROR"] == 2.0).all()
+
+
+def test_incremental_refresh_only_reaggregates_from_watermark(spec, fake_session):
+    target = rollup(spec, "DAILY_REVENUE_MONTH_TOTAL")
+    session = fake_session(handler=rollup_handler(spec, ["2024-01-01", "2024-02-01", "2024-03-01"]))
+    refresh_local_rollup(session, spec, target)
+    assert rollups._STATE["watermarks"][target["name"]] == "2024-03-01"
+
+    session = fake_session(handler=rollup_handler(spec, ["2024-01-01", "2024-02-01", "2024-03-01", "2024-04-01"]))
+    refresh_local_rollup(session, spec, target)
+
+    assert ">= '2024-03-01'" in session.queries[-1]
+    frame = rollups._STATE["frames"][target["name"]]
+    assert frame["PERIOD_START"].dt.strftime("%Y-%m").tolist() == ["2024-01", "2024-02", "2024-03", "2024-04"]
+
+
+def test_smallest_covering_rollup_is_chosen(spec, fake_session):
+    months = ["2024-01-01"]
+    session = fake_session(handler=rollup_handler(spec, months))
+    for name in ("DAILY_REVENUE_MONTH_TOTAL", "DAILY_REVENUE_MONTH_SALES_REGION"):
+        refresh_local_rollup(session, spec, rollup(spec, name))
+
+    assert answer_from_rollup("monthly revenue in 2024", session)["rollup"] == "DAILY_REVENUE_MONTH_TOTAL"
+    # Sin el rollup por producto materializado no se puede responder
+    assert answer_from_rollup("monthly revenue by product line in 2024", session) is None
+
+
+def test_dynamic_table_mode(spec, fake_session, monkeypatch):
+    monkeypatch.setitem(rollups.ROLLUPS_CONFIG, "mode", "dynamic_table")
+    session = fake_session()
+    create_dynamic_tables(session, spec)
+
+    ddl = [q for q in session.queries if q.startswith("CREATE DYNAMIC TABLE")]
+    assert len(ddl) == 8 and all("REFRESH_MODE = INCREMENTAL" in q for q in ddl)
+    answer = answer_from_rollup("yearly revenue in Europe", session)
+    assert answer["rollup"] == "DAILY_REVENUE_MONTH_SALES_REGION"
+    assert "SALES_REGION IN ('Europe')" in answer["sql"]
+    assert "DATE_TRUNC('YEAR', PERIOD_START)" in answer["sql"]
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+
+from core import router
+from core.execution import run_statement
+from core.router import ROUTER_CONFIG
+
+
+@pytest.fixture(autouse=True)
+def routes(monkeypatch):
+    monkeypatch.setattr(router, "_ROUTES", {
+        "loaded": True, "default": "WH_DEFAULT",
+        "routes": {"interactive": "WH_INTERACTIVE", "batch": "WH_BATCH"},
+    })
+    monkeypatch.setattr(router, "_UNAVAILABLE", {})
+
+
+def use_statements(session):
+    return [q for q in session.queries if q.startswith("USE WAREHOUSE")]
+
+
+def test_switches_only_when_warehouse_changes(fake_session):
+    session = fake_session()
+    run_statement(session, "SELECT 1", stage="vista")
+    run_statement(session, "SELECT 2", stage="metadata")
+    run_statement(session, "SELECT 3", stage="snapshot")
+
+    assert use_statements(session) == ["USE WAREHOUSE WH_INTERACTIVE", "USE WAREHOUSE WH_BATCH"]
+
+
+def test_failed_warehouse_falls_back_and_is_retried_later(fake_session, monkeypatch):
+    monkeypatch.setitem(ROUTER_CONFIG, "retry_seconds", 0.2)
+    fail = {"on": True}
+
+    def handler(query):
+        if query == "USE WAREHOUSE WH_BATCH" and fail["on"]:
+            raise RuntimeError("Insufficient privileges")
+        return [{"RESULT": 1}]
+
+    session = fake_session(handler=handler)
+    run_statement(session, "SELECT 1", stage="snapshot")
+    run_statement(session, "SELECT 2", stage="snapshot")
+    assert session._incidencias_warehouse == "WH_DEFAULT"
+
+    fail["on"] = False
+    time.sleep(0.25)
+    run_statement(session, "SELECT 3", stage="snapshot")
+    assert session._incidencias_warehouse == "WH_BATCH"
+
+
+def test_statements_on_one_session_run_in_parallel(fake_session):
+    session = fake_session(vista=0.2)
+    query = "SELECT * FROM V_DIAGNOSTICO_PASO1_TIPO_PEDIDO"
+    threads = [threading.Thread(target=run_statement, args=(session, query, "vista")) for _ in range(4)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert time.perf_counter() - start < 0.6
+
+
+def test_concurrent_classes_run_on_their_own_warehouse(fake_session):
+    """Dos hilos en la misma sesión, uno interactivo y otro batch: cada sentencia en su warehouse."""
+    executed = []
+    state = {"warehouse": None}
+
+    def handler(query):
+        if query.startswith("USE WAREHOUSE"):
+            state["warehouse"] = query.split()[-1]
+            return [{"RESULT": 1}]
+        warehouse, tag = state["warehouse"], session.query_tag
+        time.sleep(0.01)
+        # El estado no cambia mientras la sentencia se ejecuta
+        executed.append((query, warehouse, state["warehouse"], tag, session.query_tag))
+        return [{"RESULT": 1}]
+
+    session = fake_session(handler=handler)
+
+    def worker(stage, query):
+        for _ in range(15):
+            run_statement(session, query, stage=stage)
+
+    threads = [threading.Thread(target=worker, args=("vista", "SELECT 'interactiva'")),
+               threading.Thread(target=worker, args=("snapshot", "SELECT 'batch'"))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    expected = {"SELECT 'interactiva'": "WH_INTERACTIVE", "SELECT 'batch'": "WH_BATCH"}
+    assert len(executed) == 30
+    for query, before, after, tag_before, tag_after in executed:
+        assert before == after == expected[query]
+        assert tag_before == tag_after
+        assert ('"stage":"vista"' in tag_before) == (query == "SELECT 'interactiva'")
+
+
+def test_exclusive_statement_runs_alone(fake_session):
+    running = {"now": 0, "max_with_exclusive": 0}
+    lock = threading.Lock()
+
+    def handler(query):
+        with lock:
+            running["now"] += 1
+            if "PUT" in query:
+                running["max_with_exclusive"] = running["now"]
+        time.sleep(0.05)
+        with lock:
+            if "PUT" in query:
+                running["max_with_exclusive"] = max(running["max_with_exclusive"], running["now"])
+            running["now"] -= 1
+        return [{"RESULT": 1}]
+
+    session = fake_session(handler=handler)
+    threads = [threading.Thread(target=run_statement, args=(session, "SELECT 1", "vista")) for _ in range(3)]
+    threads.append(threading.Thread(target=run_statement, args=(session, "PUT file://x @s", "attachments"),
+                                    kwargs={"exclusive": True}))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert running["max_with_exclusive"] == 1
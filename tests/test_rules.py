@@ -0,0 +1,93 @@
+"""
+Pruebas del motor de reglas de diagnóstico
+"""
+
+import pandas as pd
+import pytest
+
+from core.ai_analysis import extract_key_metrics
+from core.rules import (
+    DESCONOCIDO, MIXTO, SIN_DATOS, build_features, compile_rules, diagnose, match_rule,
+)
+
+
+def _diagnose(df_p1, df_p2):
+    return diagnose(extract_key_metrics(df_p1, "paso1"), extract_key_metrics(df_p2, "paso2"))
+
+
+PASO2_SIN_DIF = pd.DataFrame({"CO_ESTADO_PREALBARAN": ["REVISADO"], "DIFERENCIAS_REVISION": [0]})
+
+
+def test_empty_paso1_is_pedido_no_encontrado():
+    result = _diagnose(pd.DataFrame({"TIPO_PEDIDO": []}), PASO2_SIN_DIF)
+    assert result["rule"] == "pedido_no_encontrado"
+
+
+def test_missing_tipo_pedido_column_is_not_pedido_no_encontrado():
+    df_p1 = pd.DataFrame({"CO_PEDIDO": ["P1"]})
+    features = build_features(extract_key_metrics(df_p1, "paso1"), extract_key_metrics(PASO2_SIN_DIF, "paso2"))
+    assert features["tipo_pedido"] == DESCONOCIDO
+    result = _diagnose(df_p1, PASO2_SIN_DIF)
+    assert result["rule"] == "asn_sin_diferencias"
+
+
+def test_null_tipo_pedido_is_unknown():
+    df_p1 = pd.DataFrame({"TIPO_PEDIDO": [None]})
+    assert build_features(extract_key_metrics(df_p1, "paso1"), {})["tipo_pedido"] == DESCONOCIDO
+
+
+def test_mixed_types_escalate_to_llm():
+    df_p1 = pd.DataFrame({"TIPO_PEDIDO": ["REPOSICION", "OTRO TIPO"]})
+    features = build_features(extract_key_metrics(df_p1, "paso1"), extract_key_metrics(PASO2_SIN_DIF, "paso2"))
+    assert features["tipo_pedido"] == MIXTO
+    assert _diagnose(df_p1, PASO2_SIN_DIF) is None
+
+
+def test_differences_rule_renders_totals():
+    df_p1 = pd.DataFrame({"TIPO_PEDIDO": ["REPOSICION"]})
+    df_p2 = pd.DataFrame({"CO_ESTADO_PREALBARAN": ["REVISADO"] * 2, "DIFERENCIAS_REVISION": [2, 1]})
+    result = _diagnose(df_p1, df_p2)
+    assert result["rule"] == "asn_con_diferencias"
+    assert "3 unidad(es)" in result["analysis"]
+
+
+def test_no_asn():
+    result = _diagnose(pd.DataFrame({"TIPO_PEDIDO": ["REPOSICION"]}), pd.DataFrame())
+    assert result["rule"] == "sin_asn"
+
+
+def test_priority_and_ambiguity():
+    rules = [
+        {"id": "a", "when": {"asn": "X"}, "estado": "a"},
+        {"id": "b", "when": {"diferencias": "NO"}, "estado": "b"},
+        {"id": "c", "when": {"asn": "X", "diferencias": "NO"}, "estado": "c"},
+    ]
+    table = compile_rules(rules)
+    features = {"tipo_pedido": "T", "asn": "X", "diferencias": "NO"}
+    assert match_rule(features, table)[0]["id"] == "c"
+    table = compile_rules(rules[:2])
+    assert match_rule(features, table) == (None, "ambiguous")
+    assert match_rule({**features, "asn": SIN_DATOS, "diferencias": SIN_DATOS}, table) == (None, "miss")
+
+
+def test_unknown_dimension_rejected():
+    with pytest.raises(ValueError):
+        compile_rules([{"id": "x", "when": {"almacen": "A1"}}])
+
+
+def test_opposite_differences_do_not_cancel_out():
+    df_p1 = pd.DataFrame({"TIPO_PEDIDO": ["REPOSICION"]})
+    df_p2 = pd.DataFrame({"CO_ESTADO_PREALBARAN": ["REVISADO"] * 2, "DIFERENCIAS_REVISION": [5, -5]})
+    metrics = extract_key_metrics(df_p2, "paso2")
+    assert metrics["hay_diferencias"] and metrics["diferencias_total"] == 10
+    result = _diagnose(df_p1, df_p2)
+    assert result["rule"] == "asn_con_diferencias"
+    assert "10 unidad(es)" in result["analysis"]
+
+
+def test_asn_not_reviewed_escalates_to_llm():
+    df_p1 = pd.DataFrame({"TIPO_PEDIDO": ["REPOSICION"]})
+    pendiente_sin_dif = pd.DataFrame({"CO_ESTADO_PREALBARAN": ["PENDIENTE"], "DIFERENCIAS_REVISION": [0]})
+    pendiente_con_dif = pd.DataFrame({"CO_ESTADO_PREALBARAN": ["PENDIENTE"], "DIFERENCIAS_REVISION": [3]})
+    assert _diagnose(df_p1, pendiente_sin_dif) is None
+    assert _diagnose(df_p1, pendiente_con_dif) is None
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+
+from core import scheduler
+from core.execution import run_statement
+from core.scheduler import (
+    PRIORITY_BATCH, PRIORITY_INTERACTIVE, SCHEDULER_CONFIG, SchedulerSaturated, scheduled,
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_scheduler(monkeypatch):
+    monkeypatch.setattr(scheduler, "_QUEUES", {})
+    monkeypatch.setattr(scheduler, "_BUCKETS", {})
+    monkeypatch.setitem(SCHEDULER_CONFIG, "concurrency", {"llm": 1, "vista": 8})
+    monkeypatch.setitem(SCHEDULER_CONFIG, "max_wait_seconds", 5.0)
+    monkeypatch.setitem(SCHEDULER_CONFIG, "max_queue", 50)
+    monkeypatch.setitem(SCHEDULER_CONFIG, "rate_limits", {
+        "default": {"per_minute": 6000, "burst": 100},
+        "lento": {"per_minute": 60, "burst": 1},
+    })
+
+
+def complete(session, model):
+    """Llamada a Cortex tal y como la hace ai_analysis: planificada y por run_statement."""
+    with scheduled("llm", model=model):
+        run_statement(session, f"SELECT SNOWFLAKE.CORTEX.COMPLETE('{model}', 'hola')", stage="llm", model=model)
+
+
+def test_rate_limited_model_does_not_hold_the_slot(fake_session):
+    session = fake_session(cortex=0.05)
+    complete(session, "lento")  # agota la ráfaga de 'lento'
+
+    blocked = threading.Thread(target=complete, args=(session, "lento"))
+    blocked.start()
+    time.sleep(0.1)
+    start = time.perf_counter()
+    complete(session, "rapido")
+    elapsed = time.perf_counter() - start
+    blocked.join()
+
+    # 'lento' espera ~1s a su token, pero sin ocupar el único hueco de 'llm'
+    assert elapsed < 0.5
+
+
+def test_interactive_is_admitted_before_batch(fake_session):
+    session = fake_session(cortex=0.05)
+    order = []
+
+    def call(name, priority):
+        with scheduled("llm", priority=priority):
+            order.append(name)
+            run_statement(session, "SELECT SNOWFLAKE.CORTEX.COMPLETE('m', 'x')", stage="llm")
+
+    holder = threading.Thread(target=call, args=("primero", PRIORITY_INTERACTIVE))
+    holder.start()
+    time.sleep(0.01)
+    batch = threading.Thread(target=call, args=("batch", PRIORITY_BATCH))
+    batch.start()
+    time.sleep(0.01)
+    interactive = threading.Thread(target=call, args=("interactivo", PRIORITY_INTERACTIVE))
+    interactive.start()
+    for thread in (holder, batch, interactive):
+        thread.join()
+
+    assert order == ["primero", "interactivo", "batch"]
+
+
+def test_rate_limit_beyond_max_wait_is_shed(monkeypatch, fake_session):
+    monkeypatch.setitem(SCHEDULER_CONFIG, "max_wait_seconds", 0.5)
+    session = fake_session()
+    complete(session, "lento")
+
+    with pytest.raises(SchedulerSaturated):
+        complete(session, "lento")
+
+    assert scheduler.get_scheduler_stats()["llm"]["shed"] == 1
+    assert scheduler.get_scheduler_stats()["llm"]["running"] == 0
+
+
+def test_full_queue_is_shed(monkeypatch):
+    monkeypatch.setitem(SCHEDULER_CONFIG, "max_queue", 0)
+    with pytest.raises(SchedulerSaturated):
+        with scheduled("llm"):
+            pass
+    assert scheduler.get_scheduler_stats()["llm"]["shed"] == 1
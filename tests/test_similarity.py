@@ -0,0 +1,58 @@
+"""
+Pruebas del índice de similitud: altas y búsquedas concurrentes
+"""
+
+import threading
+
+import pytest
+
+from core import similarity
+from core.similarity import create_index, index_incident, search_similar
+
+
+@pytest.fixture
+def process_index(monkeypatch):
+    """Índice del proceso vacío (embeddings hashing, sin Snowflake)."""
+    index = create_index(backend="numpy")
+    monkeypatch.setitem(similarity.SIMILARITY_CONFIG, "embeddings", "hashing")
+    monkeypatch.setitem(similarity._STATE, "index", index)
+    return index
+
+
+def _incidencia(i):
+    return {"id": f"INC-{i}", "uneco": "U1", "almacen": "A1",
+            "descripcion": f"Faltan unidades en el pedido {i}", "hora_finalizacion": "2026-01-01"}
+
+
+def test_index_incident_keeps_tipo_pedido(process_index):
+    index_incident(_incidencia(1), tipo_pedido="REPOSICION")
+    assert process_index.meta[0]["tipo_pedido"] == "REPOSICION"
+
+
+def test_concurrent_adds_and_searches(process_index):
+    errors = []
+
+    def add(start):
+        try:
+            for i in range(start, start + 300):
+                index_incident(_incidencia(i), tipo_pedido="REPOSICION")
+        except Exception as e:
+            errors.append(e)
+
+    def search():
+        try:
+            for _ in range(200):
+                df = search_similar(process_index, _incidencia("Q"), "REPOSICION", k=5)
+                assert df["id"].notna().all()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=add, args=(n * 1000,)) for n in range(3)]
+    threads += [threading.Thread(target=search) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert len(process_index) == 900
+    assert len(set(process_index.ids)) == 900
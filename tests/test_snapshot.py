@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from core import snapshot
+from core.snapshot import SNAPSHOT_CONFIG, lookup_snapshot, refresh_snapshot
+
+
+@pytest.fixture(autouse=True)
+def snapshot_dir(tmp_path, monkeypatch):
+    monkeypatch.setitem(SNAPSHOT_CONFIG, "dir", str(tmp_path))
+    monkeypatch.setitem(SNAPSHOT_CONFIG, "enabled", True)
+    monkeypatch.setattr(snapshot, "_SNAPSHOTS", {})
+
+
+def paso1_rows(n):
+    return [{"CO_UNECO": "001", "CO_CENTRO_LOGISTICO": "ALM01", "CO_PEDIDO_HOST": str(i),
+             "TIPO_PEDIDO": "ALMACENABLE"} for i in range(n)]
+
+
+def paso2_row(pedido, posicion, fecha):
+    return {"CO_PEDIDO": pedido, "CO_POSICION_PEDIDO": posicion, "CO_ALBARAN": "ASN01",
+            "FECHA_ULT_REVISION": fecha.isoformat(sep=" ")}
+
+
+def test_full_refresh_is_capped(fake_session, monkeypatch):
+    monkeypatch.setitem(SNAPSHOT_CONFIG, "max_rows", 3)
+    session = fake_session(handler=lambda q: paso1_rows(10))
+
+    refresh_snapshot(session, "diagnostico_paso1")
+
+    assert session.queries[-1].endswith("LIMIT 4")
+    assert len(snapshot._SNAPSHOTS["diagnostico_paso1"]["data"]) == 3
+
+
+def test_incremental_refresh_keeps_rows_with_same_watermark(fake_session):
+    last = (datetime.now() - timedelta(days=1)).replace(microsecond=0)
+    batches = [
+        [paso2_row("P1", 10, last - timedelta(hours=1)), paso2_row("P2", 10, last)],
+        # Misma marca que la última traída: una fila repetida y otra nueva
+        [paso2_row("P2", 10, last), paso2_row("P3", 10, last)],
+    ]
+    session = fake_session(handler=lambda q: batches.pop(0))
+
+    refresh_snapshot(session, "diagnostico_paso2")
+    refresh_snapshot(session, "diagnostico_paso2")
+
+    assert f"FECHA_ULT_REVISION >= '{last}'" in session.queries[-1]
+    assert "ORDER BY FECHA_ULT_REVISION" in session.queries[-1]
+    data = snapshot._SNAPSHOTS["diagnostico_paso2"]["data"]
+    assert sorted(data["CO_PEDIDO"]) == ["P1", "P2", "P3"]
+
+
+def test_lookup_only_answers_keys_in_snapshot(fake_session):
+    session = fake_session(handler=lambda q: paso1_rows(2))
+    refresh_snapshot(session, "diagnostico_paso1")
+
+    found = lookup_snapshot("diagnostico_paso1", {"uneco": "001", "almacen": "ALM01", "pedido_host": " 1 "})
+    missing = lookup_snapshot("diagnostico_paso1", {"uneco": "001", "almacen": "ALM01", "pedido_host": "99"})
+
+    assert found["CO_PEDIDO_HOST"].tolist() == ["1"]
+    assert missing is None
+
+
+def paso2_lookup(pedido):
+    return lookup_snapshot("diagnostico_paso2", {"pedido_host": pedido})
+
+
+def test_full_refresh_keeps_whole_keys_and_skips_a_cut_one(fake_session, monkeypatch):
+    monkeypatch.setitem(SNAPSHOT_CONFIG, "max_rows", 3)
+    recent = (datetime.now() - timedelta(days=1)).replace(microsecond=0)
+    old = recent - timedelta(days=200)
+    rows = [paso2_row("P1", 10, old), paso2_row("P1", 20, recent),
+            paso2_row("P2", 10, recent), paso2_row("P2", 20, recent)]
+    session = fake_session(handler=lambda q: rows)
+
+    refresh_snapshot(session, "diagnostico_paso2")
+
+    query = session.queries[-1]
+    assert "(CO_PEDIDO) IN (SELECT CO_PEDIDO FROM" in query and "ORDER BY CO_PEDIDO" in query
+    # Las líneas antiguas de un pedido con actividad también se guardan
+    assert paso2_lookup("P1")["CO_POSICION_PEDIDO"].tolist() == [10, 20]
+    # P2 quedó a medias por el recorte: se consulta en vivo
+    assert paso2_lookup("P2") is None
+
+
+def test_incremental_refresh_replaces_the_whole_key(fake_session):
+    last = (datetime.now() - timedelta(days=1)).replace(microsecond=0)
+    batches = [
+        [paso2_row("P1", 10, last), paso2_row("P1", 20, last), paso2_row("P2", 10, last)],
+        # La línea 20 de P1 se ha borrado en origen
+        [paso2_row("P1", 10, last + timedelta(hours=1))],
+    ]
+    session = fake_session(handler=lambda q: batches.pop(0))
+
+    refresh_snapshot(session, "diagnostico_paso2")
+    refresh_snapshot(session, "diagnostico_paso2")
+
+    assert paso2_lookup("P1")["CO_POSICION_PEDIDO"].tolist() == [10]
+    assert paso2_lookup("P2")["CO_POSICION_PEDIDO"].tolist() == [10]
+
+
+def test_truncated_incremental_marks_fetched_keys_incomplete(fake_session, monkeypatch):
+    last = (datetime.now() - timedelta(days=1)).replace(microsecond=0)
+    batches = [
+        [paso2_row("P1", 10, last)],
+        [paso2_row("P1", 10, last), paso2_row("P1", 20, last), paso2_row("P1", 30, last)],
+    ]
+    session = fake_session(handler=lambda q: batches.pop(0))
+    refresh_snapshot(session, "diagnostico_paso2")
+    assert paso2_lookup("P1") is not None
+    monkeypatch.setitem(SNAPSHOT_CONFIG, "max_rows", 2)
+
+    refresh_snapshot(session, "diagnostico_paso2")
+
+    assert ("P1",) in snapshot._SNAPSHOTS["diagnostico_paso2"]["incomplete"]
+    assert paso2_lookup("P1") is None
+
+
+def test_periodic_full_refresh_drops_rows_deleted_upstream(fake_session, monkeypatch):
+    monkeypatch.setitem(SNAPSHOT_CONFIG, "full_refresh_seconds", 0)
+    last = (datetime.now() - timedelta(days=1)).replace(microsecond=0)
+    batches = [[paso2_row("P1", 10, last), paso2_row("P2", 10, last)], [paso2_row("P2", 10, last)]]
+    session = fake_session(handler=lambda q: batches.pop(0))
+
+    refresh_snapshot(session, "diagnostico_paso2")
+    refresh_snapshot(session, "diagnostico_paso2")
+
+    assert "DATEADD" in session.queries[-1]
+    assert paso2_lookup("P1") is None
+    assert paso2_lookup("P2") is not None
+
+
+def test_refresher_prefers_the_service_session(monkeypatch):
+    from core import auth
+    service, user = object(), object()
+    monkeypatch.setitem(snapshot._REFRESHER, "session", user)
+    monkeypatch.setattr(auth, "get_service_session", lambda: service)
+    assert snapshot._refresh_session() is service
+    monkeypatch.setattr(auth, "get_service_session", lambda: None)
+    assert snapshot._refresh_session() is user
@@ -0,0 +1,82 @@
+import time
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+
+from core import state_store
+from core.state_store import (
+    STATE_CONFIG, FrameExpired, LazyFrame, SQLiteStateBackend, decode_state, encode_state,
+    flush_pending, frame_refs, resolve_frame,
+)
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    instance = SQLiteStateBackend(str(tmp_path / "estado.db"))
+    monkeypatch.setattr(state_store, "_BACKEND", {"instance": instance, "loaded": True})
+    monkeypatch.setattr(state_store, "_PENDING", {})
+    monkeypatch.setattr(state_store, "_TOUCH", set())
+    monkeypatch.setattr(state_store, "_WRITTEN_FRAMES", state_store.OrderedDict())
+    # Sin hilo de escritura: las pruebas llaman a flush_pending()
+    monkeypatch.setattr(state_store, "_WRITER", {"thread": object(), "purged_at": 0.0})
+    return instance
+
+
+def test_roundtrip_keeps_frames_as_lazy_references(backend):
+    df = pd.DataFrame({"CO_PEDIDO": ["4500000001"], "QT_PEDIDO": [100]})
+    state = {"messages": [{"raw_data": {"paso1": {"data": df}}}],
+             "when": datetime(2024, 5, 1, 10, 30), "day": date(2024, 5, 1)}
+    frames = {}
+
+    doc = encode_state(state, frames, {})
+    backend.set_many(frames)
+    restored = decode_state(doc)
+
+    lazy = restored["messages"][0]["raw_data"]["paso1"]["data"]
+    assert isinstance(lazy, LazyFrame)
+    pd.testing.assert_frame_equal(resolve_frame(lazy), df)
+    assert restored["when"] == datetime(2024, 5, 1, 10, 30)
+    assert restored["day"] == date(2024, 5, 1)
+    assert frame_refs(doc) == set(frames)
+
+
+def test_missing_frame_raises_instead_of_empty(backend):
+    with pytest.raises(FrameExpired):
+        LazyFrame("df:no-existe").load()
+
+
+def test_saving_the_document_renews_its_frames(backend, monkeypatch):
+    monkeypatch.setitem(STATE_CONFIG, "ttl_seconds", 100)
+    df = pd.DataFrame({"A": [1, 2]})
+    frames = {}
+    doc = encode_state({"data": df}, frames, {})
+    ref = next(iter(frames))
+    backend.set_many({ref: frames[ref]})
+    with backend._conn() as conn:
+        conn.execute("UPDATE state SET updated_at = ?", (time.time() - 90,))
+
+    # Un guardado posterior del documento solo renueva el DataFrame ya escrito
+    state_store._mark_written(ref)
+    state_store._enqueue({"state:sid": b"doc"}, frame_refs(doc))
+    flush_pending()
+
+    assert backend.purge(STATE_CONFIG["ttl_seconds"]) == 0
+    assert backend.get(ref) is not None
+
+
+def test_purge_removes_expired_rows(backend):
+    backend.set_many({"state:viejo": b"1", "state:nuevo": b"2"})
+    with backend._conn() as conn:
+        conn.execute("UPDATE state SET updated_at = ? WHERE key = 'state:viejo'", (time.time() - 1000,))
+
+    assert backend.purge(500) == 1
+    assert backend.get("state:viejo") is None
+    assert backend.get("state:nuevo") == b"2"
+
+
+def test_written_frames_are_bounded(backend, monkeypatch):
+    monkeypatch.setitem(STATE_CONFIG, "written_frames_max", 3)
+    for i in range(10):
+        state_store._mark_written(f"df:{i}")
+    assert list(state_store._WRITTEN_FRAMES) == ["df:7", "df:8", "df:9"]
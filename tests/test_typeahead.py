@@ -0,0 +1,93 @@
+"""
+Pruebas del autocompletado y la validación del formulario
+"""
+
+from core import typeahead
+from core.typeahead import KeyDomain, load_domain
+
+
+def domain_handler(keys):
+    """Vista falsa con los valores distintos indicados."""
+    def handler(query):
+        if "COUNT(DISTINCT" in query:
+            return [{"N": len(keys), "BYTES": max((len(k) for k in keys), default=None)}]
+        limit = int(query.rsplit("LIMIT", 1)[1])
+        return [{"CLAVE": k} for k in sorted(keys)[:limit]]
+    return handler
+
+
+def test_load_domain_limits_the_download(fake_session, monkeypatch):
+    monkeypatch.setitem(typeahead.TYPEAHEAD_CONFIG, "max_keys", 3)
+    session = fake_session(handler=domain_handler(["A1", "A2", "A3", "A4", "A5"]))
+
+    domain = load_domain(session, "almacen")
+
+    assert len(domain) == 3 and domain.partial
+    assert session.queries[-1].endswith("LIMIT 3")
+
+
+def test_load_domain_respects_memory_cap(fake_session, monkeypatch):
+    monkeypatch.setitem(typeahead.TYPEAHEAD_CONFIG, "max_bytes", 20)
+    session = fake_session(handler=domain_handler([f"K{i:04d}" for i in range(10)]))
+
+    domain = load_domain(session, "referencia")
+
+    assert session.queries[-1].endswith("LIMIT 4")
+    assert domain.nbytes <= 20 and domain.partial
+
+
+def test_full_domain_is_not_partial(fake_session):
+    domain = load_domain(fake_session(handler=domain_handler(["U1", "U2"])), "uneco")
+    assert len(domain) == 2 and not domain.partial
+
+
+def test_validation_is_case_sensitive_like_the_views():
+    domain = KeyDomain(["ABC123", "ABD999"])
+    assert domain.contains("ABC123")
+    assert domain.contains(" ABC123 ")
+    assert not domain.contains("abc123")
+    assert domain.closest("abc123", 5) == ["ABC123"]
+    assert domain.suggest("ab", 5) == ["ABC123", "ABD999"]
+
+
+def loaded(domains):
+    return {"domains": domains, "loaded_at": 0.0, "refreshing": False, "error": None}
+
+
+def lookup_handler(existing):
+    """Vista falsa para la consulta puntual: solo existen las claves indicadas."""
+    def handler(query):
+        if "LIMIT 1" in query:
+            return [{"EXISTE": 1}] if any(f"= '{k}'" in query for k in existing) else []
+        return []
+    return handler
+
+
+def test_validate_fields_suggests_original_casing(fake_session, monkeypatch):
+    monkeypatch.setitem(typeahead._STATE, "FAKE_ROLE", loaded({"uneco": KeyDomain(["ABC123"])}))
+    session = fake_session(handler=lookup_handler([]))
+    errors = typeahead.validate_fields({"uneco": "abc123"}, session)
+    assert len(errors) == 1 and "ABC123" in errors[0]
+    assert typeahead.validate_fields({"uneco": "ABC123"}, session) == []
+
+
+def test_key_added_after_load_is_confirmed_with_a_point_lookup(fake_session, monkeypatch):
+    monkeypatch.setitem(typeahead._STATE, "FAKE_ROLE", loaded({"uneco": KeyDomain(["ABC123"])}))
+    session = fake_session(handler=lookup_handler(["NUEVA1"]))
+
+    assert typeahead.validate_fields({"uneco": "NUEVA1"}, session) == []
+    lookups = [q for q in session.queries if "LIMIT 1" in q]
+    assert len(lookups) == 1 and "CO_UNECO = 'NUEVA1'" in lookups[0]
+    assert len(typeahead.validate_fields({"uneco": "NO_EXISTE"}, session)) == 1
+
+
+def test_domains_are_kept_per_role(fake_session, monkeypatch):
+    monkeypatch.setitem(typeahead._STATE, "FAKE_ROLE", loaded({"uneco": KeyDomain(["ABC123"])}))
+
+    class OtherRole:
+        def get_current_role(self):
+            return "OTRO_ROLE"
+
+    assert typeahead.get_domain("uneco", fake_session()) is not None
+    assert typeahead.get_domain("uneco", OtherRole()) is None
+    assert typeahead.suggest("uneco", "AB", session=OtherRole()) == []